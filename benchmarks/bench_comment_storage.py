@@ -0,0 +1,140 @@
+"""
+Benchmark review comment body storage modes: full, compressed, truncated, external
+
+Offline (default) it encodes a synthetic corpus of review comments shaped like
+real ones (short approvals, a few paragraphs, pasted code and logs) and
+reports stored bytes per row and encode time for each mode.
+
+With --live it also inserts the corpus into a scratch copy of review_comments
+on the configured database, one row and commit at a time like
+add_review_comment, and reports insert latency and sp_spaceused per mode.
+The scratch table is dropped afterwards.
+
+Usage: python benchmarks/bench_comment_storage.py [--rows N] [--live]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from prequel_db.comment_storage import CommentBodyCodec, STORAGE_MODES, STORAGE_EXTERNAL
+
+SCRATCH_TABLE = 'bench_review_comment_storage'
+
+WORDS = ('the this that should could we maybe function variable test case return error value '
+         'please rename extract handle null check edge behaviour why not instead here').split()
+
+def make_comment(rng):
+    """One synthetic comment body; the length mix follows typical review traffic"""
+    kind = rng.random()
+    if kind < 0.35:
+        return rng.choice(['LGTM', 'Nit: typo', 'Thanks!', 'Done.', '+1', 'Fixed in the latest push'])
+    if kind < 0.8:
+        sentences = rng.randint(2, 12)
+        return ' '.join(
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + '.'
+            for _ in range(sentences)
+        )
+    # Pasted code or log output
+    lines = rng.randint(10, 200)
+    body = ['Seeing this when I run it locally:', '```']
+    for i in range(lines):
+        body.append(f"    {rng.choice(WORDS)}_{i} = handle_{rng.choice(WORDS)}(value, retries={rng.randint(0, 5)})")
+    body.append('```')
+    return '\n'.join(body)
+
+def stored_bytes(encoded):
+    body, body_compressed, body_sha256, _ = encoded
+    return 2 * len(body) + len(body_compressed or b'') + len(body_sha256 or b'')
+
+def blob_dir_bytes(root):
+    total = 0
+    for directory, _, files in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total
+
+def run_offline(corpus, blob_root):
+    print(f"{'mode':<11} {'row bytes':>12} {'blob bytes':>12} {'avg/row':>9} {'encode us/row':>14}")
+    for mode in STORAGE_MODES:
+        codec = CommentBodyCodec(mode, blob_dir=os.path.join(blob_root, mode))
+        start = time.perf_counter()
+        encoded = [codec.encode(body) for body in corpus]
+        elapsed = time.perf_counter() - start
+
+        row_bytes = sum(stored_bytes(values) for values in encoded)
+        blob_bytes = blob_dir_bytes(os.path.join(blob_root, mode)) if mode == STORAGE_EXTERNAL else 0
+        per_row = (row_bytes + blob_bytes) / len(corpus)
+        print(f"{mode:<11} {row_bytes:>12} {blob_bytes:>12} {per_row:>9.0f} {elapsed / len(corpus) * 1e6:>14.1f}")
+
+def run_live(corpus, blob_root):
+    from prequel_db.db_handler import DatabaseHandler
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+
+    print(f"\n{'mode':<11} {'p50 ms':>8} {'p99 ms':>8} {'reserved':>12} {'data':>12}")
+    try:
+        for mode in STORAGE_MODES:
+            codec = CommentBodyCodec(mode, blob_dir=os.path.join(blob_root, 'live-' + mode))
+            db.cursor.execute(f"IF OBJECT_ID(N'{SCRATCH_TABLE}') IS NOT NULL DROP TABLE {SCRATCH_TABLE}")
+            db.cursor.execute(
+                f"""CREATE TABLE {SCRATCH_TABLE} (
+                        id INT IDENTITY(1,1) PRIMARY KEY,
+                        body NVARCHAR(MAX) NOT NULL,
+                        body_storage VARCHAR(10) NOT NULL DEFAULT 'full',
+                        body_compressed VARBINARY(MAX) NULL,
+                        body_sha256 BINARY(32) NULL,
+                        created_at DATETIME NOT NULL DEFAULT GETDATE()
+                    )"""
+            )
+            db.conn.commit()
+
+            latencies = []
+            for body in corpus:
+                start = time.perf_counter()
+                stored_body, body_compressed, body_sha256, body_storage = codec.encode(body)
+                db.cursor.execute(
+                    f"""INSERT INTO {SCRATCH_TABLE} (body, body_compressed, body_sha256, body_storage)
+                        VALUES (?, ?, ?, ?)""",
+                    (stored_body, body_compressed, body_sha256, body_storage)
+                )
+                db.conn.commit()
+                latencies.append(time.perf_counter() - start)
+
+            db.cursor.execute(f"EXEC sp_spaceused N'{SCRATCH_TABLE}'")
+            space = db.cursor.fetchone()
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{mode:<11} {statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f} "
+                  f"{space[2].strip():>12} {space[3].strip():>12}")
+    finally:
+        db.cursor.execute(f"IF OBJECT_ID(N'{SCRATCH_TABLE}') IS NOT NULL DROP TABLE {SCRATCH_TABLE}")
+        db.conn.commit()
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--live', action='store_true', help="Also measure inserts against the database")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_comment(rng) for _ in range(args.rows)]
+    print(f"{args.rows} comments, {sum(len(body) for body in corpus)} characters")
+
+    blob_root = tempfile.mkdtemp(prefix='comment-blobs-')
+    try:
+        run_offline(corpus, blob_root)
+        if args.live:
+            run_live(corpus, blob_root)
+    finally:
+        shutil.rmtree(blob_root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark API response encoding: dicts + jsonify vs slots rows + orjson
+
+Builds cursor-shaped stale PR rows (tuples with datetimes, as pyodbc and
+the analytics snapshot return them) and encodes them the way /api/stale-prs
+used to (a dict per row, isoformat() per datetime, then Flask's json
+encoder) and the way prequel_app/serialization.py does it. Reports time
+per 10k rows, peak memory while encoding and the size of the result kept
+alive afterwards (a streamed response keeps no result).
+
+Usage: python benchmarks/bench_serialization.py [--rows N] [--iterations N]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from prequel_app.serialization import _default, dumps, iter_json_array, stale_pull_request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def make_rows(count):
+    """get_stale_prs rows: id, title, number, html_url, full name, username, created_at, last_activity_at"""
+    start = datetime(2024, 1, 1, 9, 30, 15, 123456)
+    return [
+        (i, f'Fix flaky test in module {i % 97}', i % 5000, f'https://github.com/org/repo{i % 40}/pull/{i}',
+         f'org/repo{i % 40}', f'user{i % 300}', start + timedelta(minutes=i), start + timedelta(hours=i, seconds=7))
+        for i in range(count)
+    ]
+
+def dict_rows(rows):
+    """The per-row dicts the stale PR endpoint used to build"""
+    return [{
+        'id': pr_id, 'github_id': 0, 'repository_id': 0, 'author_id': 0, 'title': title, 'number': number,
+        'state': 'open', 'html_url': html_url,
+        'created_at': created_at.isoformat() if created_at else None,
+        'updated_at': last_activity_at.isoformat() if last_activity_at else None,
+        'closed_at': None, 'merged_at': None, 'is_stale': True,
+        'last_activity_at': last_activity_at.isoformat() if last_activity_at else None,
+        'repository_name': repo_name, 'author_name': username
+    } for pr_id, title, number, html_url, repo_name, username, created_at, last_activity_at in rows]
+
+def flask_default(rows):
+    # What jsonify did with the default provider: sorted keys, ASCII output
+    return json.dumps(dict_rows(rows), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def slots_json(rows):
+    return json.dumps([stale_pull_request(row) for row in rows], default=_default, separators=(',', ':')).encode('utf-8')
+
+def slots_dumps(rows):
+    return dumps([stale_pull_request(row) for row in rows])
+
+def streamed(rows):
+    for _ in iter_json_array(rows, stale_pull_request):
+        pass
+
+def _measure(fn, rows, iterations):
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(rows)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    gc.collect()
+    tracemalloc.start()
+    result = fn(rows)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, retained
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    strategies = [
+        ('dicts + json', flask_default),
+        ('slots + json', slots_json)
+    ]
+    if orjson is not None:
+        strategies.append(('slots + orjson', slots_dumps))
+        strategies.append(('streamed orjson', streamed))
+    else:
+        print('orjson not installed, dumps and the streamed response use json')
+        strategies.append(('streamed json', streamed))
+
+    rows = make_rows(args.rows)
+    per_10k = 10000 / args.rows
+    print(f"{'strategy':<16} {'ms/10k rows':>12} {'peak KiB':>10} {'retained KiB':>13}")
+    for name, fn in strategies:
+        elapsed, peak, retained = _measure(fn, rows, args.iterations)
+        print(f"{name:<16} {elapsed * 1000 * per_10k:>12.2f} {peak / 1024:>10.0f} {retained / 1024:>13.1f}")
+
+if __name__ == '__main__':
+    main()
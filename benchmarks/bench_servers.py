@@ -0,0 +1,162 @@
+"""
+Compare the threaded Flask server with the asyncio (ASGI) server under bursts of deliveries
+
+For each concurrency level (100, 1,000 and 10,000 by default) every delivery
+is sent at once, signed like GitHub signs it, and the benchmark reports
+throughput, latency percentiles and status codes per server. 503s are load
+shedding (admission control or the database circuit breaker), not failures.
+
+With --start both servers are launched from this checkout (Flask on 5001,
+ASGI on 5002) using the current environment plus the benchmark secret.
+Otherwise point --flask-url / --asgi-url at running servers that share
+--secret. Use --event pull_request to include database writes; the default
+ping deliveries measure the servers alone.
+
+Requires httpx. Usage:
+  python benchmarks/bench_servers.py --start [--levels 100,1000,10000] [--event ping]
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+def make_delivery(event, index):
+    if event == 'pull_request':
+        payload = {
+            'action': 'synchronize',
+            'number': index,
+            'pull_request': {
+                'id': 900000000 + index, 'number': index, 'state': 'open', 'title': f'Bench PR {index}',
+                'html_url': f'https://github.com/bench/repo/pull/{index}', 'body': 'x' * 500,
+                'created_at': '2024-03-01T10:00:00Z', 'updated_at': '2024-03-01T11:00:00Z',
+                'closed_at': None, 'merged_at': None,
+                'user': {'id': 7000 + index % 50, 'login': f'bench{index % 50}', 'avatar_url': ''}
+            },
+            'repository': {'id': 4242, 'name': 'repo', 'full_name': 'bench/repo'}
+        }
+    else:
+        payload = {'zen': 'Keep it logically awesome.', 'hook_id': index}
+    return json.dumps(payload).encode('utf-8')
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+async def _send_one(client, url, secret, event, body):
+    headers = {
+        'Content-Type': 'application/json',
+        'X-GitHub-Event': event,
+        'X-GitHub-Delivery': str(uuid.uuid4()),
+        'X-Hub-Signature-256': sign(secret, body)
+    }
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, content=body, headers=headers)
+        status = response.status_code
+    except Exception as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+async def burst(url, secret, event, concurrency, timeout):
+    """Send concurrency deliveries at once; returns (elapsed, statuses, latencies)"""
+    bodies = [make_delivery(event, i) for i in range(concurrency)]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(_send_one(client, url, secret, event, body) for body in bodies))
+        elapsed = time.perf_counter() - start
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for _, latency in results)
+    return elapsed, statuses, latencies
+
+def _percentile(sorted_values, quantile):
+    index = min(len(sorted_values) - 1, max(0, int(round(quantile * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def _raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+        except (ValueError, OSError):
+            pass
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft < needed:
+            print(f"warning: open file limit {soft} is below {needed}; high levels will see connection errors")
+
+def _wait_until_up(url, deadline=30):
+    import urllib.request
+    stop = time.monotonic() + deadline
+    while time.monotonic() < stop:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return True
+        except Exception:
+            time.sleep(0.3)
+    return False
+
+def start_servers(secret):
+    env = dict(os.environ, GITHUB_WEBHOOK_SECRET=secret, PYTHONPATH=ROOT)
+    env.setdefault('WEBHOOK_MAX_IN_FLIGHT', '64')
+    quiet = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL, 'cwd': ROOT, 'env': env}
+    servers = [
+        subprocess.Popen([sys.executable, '-m', 'prequel_app.app'], **quiet),
+        subprocess.Popen([sys.executable, '-m', 'prequel_app.asgi'], **quiet)
+    ]
+    for url in ('http://127.0.0.1:5001/', 'http://127.0.0.1:5002/'):
+        if not _wait_until_up(url):
+            for server in servers:
+                server.terminate()
+            sys.exit(f"Server at {url} did not start")
+    return servers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--start', action='store_true', help="Launch both servers from this checkout")
+    parser.add_argument('--flask-url', default='http://127.0.0.1:5001/')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:5002/')
+    parser.add_argument('--secret', default='bench-secret')
+    parser.add_argument('--event', choices=('ping', 'pull_request'), default='ping')
+    parser.add_argument('--levels', default='100,1000,10000')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    if httpx is None:
+        sys.exit("httpx is required: pip install httpx")
+
+    levels = [int(level) for level in args.levels.split(',')]
+    _raise_fd_limit(max(levels) * 2 + 256)
+
+    servers = start_servers(args.secret) if args.start else []
+    try:
+        print(f"{'server':<7} {'concurrency':>11} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+        for level in levels:
+            for name, url in (('flask', args.flask_url), ('asgi', args.asgi_url)):
+                elapsed, statuses, latencies = asyncio.run(burst(url, args.secret, args.event, level, args.timeout))
+                status_text = ' '.join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str))
+                print(f"{name:<7} {level:>11} {level / elapsed:>9.0f} "
+                      f"{statistics.median(latencies) * 1000:>9.1f} {_percentile(latencies, 0.99) * 1000:>9.1f} "
+                      f"{latencies[-1] * 1000:>9.1f}  {status_text}")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait(timeout=10)
+
+if __name__ == '__main__':
+    main()
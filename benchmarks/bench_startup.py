@@ -0,0 +1,107 @@
+"""
+Startup time of the service and CLI entry points
+
+Each entry point is started in a fresh interpreter --runs times and the
+median and best wall-clock times are reported. Services are measured up to
+a fully built application object (import only, no server socket); CLIs run
+with --help, which covers their imports and settings load.
+
+--importtime lists the slowest imports (cumulative) of every entry point,
+from python -X importtime. The per-request section compares reading the
+configuration from the environment and .env (what every DatabaseConnection
+used to do) with the cached settings object.
+
+Usage:
+  python benchmarks/bench_startup.py [--runs 10] [--importtime] [--top 8]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, ROOT)
+
+# (name, interpreter arguments)
+ENTRY_POINTS = [
+    ('service: flask app', ['-c', 'import prequel_app.app']),
+    ('service: asgi app', ['-c', 'import prequel_app.asgi']),
+    ('cli: github_sync', ['-m', 'prequel_app.github_sync', '--help']),
+    ('cli: event_store', ['-m', 'prequel_app.event_store', '--help']),
+    ('cli: comment_storage', ['-m', 'prequel_db.comment_storage', '--help']),
+    ('cli: index_check', ['-m', 'prequel_db.index_check', '--help']),
+    ('cli: cycle_time', ['-m', 'prequel_db.db_cycle_time']),
+]
+
+def _env():
+    return dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='1')
+
+def time_entry_point(arguments, runs):
+    """Wall-clock seconds of each run; None if the entry point fails"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable] + arguments, cwd=ROOT, env=_env(),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            sys.stderr.write(result.stderr.decode('utf-8', 'replace')[-2000:])
+            return None
+        timings.append(elapsed)
+    return timings
+
+def slowest_imports(arguments, top):
+    """(cumulative microseconds, module) of the slowest imports of one run"""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments, cwd=ROOT, env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    rows = []
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), module.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+def per_request_settings(iterations):
+    """Microseconds per call of a full configuration load vs the cached settings"""
+    from prequel_config.settings import load_settings, get_settings
+    get_settings()
+    results = {}
+    for name, fn in (('load from env + .env', load_settings), ('cached get_settings()', get_settings)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        results[name] = (time.perf_counter() - start) / iterations * 1e6
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true', help="List the slowest imports per entry point")
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'entry point':<24} {'median ms':>10} {'best ms':>10}")
+    for name, arguments in ENTRY_POINTS:
+        timings = time_entry_point(arguments, args.runs)
+        if timings is None:
+            print(f"{name:<24} {'failed':>10}")
+            continue
+        print(f"{name:<24} {statistics.median(timings) * 1000:>10.1f} {min(timings) * 1000:>10.1f}")
+
+    if args.importtime:
+        for name, arguments in ENTRY_POINTS:
+            print(f"\n{name}: slowest imports (cumulative ms)")
+            for cumulative_us, module in slowest_imports(arguments, args.top):
+                print(f"  {cumulative_us / 1000:>8.1f}  {module}")
+
+    print("\nper-request configuration cost")
+    for name, micros in per_request_settings(args.iterations).items():
+        print(f"  {name:<24} {micros:>10.2f} us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark webhook body parsing: json vs orjson vs orjson + selective extraction
+
+Builds synthetic pull_request payloads shaped like GitHub's (nested repo and
+user objects, long bodies, label and reviewer lists) at several sizes and
+reports per-delivery CPU time, peak memory while parsing and the memory the
+parsed result keeps alive afterwards.
+
+Usage: python benchmarks/bench_webhook_parsing.py [--iterations N]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from prequel_app.github_handler import PAYLOAD_FIELDS, extract_fields
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SIZES = [10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+def _user(i):
+    return {
+        'login': f'user{i}', 'id': 1000 + i, 'node_id': f'MDQ6VXNlcj{i:06d}',
+        'avatar_url': f'https://avatars.githubusercontent.com/u/{1000 + i}?v=4',
+        'gravatar_id': '', 'url': f'https://api.github.com/users/user{i}',
+        'html_url': f'https://github.com/user{i}', 'type': 'User', 'site_admin': False
+    }
+
+def _repo(i):
+    return {
+        'id': 500 + i, 'node_id': f'MDEwOlJlcG9zaXRvcnk{i:06d}', 'name': f'repo{i}',
+        'full_name': f'org/repo{i}', 'private': False, 'owner': _user(i),
+        'html_url': f'https://github.com/org/repo{i}', 'description': 'x' * 200,
+        'fork': False, 'created_at': '2024-01-01T00:00:00Z', 'pushed_at': '2024-02-01T00:00:00Z',
+        'topics': [f'topic-{t}' for t in range(20)], 'default_branch': 'main'
+    }
+
+def make_payload(target_size):
+    """Build a pull_request payload whose JSON encoding is roughly target_size bytes"""
+    payload = {
+        'action': 'opened',
+        'number': 42,
+        'pull_request': {
+            'id': 123456789, 'number': 42, 'state': 'open', 'title': 'Add feature',
+            'html_url': 'https://github.com/org/repo0/pull/42', 'body': '',
+            'created_at': '2024-03-01T10:00:00Z', 'updated_at': '2024-03-01T11:00:00Z',
+            'closed_at': None, 'merged_at': None, 'user': _user(0),
+            'head': {'ref': 'feature', 'sha': 'a' * 40, 'repo': _repo(0), 'user': _user(0)},
+            'base': {'ref': 'main', 'sha': 'b' * 40, 'repo': _repo(0), 'user': _user(0)},
+            'labels': [], 'requested_reviewers': []
+        },
+        'repository': _repo(0),
+        'sender': _user(0)
+    }
+    base_size = len(json.dumps(payload))
+    # Fill with a mix of long text and many small objects, like real large PRs
+    remaining = max(0, target_size - base_size)
+    payload['pull_request']['body'] = 'lorem ipsum ' * (remaining // 2 // 12)
+    label_count = remaining // 2 // 250
+    payload['pull_request']['labels'] = [
+        {'id': i, 'name': f'label-{i}', 'color': 'ededed', 'description': 'd' * 150, 'default': False}
+        for i in range(label_count)
+    ]
+    return json.dumps(payload).encode('utf-8')
+
+def _measure(fn, body, iterations):
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    gc.collect()
+    tracemalloc.start()
+    result = fn(body)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, retained
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    strategies = [('json.loads', json.loads)]
+    if orjson is not None:
+        strategies.append(('orjson.loads', orjson.loads))
+        strategies.append(('orjson + extract', lambda b: extract_fields(orjson.loads(b), PAYLOAD_FIELDS)))
+    else:
+        print('orjson not installed, only the json baseline is measured')
+    strategies.append(('json + extract', lambda b: extract_fields(json.loads(b), PAYLOAD_FIELDS)))
+
+    print(f"{'size':>10} {'strategy':<18} {'ms/delivery':>12} {'peak KiB':>10} {'retained KiB':>13}")
+    for size in SIZES:
+        body = make_payload(size)
+        # Fewer rounds for the multi-megabyte payloads
+        iterations = max(1, args.iterations * SIZES[1] // max(size, SIZES[1]))
+        for name, fn in strategies:
+            elapsed, peak, retained = _measure(fn, body, iterations)
+            print(f"{len(body) // 1024:>8}Ki {name:<18} {elapsed * 1000:>12.3f} {peak / 1024:>10.0f} {retained / 1024:>13.1f}")
+
+if __name__ == '__main__':
+    main()
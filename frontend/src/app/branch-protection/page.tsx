@@ -49,7 +49,9 @@ export default function BranchProtectionPage() {
       }
     } catch (err) {
       console.error('Error setting up branch protection:', err);
-      setError('Failed to set up branch protection. Please check repository access and try again.');
+      setError(err instanceof Error && err.message
+        ? err.message
+        : 'Failed to set up branch protection. Please check repository access and try again.');
     } finally {
       setLoading(false);
     }
@@ -178,7 +180,7 @@ export default function BranchProtectionPage() {
               <svg xmlns="http://www.w3.org/2000/svg" className="h-5 w-5 mr-2" viewBox="0 0 20 20" fill="currentColor">
                 <path fillRule="evenodd" d="M10 18a8 8 0 100-16 8 8 0 000 16zm3.707-9.293a1 1 0 00-1.414-1.414L9 10.586 7.707 9.293a1 1 0 00-1.414 1.414l2 2a1 1 0 001.414 0l4-4z" clipRule="evenodd" />
               </svg>
-              Branch protection rules have been successfully applied to {repository}:{branch}
+              Branch protection rules are being applied to {repository}:{branch}
             </div>
           )}
 
@@ -1,7 +1,7 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { api } from '@/lib/api';
+import { api, getAdminToken, setAdminToken } from '@/lib/api';
 import LoadingSpinner from '@/components/loading-spinner';
 import { 
   KeyIcon,
@@ -20,12 +20,14 @@ export default function SettingsPage() {
   const [error, setError] = useState<string | null>(null);
   const [success, setSuccess] = useState(false);
   const [organizationToken, setOrganizationToken] = useState('');
+  const [adminToken, setAdminTokenInput] = useState('');
   
   // Fetch existing settings on page load
   useEffect(() => {
     const fetchSettings = async () => {
       try {
         setLoading(true);
+        setAdminTokenInput(getAdminToken());
         
         // Fetch current settings from the API
         const settings = await api.getConfiguration();
@@ -56,6 +58,9 @@ export default function SettingsPage() {
     setSuccess(false);
   
     try {
+      // The admin token stays in this browser; it is never sent to the configuration API
+      setAdminToken(adminToken.trim());
+      
       // Only update if there's a new token (not the placeholder)
       const tokenToSave = githubToken === '••••••••••••••••••••' ? null : githubToken;
       const orgTokenToSave = organizationToken === '••••••••••••••••••••' ? null : organizationToken;
@@ -137,6 +142,23 @@ export default function SettingsPage() {
                   Leave as is if you don't want to change your organization token.
                 </p>
               </div>
+              
+              <div className="mt-4">
+                <label htmlFor="admin-token" className="block text-gray-300 mb-2">
+                  Admin API Token
+                </label>
+                <input
+                  id="admin-token"
+                  type="password"
+                  className="w-full px-3 py-2 bg-gray-700 text-white rounded-md focus:outline-none focus:ring-2 focus:ring-indigo-500"
+                  placeholder="One of the server's ADMIN_API_TOKEN values"
+                  value={adminToken}
+                  onChange={(e) => setAdminTokenInput(e.target.value)}
+                />
+                <p className="text-gray-400 text-xs mt-1">
+                  Needed to apply branch protection. Stored in this browser only.
+                </p>
+              </div>
             </div>
           </div>
 
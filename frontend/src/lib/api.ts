@@ -14,6 +14,26 @@ const apiClient = axios.create({
   timeout: 5000
 });
 
+// Admin endpoints (branch protection) need one of the server's ADMIN_API_TOKEN values;
+// it is entered on the Settings page and only kept in this browser
+const ADMIN_TOKEN_KEY = 'adminApiToken';
+
+export const getAdminToken = (): string =>
+  typeof window === 'undefined' ? '' : localStorage.getItem(ADMIN_TOKEN_KEY) || '';
+
+export const setAdminToken = (token: string) => {
+  if (token) {
+    localStorage.setItem(ADMIN_TOKEN_KEY, token);
+  } else {
+    localStorage.removeItem(ADMIN_TOKEN_KEY);
+  }
+};
+
+const adminHeaders = (): Record<string, string> => {
+  const token = getAdminToken();
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 // Define interfaces for our data models
 export interface Repository {
   id: number;
@@ -134,6 +154,12 @@ export interface BranchProtectionRules {
   requireCodeOwners: boolean;
 }
 
+export interface BranchProtectionJob {
+  success: boolean;
+  job_id: string;
+  status_url: string;
+}
+
 // Mock data for when API is not available
 const mockData = {
   prMetrics: {
@@ -415,17 +441,26 @@ export const api = {
     repo: string, 
     branch: string, 
     rules: BranchProtectionRules
-  ): Promise<{ success: boolean }> => {
+  ): Promise<BranchProtectionJob> => {
     try {
       const response = await apiClient.post('/api/repos/branch-protection', {
         repo,
         branch,
         rules
-      });
+      }, { headers: adminHeaders() });
       return response.data;
     } catch (error) {
-      console.warn('Error setting up branch protection, using mock response');
-      return { success: true };
+      // No mock fallback here: a rejected change must not look like it was applied
+      if (axios.isAxiosError(error) && error.response) {
+        if (error.response.status === 401) {
+          throw new Error('Admin token missing or invalid. Set it on the Settings page.');
+        }
+        if (error.response.status === 403) {
+          throw new Error('Branch protection is disabled on the server (ADMIN_API_TOKEN is not set).');
+        }
+        throw new Error(error.response.data?.error || 'Failed to set up branch protection.');
+      }
+      throw error;
     }
   }
 };
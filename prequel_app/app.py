@@ -1,107 +1,611 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, url_for
+import hmac
 import logging
+import os
 import threading
 import time
-import os
-import sys
+import math
 from datetime import datetime
-from dotenv import load_dotenv
+from functools import wraps
 # In prequel_app/app.py
 from flask_cors import CORS
 from flask import jsonify
+from prequel_config.settings import get_settings, on_reload, install_reload_handler, configure_logging
 from prequel_app.github_handler import (
-    verify_github_webhook,
-    process_pull_request,
-    process_review,
-    process_review_comment
+    WebhookVerifier,
+    WebhookVerificationError,
+    StorageUnavailable,
+    parse_webhook_payload,
+    dispatch_webhook_event
 )
 from prequel_db.db_handler import DatabaseHandler
-from prequel_app.slack_notifier import send_slack_notification, check_stale_prs
+from prequel_app.slack_notifier import check_stale_prs
+from prequel_app.slack_router import SlackRouter
+from prequel_app.outbox_worker import outbox_worker_from_settings
+from prequel_app.health import AdmissionController, DatabaseProbe
+from prequel_app.event_store import open_event_store, sniff_repository
+from prequel_app.event_registry import webhook_events
+from prequel_app.github_sync import github_sync_from_settings
+from prequel_app.branch_protection import ProtectionRules, branch_protection_jobs_from_settings
+from prequel_app.serialization import (
+    FastJSONProvider,
+    json_response,
+    streamed_json_array,
+    stale_pull_request
+)
+from prequel_db.circuit_breaker import database_breaker
+from prequel_db.write_batcher import write_batcher_from_settings
+from prequel_db.analytics_snapshot import analytics_snapshot
+from prequel_db.live_events import live_events, HEARTBEAT_FRAME
+from prequel_db.db_pull_requests import parse_pull_request_query, parse_include_archived, MAX_TIMELINE_EVENTS
+from prequel_db.db_changes import parse_change_token
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Initialize Flask app
 app = Flask(__name__)
 
-# Configuration
-SLACK_WEBHOOK_URL = os.getenv('SLACK_WEBHOOK_URL')
-GITHUB_SECRET = os.getenv('GITHUB_WEBHOOK_SECRET')
-STALE_PR_DAYS = int(os.getenv('STALE_PR_DAYS', '7'))  # Default to 7 days
+# jsonify encodes with orjson when it is installed (same output as Flask's encoder)
+app.json = FastJSONProvider(app)
+
+# Configuration is read and validated once; SIGHUP reloads it (see apply_settings)
+settings = get_settings()
+
+# Import the modules that register webhook handlers (plus WEBHOOK_HANDLER_MODULES)
+webhook_events.load_handler_modules(settings.webhook.handler_modules)
+
+# Keyed HMAC state is computed once here, not per request
+webhook_verifier = WebhookVerifier(settings.webhook.secrets, max_content_length=settings.webhook.max_content_length)
+
+# Load shedding: beyond this many concurrent webhooks we answer 503 instead of queueing
+admission = AdmissionController(
+    max_in_flight=settings.webhook.max_in_flight,
+    retry_after=settings.webhook.retry_after_seconds
+)
+# Raw deliveries are kept here when EVENT_STORE_DIR is set, so tables can be rebuilt from them
+event_store = open_event_store(settings.event_store)
+
+# Coalesces concurrent webhook writes into one transaction when WRITE_BATCH_WINDOW_MS > 0
+write_batcher = write_batcher_from_settings(settings.database)
+
+readiness_probe = DatabaseProbe(ttl=settings.webhook.readiness_probe_ttl_seconds)
+
+# Routes notifications per repository/team/event; SLACK_WEBHOOK_URL is the fallback target
+slack_router = SlackRouter(
+    default_webhook_url=settings.slack.webhook_url,
+    refresh_interval=settings.slack.routes_refresh_seconds
+)
+
+# Delivers the Slack notifications webhooks queue in the outbox (started by start_background_workers)
+outbox_worker = outbox_worker_from_settings(settings, slack_router)
+
+# Bulk branch protection jobs started from the dashboard, polled for progress
+branch_protection_jobs = branch_protection_jobs_from_settings(settings)
+
+database_breaker.configure(settings.database.breaker_failure_threshold, settings.database.breaker_reset_seconds)
+
+# Dashboard aggregations are answered from memory once the snapshot has loaded (ANALYTICS_SNAPSHOT)
+analytics_snapshot.configure(settings.analytics.snapshot_enabled)
+
+# Committed changes are pushed to dashboards connected to /api/events
+live_events.configure(settings.live_events)
+
+@on_reload
+def apply_settings(new_settings):
+    """Apply the settings that can change without a restart"""
+    webhook_verifier.set_secrets(new_settings.webhook.secrets, new_settings.webhook.max_content_length)
+    slack_router.configure(new_settings.slack.webhook_url, new_settings.slack.routes_refresh_seconds)
+    database_breaker.configure(new_settings.database.breaker_failure_threshold,
+                               new_settings.database.breaker_reset_seconds)
+    analytics_snapshot.configure(new_settings.analytics.snapshot_enabled)
+    outbox_worker.configure(new_settings.outbox, new_settings.slack.timeout_seconds)
+    live_events.configure(new_settings.live_events)
+
+CORS(app, resources={r"/*": {"origins": list(settings.api.cors_origins)}}, expose_headers=['X-Next-Cursor', 'Link'])
+
+def require_admin(view):
+    """
+    Only run view for requests carrying an admin token (Authorization: Bearer)
+
+    Tokens come from ADMIN_API_TOKEN / ADMIN_API_TOKENS and are read per
+    request, so a reload rotates them. Without a token configured the admin
+    endpoints are disabled.
+    """
+    @wraps(view)
+    def check_admin_token(*args, **kwargs):
+        tokens = get_settings().api.admin_tokens
+        if not tokens:
+            return jsonify({"error": "Admin API disabled, set ADMIN_API_TOKEN"}), 403
+        scheme, _, presented = request.headers.get('Authorization', '').partition(' ')
+        presented = presented.strip().encode('utf-8')
+        matched = False
+        # Compare against every token so timing does not reveal which one matched
+        for token in tokens:
+            matched |= hmac.compare_digest(presented, token.encode('utf-8'))
+        if scheme.lower() != 'bearer' or not presented or not matched:
+            response = jsonify({"error": "Admin token required"})
+            response.status_code = 401
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+        return view(*args, **kwargs)
+    return check_admin_token
+
+def archive_delivery(delivery_id, event_type, payload_body):
+    """
+    Append a verified delivery to the raw event store, if one is configured
+
+    Runs before the payload is parsed, so deliveries without a handler are
+    archived too; the repository for the index is read from the raw body.
+    """
+    if not event_store:
+        return
+    try:
+        event_store.append(
+            delivery_id,
+            event_type,
+            sniff_repository(payload_body),
+            payload_body
+        )
+    except Exception as e:
+        # The event log is an archive; never fail the webhook because of it
+        logger.error(f"Error appending to event store: {str(e)}")
+
+def store_event(process, data):
+    """Run a process_* function, through the write batcher when it is enabled"""
+    if write_batcher:
+        return write_batcher.run(process, data)
+    return process(data)
 
-CORS(app, resources={r"/*": {"origins": "*"}})
 # Background task for checking stale PRs
 def stale_pr_checker():
     """Background thread to check for stale PRs on a schedule"""
     while True:
+        # Read on every run so a reload applies from the next check
+        current = get_settings()
         logger.info("Running scheduled stale PR check")
-        check_stale_prs(STALE_PR_DAYS)
-        # Sleep for 1 day (86400 seconds)
-        time.sleep(86400)
+        check_stale_prs(
+            current.scheduler.stale_pr_days,
+            current.scheduler.stale_reminder_max_days,
+            router=slack_router,
+            default_webhook_url=current.slack.webhook_url,
+            settings=current
+        )
+        # Sleep for 1 day by default (STALE_CHECK_INTERVAL_SECONDS)
+        time.sleep(current.scheduler.stale_check_interval_seconds)
+
+def github_sync_loop():
+    """Background thread reconciling stored PRs with the GitHub API"""
+    sync, sync_settings = None, None
+    while True:
+        current = get_settings()
+        if sync is None or sync_settings is not current.github_sync:
+            sync, sync_settings = github_sync_from_settings(current.github_sync), current.github_sync
+        try:
+            sync.sync_all()
+        except Exception as e:
+            logger.error(f"Error in GitHub sync: {str(e)}")
+        time.sleep(max(1, current.scheduler.github_sync_interval_seconds))
+
+def analytics_snapshot_loop():
+    """Background thread loading the analytics snapshot and reloading it on a schedule"""
+    while True:
+        current = get_settings().analytics
+        if analytics_snapshot.enabled:
+            age = analytics_snapshot.age()
+            if age is None or (current.snapshot_reload_seconds > 0 and age >= current.snapshot_reload_seconds):
+                try:
+                    analytics_snapshot.reload(DatabaseHandler)
+                except Exception as e:
+                    logger.error(f"Error loading analytics snapshot: {str(e)}")
+        time.sleep(30)
+
+def maintenance_loop():
+    """
+    Background thread for scheduled table maintenance: workflow partitions
+    (added ahead of time, expired ones truncated), the purge of old
+    change tombstones and archiving of long-closed pull requests
+    """
+    while True:
+        current = get_settings()
+        db = DatabaseHandler()
+        try:
+            if not getattr(db, 'connection_failed', False):
+                added, truncated = db.maintain_workflow_partitions(current.workflows.retention_days,
+                                                                   current.workflows.partition_months_ahead)
+                if added or truncated:
+                    logger.info(f"Workflow partitions: added {added}, truncated {truncated}")
+                purged = db.purge_change_tombstones(current.delta_sync.tombstone_retention_days)
+                if purged:
+                    logger.info(f"Purged {purged} change tombstones")
+                retention = current.retention
+                archived = db.archive_closed_pull_requests(retention.closed_pr_days, retention.batch_size,
+                                                           retention.max_batches, retention.batch_pause_seconds)
+                if archived:
+                    logger.info(f"Archived {archived} closed pull requests")
+        except Exception as e:
+            logger.error(f"Error in table maintenance: {str(e)}")
+        finally:
+            db.close()
+        time.sleep(max(60, current.workflows.maintenance_interval_seconds))
 
-# API endpoint to get PR metrics
+# Pid of the process whose background work was started
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_workers():
+    """
+    Start this process's background work: the outbox worker, the stale PR
+    checker, GitHub sync (when enabled), the analytics snapshot loader and
+    table maintenance
+
+    Importing the app starts nothing. The Flask server's __main__ block and
+    the ASGI lifespan call this; under another WSGI host call it from the
+    worker startup hook (e.g. gunicorn's post_fork). Later calls in the
+    same process do nothing.
+    """
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    
+    outbox_worker.start()
+    # Targets for the stale PR digests come from the Slack routing rules
+    threading.Thread(target=stale_pr_checker, daemon=True).start()
+    logger.info("Started stale PR checker thread")
+    sync_interval = get_settings().scheduler.github_sync_interval_seconds
+    if sync_interval > 0:
+        threading.Thread(target=github_sync_loop, daemon=True).start()
+        logger.info(f"Started GitHub sync thread (every {sync_interval}s)")
+    # Always started, so enabling ANALYTICS_SNAPSHOT through a reload takes effect
+    threading.Thread(target=analytics_snapshot_loop, daemon=True).start()
+    threading.Thread(target=maintenance_loop, daemon=True).start()
+
+def _include_archived():
+    """?include_archived=true: read archived PR history too (never from the analytics snapshot)"""
+    include_archived = parse_include_archived(request.args)
+    if include_archived and 'since' in request.args:
+        raise ValueError("include_archived cannot be combined with since")
+    return include_archived
+
+# API endpoint to get PR metrics (?include_archived=true counts archived PRs too)
 @app.route('/api/metrics', methods=['GET'])
 def get_pr_metrics():
+    try:
+        include_archived = _include_archived()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    snapshot = None if include_archived else analytics_snapshot.current()
+    if snapshot:
+        return jsonify(snapshot.pr_metrics())
+    db = DatabaseHandler()
+    metrics = db.get_pr_metrics(include_archived)
+    db.close()
+    return jsonify(metrics)
+
+# API endpoint to get PR cycle-time percentiles
+@app.route('/api/metrics/cycle-time', methods=['GET'])
+def get_cycle_time_metrics():
+    try:
+        window_days = int(request.args.get('window', '30'))
+    except ValueError:
+        return jsonify({"error": "window must be a number of days"}), 400
+    if not 1 <= window_days <= 365:
+        return jsonify({"error": "window must be between 1 and 365 days"}), 400
+    
+    group_by = request.args.get('group_by', 'repository')
+    if group_by not in ('repository', 'author'):
+        return jsonify({"error": "group_by must be 'repository' or 'author'"}), 400
+    
     db = DatabaseHandler()
-    metrics = db.get_pr_metrics()
+    metrics = db.get_cycle_time_metrics(window_days, group_by)
     db.close()
     return jsonify(metrics)
 
-# API endpoint to get stale PRs
+# API endpoint to get CI metrics per workflow (served from the daily rollups)
+@app.route('/api/metrics/workflows', methods=['GET'])
+def get_workflow_metrics():
+    try:
+        window_days = int(request.args.get('window', '30'))
+    except ValueError:
+        return jsonify({"error": "window must be a number of days"}), 400
+    if not 1 <= window_days <= 365:
+        return jsonify({"error": "window must be between 1 and 365 days"}), 400
+    
+    db = DatabaseHandler()
+    metrics = db.get_workflow_metrics(window_days)
+    db.close()
+    return jsonify(metrics)
+
+# API endpoint to get the latest run of each workflow
+@app.route('/api/workflow-runs', methods=['GET'])
+def get_workflow_runs():
+    try:
+        limit = int(request.args.get('limit', '50'))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    if not 1 <= limit <= 500:
+        return jsonify({"error": "limit must be between 1 and 500"}), 400
+    
+    db = DatabaseHandler()
+    runs = db.get_recent_workflow_runs(limit)
+    db.close()
+    return jsonify(runs)
+
+def _changes_since(method_name, row_factory=None):
+    """
+    Answer a ?since= delta request with a DatabaseHandler change method
+    
+    The body is {token, full, changes, deleted}; the client keeps token for
+    its next request. Deltas are always read from the database, never from
+    the analytics snapshot, so the token matches the data.
+    """
+    try:
+        since = parse_change_token(request.args.get('since'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    db = DatabaseHandler()
+    changes = getattr(db, method_name)(since)
+    db.close()
+    
+    if changes is None:
+        return jsonify({"error": "Could not read changes"}), 500
+    if row_factory:
+        changes['changes'] = [row_factory(row) for row in changes['changes']]
+    return json_response(changes)
+
+def _streamed_from_db(open_rows, row_factory=None):
+    """
+    Stream the rows of a DatabaseHandler iter_* method as a JSON array
+    
+    open_rows(db) returns the row generator. Rows are fetched off the cursor
+    in chunks while the response is sent, and the handler is closed in the
+    response's finally, once it is sent or the client went away.
+    """
+    db = DatabaseHandler()
+    rows = open_rows(db)
+    
+    def close():
+        rows.close()
+        db.close()
+    
+    return streamed_json_array(rows, row_factory, on_close=close)
+
+# API endpoint to get stale PRs (?since=<token> returns only what changed, see _changes_since)
 @app.route('/api/stale-prs', methods=['GET'])
 def get_stale_prs():
+    if 'since' in request.args:
+        return _changes_since('get_stale_pr_changes', stale_pull_request)
+    
+    snapshot = analytics_snapshot.current()
+    if snapshot:
+        return streamed_json_array(snapshot.stale_prs(), stale_pull_request)
+    # Rows are fetched and encoded chunk by chunk as the response is sent
+    return _streamed_from_db(lambda db: db.iter_stale_prs(), stale_pull_request)
+
+# API endpoint to list pull requests: filters, sorting and keyset pagination
+# (the next page's cursor is returned in the X-Next-Cursor header;
+# ?include_archived=true lists archived PRs too)
+@app.route('/api/pull-requests', methods=['GET'])
+def list_pull_requests():
+    try:
+        query = parse_pull_request_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     db = DatabaseHandler()
-    stale_prs = db.get_stale_prs()
+    pull_requests, next_cursor = db.list_pull_requests(**query)
     db.close()
     
-    # Convert to JSON-friendly format
-    result = []
-    for pr in stale_prs:
-        pr_id, title, number, html_url, repo_name, username, created_at, last_activity_at = pr
-        result.append({
-            'id': pr_id,
-            'github_id': 0,  # Not available from the query
-            'repository_id': 0,  # Not available from the query
-            'author_id': 0,  # Not available from the query
-            'title': title,
-            'number': number,
-            'state': 'open',
-            'html_url': html_url,
-            'created_at': created_at.isoformat() if created_at else None,
-            'updated_at': last_activity_at.isoformat() if last_activity_at else None,
-            'closed_at': None,
-            'merged_at': None,
-            'is_stale': True,
-            'last_activity_at': last_activity_at.isoformat() if last_activity_at else None,
-            'repository_name': repo_name,
-            'author_name': username
-        })
-    
-    return jsonify(result)
-
-# API endpoint to get repositories
-@app.route('/api/repositories', methods=['GET'])
-def get_repositories():
+    response = json_response(pull_requests)
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("list_pull_requests", **args)}>; rel="next"'
+    return response
+
+# API endpoint to get a pull request's reviews and comments as one ordered timeline
+# (?include_archived=true finds archived PRs too)
+@app.route('/api/pull-requests/<int:pull_request_id>/timeline', methods=['GET'])
+def get_pull_request_timeline(pull_request_id):
+    try:
+        limit = int(request.args.get('limit', '500'))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    if not 1 <= limit <= MAX_TIMELINE_EVENTS:
+        return jsonify({"error": f"limit must be between 1 and {MAX_TIMELINE_EVENTS}"}), 400
+    try:
+        include_archived = parse_include_archived(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     db = DatabaseHandler()
-    # Add a method to your DatabaseHandler to get repositories with PR counts
-    repositories = db.get_repositories_with_pr_counts()
+    events = db.get_pull_request_timeline(pull_request_id, limit, include_archived)
     db.close()
     
-    return jsonify(repositories)
+    if events is None:
+        return jsonify({"error": "Pull request not found"}), 404
+    return jsonify({"pull_request_id": pull_request_id, "events": events})
+
+# API endpoint to get repositories (?since=<token> returns only what changed,
+# ?include_archived=true counts archived PRs too)
+@app.route('/api/repositories', methods=['GET'])
+def get_repositories():
+    try:
+        include_archived = _include_archived()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'since' in request.args:
+        return _changes_since('get_repository_changes')
+    snapshot = None if include_archived else analytics_snapshot.current()
+    if snapshot:
+        return streamed_json_array(snapshot.repositories_with_pr_counts())
+    return _streamed_from_db(lambda db: db.iter_repositories_with_pr_counts(include_archived))
 
-# API endpoint to get contributors
+# API endpoint to get contributors (?since=<token> returns only what changed,
+# ?include_archived=true counts archived history too)
 @app.route('/api/contributors', methods=['GET'])
 def get_contributors():
+    try:
+        include_archived = _include_archived()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'since' in request.args:
+        return _changes_since('get_contributor_changes')
+    snapshot = None if include_archived else analytics_snapshot.current()
+    if snapshot:
+        return streamed_json_array(snapshot.contributors_with_counts())
+    return _streamed_from_db(lambda db: db.iter_contributors_with_counts(include_archived))
+
+def _mask_webhook_url(url):
+    """Hide most of a Slack webhook URL, which is a credential"""
+    if not url:
+        return url
+    return url[:30] + '…' + url[-4:] if len(url) > 40 else '…'
+
+# API endpoints to manage Slack routing rules (changes need the admin token)
+@app.route('/api/slack-routes', methods=['GET'])
+def list_slack_routes():
+    db = DatabaseHandler()
+    routes = db.get_slack_routes(include_disabled=True)
+    teams = db.get_slack_team_repositories()
+    db.close()
+    
+    for route in routes:
+        route['webhook_url'] = _mask_webhook_url(route['webhook_url'])
+    
+    return jsonify({
+        'routes': routes,
+        'teams': [{'team': team, 'repository': repository} for team, repository in teams]
+    })
+
+@app.route('/api/slack-routes', methods=['POST'])
+@require_admin
+def create_slack_route():
+    payload = request.get_json(silent=True) or {}
+    if not payload.get('webhook_url'):
+        return jsonify({"error": "webhook_url is required"}), 400
+    if payload.get('repository') and payload.get('team'):
+        return jsonify({"error": "A route matches either a repository or a team, not both"}), 400
+    
+    db = DatabaseHandler()
+    route_id = db.add_slack_route(
+        payload['webhook_url'],
+        repository=payload.get('repository'),
+        team=payload.get('team'),
+        event_type=payload.get('event_type')
+    )
+    db.close()
+    
+    if route_id is None:
+        return jsonify({"error": "Failed to create route"}), 500
+    slack_router.invalidate()
+    return jsonify({"success": True, "id": route_id}), 201
+
+@app.route('/api/slack-routes/<int:route_id>', methods=['DELETE'])
+@require_admin
+def delete_slack_route(route_id):
+    db = DatabaseHandler()
+    deleted = db.delete_slack_route(route_id)
+    db.close()
+    
+    if not deleted:
+        return jsonify({"error": "Route not found"}), 404
+    slack_router.invalidate()
+    return jsonify({"success": True})
+
+@app.route('/api/slack-teams', methods=['POST'])
+@require_admin
+def add_slack_team_repository():
+    payload = request.get_json(silent=True) or {}
+    if not payload.get('team') or not payload.get('repository'):
+        return jsonify({"error": "team and repository are required"}), 400
+    
+    db = DatabaseHandler()
+    added = db.add_slack_team_repository(payload['team'], payload['repository'])
+    db.close()
+    
+    if not added:
+        return jsonify({"error": "Failed to add repository to team"}), 500
+    slack_router.invalidate()
+    return jsonify({"success": True}), 201
+
+@app.route('/api/slack-teams', methods=['DELETE'])
+@require_admin
+def remove_slack_team_repository():
+    payload = request.get_json(silent=True) or {}
+    
     db = DatabaseHandler()
-    # Add a method to your DatabaseHandler to get contributors with counts
-    contributors = db.get_contributors_with_counts()
+    removed = db.remove_slack_team_repository(payload.get('team'), payload.get('repository'))
     db.close()
     
-    return jsonify(contributors)
+    if not removed:
+        return jsonify({"error": "Team membership not found"}), 404
+    slack_router.invalidate()
+    return jsonify({"success": True})
+
+# API endpoint to start applying branch protection rules. Takes repo (one full
+# name), repos (a list) or all: true for every known repository; answers 202
+# with the job to poll. Only repositories in the repositories table can be
+# targeted.
+@app.route('/api/repos/branch-protection', methods=['POST'])
+@require_admin
+def apply_branch_protection():
+    payload = request.get_json(silent=True) or {}
+    
+    branch = payload.get('branch')
+    if not isinstance(branch, str) or not branch.strip():
+        return jsonify({"error": "branch is required"}), 400
+    try:
+        rules = ProtectionRules.from_request(payload.get('rules', {}))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if payload.get('all'):
+        repositories = None
+    else:
+        repositories = payload.get('repos') or ([payload['repo']] if payload.get('repo') else [])
+        if not isinstance(repositories, list) or not repositories:
+            return jsonify({"error": "repo, repos or all is required"}), 400
+        if not all(isinstance(name, str) and name.count('/') == 1 for name in repositories):
+            return jsonify({"error": "repositories must be full names (owner/name)"}), 400
+        
+        db = DatabaseHandler()
+        if getattr(db, 'connection_failed', False):
+            return _service_unavailable("Database unavailable", storage_retry_after())
+        try:
+            # GitHub full names are case-insensitive; jobs use the stored spelling
+            known = {name.lower(): name for _, name in db.get_repositories_for_sync()}
+        finally:
+            db.close()
+        unknown = [name for name in repositories if name.lower() not in known]
+        if unknown:
+            return jsonify({"error": "Unknown repositories", "repositories": unknown}), 400
+        repositories = list(dict.fromkeys(known[name.lower()] for name in repositories))
+    
+    job = branch_protection_jobs.submit(repositories, branch.strip(), rules)
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "status_url": url_for('get_branch_protection_job', job_id=job.id)
+    }), 202
+
+# API endpoint to poll a branch protection job
+@app.route('/api/repos/branch-protection/jobs/<job_id>', methods=['GET'])
+@require_admin
+def get_branch_protection_job(job_id):
+    job = branch_protection_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.snapshot())
+
+# API endpoint to list recent branch protection jobs
+@app.route('/api/repos/branch-protection/jobs', methods=['GET'])
+@require_admin
+def list_branch_protection_jobs():
+    return jsonify(branch_protection_jobs.recent())
 
 # Route handlers
 @app.route('/', methods=['GET'])
@@ -112,6 +616,79 @@ def health_check():
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint reporting cached database probe and circuit breaker state"""
+    status = readiness_probe.status()
+    status['admission'] = admission.snapshot()
+    if write_batcher:
+        status['write_batcher'] = write_batcher.snapshot()
+    status['outbox_worker'] = outbox_worker.snapshot()
+    status['live_events'] = live_events.snapshot()
+    return jsonify(status), 200 if status['ready'] else 503
+
+# API endpoint to get notification outbox counts (pending, delivered, dead-lettered)
+@app.route('/api/notification-outbox', methods=['GET'])
+def get_notification_outbox():
+    db = DatabaseHandler()
+    stats = db.get_outbox_stats()
+    db.close()
+    stats['worker'] = outbox_worker.snapshot()
+    return jsonify(stats)
+
+# API endpoint to get the analytics snapshot's memory footprint (?verify=1 also compares it with SQL)
+@app.route('/api/analytics-snapshot', methods=['GET'])
+def get_analytics_snapshot():
+    snapshot = analytics_snapshot.current()
+    if not snapshot:
+        return jsonify({"enabled": analytics_snapshot.enabled, "loaded": False})
+    report = snapshot.memory_report()
+    report['enabled'] = True
+    if request.args.get('verify') in ('1', 'true'):
+        db = DatabaseHandler()
+        try:
+            report['differences'] = snapshot.verify(db)
+        finally:
+            db.close()
+    return jsonify(report)
+
+# API endpoint to get per-handler webhook counters
+@app.route('/api/webhook-stats', methods=['GET'])
+def get_webhook_stats():
+    return jsonify(webhook_events.snapshot())
+
+# Live dashboard updates as Server-Sent Events; a reconnect resumes from Last-Event-ID
+# (or ?last_event_id=). Each client holds a thread here; the ASGI server streams on its event loop.
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    subscription = live_events.subscribe(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    heartbeat = get_settings().live_events.heartbeat_seconds
+    if subscription is None:
+        return _service_unavailable("Too many live event clients", heartbeat)
+    
+    def generate():
+        try:
+            yield subscription.hello()
+            while True:
+                frames = subscription.wait(heartbeat)
+                # The keep-alive also surfaces a closed connection, which ends the generator
+                yield b''.join(frames) if frames else HEARTBEAT_FRAME
+        finally:
+            live_events.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def storage_retry_after():
+    """Retry-After for a delivery that could not be stored: until the breaker probes, or the webhook default"""
+    return database_breaker.retry_after() or get_settings().webhook.retry_after_seconds
+
+def _service_unavailable(message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
 @app.route('/', methods=['POST'])
 def handle_webhook():
     """
@@ -120,107 +697,84 @@ def handle_webhook():
     logger.info("Received webhook request")
     logger.debug(f"Request Headers: {dict(request.headers)}")
     
-    # Verify webhook signature
-    if not verify_github_webhook(request, GITHUB_SECRET):
-        logger.error("Webhook verification failed")
-        return jsonify({"error": "Invalid signature"}), 400
+    # Fail fast while the database is down so blocked threads don't pile up;
+    # events nobody handles never touch the database, so they are still acknowledged
+    if webhook_events.handles_event(request.headers.get('X-GitHub-Event')) and database_breaker.is_open():
+        logger.warning("Rejecting webhook, database circuit breaker is open")
+        return _service_unavailable("Database unavailable", database_breaker.retry_after())
+    
+    if not admission.try_acquire():
+        logger.warning(f"Rejecting webhook, {admission.max_in_flight} requests already in flight")
+        return _service_unavailable("Too many requests in flight", admission.retry_after)
     
     try:
-        data = request.get_json()
-        event_type = request.headers.get('X-GitHub-Event')
-        logger.info(f"Event type: {event_type}")
-        
-        # Handle different event types
-        if event_type == 'pull_request':
-            action = data.get('action')
-            logger.info(f"Pull request action: {action}")
-            
-            if action in ['opened', 'reopened', 'synchronize', 'edited']:
-                pr_id = process_pull_request(data)
-                
-                # Send notification for new PRs
-                if action == 'opened' and SLACK_WEBHOOK_URL:
-                    pr = data['pull_request']
-                    repo = data['repository']
-                    
-                    title = "🔔 New Pull Request Created"
-                    text = f"*{pr['title']}*\n{pr.get('body', 'No description provided.')}"
-                    
-                    fields = [
-                        f"*Repository:* {repo['full_name']}",
-                        f"*Created by:* {pr['user']['login']}"
-                    ]
-                    
-                    actions = [{
-                        "text": "View Pull Request",
-                        "url": pr['html_url']
-                    }]
-                    
-                    send_slack_notification(SLACK_WEBHOOK_URL, title, text, fields, actions)
-                
-                return jsonify({"status": "success", "message": "PR processed"}), 200
-                
-        elif event_type == 'pull_request_review':
-            review_id = process_review(data)
-            
-            # Send notification for requested changes
-            if data['review']['state'] == 'changes_requested' and SLACK_WEBHOOK_URL:
-                pr = data['pull_request']
-                review = data['review']
-                repo = data['repository']
-                
-                title = "⚠️ Changes Requested on Pull Request"
-                text = f"*{pr['title']}*\n{review.get('body', 'No review comments provided.')}"
-                
-                fields = [
-                    f"*Repository:* {repo['full_name']}",
-                    f"*PR Author:* {pr['user']['login']}",
-                    f"*Reviewer:* {review['user']['login']}"
-                ]
-                
-                actions = [{
-                    "text": "View Review",
-                    "url": review['html_url']
-                }]
-                
-                send_slack_notification(SLACK_WEBHOOK_URL, title, text, fields, actions)
-            
-            return jsonify({"status": "success", "message": "Review processed"}), 200
-            
-        elif event_type == 'pull_request_review_comment':
-            comment_id = process_review_comment(data)
-            return jsonify({"status": "success", "message": "Comment processed"}), 200
-        
-        # Handle ping event (GitHub sends this when webhook is first configured)
-        elif event_type == 'ping':
-            return jsonify({"status": "success", "message": "Pong!"}), 200
-            
-        return jsonify({"status": "success", "message": "Event received"}), 200
+        return _handle_admitted_webhook()
+    finally:
+        admission.release()
+
+def _handle_admitted_webhook():
+    """Verify, parse and process a webhook once it has been admitted"""
+    # Verify webhook signature while streaming the body in; unsigned or
+    # oversized requests are rejected before any of the body is read
+    try:
+        payload_body = webhook_verifier.read_verified_body(
+            request.stream,
+            request.headers.get('X-Hub-Signature-256'),
+            request.content_length
+        )
+    except WebhookVerificationError as e:
+        logger.error(f"Webhook verification failed: {str(e)}")
+        return jsonify({"error": str(e)}), e.status_code
+    
+    # Every verified delivery goes to the event log, whether or not it is handled
+    archive_delivery(
+        request.headers.get('X-GitHub-Delivery'),
+        request.headers.get('X-GitHub-Event'),
+        payload_body
+    )
+    
+    # Deliveries without a handler (push, check_run, PR labeled, ...) are
+    # acknowledged here, without being parsed
+    if not webhook_events.accepts(request.headers.get('X-GitHub-Event'), payload_body):
+        return jsonify({"status": "success", "message": "Event ignored"}), 200
+    
+    try:
+        data = parse_webhook_payload(payload_body, selective=get_settings().webhook.selective_parse)
+    except ValueError as e:
+        logger.error(f"Webhook body is not valid JSON: {str(e)}")
+        return jsonify({"error": "Invalid JSON payload"}), 400
+    del payload_body
+    
+    try:
+        status_code, body, notifications = dispatch_webhook_event(
+            request.headers.get('X-GitHub-Event'), data, store_event
+        )
+        # Queued notifications go out now rather than at the next poll
+        outbox_worker.wake()
+        for notification in notifications:
+            slack_router.notify(*notification)
+        return jsonify(body), status_code
         
+    except StorageUnavailable as e:
+        logger.error(f"Webhook not stored, asking GitHub to retry: {str(e)}")
+        return _service_unavailable("Database unavailable", storage_retry_after())
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         return jsonify({"error": f"Error processing webhook: {str(e)}"}), 500
 
 if __name__ == '__main__':
-    # Verify environment variables
-    missing_vars = []
-    if not GITHUB_SECRET:
-        missing_vars.append("GITHUB_WEBHOOK_SECRET")
-    
-    if not os.getenv('DATABASE_CONNECTION_STRING'):
-        missing_vars.append("DATABASE_CONNECTION_STRING")
+    configure_logging(settings)
+    install_reload_handler()
     
+    # Verify environment variables
+    missing_vars = settings.missing()
     if missing_vars:
         logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
         logger.error("Please set these variables in your .env file")
     
-    # Start stale PR checker in a separate thread if Slack webhook is configured
-    if SLACK_WEBHOOK_URL:
-        checker_thread = threading.Thread(target=stale_pr_checker, daemon=True)
-        checker_thread.start()
-        logger.info("Started stale PR checker thread")
-    else:
-        logger.warning("SLACK_WEBHOOK_URL not set, stale PR notifications disabled")
+    start_background_workers()
+    if not settings.slack.webhook_url:
+        logger.warning("SLACK_WEBHOOK_URL not set, only repositories with Slack routes will be notified")
     
     logger.info("Starting GitHub webhook server...")
     app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+Asyncio webhook server (ASGI)
+
+An alternative to the threaded Flask server for webhook traffic. Requests are
+handled on one event loop; the only blocking work left, pyodbc calls and
+event-log appends, runs on a bounded thread pool. Slack notifications are
+queued in the outbox and delivered by the outbox worker thread; any a
+handler returns for direct delivery are posted with an async HTTP client.
+Verification, parsing and event processing are the same code the Flask app
+uses.
+
+Run with: uvicorn prequel_app.asgi:app --host 0.0.0.0 --port 5002
+      or: python -m prequel_app.asgi
+
+Dashboard API routes are served by mounting the Flask app when asgiref is
+installed; otherwise only /, /ready, /api/events and the webhook endpoint are
+available. The live event stream (/api/events) is served here directly, so
+each connected dashboard costs a coroutine rather than a thread.
+"""
+import asyncio
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from prequel_app.app import (
+    app as flask_app,
+    webhook_verifier,
+    slack_router,
+    readiness_probe,
+    write_batcher,
+    archive_delivery,
+    store_event,
+    start_background_workers,
+    outbox_worker,
+    storage_retry_after,
+    settings
+)
+from prequel_app.github_handler import (
+    WebhookVerificationError,
+    StorageUnavailable,
+    parse_webhook_payload,
+    dispatch_webhook_event
+)
+from prequel_config.settings import get_settings, configure_logging, install_reload_handler
+from prequel_app.health import AdmissionController
+from prequel_app.event_registry import webhook_events
+from prequel_app.slack_notifier import build_notification_blocks, post_slack_blocks
+from prequel_db.circuit_breaker import database_breaker
+from prequel_db.live_events import live_events, HEARTBEAT_FRAME
+
+logger = logging.getLogger(__name__)
+
+# httpx is optional; without it Slack posts run on the thread pool via requests
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+# Waiting deliveries cost a coroutine, not a thread, so the in-flight cap can be
+# much higher than the Flask server's; database concurrency is bounded separately
+admission = AdmissionController(
+    max_in_flight=settings.asgi.max_in_flight,
+    retry_after=settings.webhook.retry_after_seconds
+)
+db_executor = ThreadPoolExecutor(max_workers=settings.asgi.db_workers, thread_name_prefix='asgi-db')
+flask_asgi = WsgiToAsgi(flask_app) if WsgiToAsgi else None
+
+_slack_client = None
+
+async def _send_json(send, status, body, headers=None):
+    payload = json.dumps(body).encode('utf-8')
+    response_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.encode('latin-1'), value.encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def _service_unavailable(send, message, retry_after):
+    await _send_json(send, 503, {"error": message}, {'Retry-After': str(max(1, int(math.ceil(retry_after))))})
+
+async def _read_verified_body(receive, signature, content_length):
+    """Verify the body while it streams in; returns None if the client went away"""
+    check = webhook_verifier.begin(signature, content_length)
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        if chunk:
+            check.update(chunk)
+            chunks.append(chunk)
+        more_body = message.get('more_body', False)
+
+    if not check.finish():
+        raise WebhookVerificationError("Invalid signature")
+    return b''.join(chunks)
+
+async def _post_slack(url, blocks, fallback_text):
+    if _slack_client is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(db_executor, post_slack_blocks, url, blocks, fallback_text)
+    message = {"blocks": blocks}
+    if fallback_text:
+        message["text"] = fallback_text
+    try:
+        response = await _slack_client.post(url, json=message)
+        logger.debug(f"Slack API Response: {response.status_code} - {response.text}")
+        return response.status_code == 200
+    except Exception as e:
+        logger.error(f"Error sending Slack notification: {str(e)}")
+        return False
+
+async def notify(repository, event_type, title, text, fields=None, actions=None):
+    """Async counterpart of SlackRouter.notify: same routing, concurrent async posts"""
+    # resolve() may load the routing table from the database, so keep it off the loop
+    loop = asyncio.get_running_loop()
+    urls = await loop.run_in_executor(db_executor, slack_router.resolve, repository, event_type)
+    if not urls:
+        logger.warning(f"No Slack route for {event_type} on {repository}, notification dropped")
+        return {}
+    blocks = build_notification_blocks(title, text, fields, actions)
+    results = await asyncio.gather(*(_post_slack(url, blocks, title) for url in urls))
+    return dict(zip(urls, results))
+
+async def handle_webhook(scope, receive, send):
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+    # Fail fast while the database is down (events nobody handles are still acknowledged)
+    if webhook_events.handles_event(headers.get('x-github-event')) and database_breaker.is_open():
+        logger.warning("Rejecting webhook, database circuit breaker is open")
+        await _service_unavailable(send, "Database unavailable", database_breaker.retry_after())
+        return
+
+    if not admission.try_acquire():
+        logger.warning(f"Rejecting webhook, {admission.max_in_flight} requests already in flight")
+        await _service_unavailable(send, "Too many requests in flight", admission.retry_after)
+        return
+
+    try:
+        content_length = headers.get('content-length')
+        try:
+            payload_body = await _read_verified_body(
+                receive,
+                headers.get('x-hub-signature-256'),
+                int(content_length) if content_length else None
+            )
+        except WebhookVerificationError as e:
+            logger.error(f"Webhook verification failed: {str(e)}")
+            await _send_json(send, e.status_code, {"error": str(e)})
+            return
+        if payload_body is None:
+            return
+
+        # Every verified delivery goes to the event log, whether or not it is handled
+        loop = asyncio.get_running_loop()
+        event_type = headers.get('x-github-event')
+        await loop.run_in_executor(
+            db_executor, archive_delivery, headers.get('x-github-delivery'), event_type, payload_body
+        )
+
+        if not webhook_events.accepts(event_type, payload_body):
+            await _send_json(send, 200, {"status": "success", "message": "Event ignored"})
+            return
+
+        try:
+            data = parse_webhook_payload(payload_body, selective=get_settings().webhook.selective_parse)
+        except ValueError as e:
+            logger.error(f"Webhook body is not valid JSON: {str(e)}")
+            await _send_json(send, 400, {"error": "Invalid JSON payload"})
+            return
+        del payload_body
+
+        try:
+            status_code, body, notifications = await loop.run_in_executor(
+                db_executor, dispatch_webhook_event, event_type, data, store_event
+            )
+            outbox_worker.wake()
+            if notifications:
+                await asyncio.gather(*(notify(*notification) for notification in notifications))
+        except StorageUnavailable as e:
+            logger.error(f"Webhook not stored, asking GitHub to retry: {str(e)}")
+            await _service_unavailable(send, "Database unavailable", storage_retry_after())
+            return
+        except Exception as e:
+            logger.error(f"Error processing webhook: {str(e)}")
+            await _send_json(send, 500, {"error": f"Error processing webhook: {str(e)}"})
+            return
+        await _send_json(send, status_code, body)
+    finally:
+        admission.release()
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def handle_event_stream(scope, receive, send):
+    """Stream committed changes as Server-Sent Events (see prequel_db/live_events.py)"""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    last_event_id = headers.get('last-event-id') or (query.get('last_event_id') or [None])[0]
+    heartbeat = get_settings().live_events.heartbeat_seconds
+
+    # Publishers run on other threads; the wake-up is handed to this loop
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = live_events.subscribe(last_event_id, lambda: loop.call_soon_threadsafe(ready.set))
+    if subscription is None:
+        await _service_unavailable(send, "Too many live event clients", heartbeat)
+        return
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*')
+        ]})
+        await send({'type': 'http.response.body', 'body': subscription.hello(), 'more_body': True})
+        while not disconnected.done():
+            ready.clear()
+            frames = subscription.drain()
+            if not frames:
+                woken = asyncio.ensure_future(ready.wait())
+                done, _ = await asyncio.wait({woken, disconnected}, timeout=heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if done:
+                    continue
+            body = b''.join(frames) if frames else HEARTBEAT_FRAME
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError:
+        # The client went away while we were writing
+        pass
+    finally:
+        disconnected.cancel()
+        live_events.unsubscribe(subscription)
+
+async def _lifespan(receive, send):
+    global _slack_client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            install_reload_handler()
+            # The same background work as the Flask server's __main__ block, including the
+            # analytics snapshot the mounted dashboard routes read from
+            start_background_workers()
+            if httpx is not None:
+                _slack_client = httpx.AsyncClient(
+                    timeout=get_settings().slack.timeout_seconds,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+                )
+            else:
+                logger.warning("httpx not installed, Slack notifications will use the thread pool")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _slack_client is not None:
+                await _slack_client.aclose()
+                _slack_client = None
+            if write_batcher:
+                write_batcher.close()
+            outbox_worker.stop()
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if path == '/' and method == 'POST':
+        await handle_webhook(scope, receive, send)
+    elif path == '/' and method == 'GET':
+        await _send_json(send, 200, {"status": "healthy", "timestamp": datetime.now().isoformat()})
+    elif path == '/ready' and method == 'GET':
+        status = readiness_probe.status()
+        status['admission'] = admission.snapshot()
+        if write_batcher:
+            status['write_batcher'] = write_batcher.snapshot()
+        status['outbox_worker'] = outbox_worker.snapshot()
+        status['live_events'] = live_events.snapshot()
+        await _send_json(send, 200 if status['ready'] else 503, status)
+    elif path == '/api/events' and method == 'GET':
+        await handle_event_stream(scope, receive, send)
+    elif flask_asgi is not None:
+        await flask_asgi(scope, receive, send)
+    else:
+        await _send_json(send, 404, {"error": "Not found"})
+
+if __name__ == '__main__':
+    import uvicorn
+    configure_logging(settings)
+    uvicorn.run(app, host='0.0.0.0', port=settings.asgi.port, log_level='info')
@@ -0,0 +1,403 @@
+"""
+Bulk branch protection across known repositories
+
+Applies one set of protection rules (the dashboard's BranchProtectionRules)
+to a branch of many repositories as a background job. Repositories are
+handled concurrently through the pooled, rate-limit aware GitHubClient:
+reads run in parallel, writes are paced by the shared RateLimiter, which
+slows down when GitHub pushes back.
+
+Every repository is diffed before it is written. The current protection is
+read with If-None-Match, and the ETag and a fingerprint of the managed
+settings are kept in github_sync_state, so a repository whose protection is
+unchanged since the last job costs one 304 (free against the rate limit)
+and is skipped. Only the required review count, stale review dismissal and
+code owner review settings are managed. Everything else already on a
+branch is carried over when it is updated. That covers status checks,
+admin enforcement, push, dismissal and bypass restrictions, last push
+approval, and the branch toggles (linear history, force pushes, deletions,
+creations, conversation resolution, lock, fork syncing).
+
+Usage:
+  python -m prequel_app.branch_protection --branch main [--repo owner/name ...]
+      [--reviewers 1] [--no-pull-request] [--dismiss-stale] [--code-owners]
+      [--api-url URL]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+
+from prequel_config.settings import get_settings, configure_logging
+from prequel_db.db_handler import DatabaseHandler
+from prequel_app.github_sync import GitHubClient, RateLimiter, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# GitHub accepts 0 to 6 required approving reviews
+MAX_REQUIRED_REVIEWERS = 6
+MAX_JOB_ERRORS = 100
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+class ProtectionRules:
+    """The managed subset of a branch protection: required pull request reviews"""
+
+    __slots__ = ('require_pull_request', 'required_reviewers', 'dismiss_stale_reviews', 'require_code_owners')
+
+    def __init__(self, require_pull_request=True, required_reviewers=1, dismiss_stale_reviews=False,
+                 require_code_owners=False):
+        self.require_pull_request = require_pull_request
+        self.required_reviewers = required_reviewers
+        self.dismiss_stale_reviews = dismiss_stale_reviews
+        self.require_code_owners = require_code_owners
+
+    @classmethod
+    def from_request(cls, rules):
+        """Validate the frontend's BranchProtectionRules; raises ValueError"""
+        if not isinstance(rules, dict):
+            raise ValueError("rules must be an object")
+        reviewers = rules.get('requiredReviewers', 1)
+        if isinstance(reviewers, bool) or not isinstance(reviewers, int):
+            raise ValueError("requiredReviewers must be a number")
+        if not 0 <= reviewers <= MAX_REQUIRED_REVIEWERS:
+            raise ValueError(f"requiredReviewers must be between 0 and {MAX_REQUIRED_REVIEWERS}")
+        return cls(
+            require_pull_request=bool(rules.get('requirePullRequest', True)),
+            required_reviewers=reviewers,
+            dismiss_stale_reviews=bool(rules.get('dismissStaleReviews', False)),
+            require_code_owners=bool(rules.get('requireCodeOwners', False))
+        )
+
+    def state(self):
+        """The managed settings these rules ask for, in managed_state's shape"""
+        if not self.require_pull_request:
+            return {'required_pull_request_reviews': None}
+        return {'required_pull_request_reviews': {
+            'required_approving_review_count': self.required_reviewers,
+            'dismiss_stale_reviews': self.dismiss_stale_reviews,
+            'require_code_owner_reviews': self.require_code_owners
+        }}
+
+    def to_dict(self):
+        return {
+            'requirePullRequest': self.require_pull_request,
+            'requiredReviewers': self.required_reviewers,
+            'dismissStaleReviews': self.dismiss_stale_reviews,
+            'requireCodeOwners': self.require_code_owners
+        }
+
+def managed_state(protection):
+    """The managed settings of a protection as returned by GitHub (None: branch not protected)"""
+    reviews = (protection or {}).get('required_pull_request_reviews')
+    if not reviews:
+        return {'required_pull_request_reviews': None}
+    return {'required_pull_request_reviews': {
+        'required_approving_review_count': reviews.get('required_approving_review_count', 0),
+        'dismiss_stale_reviews': bool(reviews.get('dismiss_stale_reviews')),
+        'require_code_owner_reviews': bool(reviews.get('require_code_owner_reviews'))
+    }}
+
+def state_fingerprint(state):
+    """40-character digest of managed settings, stored as the sync state cursor"""
+    return hashlib.sha1(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Protection settings GitHub returns as {"enabled": bool} and takes back as a plain bool
+PROTECTION_TOGGLES = ('required_linear_history', 'allow_force_pushes', 'allow_deletions', 'block_creations',
+                      'required_conversation_resolution', 'lock_branch', 'allow_fork_syncing')
+
+def _actors(section):
+    """Users, teams and apps of a GET restriction section in their update shape"""
+    return {
+        'users': [user['login'] for user in section.get('users', [])],
+        'teams': [team['slug'] for team in section.get('teams', [])],
+        'apps': [app['slug'] for app in section.get('apps', [])]
+    }
+
+def protection_update_body(current, rules):
+    """
+    PUT body applying rules to a branch
+
+    The PUT replaces the whole protection, so every unmanaged setting of the
+    current protection (GET shape) is converted to its update shape; a
+    setting left out of the body would be switched off.
+    """
+    current = current or {}
+    body = {
+        'required_status_checks': None,
+        'enforce_admins': bool((current.get('enforce_admins') or {}).get('enabled')),
+        'required_pull_request_reviews': rules.state()['required_pull_request_reviews'],
+        'restrictions': None
+    }
+    checks = current.get('required_status_checks')
+    if checks:
+        body['required_status_checks'] = {
+            'strict': bool(checks.get('strict')),
+            'checks': [
+                {'context': check['context'], 'app_id': check.get('app_id')}
+                for check in checks.get('checks') or [{'context': context} for context in checks.get('contexts', [])]
+            ]
+        }
+    restrictions = current.get('restrictions')
+    if restrictions:
+        body['restrictions'] = _actors(restrictions)
+
+    # The unmanaged review settings stay as they are while reviews are required
+    reviews = current.get('required_pull_request_reviews')
+    if reviews and body['required_pull_request_reviews'] is not None:
+        body['required_pull_request_reviews']['require_last_push_approval'] = bool(reviews.get('require_last_push_approval'))
+        if reviews.get('dismissal_restrictions'):
+            body['required_pull_request_reviews']['dismissal_restrictions'] = _actors(reviews['dismissal_restrictions'])
+        if reviews.get('bypass_pull_request_allowances'):
+            body['required_pull_request_reviews']['bypass_pull_request_allowances'] = \
+                _actors(reviews['bypass_pull_request_allowances'])
+
+    for toggle in PROTECTION_TOGGLES:
+        if toggle in current:
+            body[toggle] = bool((current.get(toggle) or {}).get('enabled'))
+    return body
+
+class BranchProtectionJob:
+    """Progress of one bulk application, updated by the worker threads"""
+
+    def __init__(self, repositories, branch, rules):
+        self.id = uuid.uuid4().hex
+        self.repositories = repositories
+        self.branch = branch
+        self.rules = rules
+        self.status = JOB_QUEUED
+        self.counts = {'total': len(repositories) if repositories is not None else None,
+                       'done': 0, 'unchanged': 0, 'applied': 0, 'failed': 0}
+        self.errors = []
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def fail(self, error):
+        with self._lock:
+            self.errors.append({'repository': None, 'error': error})
+        self.status = JOB_FAILED
+
+    def record(self, full_name, outcome, error=None):
+        with self._lock:
+            self.counts['done'] += 1
+            self.counts[outcome] += 1
+            if error and len(self.errors) < MAX_JOB_ERRORS:
+                self.errors.append({'repository': full_name, 'error': error})
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self.counts)
+            errors = list(self.errors)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'branch': self.branch,
+            'rules': self.rules.to_dict(),
+            **counts,
+            'errors': errors,
+            'requests': dict(self.requests),
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class BranchProtectionApplier:
+    """Applies a job's rules to its repositories, concurrency at a time"""
+
+    def __init__(self, client, concurrency=8, db_factory=DatabaseHandler):
+        self.client = client
+        self.concurrency = concurrency
+        self.db_factory = db_factory
+
+    def run(self, job):
+        job.status = JOB_RUNNING
+        job.started_at = datetime.utcnow()
+        try:
+            if job.repositories is None:
+                db = self.db_factory()
+                try:
+                    job.repositories = [name for _, name in db.get_repositories_for_sync()]
+                finally:
+                    db.close()
+                job.counts['total'] = len(job.repositories)
+
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='branch-protection') as executor:
+                list(executor.map(lambda full_name: self._apply_safely(job, full_name), job.repositories))
+            job.status = JOB_COMPLETED
+        except Exception as e:
+            logger.error(f"Branch protection job {job.id} failed: {str(e)}")
+            job.fail(str(e))
+        finally:
+            job.requests = {'requests': self.client.requests_made, 'not_modified': self.client.not_modified,
+                            'write_interval': round(self.client.rate_limiter.write_interval, 2)}
+            job.finished_at = datetime.utcnow()
+            logger.info(f"Branch protection job {job.id} {job.status}: {job.counts}")
+
+    def _apply_safely(self, job, full_name):
+        db = self.db_factory()
+        try:
+            if getattr(db, 'connection_failed', False):
+                job.record(full_name, 'failed', "Database connection failed")
+                return
+            job.record(full_name, self.apply_repository(db, full_name, job.branch, job.rules))
+        except RateLimitExceeded as e:
+            job.record(full_name, 'failed', str(e))
+        except requests.HTTPError as e:
+            job.record(full_name, 'failed', f"GitHub returned {e.response.status_code}: {_error_message(e.response)}")
+        except Exception as e:
+            logger.error(f"Error applying branch protection to {full_name}: {str(e)}")
+            job.record(full_name, 'failed', str(e))
+        finally:
+            db.close()
+
+    def apply_repository(self, db, full_name, branch, rules):
+        """Bring one branch in line with rules; returns 'unchanged' or 'applied'"""
+        path = f"/repos/{full_name}/branches/{quote(branch, safe='')}/protection"
+        resource = f"protection/{branch}"
+        desired = rules.state()
+        desired_fingerprint = state_fingerprint(desired)
+        etag, fingerprint = db.get_sync_state(full_name, resource)
+
+        not_modified, current, new_etag = self._get_protection(path, etag)
+        if not_modified:
+            # The protection is what it was when the fingerprint was taken
+            if fingerprint == desired_fingerprint:
+                return 'unchanged'
+            # Its settings have to be carried over, so read it in full
+            _, current, new_etag = self._get_protection(path, None)
+
+        current_state = managed_state(current)
+        if current_state == desired:
+            db.save_sync_state(full_name, resource, new_etag, state_fingerprint(current_state))
+            return 'unchanged'
+
+        self.client.put(path, protection_update_body(current, rules))
+        # The PUT changes the ETag, so the next job reads the protection in full once
+        db.save_sync_state(full_name, resource, None, desired_fingerprint)
+        return 'applied'
+
+    def _get_protection(self, path, etag):
+        """(not_modified, protection or None if unprotected, ETag) for a branch"""
+        try:
+            response = self.client.get(path, etag=etag)
+        except requests.HTTPError as e:
+            # 404 is GitHub's answer for a branch without protection
+            if e.response is not None and e.response.status_code == 404 and 'not protected' in e.response.text.lower():
+                return False, None, None
+            raise
+        if response.status_code == 304:
+            return True, None, etag
+        return False, response.json(), response.headers.get('ETag')
+
+def _error_message(response):
+    try:
+        return response.json().get('message', response.reason)
+    except ValueError:
+        return response.reason
+
+class BranchProtectionJobs:
+    """
+    Runs branch protection jobs one after another in the background and keeps
+    the most recent ones for the status endpoint
+    """
+
+    def __init__(self, applier_factory, max_jobs=50):
+        self._applier_factory = applier_factory
+        self._max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='branch-protection-jobs')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, repositories, branch, rules):
+        """Queue a job for the given full names (None: every known repository)"""
+        job = BranchProtectionJob(repositories, branch, rules)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                oldest_id = next(iter(self._jobs))
+                if self._jobs[oldest_id].status in (JOB_QUEUED, JOB_RUNNING):
+                    break
+                self._jobs.popitem(last=False)
+        self._executor.submit(lambda: self._applier_factory().run(job))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def recent(self):
+        """Snapshots of the kept jobs, newest first"""
+        with self._lock:
+            return [job.snapshot() for job in reversed(self._jobs.values())]
+
+def branch_protection_applier_from_settings(settings, rate_limiter=None, api_url=None):
+    """Build an applier from the GitHub API settings and BRANCH_PROTECTION_* settings"""
+    protection = settings.branch_protection
+    client = GitHubClient(
+        api_url=api_url or settings.github_sync.api_url,
+        token=settings.github_sync.token,
+        concurrency=protection.concurrency,
+        rate_limiter=rate_limiter or RateLimiter(
+            min_remaining=settings.github_sync.min_remaining,
+            min_write_interval=protection.write_interval_seconds
+        )
+    )
+    return BranchProtectionApplier(client, concurrency=protection.concurrency)
+
+def branch_protection_jobs_from_settings(settings):
+    """Job runner whose jobs share one rate limiter (the limits are per token)"""
+    rate_limiter = RateLimiter(
+        min_remaining=settings.github_sync.min_remaining,
+        min_write_interval=settings.branch_protection.write_interval_seconds
+    )
+    return BranchProtectionJobs(
+        lambda: branch_protection_applier_from_settings(get_settings(), rate_limiter),
+        max_jobs=settings.branch_protection.max_jobs_kept
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--branch', required=True)
+    parser.add_argument('--repo', action='append', help="Repository full name (default: all known repositories)")
+    parser.add_argument('--reviewers', type=int, default=1, help="Required approving reviews")
+    parser.add_argument('--no-pull-request', action='store_true', help="Do not require pull requests")
+    parser.add_argument('--dismiss-stale', action='store_true', help="Dismiss approvals when new commits are pushed")
+    parser.add_argument('--code-owners', action='store_true', help="Require review from code owners")
+    parser.add_argument('--api-url', help="GitHub API base URL (default: GITHUB_API_URL or api.github.com)")
+    args = parser.parse_args(argv)
+    settings = get_settings()
+    configure_logging(settings)
+
+    rules = ProtectionRules.from_request({
+        'requirePullRequest': not args.no_pull_request,
+        'requiredReviewers': args.reviewers,
+        'dismissStaleReviews': args.dismiss_stale,
+        'requireCodeOwners': args.code_owners
+    })
+    job = BranchProtectionJob(args.repo, args.branch, rules)
+    applier = branch_protection_applier_from_settings(settings, api_url=args.api_url)
+    worker = threading.Thread(target=applier.run, args=(job,), daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(5)
+        progress = job.snapshot()
+        print(f"{progress['status']}: {progress['done']}/{progress['total']} done, "
+              f"{progress['applied']} applied, {progress['unchanged']} unchanged, {progress['failed']} failed")
+    print(json.dumps(job.snapshot(), indent=2))
+
+if __name__ == '__main__':
+    main()
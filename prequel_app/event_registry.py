@@ -0,0 +1,149 @@
+import importlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# GitHub serialises "action" as the first key of every payload that has one,
+# so it can be read from the first bytes without parsing the document
+ACTION_PATTERN = re.compile(rb'^\s*\{\s*"action"\s*:\s*"([A-Za-z_]{1,64})"')
+ACTION_SNIFF_BYTES = 256
+
+# Modules whose import registers the built-in handlers
+HANDLER_MODULES = ['prequel_app.github_handler']
+
+def sniff_action(payload_body):
+    """Read the action from the start of a raw payload, or None if it is not there"""
+    match = ACTION_PATTERN.match(payload_body[:ACTION_SNIFF_BYTES])
+    return match.group(1).decode('ascii') if match else None
+
+class _Handler:
+    __slots__ = ('name', 'event', 'actions', 'fn', 'calls', 'errors', 'seconds')
+
+    def __init__(self, name, event, actions, fn):
+        self.name = name
+        self.event = event
+        self.actions = actions
+        self.fn = fn
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+class EventRegistry:
+    """
+    Webhook handlers keyed by (X-GitHub-Event, action)
+
+    Handlers register with the @handler decorator, either for every action of
+    an event or for a fixed set of actions. A handler is called as
+    fn(data, store) and returns (status_code, response_body, notifications),
+    like github_handler.dispatch_webhook_event.
+
+    accepts() decides from the event header and the start of the raw body
+    whether a delivery has a handler at all, so the servers can acknowledge
+    the rest right after signature verification without parsing them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._by_event = {}
+        self._ignored = Counter()
+
+    def handler(self, event, actions=None, name=None):
+        """Decorator registering fn for an event, optionally limited to some actions"""
+        def register(fn):
+            entry = _Handler(name or fn.__name__, event, tuple(actions) if actions else None, fn)
+            with self._lock:
+                for existing in self._by_event.get(event, []):
+                    if existing.actions is None or entry.actions is None or set(existing.actions) & set(entry.actions):
+                        raise ValueError(f"Handler {entry.name} overlaps {existing.name} for '{event}' events")
+                self._by_event.setdefault(event, []).append(entry)
+                self._handlers[entry.name] = entry
+            return fn
+        return register
+
+    def lookup(self, event, action=None):
+        for entry in self._by_event.get(event, ()):
+            if entry.actions is None or action in entry.actions:
+                return entry
+        return None
+
+    def handles_event(self, event):
+        """True if any handler is registered for this X-GitHub-Event"""
+        return event in self._by_event
+
+    def accepts(self, event, payload_body=None):
+        """
+        True if a delivery may have a handler and has to be parsed
+
+        Deliveries whose action cannot be sniffed are accepted and settled by
+        dispatch() once parsed.
+        """
+        entries = self._by_event.get(event)
+        if not entries:
+            self._count_ignored(event, None)
+            return False
+        if any(entry.actions is None for entry in entries):
+            return True
+        action = sniff_action(payload_body) if payload_body else None
+        if action is None or self.lookup(event, action):
+            return True
+        self._count_ignored(event, action)
+        return False
+
+    def dispatch(self, event, data, store):
+        """Run the handler for a parsed delivery and record its counters"""
+        action = data.get('action')
+        entry = self.lookup(event, action)
+        if entry is None:
+            self._count_ignored(event, action)
+            return 200, {"status": "success", "message": "Event received"}, []
+
+        started = time.perf_counter()
+        try:
+            return entry.fn(data, store)
+        except Exception:
+            with self._lock:
+                entry.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                entry.calls += 1
+                entry.seconds += elapsed
+
+    def _count_ignored(self, event, action):
+        with self._lock:
+            self._ignored[f"{event}.{action}" if action else str(event)] += 1
+
+    def snapshot(self):
+        """Per-handler counters plus acknowledged-but-ignored deliveries"""
+        with self._lock:
+            handlers = {
+                entry.name: {
+                    'event': entry.event,
+                    'actions': list(entry.actions) if entry.actions else None,
+                    'calls': entry.calls,
+                    'errors': entry.errors,
+                    'avg_ms': round(entry.seconds / entry.calls * 1000, 3) if entry.calls else None
+                }
+                for entry in self._handlers.values()
+            }
+            ignored = dict(self._ignored)
+        return {'handlers': handlers, 'ignored': ignored}
+
+    def load_handler_modules(self, extra=()):
+        """
+        Import the modules that register handlers
+
+        Extra modules come from WEBHOOK_HANDLER_MODULES (settings.webhook.handler_modules),
+        so new event types plug in without changes to the servers.
+        """
+        for module_name in HANDLER_MODULES + list(extra):
+            importlib.import_module(module_name)
+        logger.info(f"Webhook handlers registered: {', '.join(sorted(self._handlers))}")
+
+webhook_events = EventRegistry()
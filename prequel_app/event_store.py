@@ -0,0 +1,390 @@
+import argparse
+import gzip
+import logging
+import os
+import re
+import struct
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from prequel_config.settings import get_settings, configure_logging
+
+logger = logging.getLogger(__name__)
+
+# zstandard is optional; gzip is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+
+# Frame header: magic, codec, compressed length
+FRAME_HEADER = struct.Struct('>4sBI')
+FRAME_MAGIC = b'PQEV'
+
+DEFAULT_MAX_SEGMENT_BYTES = 256 * 1024 * 1024
+INDEX_FILE = 'index.tsv'
+
+# GitHub writes full_name before the nested owner object of the top-level repository
+REPOSITORY_PATTERN = re.compile(rb'"repository":\s*\{[^{}]*?"full_name":\s*"([^"\\]+)"')
+
+def sniff_repository(payload_body):
+    """Read the repository full_name from a raw payload without parsing it, or None"""
+    match = REPOSITORY_PATTERN.search(payload_body)
+    return match.group(1).decode('utf-8', 'replace') if match else None
+
+class EventStore:
+    """
+    Append-only store of raw webhook deliveries
+
+    Deliveries are written to day-partitioned directories (YYYY-MM-DD) of
+    segment files. Each record is a frame: a 9-byte header followed by the
+    compressed payload, so a record can be read with a single seek. Each day
+    also has a small tab-separated index with one line per delivery:
+    delivery_id, event_type, repository, segment, offset, length, received_at.
+    The store is single-writer; run one writer process per directory.
+    """
+
+    def __init__(self, root, codec=None, max_segment_bytes=DEFAULT_MAX_SEGMENT_BYTES, compression_level=None):
+        self.root = root
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'gzip'
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("zstandard not installed, falling back to gzip for the event store")
+            codec = 'gzip'
+        self.codec = CODEC_ZSTD if codec == 'zstd' else CODEC_GZIP
+        self.compression_level = compression_level
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._day = None
+        self._segment = None
+        self._segment_file = None
+        self._index_file = None
+        self._delivery_index = None
+        os.makedirs(root, exist_ok=True)
+
+    # Compression
+
+    def _compress(self, body):
+        if self.codec == CODEC_ZSTD:
+            return zstandard.ZstdCompressor(level=self.compression_level or 3).compress(body)
+        return gzip.compress(body, compresslevel=self.compression_level or 5, mtime=0)
+
+    @staticmethod
+    def _decompress(codec, data):
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd-compressed events")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    # Writing
+
+    def _segment_path(self, day, segment):
+        return os.path.join(self.root, day, f"segment-{segment:05d}.log")
+
+    def _open_day(self, day):
+        """Switch the writer to a day directory, continuing its last segment"""
+        self._close_files()
+        day_dir = os.path.join(self.root, day)
+        os.makedirs(day_dir, exist_ok=True)
+        segments = sorted(name for name in os.listdir(day_dir) if name.startswith('segment-'))
+        self._segment = int(segments[-1][8:13]) if segments else 1
+        self._segment_file = open(self._segment_path(day, self._segment), 'ab')
+        self._index_file = open(os.path.join(day_dir, INDEX_FILE), 'a', encoding='utf-8')
+        self._day = day
+
+    def _close_files(self):
+        for handle in (self._segment_file, self._index_file):
+            if handle:
+                handle.close()
+        self._segment_file = None
+        self._index_file = None
+
+    def append(self, delivery_id, event_type, repository, body, received_at=None):
+        """Append one delivery and return its index record"""
+        received_at = received_at or datetime.now(timezone.utc)
+        day = received_at.strftime('%Y-%m-%d')
+        delivery_id = delivery_id or str(uuid.uuid4())
+        compressed = self._compress(body)
+        frame = FRAME_HEADER.pack(FRAME_MAGIC, self.codec, len(compressed)) + compressed
+
+        with self._lock:
+            if day != self._day:
+                self._open_day(day)
+            offset = self._segment_file.seek(0, os.SEEK_END)
+            if offset and offset + len(frame) > self.max_segment_bytes:
+                self._segment_file.close()
+                self._segment += 1
+                self._segment_file = open(self._segment_path(day, self._segment), 'ab')
+                offset = 0
+
+            self._segment_file.write(frame)
+            self._segment_file.flush()
+
+            record = {
+                'delivery_id': delivery_id,
+                'event_type': event_type or '',
+                'repository': repository or '',
+                'day': day,
+                'segment': self._segment,
+                'offset': offset,
+                'length': len(frame),
+                'received_at': received_at.isoformat()
+            }
+            self._index_file.write(_format_index_line(record))
+            self._index_file.flush()
+
+            if self._delivery_index is not None:
+                self._delivery_index[delivery_id] = record
+            return record
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+            self._day = None
+
+    # Reading
+
+    def days(self, start_day=None, end_day=None):
+        """Day partitions in order, optionally limited to [start_day, end_day]"""
+        days = sorted(
+            name for name in os.listdir(self.root)
+            if len(name) == 10 and os.path.isdir(os.path.join(self.root, name))
+        )
+        return [day for day in days if (not start_day or day >= start_day) and (not end_day or day <= end_day)]
+
+    def iter_index(self, start_day=None, end_day=None, event_type=None, repository=None):
+        """Yield index records in append order, filtered by event type and repository"""
+        for day in self.days(start_day, end_day):
+            path = os.path.join(self.root, day, INDEX_FILE)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as index_file:
+                for line in index_file:
+                    record = _parse_index_line(day, line)
+                    if record is None:
+                        continue
+                    if event_type and record['event_type'] != event_type:
+                        continue
+                    if repository and record['repository'] != repository:
+                        continue
+                    yield record
+
+    def read(self, record):
+        """Read and decompress the delivery an index record points to"""
+        with open(self._segment_path(record['day'], record['segment']), 'rb') as segment_file:
+            segment_file.seek(record['offset'])
+            return self._read_frame(segment_file)
+
+    def _read_frame(self, segment_file):
+        header = segment_file.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        magic, codec, length = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError(f"Corrupt event segment at offset {segment_file.tell() - FRAME_HEADER.size}")
+        return self._decompress(codec, segment_file.read(length))
+
+    def scan(self, start_day=None, end_day=None, event_type=None, repository=None):
+        """
+        Yield (record, body) pairs in append order
+
+        Segments are read sequentially front to back; records filtered out by
+        the index are skipped with a seek instead of being decompressed.
+        """
+        open_path = None
+        segment_file = None
+        try:
+            for record in self.iter_index(start_day, end_day, event_type, repository):
+                path = self._segment_path(record['day'], record['segment'])
+                if path != open_path:
+                    if segment_file:
+                        segment_file.close()
+                    segment_file = open(path, 'rb', buffering=1024 * 1024)
+                    open_path = path
+                if segment_file.tell() != record['offset']:
+                    segment_file.seek(record['offset'])
+                yield record, self._read_frame(segment_file)
+        finally:
+            if segment_file:
+                segment_file.close()
+
+    def get(self, delivery_id):
+        """Point lookup of a delivery body by its X-GitHub-Delivery id"""
+        with self._lock:
+            if self._delivery_index is None:
+                self._delivery_index = {record['delivery_id']: record for record in self.iter_index()}
+            record = self._delivery_index.get(delivery_id)
+        return self.read(record) if record else None
+
+def _format_index_line(record):
+    return '\t'.join((
+        record['delivery_id'],
+        record['event_type'],
+        record['repository'],
+        str(record['segment']),
+        str(record['offset']),
+        str(record['length']),
+        record['received_at']
+    )) + '\n'
+
+def _parse_index_line(day, line):
+    parts = line.rstrip('\n').split('\t')
+    # A torn last line from a crash mid-write is ignored
+    if len(parts) != 7:
+        return None
+    delivery_id, event_type, repository, segment, offset, length, received_at = parts
+    return {
+        'delivery_id': delivery_id,
+        'event_type': event_type,
+        'repository': repository,
+        'day': day,
+        'segment': int(segment),
+        'offset': int(offset),
+        'length': int(length),
+        'received_at': received_at
+    }
+
+def open_event_store(store_settings):
+    """Create the EventStore configured by EVENT_STORE_DIR, or None if it is not set"""
+    if not store_settings.directory:
+        return None
+    return EventStore(
+        store_settings.directory,
+        codec=store_settings.codec,
+        max_segment_bytes=store_settings.max_segment_bytes
+    )
+
+# Child tables first so foreign keys are never violated
+REBUILD_RESET_TABLES = [
+    # Archived rows are replayed too, and refer to user and repository ids the reset discards
+    'review_comments_archive',
+    'stale_pr_history_archive',
+    'pr_reviews_archive',
+    'pull_requests_archive',
+    'review_comments',
+    'pr_reviews',
+    'stale_pr_history',
+    'pr_cycle_facts',
+    'pr_cycle_rollup_daily',
+    'workflow_rollup_daily',
+    'workflow_latest_runs',
+    'workflow_jobs',
+    'workflow_runs',
+    'workflows',
+    'pull_requests',
+    'users',
+    'repositories',
+    # Sync cursors and ETags describe the cleared rows; the next sync reads everything again
+    'github_sync_state'
+]
+
+def rebuild(store, start_day=None, end_day=None, reset=False):
+    """
+    Re-derive the relational tables by replaying stored deliveries in order
+
+    Uses one database connection for the whole replay. With reset=True the
+    derived tables are emptied first; routing rules and other configuration
+    tables are left alone.
+    """
+    from prequel_app.github_handler import (
+        parse_webhook_payload,
+        process_pull_request,
+        process_review,
+        process_review_comment,
+        process_workflow_run,
+        process_workflow_job
+    )
+    from prequel_app.event_registry import webhook_events
+    from prequel_db.db_handler import DatabaseHandler
+
+    processors = {
+        'pull_request': process_pull_request,
+        'pull_request_review': process_review,
+        'pull_request_review_comment': process_review_comment,
+        'workflow_run': process_workflow_run,
+        'workflow_job': process_workflow_job
+    }
+
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        raise RuntimeError("Database connection failed")
+
+    try:
+        if reset:
+            for table in REBUILD_RESET_TABLES:
+                db.cursor.execute(f"DELETE FROM {table}")
+            # Ids are reassigned by the replay, so delta sync clients have to start over
+            db.record_change_reset()
+            db.conn.commit()
+            logger.info("Cleared derived tables before rebuild")
+
+        replayed = 0
+        for record, body in store.scan(start_day, end_day):
+            processor = processors.get(record['event_type'])
+            if processor is None:
+                continue
+            try:
+                data = parse_webhook_payload(body, selective=True)
+            except ValueError as e:
+                logger.error(f"Skipping unreadable delivery {record['delivery_id']}: {str(e)}")
+                continue
+            # Every verified delivery is archived; only replay what the live server processes
+            if webhook_events.lookup(record['event_type'], data.get('action')) is None:
+                continue
+            processor(data, db=db)
+            replayed += 1
+            if replayed % 1000 == 0:
+                logger.info(f"Replayed {replayed} deliveries (at {record['day']})")
+
+        db.backfill_cycle_time_rollups()
+        return replayed
+    finally:
+        db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Raw webhook event store tools")
+    parser.add_argument('--dir', help="Event store directory (default: EVENT_STORE_DIR)")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = subcommands.add_parser('rebuild', help="Re-derive database tables from the event log")
+    rebuild_parser.add_argument('--from', dest='start_day', help="First day to replay (YYYY-MM-DD)")
+    rebuild_parser.add_argument('--to', dest='end_day', help="Last day to replay (YYYY-MM-DD)")
+    rebuild_parser.add_argument('--reset', action='store_true', help="Empty the derived tables first")
+
+    show_parser = subcommands.add_parser('show', help="Print one delivery by id")
+    show_parser.add_argument('delivery_id')
+
+    list_parser = subcommands.add_parser('list', help="List indexed deliveries")
+    list_parser.add_argument('--from', dest='start_day')
+    list_parser.add_argument('--to', dest='end_day')
+    list_parser.add_argument('--event')
+    list_parser.add_argument('--repository')
+
+    args = parser.parse_args(argv)
+    settings = get_settings()
+    configure_logging(settings)
+    root = args.dir or settings.event_store.directory
+    if not root:
+        parser.error("--dir or EVENT_STORE_DIR is required")
+    store = EventStore(root)
+
+    if args.command == 'rebuild':
+        replayed = rebuild(store, args.start_day, args.end_day, reset=args.reset)
+        print(f"Replayed {replayed} deliveries")
+    elif args.command == 'show':
+        body = store.get(args.delivery_id)
+        if body is None:
+            sys.exit(f"Delivery {args.delivery_id} not found")
+        sys.stdout.write(body.decode('utf-8') + '\n')
+    elif args.command == 'list':
+        for record in store.iter_index(args.start_day, args.end_day, args.event, args.repository):
+            print(_format_index_line(record), end='')
+
+if __name__ == '__main__':
+    main()
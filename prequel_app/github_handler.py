@@ -1,60 +1,237 @@
 import hmac
 import hashlib
+import json
 import logging
+import re
 from datetime import datetime
-import os
-import sys
-
-# Add the project root directory to Python's path
-sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from prequel_db.db_handler import DatabaseHandler
+from prequel_app.slack_notifier import EVENT_PR_OPENED, EVENT_CHANGES_REQUESTED
+from prequel_app.event_registry import webhook_events
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def verify_github_webhook(request, github_secret):
+# orjson is optional; it parses webhook payloads several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Payload fields the process_* functions and notifications actually read.
+# True keeps the value as-is, a dict descends into a nested object.
+USER_FIELDS = {'id': True, 'login': True, 'avatar_url': True}
+PAYLOAD_FIELDS = {
+    'action': True,
+    'zen': True,
+    'repository': {'id': True, 'name': True, 'full_name': True},
+    'pull_request': {
+        'id': True, 'title': True, 'number': True, 'state': True, 'html_url': True,
+        'body': True, 'created_at': True, 'updated_at': True, 'closed_at': True,
+        'merged_at': True, 'user': USER_FIELDS
+    },
+    'review': {
+        'id': True, 'state': True, 'body': True, 'submitted_at': True,
+        'html_url': True, 'user': USER_FIELDS
+    },
+    'comment': {
+        'id': True, 'body': True, 'created_at': True, 'updated_at': True,
+        'pull_request_review_id': True, 'user': USER_FIELDS
+    },
+    'workflow_run': {
+        'id': True, 'name': True, 'workflow_id': True, 'run_number': True, 'run_attempt': True,
+        'status': True, 'conclusion': True, 'html_url': True, 'created_at': True,
+        'run_started_at': True, 'updated_at': True,
+        'actor': {'login': True}, 'triggering_actor': {'login': True}
+    },
+    'workflow_job': {
+        'id': True, 'run_id': True, 'run_attempt': True, 'workflow_name': True, 'status': True,
+        'conclusion': True, 'created_at': True, 'started_at': True, 'completed_at': True
+    }
+}
+
+# Payload fields each built-in event needs to be stored at all; a delivery
+# missing one is rejected with 422 instead of being retried
+REQUIRED_PAYLOAD_FIELDS = {
+    'pull_request': ('repository.id', 'pull_request.id', 'pull_request.user.id'),
+    'pull_request_review': ('repository.id', 'pull_request.id', 'pull_request.user.id',
+                            'review.id', 'review.user.id'),
+    'pull_request_review_comment': ('repository.id', 'pull_request.id', 'pull_request.user.id',
+                                    'comment.id', 'comment.user.id'),
+    'workflow_run': ('repository.id', 'workflow_run.id', 'workflow_run.name'),
+    'workflow_job': ('repository.id', 'workflow_job.id', 'workflow_job.workflow_name')
+}
+
+def missing_payload_fields(event_type, data):
+    """The REQUIRED_PAYLOAD_FIELDS of event_type that are absent or empty in data"""
+    missing = []
+    for path in REQUIRED_PAYLOAD_FIELDS.get(event_type, ()):
+        value = data
+        for key in path.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is None or value == '':
+            missing.append(path)
+    return missing
+
+def extract_fields(document, spec):
     """
-    Verify that the webhook request came from GitHub
+    Copy only the fields named in spec out of a parsed payload
+    
+    The full document can then be released straight away, so a 25 MB delivery
+    keeps a few hundred bytes alive instead of the whole object graph.
+    """
+    if not isinstance(document, dict):
+        return document
+    result = {}
+    for key, sub_spec in spec.items():
+        if key not in document:
+            continue
+        value = document[key]
+        result[key] = value if sub_spec is True else extract_fields(value, sub_spec)
+    return result
+
+def parse_webhook_payload(payload_body, selective=False):
     """
-    logger.debug("Starting webhook verification")
+    Parse a webhook body (bytes) with the fastest available JSON parser
     
-    # Get headers
-    received_signature = request.headers.get('X-Hub-Signature-256')
-    logger.debug(f"Received X-Hub-Signature-256: {received_signature}")
+    With selective=True only the fields in PAYLOAD_FIELDS are kept.
+    Raises ValueError if the body is not valid JSON.
+    """
+    if orjson is not None:
+        data = orjson.loads(payload_body)
+    else:
+        data = json.loads(payload_body)
     
-    if not received_signature:
-        logger.error("No X-Hub-Signature-256 found in headers")
-        return False
+    if selective:
+        return extract_fields(data, PAYLOAD_FIELDS)
+    return data
 
-    # Get payload
-    payload_body = request.get_data()
-    logger.debug(f"Payload length: {len(payload_body)} bytes")
+# GitHub caps webhook payloads at 25 MB
+DEFAULT_MAX_CONTENT_LENGTH = 25 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+SIGNATURE_PATTERN = re.compile(r'^sha256=[0-9a-f]{64}$')
+
+class WebhookVerificationError(Exception):
+    """Raised when a webhook delivery is rejected before it is processed"""
+    
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class StorageUnavailable(Exception):
+    """Raised when a webhook handler's event could not be stored (database unreachable)"""
+
+class SignatureCheck:
+    """
+    Incremental HMAC check for a single delivery
+    
+    Feed body chunks to update() as they arrive and call finish() at the end.
+    """
+    
+    def __init__(self, keyed_hmacs, expected_digest, max_content_length):
+        # Copying a keyed HMAC reuses the already-computed inner/outer pads
+        self._hmacs = [keyed.copy() for keyed in keyed_hmacs]
+        self._expected_digest = expected_digest
+        self._max_content_length = max_content_length
+        self.bytes_read = 0
     
-    if not github_secret:
-        logger.error("GITHUB_SECRET not configured")
-        return False
+    def update(self, chunk):
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self._max_content_length:
+            raise WebhookVerificationError("Payload too large", status_code=413)
+        for mac in self._hmacs:
+            mac.update(chunk)
+    
+    def finish(self):
+        """Return True if the body matches the signature under any active secret"""
+        matched = False
+        # Compare against every secret so timing does not reveal which one matched
+        for mac in self._hmacs:
+            matched |= hmac.compare_digest(mac.digest(), self._expected_digest)
+        return matched
+
+class WebhookVerifier:
+    """
+    Verifies GitHub webhook signatures while the body is being read
+    
+    Requests with a missing or malformed X-Hub-Signature-256 header, or a
+    declared Content-Length above max_content_length, are rejected before any
+    of the body is read. Several secrets can be active at once so a secret can
+    be rotated without dropping deliveries.
+    """
+    
+    def __init__(self, secrets, max_content_length=DEFAULT_MAX_CONTENT_LENGTH):
+        self.set_secrets(secrets, max_content_length)
+    
+    def set_secrets(self, secrets, max_content_length=DEFAULT_MAX_CONTENT_LENGTH):
+        """Replace the active secrets; checks already in progress keep the old ones"""
+        if isinstance(secrets, str):
+            secrets = [secrets]
+        unique_secrets = []
+        for secret in secrets or []:
+            if secret and secret not in unique_secrets:
+                unique_secrets.append(secret)
+        self._keyed_hmacs = [hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256) for secret in unique_secrets]
+        self.max_content_length = max_content_length
+    
+    @property
+    def configured(self):
+        return bool(self._keyed_hmacs)
+    
+    def begin(self, received_signature, content_length=None):
+        """
+        Validate the headers and start an incremental check
         
-    try:
-        # Calculate signature
-        secret_bytes = github_secret.encode('utf-8')
-        hmac_gen = hmac.new(secret_bytes, payload_body, hashlib.sha256)
-        expected_signature = f"sha256={hmac_gen.hexdigest()}"
-        logger.debug(f"Expected signature: {expected_signature}")
-        logger.debug(f"Received signature: {received_signature}")
-        
-        return hmac.compare_digest(received_signature, expected_signature)
-    except Exception as e:
-        logger.error(f"Error during signature verification: {str(e)}")
-        return False
+        Raises WebhookVerificationError if the delivery can be rejected up front.
+        """
+        if not self._keyed_hmacs:
+            logger.error("GITHUB_SECRET not configured")
+            raise WebhookVerificationError("Webhook secret not configured")
+        
+        if not received_signature:
+            raise WebhookVerificationError("Missing X-Hub-Signature-256 header")
+        
+        if not SIGNATURE_PATTERN.match(received_signature):
+            raise WebhookVerificationError("Malformed X-Hub-Signature-256 header")
+        
+        if content_length is not None and content_length > self.max_content_length:
+            raise WebhookVerificationError("Payload too large", status_code=413)
+        
+        expected_digest = bytes.fromhex(received_signature[len('sha256='):])
+        return SignatureCheck(self._keyed_hmacs, expected_digest, self.max_content_length)
+    
+    def read_verified_body(self, stream, received_signature, content_length=None, chunk_size=READ_CHUNK_SIZE):
+        """
+        Read a request body from a file-like stream, verifying it as it streams in
+        
+        Returns the body bytes, or raises WebhookVerificationError.
+        """
+        check = self.begin(received_signature, content_length)
+        
+        chunks = []
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            check.update(chunk)
+            chunks.append(chunk)
+        
+        if not check.finish():
+            raise WebhookVerificationError("Invalid signature")
+        
+        logger.debug(f"Verified payload of {check.bytes_read} bytes")
+        return b''.join(chunks)
 
-def process_pull_request(data):
+def process_pull_request(data, db=None):
     """
     Process pull request event data and store in database
+    
+    Pass db to reuse an open DatabaseHandler (e.g. for bulk replays); it is then
+    left open for the caller.
     """
+    owns_db = db is None
     try:
-        db = DatabaseHandler()
+        if owns_db:
+            db = DatabaseHandler()
         
         # Check if database connection was successful
         if hasattr(db, 'connection_failed') and db.connection_failed:
@@ -81,23 +258,34 @@ def process_pull_request(data):
         
         if repo_id is None or user_id is None:
             logger.error(f"Failed to get or create repository or user: repo_id={repo_id}, user_id={user_id}")
-            db.close()
+            if owns_db:
+                db.close()
             return None
             
         pr_id = db.get_or_create_pull_request(pr_data, repo_id, user_id)
         
-        db.close()
+        # A merge completes the PR's time-to-merge and review-round rollups
+        if pr_id is not None and pr_data.get('merged_at'):
+            db.update_cycle_time_rollups(pr_id)
+        
+        if owns_db:
+            db.close()
         return pr_id
     except Exception as e:
         logger.error(f"Error processing pull request: {str(e)}")
         return None
 
-def process_review(data):
+def process_review(data, db=None):
     """
     Process pull request review event data and store in database
+    
+    Pass db to reuse an open DatabaseHandler (e.g. for bulk replays); it is then
+    left open for the caller.
     """
+    owns_db = db is None
     try:
-        db = DatabaseHandler()
+        if owns_db:
+            db = DatabaseHandler()
         
         # Check if database connection was successful
         if hasattr(db, 'connection_failed') and db.connection_failed:
@@ -127,18 +315,24 @@ def process_review(data):
         
         if repo_id is None or reviewer_id is None or pr_author_id is None:
             logger.error("Failed to get or create repository, reviewer, or PR author")
-            db.close()
+            if owns_db:
+                db.close()
             return None
             
         pr_id = db.get_or_create_pull_request(pr_data, repo_id, pr_author_id)
         
         if pr_id is None:
             logger.error("Failed to get or create pull request")
-            db.close()
+            if owns_db:
+                db.close()
             return None
             
         review_id = db.add_pr_review(review_data, pr_id, reviewer_id)
         
+        # The first review sets the PR's time-to-first-review rollup
+        if review_id is not None:
+            db.update_cycle_time_rollups(pr_id)
+        
         # Add review body as a comment if it exists
         if review_data.get('body'):
             # Create comment data from the review with a numeric ID
@@ -156,18 +350,24 @@ def process_review(data):
             # Add the review comment, linking it to the review
             db.add_review_comment(comment_data, pr_id, reviewer_id, review_id)
         
-        db.close()
+        if owns_db:
+            db.close()
         return review_id
     except Exception as e:
         logger.error(f"Error processing review: {str(e)}")
         return None
 
-def process_review_comment(data):
+def process_review_comment(data, db=None):
     """
     Process pull request review comment and store in database
+    
+    Pass db to reuse an open DatabaseHandler (e.g. for bulk replays); it is then
+    left open for the caller.
     """
+    owns_db = db is None
     try:
-        db = DatabaseHandler()
+        if owns_db:
+            db = DatabaseHandler()
         
         # Check if database connection was successful
         if hasattr(db, 'connection_failed') and db.connection_failed:
@@ -197,14 +397,16 @@ def process_review_comment(data):
         
         if repo_id is None or commenter_id is None or pr_author_id is None:
             logger.error("Failed to get or create repository, commenter, or PR author")
-            db.close()
+            if owns_db:
+                db.close()
             return None
             
         pr_id = db.get_or_create_pull_request(pr_data, repo_id, pr_author_id)
         
         if pr_id is None:
             logger.error("Failed to get or create pull request")
-            db.close()
+            if owns_db:
+                db.close()
             return None
         
         # Check if this comment is associated with a review
@@ -216,8 +418,252 @@ def process_review_comment(data):
         
         comment_id = db.add_review_comment(comment_data, pr_id, commenter_id, review_id)
         
-        db.close()
+        if owns_db:
+            db.close()
         return comment_id
     except Exception as e:
         logger.error(f"Error processing review comment: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+def process_workflow_run(data, db=None):
+    """
+    Process a workflow_run event and store it in the database
+    
+    Pass db to reuse an open DatabaseHandler (e.g. for bulk replays); it is then
+    left open for the caller.
+    """
+    owns_db = db is None
+    try:
+        if owns_db:
+            db = DatabaseHandler()
+        
+        # Check if database connection was successful
+        if hasattr(db, 'connection_failed') and db.connection_failed:
+            logger.error("Database connection failed, skipping workflow run processing")
+            return None
+        
+        repo_data = data.get('repository')
+        run_data = data.get('workflow_run')
+        
+        if not repo_data or not run_data:
+            logger.error("Missing repository or workflow run data")
+            return None
+        
+        repo_id = db.get_or_create_repository(repo_data)
+        if repo_id is None:
+            logger.error("Failed to get or create repository")
+            if owns_db:
+                db.close()
+            return None
+        
+        actor = run_data.get('triggering_actor') or run_data.get('actor') or {}
+        run_id = db.record_workflow_run(run_data, repo_id, actor.get('login'))
+        
+        if owns_db:
+            db.close()
+        return run_id
+    except Exception as e:
+        logger.error(f"Error processing workflow run: {str(e)}")
+        return None
+
+def process_workflow_job(data, db=None):
+    """
+    Process a completed workflow_job event and store it in the database
+    
+    Pass db to reuse an open DatabaseHandler (e.g. for bulk replays); it is then
+    left open for the caller.
+    """
+    owns_db = db is None
+    try:
+        if owns_db:
+            db = DatabaseHandler()
+        
+        # Check if database connection was successful
+        if hasattr(db, 'connection_failed') and db.connection_failed:
+            logger.error("Database connection failed, skipping workflow job processing")
+            return None
+        
+        repo_data = data.get('repository')
+        job_data = data.get('workflow_job')
+        
+        if not repo_data or not job_data:
+            logger.error("Missing repository or workflow job data")
+            return None
+        
+        repo_id = db.get_or_create_repository(repo_data)
+        if repo_id is None:
+            logger.error("Failed to get or create repository")
+            if owns_db:
+                db.close()
+            return None
+        
+        job_id = db.record_workflow_job(job_data, repo_id)
+        
+        if owns_db:
+            db.close()
+        return job_id
+    except Exception as e:
+        logger.error(f"Error processing workflow job: {str(e)}")
+        return None
+
+def build_pr_opened_notification(data):
+    """Notification for a newly opened PR as (repository, event, title, text, fields, actions)"""
+    pr = data['pull_request']
+    repo = data['repository']
+    
+    title = "🔔 New Pull Request Created"
+    text = f"*{pr['title']}*\n{pr.get('body', 'No description provided.')}"
+    
+    fields = [
+        f"*Repository:* {repo['full_name']}",
+        f"*Created by:* {pr['user']['login']}"
+    ]
+    
+    actions = [{
+        "text": "View Pull Request",
+        "url": pr['html_url']
+    }]
+    
+    return (repo['full_name'], EVENT_PR_OPENED, title, text, fields, actions)
+
+def build_changes_requested_notification(data):
+    """Notification for a review requesting changes as (repository, event, title, text, fields, actions)"""
+    pr = data['pull_request']
+    review = data['review']
+    repo = data['repository']
+    
+    title = "⚠️ Changes Requested on Pull Request"
+    text = f"*{pr['title']}*\n{review.get('body', 'No review comments provided.')}"
+    
+    fields = [
+        f"*Repository:* {repo['full_name']}",
+        f"*PR Author:* {pr['user']['login']}",
+        f"*Reviewer:* {review['user']['login']}"
+    ]
+    
+    actions = [{
+        "text": "View Review",
+        "url": review['html_url']
+    }]
+    
+    return (repo['full_name'], EVENT_CHANGES_REQUESTED, title, text, fields, actions)
+
+def with_outbox(process, notifications):
+    """
+    Wrap a process_* function so its notifications are queued in the outbox
+    
+    The event data and the outbox rows are written in one transaction (or
+    in the write batcher's), and the rows are only queued when processing
+    succeeded, so a notification exists exactly when its event was stored.
+    The outbox worker delivers them.
+    """
+    if not notifications:
+        return process
+    
+    def process_and_enqueue(data, db=None):
+        owns_db = db is None
+        if owns_db:
+            db = DatabaseHandler()
+        try:
+            if hasattr(db, 'connection_failed') and db.connection_failed:
+                logger.error(f"Database connection failed, skipping {process.__name__}")
+                return None
+            
+            def work():
+                result = process(data, db=db)
+                if result is not None:
+                    for notification in notifications:
+                        if db.enqueue_notification(*notification) is None:
+                            return None
+                return result
+            
+            return db.run_in_transaction(work)
+        finally:
+            if owns_db:
+                db.close()
+    
+    process_and_enqueue.__name__ = process.__name__
+    return process_and_enqueue
+
+def dispatch_webhook_event(event_type, data, store):
+    """
+    Store a verified, parsed webhook event and queue its notifications
+    
+    store(process, data) runs one of the process_* functions (directly, via a
+    write batcher or on an executor). The built-in handlers queue their Slack
+    notifications in the outbox with the event data (see with_outbox). The
+    work is done by the handler registered for (event_type, action), if any.
+    
+    Returns (status_code, response_body, notifications), where notifications
+    are (repository, event, title, text, fields, actions) tuples a handler
+    wants sent directly by the server, without the outbox.
+    
+    A payload missing one of its event's REQUIRED_PAYLOAD_FIELDS can never
+    be stored, so it is answered with 422 before its handler runs.
+    Otherwise a process_* function returns None only when nothing was
+    stored: no connection could be opened (including a half-open circuit
+    breaker with no probe slot left) or the database failed mid-request.
+    That raises StorageUnavailable out of the handler, so the delivery is
+    answered with 503 and retried rather than acknowledged and lost.
+    """
+    logger.info(f"Event type: {event_type}")
+    
+    if webhook_events.lookup(event_type, data.get('action')) is not None:
+        missing = missing_payload_fields(event_type, data)
+        if missing:
+            logger.error(f"Rejecting {event_type} delivery, missing payload fields: {', '.join(missing)}")
+            return 422, {"error": "Invalid payload", "missing": missing}, []
+    
+    def checked_store(process, data):
+        result = store(process, data)
+        if result is None:
+            raise StorageUnavailable(f"{process.__name__} did not store the event")
+        return result
+    
+    return webhook_events.dispatch(event_type, data, checked_store)
+
+# Closing (or merging) a PR stores its state, closed_at and merged_at without a notification;
+# a merge also completes the PR's cycle time rollups in process_pull_request
+@webhook_events.handler('pull_request', actions=('opened', 'reopened', 'synchronize', 'edited', 'closed'))
+def handle_pull_request(data, store):
+    logger.info(f"Pull request action: {data.get('action')}")
+    
+    # Queue a notification for new PRs
+    notifications = []
+    if data.get('action') == 'opened':
+        notifications.append(build_pr_opened_notification(data))
+    store(with_outbox(process_pull_request, notifications), data)
+    
+    return 200, {"status": "success", "message": "PR processed"}, []
+
+@webhook_events.handler('pull_request_review')
+def handle_review(data, store):
+    # Queue a notification for requested changes
+    notifications = []
+    if data['review']['state'] == 'changes_requested':
+        notifications.append(build_changes_requested_notification(data))
+    store(with_outbox(process_review, notifications), data)
+    
+    return 200, {"status": "success", "message": "Review processed"}, []
+
+@webhook_events.handler('pull_request_review_comment')
+def handle_review_comment(data, store):
+    store(process_review_comment, data)
+    return 200, {"status": "success", "message": "Comment processed"}, []
+
+# Every run action updates the workflow's latest run; completed runs are also counted
+@webhook_events.handler('workflow_run')
+def handle_workflow_run(data, store):
+    store(process_workflow_run, data)
+    return 200, {"status": "success", "message": "Workflow run processed"}, []
+
+# Queued and in-progress jobs are acknowledged unparsed: only completed jobs carry metrics
+@webhook_events.handler('workflow_job', actions=('completed',))
+def handle_workflow_job(data, store):
+    store(process_workflow_job, data)
+    return 200, {"status": "success", "message": "Workflow job processed"}, []
+
+# GitHub sends this when the webhook is first configured
+@webhook_events.handler('ping')
+def handle_ping(data, store):
+    return 200, {"status": "success", "message": "Pong!"}, []
@@ -0,0 +1,424 @@
+"""
+Reconciliation sync with the GitHub REST API
+
+Webhooks can be missed (outages, failed redeliveries), which leaves PR state
+and last activity wrong and skews stale detection. This job walks each known
+repository's pull requests, reviews and review comments and applies only what
+changed through the regular upsert methods.
+
+Requests are cheap when nothing changed: the PR list is read newest-updated
+first and stops at the last cursor, review comments use ?since=, and every
+first page is sent with If-None-Match so unchanged data comes back as a 304,
+which does not count against the rate limit.
+
+Usage: python -m prequel_app.github_sync [--repo owner/name ...] [--api-url URL]
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prequel_config.settings import get_settings, configure_logging
+from prequel_db.db_handler import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://api.github.com'
+PER_PAGE = 100
+
+class RateLimitExceeded(Exception):
+    """Raised when the rate limit would make the sync wait longer than allowed"""
+
+class RateLimiter:
+    """
+    Rate-limit state shared by every sync worker
+
+    Primary limit: once X-RateLimit-Remaining drops to min_remaining, all
+    workers pause until X-RateLimit-Reset. Secondary limits (403/429 with
+    Retry-After, or an exhausted primary limit) pause all workers for the
+    indicated time, with exponential backoff when GitHub gives none. Waits
+    longer than max_wait seconds raise RateLimitExceeded instead.
+
+    Mutating requests are also spaced out, as GitHub asks: at least
+    write_interval seconds apart across all workers. The interval doubles
+    on every rate-limit rejection and shrinks back towards
+    min_write_interval as writes succeed.
+    """
+
+    def __init__(self, min_remaining=50, max_wait=900, min_write_interval=1.0, max_write_interval=60.0):
+        self.min_remaining = min_remaining
+        self.max_wait = max_wait
+        self.min_write_interval = min_write_interval
+        self.max_write_interval = max_write_interval
+        self.write_interval = min_write_interval
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._next_write_at = 0.0
+        self.remaining = None
+
+    def _pause(self, seconds):
+        if seconds > self.max_wait:
+            raise RateLimitExceeded(f"GitHub rate limit requires waiting {seconds:.0f}s")
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(min(delay, 5))
+
+    def wait_for_write(self):
+        """Wait for any pause, then for this request's turn in the write schedule"""
+        self.wait()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_write_at)
+            self._next_write_at = slot + self.write_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def write_succeeded(self):
+        with self._lock:
+            self.write_interval = max(self.min_write_interval, self.write_interval * 0.8)
+
+    def observe(self, response):
+        """Track the primary limit from a response's headers"""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        self.remaining = int(remaining)
+        if self.remaining <= self.min_remaining:
+            reset = float(response.headers.get('X-RateLimit-Reset', time.time() + 60))
+            logger.warning(f"GitHub rate limit nearly used ({self.remaining} left), pausing until reset")
+            self._pause(max(0.0, reset - time.time()) + 1)
+
+    def is_limited(self, response):
+        """True if a response is a primary or secondary rate-limit rejection"""
+        if response.status_code not in (403, 429):
+            return False
+        return (
+            'Retry-After' in response.headers
+            or response.headers.get('X-RateLimit-Remaining') == '0'
+            or 'rate limit' in response.text.lower()
+        )
+
+    def back_off(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            seconds = float(retry_after)
+        elif response.headers.get('X-RateLimit-Remaining') == '0':
+            seconds = max(0.0, float(response.headers.get('X-RateLimit-Reset', time.time() + 60)) - time.time()) + 1
+        else:
+            seconds = 60 * (2 ** attempt)
+        logger.warning(f"GitHub rate limited a request, backing off {seconds:.0f}s")
+        with self._lock:
+            self.write_interval = min(self.max_write_interval, max(self.write_interval, 0.5) * 2)
+        self._pause(seconds)
+
+class GitHubClient:
+    """
+    Pooled, rate-limit aware GitHub REST client
+
+    At most concurrency requests are in flight at once; connections are
+    kept alive in a pool of the same size.
+    """
+
+    def __init__(self, api_url=DEFAULT_API_URL, token=None, concurrency=4, rate_limiter=None,
+                 timeout=30, max_attempts=5):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.requests_made = 0
+        self.not_modified = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/vnd.github+json',
+            'X-GitHub-Api-Version': '2022-11-28',
+            'User-Agent': 'prequel-sync'
+        })
+        if token:
+            self.session.headers['Authorization'] = f"Bearer {token}"
+
+    def get(self, path_or_url, params=None, etag=None):
+        """GET with If-None-Match; returns a 200 or 304 response, raises for other statuses"""
+        headers = {'If-None-Match': etag} if etag else None
+        return self._request('GET', path_or_url, params=params, headers=headers)
+
+    def put(self, path_or_url, body):
+        """PUT a JSON body, paced by the rate limiter's write interval; raises for error statuses"""
+        return self._request('PUT', path_or_url, body=body)
+
+    def _request(self, method, path_or_url, params=None, headers=None, body=None):
+        url = path_or_url if path_or_url.startswith('http') else self.api_url + path_or_url
+        writing = method != 'GET'
+
+        for attempt in range(self.max_attempts):
+            if writing:
+                self.rate_limiter.wait_for_write()
+            else:
+                self.rate_limiter.wait()
+            with self._slots:
+                response = self.session.request(method, url, params=params, headers=headers, json=body,
+                                                timeout=self.timeout)
+            self.requests_made += 1
+
+            if self.rate_limiter.is_limited(response):
+                self.rate_limiter.back_off(response, attempt)
+                continue
+            if response.status_code >= 500 and attempt + 1 < self.max_attempts:
+                time.sleep(2 ** attempt)
+                continue
+
+            self.rate_limiter.observe(response)
+            if response.status_code == 304:
+                self.not_modified += 1
+                return response
+            response.raise_for_status()
+            if writing:
+                self.rate_limiter.write_succeeded()
+            return response
+
+        raise RateLimitExceeded(f"Giving up on {url} after {self.max_attempts} attempts")
+
+    def paginate(self, path, params=None, etag=None):
+        """
+        Yield (items, response) page by page, following Link: rel="next"
+
+        Only the first page is conditional; a 304 there is yielded as
+        ([], response) and ends the walk.
+        """
+        response = self.get(path, params=params, etag=etag)
+        while True:
+            if response.status_code == 304:
+                yield [], response
+                return
+            yield response.json(), response
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                return
+            response = self.get(next_url)
+
+def _parse_github_time(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ') if value else None
+
+def pull_request_changed(pr, stored):
+    """True if a PR from the API differs from its stored (id, updated_at, state)"""
+    if stored is None:
+        return True
+    _, stored_updated_at, stored_state = stored
+    updated_at = _parse_github_time(pr.get('updated_at'))
+    if stored_updated_at is None or updated_at is None:
+        return True
+    # DATETIME keeps 1/300s precision; compare whole seconds
+    return (stored_updated_at.replace(microsecond=0) != updated_at
+            or (stored_state or '').lower() != (pr.get('state') or '').lower())
+
+class GitHubSync:
+    """Reconciles repositories with GitHub, one worker (and DB connection) per repository"""
+
+    def __init__(self, client, concurrency=4, db_factory=DatabaseHandler):
+        self.client = client
+        self.concurrency = concurrency
+        self.db_factory = db_factory
+
+    def sync_all(self, repositories=None):
+        """Sync the given full names (default: every repository in the database); returns stats"""
+        db = self.db_factory()
+        try:
+            known = db.get_repositories_for_sync()
+        finally:
+            db.close()
+        if repositories:
+            wanted = {name.lower() for name in repositories}
+            known = [(repo_id, name) for repo_id, name in known if name.lower() in wanted]
+
+        totals = {'repositories': 0, 'pull_requests': 0, 'reviews': 0, 'comments': 0, 'errors': 0}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='github-sync') as executor:
+            for stats in executor.map(lambda repo: self.sync_repository(*repo), known):
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + value
+        totals['requests'] = self.client.requests_made
+        totals['not_modified'] = self.client.not_modified
+        logger.info(f"GitHub sync finished: {totals}")
+        return totals
+
+    def sync_repository(self, repository_id, full_name):
+        stats = {'repositories': 1, 'pull_requests': 0, 'reviews': 0, 'comments': 0, 'errors': 0}
+        db = self.db_factory()
+        if getattr(db, 'connection_failed', False):
+            stats['errors'] += 1
+            return stats
+        try:
+            # Comments first: applying one moves the PR's last activity to the
+            # comment time, and the PR pass then sets it to the PR's updated_at
+            orphans = self._sync_comments(db, repository_id, full_name, stats)
+            self._sync_pull_requests(db, repository_id, full_name, stats)
+            for comment in orphans:
+                self._apply_comment(db, repository_id, comment, stats)
+        except RateLimitExceeded as e:
+            logger.warning(f"Sync of {full_name} stopped: {str(e)}")
+            stats['errors'] += 1
+        except Exception as e:
+            logger.error(f"Error syncing {full_name}: {str(e)}")
+            stats['errors'] += 1
+        finally:
+            db.close()
+        return stats
+
+    def _sync_pull_requests(self, db, repository_id, full_name, stats):
+        """
+        Apply PRs updated since the cursor (the newest updated_at applied)
+
+        PRs updated in the cursor's own second are read again, since GitHub
+        times have one-second precision; unchanged ones are skipped by
+        pull_request_changed. If a PR fails to apply, the cursor stops at
+        its updated_at and the ETag is dropped, so the next run retries it.
+        """
+        etag, cursor = db.get_sync_state(full_name, 'pulls')
+        params = {'state': 'all', 'sort': 'updated', 'direction': 'desc', 'per_page': PER_PAGE}
+        new_etag, new_cursor = etag, cursor
+        failed_at = None
+
+        for page_number, (items, response) in enumerate(self.client.paginate(f"/repos/{full_name}/pulls", params, etag)):
+            if response.status_code == 304:
+                return
+            if page_number == 0:
+                new_etag = response.headers.get('ETag')
+
+            page = []
+            reached_cursor = False
+            for pr in items:
+                if cursor and pr['updated_at'] < cursor:
+                    reached_cursor = True
+                    break
+                page.append(pr)
+
+            stored = db.get_pull_request_versions([pr['id'] for pr in page])
+            for pr in page:
+                if pull_request_changed(pr, stored.get(pr['id'])):
+                    if not self._apply_pull_request(db, repository_id, full_name, pr, stats):
+                        # Newest first, so the last failure is the oldest one
+                        failed_at = pr['updated_at']
+                        continue
+                new_cursor = max(new_cursor or '', pr['updated_at'])
+            if reached_cursor:
+                break
+
+        if failed_at is not None:
+            new_etag, new_cursor = None, failed_at
+        db.save_sync_state(full_name, 'pulls', new_etag, new_cursor)
+
+    def _apply_pull_request(self, db, repository_id, full_name, pr, stats):
+        """Apply one PR with its reviews; returns False if it could not be stored"""
+        author_id = db.get_or_create_user(pr.get('user'))
+        pr_id = db.get_or_create_pull_request(pr, repository_id, author_id)
+        if pr_id is None:
+            stats['errors'] += 1
+            return False
+        self._sync_reviews(db, full_name, pr, pr_id, stats)
+        # Written last so state and last activity end at GitHub's values
+        if db.get_or_create_pull_request(pr, repository_id, author_id) is None:
+            stats['errors'] += 1
+            return False
+        db.update_cycle_time_rollups(pr_id)
+        stats['pull_requests'] += 1
+        return True
+
+    def _sync_reviews(self, db, full_name, pr, pr_id, stats):
+        resource = f"reviews/{pr['number']}"
+        etag, _ = db.get_sync_state(full_name, resource)
+        stored = {github_id: (state or '').upper() for github_id, state in db.get_review_states(pr_id).items()}
+
+        new_etag = etag
+        path = f"/repos/{full_name}/pulls/{pr['number']}/reviews"
+        for page_number, (items, response) in enumerate(self.client.paginate(path, {'per_page': PER_PAGE}, etag)):
+            if response.status_code == 304:
+                return
+            if page_number == 0:
+                new_etag = response.headers.get('ETag')
+            for review in items:
+                if not review.get('user') or not review.get('submitted_at'):
+                    continue
+                if stored.get(review['id']) == (review.get('state') or '').upper():
+                    continue
+                reviewer_id = db.get_or_create_user(review['user'])
+                if db.add_pr_review(review, pr_id, reviewer_id) is not None:
+                    stats['reviews'] += 1
+
+        db.save_sync_state(full_name, resource, new_etag, None)
+
+    def _sync_comments(self, db, repository_id, full_name, stats):
+        """Apply review comments updated since the cursor; returns those whose PR is not stored yet"""
+        etag, cursor = db.get_sync_state(full_name, 'comments')
+        params = {'sort': 'updated', 'direction': 'asc', 'per_page': PER_PAGE}
+        if cursor:
+            params['since'] = cursor
+
+        first_etag, new_cursor = None, cursor
+        orphans = []
+        for page_number, (items, response) in enumerate(
+                self.client.paginate(f"/repos/{full_name}/pulls/comments", params, etag)):
+            if response.status_code == 304:
+                return orphans
+            if page_number == 0:
+                first_etag = response.headers.get('ETag')
+            for comment in items:
+                if not self._apply_comment(db, repository_id, comment, stats):
+                    orphans.append(comment)
+                new_cursor = max(new_cursor or '', comment['updated_at'])
+
+        # The ETag belongs to the ?since= URL it was served for, so it is only
+        # worth keeping while the cursor (and so the URL) stays the same
+        db.save_sync_state(full_name, 'comments', first_etag if new_cursor == cursor else None, new_cursor)
+        return orphans
+
+    def _apply_comment(self, db, repository_id, comment, stats):
+        """Upsert one review comment; returns False if its PR is not stored yet"""
+        if not comment.get('user'):
+            return True
+        number = int(comment['pull_request_url'].rstrip('/').rsplit('/', 1)[-1])
+        pr_id, _ = db.get_pull_request_id_by_number(repository_id, number)
+        if pr_id is None:
+            return False
+        author_id = db.get_or_create_user(comment['user'])
+        if db.add_review_comment(comment, pr_id, author_id) is not None:
+            stats['comments'] += 1
+        return True
+
+def github_sync_from_settings(sync_settings, api_url=None):
+    """Build a GitHubSync from GITHUB_TOKEN, GITHUB_API_URL and GITHUB_SYNC_CONCURRENCY"""
+    client = GitHubClient(
+        api_url=api_url or sync_settings.api_url,
+        token=sync_settings.token,
+        concurrency=sync_settings.concurrency,
+        rate_limiter=RateLimiter(min_remaining=sync_settings.min_remaining)
+    )
+    return GitHubSync(client, concurrency=sync_settings.concurrency)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile stored PRs, reviews and comments with GitHub")
+    parser.add_argument('--repo', action='append', help="Repository full name (default: all known repositories)")
+    parser.add_argument('--api-url', help="GitHub API base URL (default: GITHUB_API_URL or api.github.com)")
+    args = parser.parse_args(argv)
+    settings = get_settings()
+    configure_logging(settings)
+
+    totals = github_sync_from_settings(settings.github_sync, args.api_url).sync_all(args.repo)
+    print(' '.join(f"{key}={value}" for key, value in totals.items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from prequel_db.db_handler import DatabaseHandler
+from prequel_db.circuit_breaker import database_breaker
+
+logger = logging.getLogger(__name__)
+
+class AdmissionController:
+    """
+    Caps the number of webhook requests being worked on at once
+
+    try_acquire() never blocks: when the limit is reached the caller should
+    shed the request (503 + Retry-After) instead of queueing another thread.
+    """
+
+    def __init__(self, max_in_flight, retry_after=5):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def try_acquire(self):
+        if not self._semaphore.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def snapshot(self):
+        return {
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'rejected': self.rejected
+        }
+
+class DatabaseProbe:
+    """
+    Cached database readiness probe
+
+    status() always answers from the last probe result. When that result is
+    older than ttl seconds a new probe is started on a background thread, so
+    readiness checks never wait on the database themselves.
+    """
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._probing = False
+        self._checked_at = 0.0
+        self._result = {
+            'ok': None,
+            'checked_at': None,
+            'latency_ms': None
+        }
+
+    def _probe(self):
+        started = time.perf_counter()
+        ok = False
+        try:
+            db = DatabaseHandler()
+            ok = not getattr(db, 'connection_failed', False) and db.check_connection()
+            db.close()
+        except Exception as e:
+            logger.error(f"Readiness probe failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._result = {
+                    'ok': ok,
+                    'checked_at': datetime.now().isoformat(),
+                    'latency_ms': round((time.perf_counter() - started) * 1000, 2)
+                }
+                self._checked_at = time.monotonic()
+                self._probing = False
+
+    def status(self):
+        with self._lock:
+            stale = time.monotonic() - self._checked_at >= self.ttl
+            if stale and not self._probing:
+                self._probing = True
+                threading.Thread(target=self._probe, daemon=True).start()
+            result = dict(self._result)
+
+        breaker = database_breaker.snapshot()
+        result['breaker'] = breaker
+        result['ready'] = bool(result['ok']) and breaker['state'] != database_breaker.OPEN
+        return result
@@ -0,0 +1,273 @@
+"""
+Delivery worker for the notification outbox
+
+Webhook handlers queue Slack notifications in the notification_outbox table,
+in the same transaction as the event data (see github_handler.with_outbox),
+so a webhook is answered without waiting for Slack and a notification exists
+exactly when its event was stored. This worker claims due rows in batches,
+posts them to their routed webhooks with bounded concurrency and settles each
+row: delivered, retried later with exponential backoff, or dead-lettered
+after OUTBOX_MAX_ATTEMPTS.
+
+Every server process runs a worker, started by the server's startup hook
+(prequel_app.app.start_background_workers) and again in a process forked
+after that; claims use READPAST and a lease, so
+workers share the queue without blocking each other and rows held by a
+crashed worker are picked up once their lease expires. A row is settled only
+once, but a crash between a Slack post and the settle means that post is sent
+again, so delivery to Slack is at-least-once per webhook URL.
+
+Usage (stats, or requeue dead-lettered notifications):
+  python -m prequel_app.outbox_worker stats
+  python -m prequel_app.outbox_worker requeue [--id N ...]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prequel_db.db_handler import DatabaseHandler
+from prequel_db.db_outbox import OUTBOX_PENDING, OUTBOX_DELIVERED, OUTBOX_DEAD
+from prequel_app.slack_notifier import build_notification_blocks, post_slack_blocks
+
+logger = logging.getLogger(__name__)
+
+# How often delivered rows older than OUTBOX_RETENTION_DAYS are purged
+PURGE_INTERVAL_SECONDS = 3600
+
+class OutboxWorker:
+    """Claims due outbox rows, delivers them through a SlackRouter and settles them"""
+
+    def __init__(self, router, db_factory=DatabaseHandler, batch_size=20, concurrency=8, max_attempts=8,
+                 lease_seconds=60, retry_base_seconds=5.0, retry_max_seconds=3600.0, poll_seconds=2.0,
+                 retention_days=7, slack_timeout=10.0, post=post_slack_blocks):
+        self.router = router
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.poll_seconds = poll_seconds
+        self.retention_days = retention_days
+        self.slack_timeout = slack_timeout
+        self._post = post
+        self._db_factory = db_factory
+        self._db = None
+        self._concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='outbox-delivery')
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._purged_at = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'claimed': 0, 'delivered': 0, 'retried': 0, 'dead': 0, 'lost_claims': 0}
+
+    def configure(self, outbox_settings, slack_timeout):
+        """Apply reloaded settings (the delivery pool size needs a restart)"""
+        self.batch_size = outbox_settings.batch_size
+        self.max_attempts = outbox_settings.max_attempts
+        self.lease_seconds = outbox_settings.lease_seconds
+        self.retry_base_seconds = outbox_settings.retry_base_seconds
+        self.retry_max_seconds = outbox_settings.retry_max_seconds
+        self.poll_seconds = outbox_settings.poll_seconds
+        self.retention_days = outbox_settings.retention_days
+        self.slack_timeout = slack_timeout
+
+    def wake(self):
+        """Look for due rows now instead of at the next poll (call after queueing)"""
+        self._wake.set()
+
+    def retry_delay(self, attempts):
+        """Seconds before the next attempt: exponential in attempts, capped, with jitter"""
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _deliver(self, row):
+        """Post one notification to every routed URL not reached yet; returns (delivered, failed)"""
+        delivered = list(row['delivered_targets'])
+        urls = self.router.resolve(row['repository'], row['event_type'])
+        payload = row['payload']
+        blocks = build_notification_blocks(payload['title'], payload['text'], payload.get('fields'), payload.get('actions'))
+        failed = []
+        for url in urls:
+            if url in delivered:
+                continue
+            if self._post(url, blocks, fallback_text=payload['title'], timeout=self.slack_timeout):
+                delivered.append(url)
+            else:
+                failed.append(url)
+        return delivered, failed
+
+    def _get_db(self):
+        if self._db is None:
+            db = self._db_factory()
+            if getattr(db, 'connection_failed', False):
+                return None
+            self._db = db
+        return self._db
+
+    def _discard_db(self):
+        try:
+            if self._db is not None:
+                self._db.close()
+        except Exception:
+            pass
+        self._db = None
+
+    def run_once(self):
+        """Claim, deliver and settle one batch; returns the number of rows claimed"""
+        db = self._get_db()
+        if db is None:
+            return 0
+
+        claim_token, rows = db.claim_outbox_notifications(self.batch_size, self.lease_seconds)
+        if claim_token is None:
+            # The claim failed; reconnect on the next round
+            self._discard_db()
+            return 0
+        if not rows:
+            return 0
+
+        outcomes = list(self._executor.map(self._deliver_safely, rows))
+        counts = {'claimed': len(rows), 'delivered': 0, 'retried': 0, 'dead': 0, 'lost_claims': 0}
+        for row, (delivered, failed, error) in zip(rows, outcomes):
+            if not failed and error is None:
+                status, retry_in, counter = OUTBOX_DELIVERED, None, 'delivered'
+                if not delivered:
+                    error = f"No Slack route for {row['event_type']} on {row['repository']}"
+                    logger.warning(f"{error}, outbox notification {row['id']} dropped")
+            elif row['attempts'] >= self.max_attempts:
+                status, retry_in, counter = OUTBOX_DEAD, None, 'dead'
+                logger.error(f"Outbox notification {row['id']} dead-lettered after {row['attempts']} attempts: {error}")
+            else:
+                status, retry_in, counter = OUTBOX_PENDING, self.retry_delay(row['attempts']), 'retried'
+
+            if db.settle_outbox_notification(row['id'], claim_token, status, delivered, retry_in, error):
+                counts[counter] += 1
+            else:
+                counts['lost_claims'] += 1
+
+        with self._stats_lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+        return len(rows)
+
+    def _deliver_safely(self, row):
+        """(delivered, failed, error) for one row; never raises"""
+        try:
+            delivered, failed = self._deliver(row)
+            error = f"Slack rejected the notification for {len(failed)} webhook(s)" if failed else None
+            return delivered, failed, error
+        except Exception as e:
+            logger.error(f"Error delivering outbox notification {row['id']}: {str(e)}")
+            return list(row['delivered_targets']), [None], str(e)
+
+    def _maybe_purge(self):
+        if self.retention_days <= 0 or time.monotonic() - self._purged_at < PURGE_INTERVAL_SECONDS:
+            return
+        self._purged_at = time.monotonic()
+        db = self._get_db()
+        if db is not None:
+            purged = db.purge_delivered_notifications(self.retention_days)
+            if purged:
+                logger.info(f"Purged {purged} delivered outbox notifications")
+
+    def _run(self):
+        while not self._stopped:
+            claimed = 0
+            try:
+                claimed = self.run_once()
+                self._maybe_purge()
+            except Exception as e:
+                logger.error(f"Unexpected error in outbox worker: {str(e)}")
+                self._discard_db()
+            # A full batch means more rows are probably due; otherwise wait for a wake-up or the poll
+            if claimed < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def start(self):
+        """Start the delivery thread, once per process"""
+        with self._start_lock:
+            if self._stopped or self._pid == os.getpid():
+                return self
+            if self._pid is not None:
+                # Forked from a process that had started the worker: its threads and
+                # connection did not come along, so only drop the references
+                self._executor = ThreadPoolExecutor(max_workers=self._concurrency,
+                                                    thread_name_prefix='outbox-delivery')
+                self._db = None
+                self._wake = threading.Event()
+            if self._pid is None and hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self._after_fork)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+            self._thread.start()
+            logger.info("Started notification outbox worker")
+        return self
+
+    def _after_fork(self):
+        # The lock may have been held by a parent thread at the fork
+        self._start_lock = threading.Lock()
+        self.start()
+
+    def stop(self, timeout=5):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        self._discard_db()
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['batch_size'] = self.batch_size
+        stats['max_attempts'] = self.max_attempts
+        return stats
+
+def outbox_worker_from_settings(settings, router):
+    """Create the outbox worker configured by the OUTBOX_* settings"""
+    outbox = settings.outbox
+    return OutboxWorker(
+        router,
+        batch_size=outbox.batch_size,
+        concurrency=outbox.concurrency,
+        max_attempts=outbox.max_attempts,
+        lease_seconds=outbox.lease_seconds,
+        retry_base_seconds=outbox.retry_base_seconds,
+        retry_max_seconds=outbox.retry_max_seconds,
+        poll_seconds=outbox.poll_seconds,
+        retention_days=outbox.retention_days,
+        slack_timeout=settings.slack.timeout_seconds
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('stats', 'requeue'))
+    parser.add_argument('--id', type=int, action='append', dest='ids', help="Only requeue these outbox ids")
+    args = parser.parse_args()
+
+    from prequel_config.settings import configure_logging
+    configure_logging()
+
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+    try:
+        if args.command == 'stats':
+            print(json.dumps(db.get_outbox_stats(), indent=2))
+        else:
+            print(f"Requeued {db.requeue_dead_notifications(args.ids)} dead-lettered notifications")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+JSON encoding for API responses
+
+Row-heavy endpoints build compact row objects (dataclasses with __slots__,
+no per-row dict) straight from the cursor rows and encode them to bytes in
+one pass. With orjson the encoding, including datetime formatting, runs in
+C; without it the json module is used and datetimes are formatted through
+a small cache, since the analytics snapshot hands out the same datetime
+objects on every request.
+
+Large arrays are streamed in chunks of STREAM_CHUNK_ROWS rows, so a
+response never holds more than one chunk of encoded rows. Rows read from
+the database are fetched off the cursor while the response is sent (the
+DatabaseHandler iter_* methods), so there is no list of them either.
+
+FastJSONProvider puts orjson behind jsonify for every other route, with
+the same output as Flask's default provider (sorted keys, HTTP dates).
+"""
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import lru_cache
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+# orjson is optional; it encodes these responses several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rows encoded per chunk of a streamed array
+STREAM_CHUNK_ROWS = 500
+
+JSON_MIMETYPE = 'application/json'
+
+@lru_cache(maxsize=65536)
+def _isoformat(value):
+    return value.isoformat()
+
+def _default(obj):
+    """Fallback encoder for the json module: row objects and datetimes"""
+    if isinstance(obj, (datetime, date)):
+        return _isoformat(obj)
+    slots = getattr(type(obj), '__slots__', None)
+    if slots is not None:
+        return {name: getattr(obj, name) for name in slots}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+if orjson is not None:
+    _DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Encode obj as JSON bytes; datetimes become ISO 8601 strings"""
+        return orjson.dumps(obj, default=_default, option=_DUMPS_OPTIONS)
+else:
+    def dumps(obj):
+        """Encode obj as JSON bytes; datetimes become ISO 8601 strings"""
+        return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+def json_response(obj, status=200):
+    """A JSON response from dumps(obj)"""
+    return Response(dumps(obj), status=status, mimetype=JSON_MIMETYPE)
+
+def iter_json_array(rows, row_factory=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Encode an iterable of rows as a JSON array, yielding bytes chunk by chunk
+
+    row_factory (e.g. stale_pull_request) turns each cursor row into an
+    encodable object; each chunk is encoded with one dumps call.
+    """
+    yield b'['
+    first = True
+    chunk = []
+    for row in rows:
+        chunk.append(row_factory(row) if row_factory else row)
+        if len(chunk) >= chunk_rows:
+            yield (b'' if first else b',') + dumps(chunk)[1:-1]
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + dumps(chunk)[1:-1]
+    yield b']'
+
+def streamed_json_array(rows, row_factory=None, on_close=None):
+    """
+    A streamed response for iter_json_array
+
+    on_close() runs once the response has been sent or the client went away,
+    e.g. to close the database handler the rows are fetched from.
+    """
+    if on_close is None:
+        return Response(iter_json_array(rows, row_factory), mimetype=JSON_MIMETYPE)
+
+    def generate():
+        try:
+            yield from iter_json_array(rows, row_factory)
+        finally:
+            on_close()
+    return Response(generate(), mimetype=JSON_MIMETYPE)
+
+@dataclass(slots=True)
+class StalePullRequest:
+    """A /api/stale-prs row, shaped like the frontend's PullRequest"""
+    id: int
+    github_id: int
+    repository_id: int
+    author_id: int
+    title: str
+    number: int
+    state: str
+    html_url: str
+    created_at: datetime
+    updated_at: datetime
+    closed_at: datetime
+    merged_at: datetime
+    is_stale: bool
+    last_activity_at: datetime
+    repository_name: str
+    author_name: str
+
+def stale_pull_request(row):
+    """StalePullRequest from a get_stale_prs row (ids the query does not read are 0)"""
+    pr_id, title, number, html_url, repo_name, username, created_at, last_activity_at = row
+    return StalePullRequest(pr_id, 0, 0, 0, title, number, 'open', html_url, created_at,
+                            last_activity_at, None, None, True, last_activity_at, repo_name, username)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with orjson doing the encoding
+
+    Output matches DefaultJSONProvider: keys are sorted and datetimes,
+    decimals and the like still go through its default() (HTTP dates).
+    Without orjson, or for values orjson rejects (integers beyond 64 bits),
+    the default provider is used.
+    """
+
+    def _orjson_dumps(self, obj, indent=False):
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return None
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            encoded = self._orjson_dumps(obj)
+            if encoded is not None:
+                return encoded.decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        encoded = self._orjson_dumps(obj, indent)
+        if encoded is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(encoded + b'\n', mimetype=self.mimetype)
@@ -1,138 +1,296 @@
 import requests
 import logging
 from datetime import datetime
-import os
-import sys
-
-# Add the project root directory to Python's path
-sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from prequel_db.db_handler import DatabaseHandler
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def send_slack_notification(webhook_url, title, text, fields=None, actions=None):
+# Event types that Slack routing rules can match on
+EVENT_PR_OPENED = 'pull_request.opened'
+EVENT_CHANGES_REQUESTED = 'pull_request_review.changes_requested'
+EVENT_STALE_PR = 'stale_pr'
+
+# Slack Block Kit limits for a single message
+SLACK_MAX_BLOCKS = 50
+SLACK_MAX_SECTION_FIELDS = 10
+SLACK_MAX_TEXT_LENGTH = 3000
+
+# Stale PRs per digest message; leaves room for the header and intro blocks
+STALE_PRS_PER_MESSAGE = 40
+
+def post_slack_blocks(webhook_url, blocks, fallback_text=None, timeout=None):
     """
-    Send a notification to the Slack webhook
+    Post a list of Block Kit blocks to the Slack webhook
     """
     try:
         if not webhook_url:
             logger.error("SLACK_WEBHOOK_URL not configured")
             return False
             
+        message = {
+            "blocks": blocks
+        }
+        if fallback_text:
+            message["text"] = fallback_text
+        
+        logger.debug("Sending notification to Slack")
+        response = requests.post(webhook_url, json=message, timeout=timeout)
+        logger.debug(f"Slack API Response: {response.status_code} - {response.text}")
+        return response.status_code == 200
+    except Exception as e:
+        logger.error(f"Error sending Slack notification: {str(e)}")
+        return False
+
+def build_notification_blocks(title, text, fields=None, actions=None):
+    """
+    Build the Block Kit blocks for a standard notification
+    """
+    blocks = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": title
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": _truncate(text, SLACK_MAX_TEXT_LENGTH)
+            }
+        }
+    ]
+    
+    # Add fields if provided (Slack allows at most 10 fields per section)
+    if fields:
+        for start in range(0, len(fields), SLACK_MAX_SECTION_FIELDS):
+            field_block = {
+                "type": "section",
+                "fields": []
+            }
+            for field in fields[start:start + SLACK_MAX_SECTION_FIELDS]:
+                field_block["fields"].append({
+                    "type": "mrkdwn",
+                    "text": field
+                })
+            blocks.append(field_block)
+    
+    # Add actions if provided
+    if actions:
+        action_block = {
+            "type": "actions",
+            "elements": []
+        }
+        for action in actions:
+            # A button without a link can't be sent; drop it rather than the message
+            if not action.get("url"):
+                logger.warning(f"Skipping Slack action without a url: {action.get('text')}")
+                continue
+            action_block["elements"].append({
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": action.get("text") or action["url"]
+                },
+                "url": action["url"]
+            })
+        if action_block["elements"]:
+            blocks.append(action_block)
+    
+    return blocks
+
+def send_slack_notification(webhook_url, title, text, fields=None, actions=None):
+    """
+    Send a notification to the Slack webhook
+    """
+    if not webhook_url:
+        logger.error("SLACK_WEBHOOK_URL not configured")
+        return False
+
+    try:
+        blocks = build_notification_blocks(title, text, fields, actions)
+    except Exception as e:
+        logger.error(f"Error sending Slack notification: {str(e)}")
+        return False
+    return post_slack_blocks(webhook_url, blocks, fallback_text=title)
+
+def _truncate(text, limit):
+    """Trim text to fit a Slack text field"""
+    text = text or ''
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+def build_stale_pr_digests(title, intro, stale_prs, per_message=STALE_PRS_PER_MESSAGE):
+    """
+    Build one or more Slack messages (as block lists) covering every stale PR
+    
+    Each PR gets its own section with a link button, and PRs are split across
+    messages so no message exceeds Slack's block limit.
+    """
+    per_message = max(1, min(per_message, SLACK_MAX_BLOCKS - 2))
+    chunks = [stale_prs[i:i + per_message] for i in range(0, len(stale_prs), per_message)]
+    digests = []
+    
+    for index, chunk in enumerate(chunks, start=1):
+        header = title if len(chunks) == 1 else f"{title} ({index}/{len(chunks)})"
         blocks = [
             {
                 "type": "header",
                 "text": {
                     "type": "plain_text",
-                    "text": title
+                    "text": _truncate(header, 150)
                 }
             },
             {
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": text
+                    "text": intro
                 }
             }
         ]
         
-        # Add fields if provided
-        if fields:
-            field_block = {
+        for pr in chunk:
+            days_inactive = (datetime.now() - pr['last_activity_at']).days if isinstance(pr['last_activity_at'], datetime) else '?'
+            text = (
+                f"*{pr['repo_name']} #{pr['number']}*: {pr['title']}\n"
+                f"Created by: {pr['username']} | Inactive for {days_inactive} days"
+            )
+            blocks.append({
                 "type": "section",
-                "fields": []
-            }
-            for field in fields:
-                field_block["fields"].append({
+                "text": {
                     "type": "mrkdwn",
-                    "text": field
-                })
-            blocks.append(field_block)
-        
-        # Add actions if provided
-        if actions:
-            action_block = {
-                "type": "actions",
-                "elements": []
-            }
-            for action in actions:
-                action_block["elements"].append({
+                    "text": _truncate(text, SLACK_MAX_TEXT_LENGTH)
+                },
+                "accessory": {
                     "type": "button",
                     "text": {
                         "type": "plain_text",
-                        "text": action["text"]
+                        "text": f"View #{pr['number']}"
                     },
-                    "url": action["url"]
-                })
-            blocks.append(action_block)
-        
-        message = {
-            "blocks": blocks
-        }
+                    "url": pr['html_url']
+                }
+            })
         
-        logger.debug("Sending notification to Slack")
-        response = requests.post(webhook_url, json=message)
-        logger.debug(f"Slack API Response: {response.status_code} - {response.text}")
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Error sending Slack notification: {str(e)}")
-        return False
+        digests.append(([pr['history_id'] for pr in chunk], blocks))
+    
+    return digests
 
-def check_stale_prs(stale_days):
+def _send_stale_pr_digests(webhook_url, title, intro, stale_prs):
+    """Send digests chunk by chunk and return the history ids Slack accepted"""
+    sent_ids = []
+    for history_ids, blocks in build_stale_pr_digests(title, intro, stale_prs):
+        if not post_slack_blocks(webhook_url, blocks, fallback_text=title):
+            logger.error(f"Slack rejected stale PR digest, {len(stale_prs) - len(sent_ids)} PRs will be retried on the next run")
+            break
+        sent_ids.extend(history_ids)
+    return sent_ids
+
+def _notify_stale_prs(db, router, default_webhook_url, title, intro, stale_prs):
+    """
+    Deliver stale PR digests to every routed channel and mark what was delivered
+    
+    Each channel gets one digest series covering its PRs; channels are served
+    concurrently. A PR is only marked as notified once every channel it routes
+    to has accepted it, so a failing channel gets it again on the next run.
+    """
+    prs_by_url = {}
+    targets_by_history_id = {}
+    for pr in stale_prs:
+        urls = router.resolve(pr['repo_name'], EVENT_STALE_PR) if router else (default_webhook_url,)
+        urls = [url for url in urls if url]
+        if not urls:
+            logger.warning(f"No Slack route for stale PR {pr['repo_name']} #{pr['number']}")
+            continue
+        targets_by_history_id[pr['history_id']] = len(urls)
+        for url in urls:
+            prs_by_url.setdefault(url, []).append(pr)
+    
+    if not prs_by_url:
+        return 0
+    
+    jobs = {
+        url: (lambda url=url, prs=prs: _send_stale_pr_digests(url, title, intro, prs))
+        for url, prs in prs_by_url.items()
+    }
+    if router:
+        results = router.fan_out(jobs)
+    else:
+        results = {url: job() for url, job in jobs.items()}
+    
+    delivered = {}
+    for sent_ids in results.values():
+        for history_id in sent_ids or []:
+            delivered[history_id] = delivered.get(history_id, 0) + 1
+    
+    done = [history_id for history_id, count in delivered.items() if count == targets_by_history_id[history_id]]
+    for start in range(0, len(done), STALE_PRS_PER_MESSAGE):
+        db.mark_stale_notifications_sent(done[start:start + STALE_PRS_PER_MESSAGE])
+    return len(done)
+
+def check_stale_prs(stale_days, reminder_max_days=30, router=None, default_webhook_url=None, settings=None):
     """
     Check for stale PRs and send notifications
+    
+    Only newly stale PRs are announced. PRs that stay stale get reminders on a
+    doubling cadence (stale_days, 2x, 4x, ... capped at reminder_max_days).
+    Without a router everything goes to default_webhook_url.
     """
     try:
-        db = DatabaseHandler()
+        db = DatabaseHandler(settings)
         
         # Check if database connection was successful
         if hasattr(db, 'connection_failed') and db.connection_failed:
             logger.error("Database connection failed, skipping stale PR check")
             return
             
-        newly_stale_pr_ids = db.check_for_stale_prs(stale_days)
+        db.check_for_stale_prs(stale_days)
         
-        if newly_stale_pr_ids:
-            stale_prs = db.get_stale_prs()
-            
-            if stale_prs:
-                # Check if slack webhook URL is available
-                import os
-                webhook_url = os.getenv('SLACK_WEBHOOK_URL')
-                if not webhook_url:
-                    logger.error("SLACK_WEBHOOK_URL not configured")
-                    db.close()
-                    return
-                
-                # Notify about stale PRs
-                title = "🚨 Stale Pull Requests Detected"
-                text = f"The following pull requests have been inactive for {stale_days} days:"
-                
-                fields = []
-                actions = []
-                
-                # Only include up to 10 PRs to avoid Slack message size limits
-                for i, pr in enumerate(stale_prs[:10]):
-                    pr_id, pr_title, pr_number, pr_url, repo_name, username, created_at, last_activity = pr
-                    
-                    days_inactive = (datetime.now() - last_activity).days if isinstance(last_activity, datetime) else '?'
-                    fields.append(f"*{repo_name} #{pr_number}*: {pr_title}")
-                    fields.append(f"Created by: {username} | Inactive for {days_inactive} days")
-                    
-                    actions.append({
-                        "text": f"View #{pr_number}",
-                        "url": pr_url
-                    })
-                
-                # If there are more than 10 stale PRs, add a note
-                if len(stale_prs) > 10:
-                    text += f"\n\n*Note: Showing 10 of {len(stale_prs)} stale PRs*"
-                
-                send_slack_notification(webhook_url, title, text, fields, actions)
+        pending = db.get_stale_prs_pending_notification(stale_days, reminder_max_days)
+        if not pending:
+            db.close()
+            return
+        
+        new_prs = []
+        reminder_prs = []
+        for row in pending:
+            history_id, pr_id, pr_title, pr_number, pr_url, repo_name, username, created_at, last_activity, notification_count = row
+            pr = {
+                'history_id': history_id,
+                'id': pr_id,
+                'title': pr_title,
+                'number': pr_number,
+                'html_url': pr_url,
+                'repo_name': repo_name,
+                'username': username,
+                'last_activity_at': last_activity
+            }
+            if notification_count:
+                reminder_prs.append(pr)
+            else:
+                new_prs.append(pr)
+        
+        if new_prs:
+            sent = _notify_stale_prs(
+                db, router, default_webhook_url,
+                "🚨 Stale Pull Requests Detected",
+                f"The following pull requests have been inactive for {stale_days} days:",
+                new_prs
+            )
+            logger.info(f"Announced {sent} of {len(new_prs)} newly stale PRs")
+        
+        if reminder_prs:
+            sent = _notify_stale_prs(
+                db, router, default_webhook_url,
+                "⏰ Pull Requests Still Stale",
+                "Reminder: these pull requests are still waiting for activity:",
+                reminder_prs
+            )
+            logger.info(f"Sent reminders for {sent} of {len(reminder_prs)} stale PRs")
         
         db.close()
     except Exception as e:
-        logger.error(f"Error checking for stale PRs: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error checking for stale PRs: {str(e)}")
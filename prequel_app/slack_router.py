@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prequel_db.db_handler import DatabaseHandler
+from prequel_app.slack_notifier import build_notification_blocks, post_slack_blocks
+
+logger = logging.getLogger(__name__)
+
+class SlackRouter:
+    """
+    Routes Slack notifications to webhook URLs based on rules stored in the database
+
+    Rules are compiled into a dict keyed by (scope, event_type), where scope is a
+    repository full name, ('team', name) or None for "any repository". Resolving a
+    (repository, event) pair is a handful of dict probes and the result is cached,
+    so routing cost does not grow with the number of rules. Delivery to multiple
+    targets runs concurrently on a shared thread pool.
+    """
+
+    def __init__(self, default_webhook_url=None, refresh_interval=30, max_workers=8):
+        self.default_webhook_url = default_webhook_url
+        self.refresh_interval = refresh_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='slack-fanout')
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._version = None
+        self._loaded = False
+        self._checked_at = 0.0
+        # (table, teams_by_repo, resolve cache), swapped as one reference on reload
+        self._compiled = ({}, {}, {})
+
+    @staticmethod
+    def compile(routes, team_repositories):
+        """Compile routing rules and team membership into lookup dicts"""
+        table = {}
+        for route in routes:
+            if route.get('repository'):
+                scope = route['repository'].lower()
+            elif route.get('team'):
+                scope = ('team', route['team'].lower())
+            else:
+                scope = None
+            key = (scope, route.get('event_type') or None)
+            urls = table.setdefault(key, [])
+            if route['webhook_url'] not in urls:
+                urls.append(route['webhook_url'])
+
+        teams_by_repo = {}
+        for team, repository in team_repositories:
+            teams_by_repo.setdefault(repository.lower(), []).append(('team', team.lower()))
+
+        return (
+            {key: tuple(urls) for key, urls in table.items()},
+            {repo: tuple(teams) for repo, teams in teams_by_repo.items()}
+        )
+
+    def reload(self):
+        """Load routing rules from the database and swap in the compiled table"""
+        db = DatabaseHandler()
+        try:
+            if hasattr(db, 'connection_failed') and db.connection_failed:
+                logger.error("Database connection failed, keeping current Slack routes")
+                return False
+
+            version = db.get_slack_routing_version()
+            if version is None:
+                return False
+            if self._loaded and version == self._version:
+                return True
+
+            table, teams_by_repo = self.compile(db.get_slack_routes(), db.get_slack_team_repositories())
+            with self._lock:
+                self._compiled = (table, teams_by_repo, {})
+                self._version = version
+                self._loaded = True
+            logger.info(f"Loaded {len(table)} Slack routing entries (version {version})")
+            return True
+        finally:
+            db.close()
+            self._checked_at = time.monotonic()
+
+    def configure(self, default_webhook_url, refresh_interval):
+        """Apply new fallback URL and refresh interval (settings reload)"""
+        with self._lock:
+            self.default_webhook_url = default_webhook_url
+            self.refresh_interval = refresh_interval
+            table, teams_by_repo, _ = self._compiled
+            self._compiled = (table, teams_by_repo, {})
+
+    def invalidate(self):
+        """Force a reload on the next lookup (call after changing routes)"""
+        with self._lock:
+            self._loaded = False
+            self._checked_at = 0.0
+
+    def _refresh_in_background(self):
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Error reloading Slack routes: {str(e)}")
+        finally:
+            self._refreshing = False
+
+    def _maybe_refresh(self):
+        """Reload synchronously on first use, then poll the version in the background"""
+        if not self._loaded:
+            # While the database is unreachable, only retry once per refresh interval
+            if self._checked_at and time.monotonic() - self._checked_at < self.refresh_interval:
+                return
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Error loading Slack routes: {str(e)}")
+                self._checked_at = time.monotonic()
+            return
+
+        if time.monotonic() - self._checked_at < self.refresh_interval or self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def resolve(self, repository, event_type):
+        """Get the webhook URLs a (repository, event_type) notification should go to"""
+        self._maybe_refresh()
+
+        table, teams_by_repo, cache = self._compiled
+        repo_key = (repository or '').lower()
+        cache_key = (repo_key, event_type)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        scopes = (repo_key,) + teams_by_repo.get(repo_key, ()) + (None,)
+        urls = []
+        for scope in scopes:
+            for key in ((scope, event_type), (scope, None)):
+                for url in table.get(key, ()):
+                    if url not in urls:
+                        urls.append(url)
+
+        if not urls and self.default_webhook_url:
+            urls.append(self.default_webhook_url)
+
+        result = tuple(urls)
+        cache[cache_key] = result
+        return result
+
+    def fan_out(self, jobs):
+        """
+        Run one callable per target concurrently and wait for all of them
+
+        jobs maps a target (webhook URL) to a zero-argument callable; returns a
+        dict mapping each target to the callable's result (False on error).
+        """
+        if len(jobs) == 1:
+            target, job = next(iter(jobs.items()))
+            return {target: job()}
+
+        futures = {target: self._executor.submit(job) for target, job in jobs.items()}
+        results = {}
+        for target, future in futures.items():
+            try:
+                results[target] = future.result()
+            except Exception as e:
+                logger.error(f"Error delivering Slack notification: {str(e)}")
+                results[target] = False
+        return results
+
+    def notify(self, repository, event_type, title, text, fields=None, actions=None):
+        """Send a notification to every webhook routed for this repository and event"""
+        urls = self.resolve(repository, event_type)
+        if not urls:
+            logger.warning(f"No Slack route for {event_type} on {repository}, notification dropped")
+            return {}
+
+        blocks = build_notification_blocks(title, text, fields, actions)
+        return self.fan_out({
+            url: (lambda url=url: post_slack_blocks(url, blocks, fallback_text=title))
+            for url in urls
+        })
@@ -0,0 +1,402 @@
+"""
+Application settings
+
+Configuration is read from the environment (plus the project's .env file)
+once, validated and frozen into a Settings object. Components are handed the
+settings they need; get_settings() returns the process-wide instance for code
+that is not. Sending SIGHUP to a server process reloads it: listeners
+registered with on_reload() apply what can change at runtime (Slack default
+URL, webhook secrets, schedules, breaker thresholds). Ports and pool sizes
+still need a restart.
+"""
+import logging
+import os
+import signal
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+try:
+    from dotenv import dotenv_values
+except ImportError:
+    dotenv_values = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+DEFAULT_ENV_FILE = os.path.join(ROOT, '.env')
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+class SettingsError(ValueError):
+    """Raised when environment values cannot be parsed; lists every bad variable"""
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    server: Optional[str] = None
+    database: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
+    connect_timeout: int = 30
+    read_server: Optional[str] = None
+    read_database: Optional[str] = None
+    read_username: Optional[str] = None
+    read_password: Optional[str] = None
+    read_application_intent: bool = False
+    read_pool_size: int = 8
+    read_max_staleness_seconds: float = 30.0
+    breaker_failure_threshold: int = 3
+    breaker_reset_seconds: float = 30.0
+    write_batch_window_ms: float = 0.0
+    write_batch_max_items: int = 50
+
+    def missing(self):
+        """Names of the required SQL_* variables that are not set"""
+        required = (('SQL_SERVER', self.server), ('SQL_DATABASE', self.database),
+                    ('SQL_USERNAME', self.username), ('SQL_PASSWORD', self.password))
+        return [name for name, value in required if not value]
+
+@dataclass(frozen=True)
+class CommentStorageSettings:
+    mode: str = 'full'
+    truncate_chars: int = 280
+    min_encoded_chars: int = 128
+    blob_dir: Optional[str] = None
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    secrets: Tuple[str, ...] = ()
+    max_content_length: int = 25 * 1024 * 1024
+    selective_parse: bool = True
+    max_in_flight: int = 32
+    retry_after_seconds: int = 5
+    readiness_probe_ttl_seconds: float = 10.0
+    handler_modules: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class SlackSettings:
+    webhook_url: Optional[str] = None
+    routes_refresh_seconds: int = 30
+    timeout_seconds: float = 10.0
+
+@dataclass(frozen=True)
+class SchedulerSettings:
+    stale_pr_days: int = 7
+    stale_reminder_max_days: int = 30
+    stale_check_interval_seconds: int = 86400
+    github_sync_interval_seconds: int = 0
+
+@dataclass(frozen=True)
+class GitHubSyncSettings:
+    api_url: str = 'https://api.github.com'
+    token: Optional[str] = None
+    concurrency: int = 4
+    min_remaining: int = 50
+
+@dataclass(frozen=True)
+class BranchProtectionSettings:
+    concurrency: int = 8
+    write_interval_seconds: float = 1.0
+    max_jobs_kept: int = 50
+
+@dataclass(frozen=True)
+class ApiSettings:
+    admin_tokens: Tuple[str, ...] = ()
+    cors_origins: Tuple[str, ...] = ('*',)
+
+@dataclass(frozen=True)
+class EventStoreSettings:
+    directory: Optional[str] = None
+    codec: Optional[str] = None
+    max_segment_bytes: int = 256 * 1024 * 1024
+
+@dataclass(frozen=True)
+class AsgiSettings:
+    port: int = 5002
+    max_in_flight: int = 2000
+    db_workers: int = 16
+
+@dataclass(frozen=True)
+class AnalyticsSettings:
+    snapshot_enabled: bool = False
+    snapshot_reload_seconds: int = 3600
+
+@dataclass(frozen=True)
+class OutboxSettings:
+    batch_size: int = 20
+    concurrency: int = 8
+    max_attempts: int = 8
+    lease_seconds: int = 60
+    retry_base_seconds: float = 5.0
+    retry_max_seconds: float = 3600.0
+    poll_seconds: float = 2.0
+    retention_days: int = 7
+
+@dataclass(frozen=True)
+class WorkflowSettings:
+    retention_days: int = 90
+    partition_months_ahead: int = 2
+    maintenance_interval_seconds: int = 21600
+
+@dataclass(frozen=True)
+class DeltaSyncSettings:
+    tombstone_retention_days: int = 30
+
+@dataclass(frozen=True)
+class RetentionSettings:
+    closed_pr_days: int = 0
+    batch_size: int = 100
+    batch_pause_seconds: float = 0.5
+    max_batches: int = 200
+
+@dataclass(frozen=True)
+class LiveEventSettings:
+    max_clients: int = 1000
+    client_buffer: int = 256
+    replay_size: int = 1024
+    heartbeat_seconds: float = 15.0
+
+@dataclass(frozen=True)
+class Settings:
+    database: DatabaseSettings = field(default_factory=DatabaseSettings)
+    comments: CommentStorageSettings = field(default_factory=CommentStorageSettings)
+    webhook: WebhookSettings = field(default_factory=WebhookSettings)
+    slack: SlackSettings = field(default_factory=SlackSettings)
+    scheduler: SchedulerSettings = field(default_factory=SchedulerSettings)
+    github_sync: GitHubSyncSettings = field(default_factory=GitHubSyncSettings)
+    branch_protection: BranchProtectionSettings = field(default_factory=BranchProtectionSettings)
+    api: ApiSettings = field(default_factory=ApiSettings)
+    event_store: EventStoreSettings = field(default_factory=EventStoreSettings)
+    asgi: AsgiSettings = field(default_factory=AsgiSettings)
+    analytics: AnalyticsSettings = field(default_factory=AnalyticsSettings)
+    outbox: OutboxSettings = field(default_factory=OutboxSettings)
+    workflows: WorkflowSettings = field(default_factory=WorkflowSettings)
+    live_events: LiveEventSettings = field(default_factory=LiveEventSettings)
+    delta_sync: DeltaSyncSettings = field(default_factory=DeltaSyncSettings)
+    retention: RetentionSettings = field(default_factory=RetentionSettings)
+    log_level: str = 'DEBUG'
+
+    def missing(self):
+        """Required variables the webhook server cannot work without"""
+        missing = [] if self.webhook.secrets else ['GITHUB_WEBHOOK_SECRET']
+        return missing + self.database.missing()
+
+class _Reader:
+    """Typed lookups over a dict of raw values, collecting every parse error"""
+
+    def __init__(self, values):
+        self.values = values
+        self.errors = []
+
+    def str(self, name, default=None):
+        value = self.values.get(name)
+        return value if value not in (None, '') else default
+
+    def _number(self, name, default, kind):
+        value = self.values.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            return kind(value)
+        except ValueError:
+            self.errors.append(f"{name}={value!r} is not a valid {kind.__name__}")
+            return default
+
+    def int(self, name, default):
+        return self._number(name, default, int)
+
+    def float(self, name, default):
+        return self._number(name, default, float)
+
+    def bool(self, name, default):
+        value = self.values.get(name)
+        return value.lower() in TRUE_VALUES if value not in (None, '') else default
+
+    def list(self, name):
+        return tuple(item.strip() for item in (self.values.get(name) or '').split(',') if item.strip())
+
+def _read_values(environ, env_file):
+    values = {}
+    if env_file and dotenv_values is not None and os.path.exists(env_file):
+        values.update({key: value for key, value in dotenv_values(env_file).items() if value is not None})
+    # Real environment variables win over .env, as with load_dotenv()
+    values.update(os.environ if environ is None else environ)
+    return values
+
+def load_settings(environ=None, env_file=DEFAULT_ENV_FILE):
+    """Read and validate settings; raises SettingsError listing every malformed value"""
+    env = _Reader(_read_values(environ, env_file))
+
+    secrets = []
+    for secret in (env.str('GITHUB_WEBHOOK_SECRET'),) + env.list('GITHUB_WEBHOOK_SECRETS'):
+        if secret and secret not in secrets:
+            secrets.append(secret)
+
+    admin_tokens = []
+    for token in (env.str('ADMIN_API_TOKEN'),) + env.list('ADMIN_API_TOKENS'):
+        if token and token not in admin_tokens:
+            admin_tokens.append(token)
+
+    settings = Settings(
+        database=DatabaseSettings(
+            server=env.str('SQL_SERVER'),
+            database=env.str('SQL_DATABASE'),
+            username=env.str('SQL_USERNAME'),
+            password=env.str('SQL_PASSWORD'),
+            connect_timeout=env.int('SQL_CONNECT_TIMEOUT', 30),
+            read_server=env.str('SQL_READ_SERVER'),
+            read_database=env.str('SQL_READ_DATABASE'),
+            read_username=env.str('SQL_READ_USERNAME'),
+            read_password=env.str('SQL_READ_PASSWORD'),
+            read_application_intent=env.bool('SQL_READ_APPLICATION_INTENT', False),
+            read_pool_size=env.int('SQL_READ_POOL_SIZE', 8),
+            read_max_staleness_seconds=env.float('SQL_READ_MAX_STALENESS_SECONDS', 30.0),
+            breaker_failure_threshold=env.int('DB_BREAKER_FAILURE_THRESHOLD', 3),
+            breaker_reset_seconds=env.float('DB_BREAKER_RESET_SECONDS', 30.0),
+            write_batch_window_ms=env.float('WRITE_BATCH_WINDOW_MS', 0.0),
+            write_batch_max_items=env.int('WRITE_BATCH_MAX_ITEMS', 50)
+        ),
+        comments=CommentStorageSettings(
+            mode=env.str('COMMENT_BODY_STORAGE', 'full').lower(),
+            truncate_chars=env.int('COMMENT_BODY_TRUNCATE_CHARS', 280),
+            min_encoded_chars=env.int('COMMENT_BODY_MIN_ENCODED_CHARS', 128),
+            blob_dir=env.str('COMMENT_BLOB_DIR')
+        ),
+        webhook=WebhookSettings(
+            secrets=tuple(secrets),
+            max_content_length=env.int('WEBHOOK_MAX_CONTENT_LENGTH', 25 * 1024 * 1024),
+            selective_parse=env.bool('WEBHOOK_SELECTIVE_PARSE', True),
+            max_in_flight=env.int('WEBHOOK_MAX_IN_FLIGHT', 32),
+            retry_after_seconds=env.int('WEBHOOK_RETRY_AFTER_SECONDS', 5),
+            readiness_probe_ttl_seconds=env.float('READINESS_PROBE_TTL_SECONDS', 10.0),
+            handler_modules=env.list('WEBHOOK_HANDLER_MODULES')
+        ),
+        slack=SlackSettings(
+            webhook_url=env.str('SLACK_WEBHOOK_URL'),
+            routes_refresh_seconds=env.int('SLACK_ROUTES_REFRESH_SECONDS', 30),
+            timeout_seconds=env.float('SLACK_TIMEOUT_SECONDS', 10.0)
+        ),
+        scheduler=SchedulerSettings(
+            stale_pr_days=env.int('STALE_PR_DAYS', 7),
+            stale_reminder_max_days=env.int('STALE_REMINDER_MAX_DAYS', 30),
+            stale_check_interval_seconds=env.int('STALE_CHECK_INTERVAL_SECONDS', 86400),
+            github_sync_interval_seconds=env.int('GITHUB_SYNC_INTERVAL_SECONDS', 0)
+        ),
+        github_sync=GitHubSyncSettings(
+            api_url=env.str('GITHUB_API_URL', 'https://api.github.com'),
+            token=env.str('GITHUB_TOKEN'),
+            concurrency=env.int('GITHUB_SYNC_CONCURRENCY', 4),
+            min_remaining=env.int('GITHUB_SYNC_MIN_REMAINING', 50)
+        ),
+        branch_protection=BranchProtectionSettings(
+            concurrency=env.int('BRANCH_PROTECTION_CONCURRENCY', 8),
+            write_interval_seconds=env.float('BRANCH_PROTECTION_WRITE_INTERVAL_SECONDS', 1.0),
+            max_jobs_kept=env.int('BRANCH_PROTECTION_MAX_JOBS_KEPT', 50)
+        ),
+        api=ApiSettings(
+            admin_tokens=tuple(admin_tokens),
+            cors_origins=env.list('CORS_ORIGINS') or ('*',)
+        ),
+        event_store=EventStoreSettings(
+            directory=env.str('EVENT_STORE_DIR'),
+            codec=env.str('EVENT_STORE_CODEC'),
+            max_segment_bytes=env.int('EVENT_STORE_MAX_SEGMENT_BYTES', 256 * 1024 * 1024)
+        ),
+        asgi=AsgiSettings(
+            port=env.int('ASGI_PORT', 5002),
+            max_in_flight=env.int('ASYNC_WEBHOOK_MAX_IN_FLIGHT', 2000),
+            db_workers=env.int('ASYNC_DB_WORKERS', 16)
+        ),
+        analytics=AnalyticsSettings(
+            snapshot_enabled=env.bool('ANALYTICS_SNAPSHOT', False),
+            snapshot_reload_seconds=env.int('ANALYTICS_SNAPSHOT_RELOAD_SECONDS', 3600)
+        ),
+        outbox=OutboxSettings(
+            batch_size=env.int('OUTBOX_BATCH_SIZE', 20),
+            concurrency=env.int('OUTBOX_CONCURRENCY', 8),
+            max_attempts=env.int('OUTBOX_MAX_ATTEMPTS', 8),
+            lease_seconds=env.int('OUTBOX_LEASE_SECONDS', 60),
+            retry_base_seconds=env.float('OUTBOX_RETRY_BASE_SECONDS', 5.0),
+            retry_max_seconds=env.float('OUTBOX_RETRY_MAX_SECONDS', 3600.0),
+            poll_seconds=env.float('OUTBOX_POLL_SECONDS', 2.0),
+            retention_days=env.int('OUTBOX_RETENTION_DAYS', 7)
+        ),
+        workflows=WorkflowSettings(
+            retention_days=env.int('WORKFLOW_RETENTION_DAYS', 90),
+            partition_months_ahead=env.int('WORKFLOW_PARTITION_MONTHS_AHEAD', 2),
+            maintenance_interval_seconds=env.int('WORKFLOW_MAINTENANCE_INTERVAL_SECONDS', 21600)
+        ),
+        live_events=LiveEventSettings(
+            max_clients=env.int('EVENTS_MAX_CLIENTS', 1000),
+            client_buffer=env.int('EVENTS_CLIENT_BUFFER', 256),
+            replay_size=env.int('EVENTS_REPLAY_SIZE', 1024),
+            heartbeat_seconds=env.float('EVENTS_HEARTBEAT_SECONDS', 15.0)
+        ),
+        delta_sync=DeltaSyncSettings(
+            tombstone_retention_days=env.int('CHANGE_TOMBSTONE_RETENTION_DAYS', 30)
+        ),
+        retention=RetentionSettings(
+            closed_pr_days=env.int('RETENTION_CLOSED_PR_DAYS', 0),
+            batch_size=env.int('RETENTION_BATCH_SIZE', 100),
+            batch_pause_seconds=env.float('RETENTION_BATCH_PAUSE_SECONDS', 0.5),
+            max_batches=env.int('RETENTION_MAX_BATCHES', 200)
+        ),
+        log_level=env.str('LOG_LEVEL', 'DEBUG').upper()
+    )
+
+    if settings.comments.mode not in ('full', 'compressed', 'truncated', 'external'):
+        env.errors.append(f"COMMENT_BODY_STORAGE={settings.comments.mode!r} is not one of full, compressed, truncated, external")
+    if not isinstance(getattr(logging, settings.log_level, None), int):
+        env.errors.append(f"LOG_LEVEL={settings.log_level!r} is not a logging level")
+    if env.errors:
+        raise SettingsError("Invalid configuration: " + "; ".join(env.errors))
+    return settings
+
+_settings = None
+_settings_lock = threading.Lock()
+_listeners = []
+
+def get_settings():
+    """The process-wide settings, loaded on first use"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = load_settings()
+    return _settings
+
+def on_reload(listener):
+    """Register listener(settings), called after every successful reload"""
+    _listeners.append(listener)
+    return listener
+
+def reload_settings():
+    """Re-read the environment and .env; keeps the current settings if they are invalid"""
+    global _settings
+    try:
+        settings = load_settings()
+    except SettingsError as e:
+        logger.error(f"Settings not reloaded: {str(e)}")
+        return None
+    with _settings_lock:
+        _settings = settings
+    for listener in list(_listeners):
+        try:
+            listener(settings)
+        except Exception as e:
+            logger.error(f"Error applying reloaded settings in {getattr(listener, '__name__', listener)}: {str(e)}")
+    logger.info("Settings reloaded")
+    return settings
+
+def install_reload_handler():
+    """Reload settings on SIGHUP; only possible from the main thread and on POSIX"""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return False
+    # The reload takes locks and reads files, so it runs outside the signal handler
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_settings, daemon=True).start())
+    return True
+
+def configure_logging(settings=None):
+    """Set up root logging; called by entry points, never at import time"""
+    settings = settings or get_settings()
+    logging.basicConfig(level=getattr(logging, settings.log_level))
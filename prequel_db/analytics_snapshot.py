@@ -0,0 +1,600 @@
+"""
+In-process columnar snapshot of PR, review and comment data
+
+The dashboard endpoints (/api/metrics, /api/repositories, /api/contributors,
+/api/stale-prs) aggregate every PR, review and comment on each request. With
+ANALYTICS_SNAPSHOT=true the server keeps a compact copy of just the columns
+those queries need: users and repositories are integer-coded, and each table
+is a set of array.array columns (cheap appends) that are turned into NumPy
+arrays for bincount/unique style aggregations when a request comes in.
+
+The snapshot is loaded once from the database and then kept current by the
+model methods, which report every committed write (see
+DatabaseConnection._after_commit). Writes made by other processes, or rows
+first seen through them, only appear after the next periodic reload
+(ANALYTICS_SNAPSHOT_RELOAD_SECONDS). verify() compares the snapshot with the
+SQL queries it replaces.
+
+Usage:
+  python -m prequel_db.analytics_snapshot report
+  python -m prequel_db.analytics_snapshot verify
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Timestamps are stored as int64 microseconds since 1970-01-01 (naive, like the
+# DATETIME columns); NULL is the smallest int64 so MAX() ignores it
+EPOCH = datetime(1970, 1, 1)
+NULL_TIME = -(2 ** 63)
+
+def to_micros(value):
+    """Naive datetime, ISO 8601 string or None -> int64 microseconds"""
+    if value is None:
+        return NULL_TIME
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return NULL_TIME
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(value):
+    value = int(value)
+    if value == NULL_TIME:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+def _isoformat(value):
+    value = from_micros(value)
+    return value.isoformat() if value else None
+
+class _Table:
+    """
+    Columns of one entity, keyed by database id
+
+    Numeric columns are array.array (typecode per column); string columns
+    are plain lists. Rows are only removed by remove(), which compacts the
+    columns and returns the new index of every row it kept.
+    """
+
+    def __init__(self, numeric, text=()):
+        self.columns = {name: array(typecode) for name, typecode in numeric}
+        self.text = {name: [] for name in text}
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def upsert(self, row_id, values):
+        """Insert or update a row; returns its index"""
+        row = self.rows.get(row_id)
+        if row is None:
+            row = len(self.rows)
+            self.rows[row_id] = row
+            self.columns['id'].append(row_id)
+            for name, column in self.columns.items():
+                if name != 'id':
+                    column.append(values.get(name, 0))
+            for name, column in self.text.items():
+                column.append(values.get(name))
+            return row
+        for name, value in values.items():
+            if name in self.columns:
+                self.columns[name][row] = value
+            else:
+                self.text[name][row] = value
+        return row
+
+    def remove(self, row_ids):
+        """Drop rows by id; returns {old index: new index} for the kept rows (None if nothing was dropped)"""
+        dropped = {self.rows[row_id] for row_id in row_ids if row_id in self.rows}
+        if not dropped:
+            return None
+        kept = [row for row in range(len(self.rows)) if row not in dropped]
+        for name, column in self.columns.items():
+            self.columns[name] = array(column.typecode, (column[row] for row in kept))
+        for name, column in self.text.items():
+            self.text[name] = [column[row] for row in kept]
+        moved = {old: new for new, old in enumerate(kept)}
+        self.rows = {row_id: moved[row] for row_id, row in self.rows.items() if row in moved}
+        return moved
+
+    def numpy(self, name):
+        """A NumPy copy of one column (a copy, so the array can keep growing)"""
+        import numpy as np
+        return np.array(self.columns[name])
+
+    def memory(self):
+        """Bytes used by each column and by the id index"""
+        usage = {name: len(column) * column.itemsize for name, column in self.columns.items()}
+        for name, column in self.text.items():
+            usage[name] = sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column if value is not None)
+        usage['(id index)'] = sys.getsizeof(self.rows)
+        return usage
+
+class AnalyticsSnapshot:
+    """
+    Columnar copy of the dashboard's data with vectorized versions of its queries
+
+    Every method takes the snapshot lock, so aggregations see a consistent
+    state. Updates that arrive while load() is still reading the database are
+    queued and replayed afterwards; upserts are idempotent, so replaying a
+    write the load already saw is harmless.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.users = _Table((('id', 'q'), ('github_id', 'q'), ('created_at', 'q')), ('username', 'avatar_url'))
+        self.repositories = _Table((('id', 'q'), ('github_id', 'q'), ('created_at', 'q')), ('name', 'full_name'))
+        self.pull_requests = _Table(
+            (('id', 'q'), ('repository', 'i'), ('author', 'i'), ('number', 'q'), ('is_open', 'b'),
+             ('is_stale', 'b'), ('created_at', 'q'), ('last_activity_at', 'q')),
+            ('title', 'html_url')
+        )
+        self.reviews = _Table((('id', 'q'), ('pull_request', 'i'), ('reviewer', 'i')))
+        # A comment's PR is only needed to drop it with an archived PR (-1 when unknown)
+        self.comments = _Table((('id', 'q'), ('pull_request', 'i'), ('author', 'i'), ('contains_command', 'b')))
+        self.loaded = False
+        self.loaded_at = None
+        self.load_seconds = None
+        self.updates = 0
+        # Writes referring to a user, repository or PR the snapshot has not seen
+        self.missed_updates = 0
+        self._pending = []
+
+    # Loading
+
+    def load(self, db):
+        """Fill the snapshot from the database; returns False if a query fails"""
+        if not hasattr(db, 'conn') or not db.conn:
+            logger.warning("Analytics snapshot load skipped due to missing connection")
+            return False
+
+        start = time.perf_counter()
+        try:
+            db.cursor.execute("SELECT id, github_id, username, avatar_url, created_at FROM users")
+            users = db.cursor.fetchall()
+            db.cursor.execute("SELECT id, github_id, name, full_name, created_at FROM repositories")
+            repositories = db.cursor.fetchall()
+            db.cursor.execute(
+                """SELECT id, repository_id, author_id, number, title, html_url, state, is_stale,
+                          created_at, last_activity_at
+                   FROM pull_requests"""
+            )
+            pull_requests = db.cursor.fetchall()
+            db.cursor.execute("SELECT id, pull_request_id, reviewer_id FROM pr_reviews")
+            reviews = db.cursor.fetchall()
+            db.cursor.execute("SELECT id, pull_request_id, author_id, contains_command FROM review_comments")
+            comments = db.cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading analytics snapshot: {str(e)}")
+            return False
+
+        with self._lock:
+            for row in users:
+                self._upsert_user(*row)
+            for row in repositories:
+                self._upsert_repository(*row)
+            for (pr_id, repository_id, author_id, number, title, html_url, state, is_stale,
+                 created_at, last_activity_at) in pull_requests:
+                self._upsert_pull_request(pr_id, repository_id, author_id, number, title, html_url,
+                                          state, created_at, last_activity_at, is_stale=is_stale)
+            for review_id, pull_request_id, reviewer_id in reviews:
+                self._upsert_review(review_id, pull_request_id, reviewer_id)
+            for comment_id, pull_request_id, author_id, contains_command in comments:
+                self._upsert_comment(comment_id, pull_request_id, author_id, contains_command)
+
+            self.loaded = True
+            pending, self._pending = self._pending, []
+            for method, args in pending:
+                getattr(self, method)(*args)
+            self.loaded_at = datetime.now()
+            self.load_seconds = round(time.perf_counter() - start, 3)
+
+        logger.info(f"Loaded analytics snapshot: {len(pull_requests)} PRs, {len(reviews)} reviews, "
+                    f"{len(comments)} comments in {self.load_seconds}s")
+        return True
+
+    # Incremental updates (called after the corresponding database write commits)
+
+    def apply(self, method, *args):
+        """Apply one update now, or queue it while the snapshot is loading"""
+        with self._lock:
+            if not self.loaded:
+                self._pending.append((method, args))
+                return
+            self.updates += 1
+            getattr(self, method)(*args)
+
+    # Users and repositories are never updated by the model methods, so a
+    # known row is kept as loaded
+
+    def _upsert_user(self, user_id, github_id, username, avatar_url, created_at):
+        if user_id in self.users.rows:
+            return
+        self.users.upsert(user_id, {
+            'github_id': github_id or 0, 'created_at': to_micros(created_at),
+            'username': username, 'avatar_url': avatar_url
+        })
+
+    def _upsert_repository(self, repository_id, github_id, name, full_name, created_at):
+        if repository_id in self.repositories.rows:
+            return
+        self.repositories.upsert(repository_id, {
+            'github_id': github_id or 0, 'created_at': to_micros(created_at),
+            'name': name, 'full_name': full_name
+        })
+
+    def _upsert_pull_request(self, pr_id, repository_id, author_id, number, title, html_url, state,
+                             created_at, last_activity_at, is_stale=None):
+        repository = self.repositories.rows.get(repository_id)
+        author = self.users.rows.get(author_id)
+        if repository is None or author is None:
+            self.missed_updates += 1
+            return
+        values = {
+            'repository': repository, 'author': author, 'number': number or 0,
+            'is_open': 1 if state == 'open' else 0,
+            'created_at': to_micros(created_at), 'last_activity_at': to_micros(last_activity_at),
+            'title': title, 'html_url': html_url
+        }
+        if is_stale is not None:
+            values['is_stale'] = 1 if is_stale else 0
+        self.pull_requests.upsert(pr_id, values)
+
+    def _touch_pull_request(self, pull_request_id, activity_at):
+        """A review or comment updates last_activity_at and clears is_stale, as in SQL"""
+        row = self.pull_requests.rows.get(pull_request_id)
+        if row is None:
+            return None
+        if activity_at is not None:
+            self.pull_requests.columns['last_activity_at'][row] = to_micros(activity_at)
+            self.pull_requests.columns['is_stale'][row] = 0
+        return row
+
+    def _upsert_review(self, review_id, pull_request_id, reviewer_id, submitted_at=None):
+        pull_request = self._touch_pull_request(pull_request_id, submitted_at)
+        reviewer = self.users.rows.get(reviewer_id)
+        if pull_request is None or reviewer is None:
+            self.missed_updates += 1
+            return
+        self.reviews.upsert(review_id, {'pull_request': pull_request, 'reviewer': reviewer})
+
+    def _upsert_comment(self, comment_id, pull_request_id, author_id, contains_command, updated_at=None):
+        pull_request = None
+        if pull_request_id is not None:
+            pull_request = self._touch_pull_request(pull_request_id, updated_at)
+        author = self.users.rows.get(author_id)
+        if author is None:
+            self.missed_updates += 1
+            return
+        self.comments.upsert(comment_id, {
+            'pull_request': -1 if pull_request is None else pull_request,
+            'author': author, 'contains_command': 1 if contains_command else 0
+        })
+
+    def _mark_stale(self, pr_ids):
+        is_stale = self.pull_requests.columns['is_stale']
+        for pr_id in pr_ids:
+            row = self.pull_requests.rows.get(pr_id)
+            if row is not None:
+                is_stale[row] = 1
+
+    def _archive_pull_requests(self, pr_ids):
+        """Archived PRs leave the live tables with their reviews and comments, so drop them here too"""
+        archived = {self.pull_requests.rows[pr_id] for pr_id in pr_ids if pr_id in self.pull_requests.rows}
+        if not archived:
+            return
+        children = (self.reviews, self.comments)
+        for table in children:
+            ids, pull_request = table.columns['id'], table.columns['pull_request']
+            table.remove([ids[row] for row in range(len(table)) if pull_request[row] in archived])
+        moved = self.pull_requests.remove(pr_ids)
+        # Children store the PR's row index, which the compaction changed
+        for table in children:
+            pull_request = table.columns['pull_request']
+            for row in range(len(table)):
+                if pull_request[row] >= 0:
+                    pull_request[row] = moved[pull_request[row]]
+
+    # Queries (same output as the DatabaseHandler methods they replace)
+
+    def pr_metrics(self):
+        """Same result as DatabaseHandler.get_pr_metrics"""
+        import numpy as np
+
+        with self._lock:
+            usernames = self.users.text['username']
+            user_count = len(self.users)
+
+            def ranked(codes):
+                counts = np.bincount(codes, minlength=user_count)
+                totals = Counter()
+                for code in np.flatnonzero(counts).tolist():
+                    totals[usernames[code]] += int(counts[code])
+                return [[username, count] for username, count in totals.most_common()]
+
+            is_stale = self.pull_requests.numpy('is_stale')
+            is_open = self.pull_requests.numpy('is_open')
+            return {
+                'pr_authors': ranked(self.pull_requests.numpy('author')),
+                'active_reviewers': ranked(self.reviews.numpy('reviewer')),
+                'comment_users': ranked(self.comments.numpy('author')),
+                'stale_pr_count': int(np.count_nonzero(is_stale & is_open))
+            }
+
+    def repositories_with_pr_counts(self):
+        """Same result as DatabaseHandler.get_repositories_with_pr_counts"""
+        import numpy as np
+
+        with self._lock:
+            repository_count = len(self.repositories)
+            user_count = max(len(self.users), 1)
+            pr_repository = self.pull_requests.numpy('repository').astype(np.int64)
+            pr_author = self.pull_requests.numpy('author').astype(np.int64)
+            is_stale = self.pull_requests.numpy('is_stale').astype(bool)
+
+            pr_counts = np.bincount(pr_repository, minlength=repository_count)
+            stale_counts = np.bincount(pr_repository[is_stale], minlength=repository_count)
+            review_counts = np.bincount(pr_repository[self.reviews.numpy('pull_request')],
+                                        minlength=repository_count)
+            # Distinct (repository, author) pairs, counted per repository
+            pairs = np.unique(pr_repository * user_count + pr_author)
+            contributor_counts = np.bincount(pairs // user_count, minlength=repository_count)
+            last_activity = np.full(repository_count, NULL_TIME, dtype=np.int64)
+            np.maximum.at(last_activity, pr_repository, self.pull_requests.numpy('last_activity_at'))
+
+            columns = self.repositories.columns
+            names, full_names = self.repositories.text['name'], self.repositories.text['full_name']
+            repositories = []
+            for code in np.argsort(-pr_counts, kind='stable').tolist():
+                repositories.append({
+                    'id': columns['id'][code],
+                    'github_id': columns['github_id'][code],
+                    'name': names[code],
+                    'full_name': full_names[code],
+                    'created_at': _isoformat(columns['created_at'][code]),
+                    'pr_count': int(pr_counts[code]),
+                    'review_count': int(review_counts[code]),
+                    'stale_pr_count': int(stale_counts[code]),
+                    'contributor_count': int(contributor_counts[code]),
+                    'last_activity': _isoformat(last_activity[code])
+                })
+            return repositories
+
+    def contributors_with_counts(self):
+        """Same result as DatabaseHandler.get_contributors_with_counts"""
+        import numpy as np
+
+        with self._lock:
+            user_count = len(self.users)
+            repository_count = max(len(self.repositories), 1)
+            pr_author = self.pull_requests.numpy('author').astype(np.int64)
+            comment_author = self.comments.numpy('author')
+            is_command = self.comments.numpy('contains_command').astype(bool)
+
+            pr_counts = np.bincount(pr_author, minlength=user_count)
+            review_counts = np.bincount(self.reviews.numpy('reviewer'), minlength=user_count)
+            command_counts = np.bincount(comment_author[is_command], minlength=user_count)
+
+            # Distinct repository names per author, from the sorted (author, repository) pairs
+            repository_names = self.repositories.text['name']
+            pairs = np.unique(pr_author * repository_count + self.pull_requests.numpy('repository'))
+            repositories_by_user = {}
+            for author, repository in zip((pairs // repository_count).tolist(), (pairs % repository_count).tolist()):
+                repositories_by_user.setdefault(author, {})[repository_names[repository]] = None
+
+            columns = self.users.columns
+            usernames, avatar_urls = self.users.text['username'], self.users.text['avatar_url']
+            contributors = []
+            for code in np.argsort(-pr_counts, kind='stable').tolist():
+                contributors.append({
+                    'id': columns['id'][code],
+                    'github_id': columns['github_id'][code],
+                    'username': usernames[code],
+                    'avatar_url': avatar_urls[code],
+                    'created_at': _isoformat(columns['created_at'][code]),
+                    'pr_count': int(pr_counts[code]),
+                    'review_count': int(review_counts[code]),
+                    'command_count': int(command_counts[code]),
+                    'repositories': list(repositories_by_user.get(code, ()))
+                })
+            return contributors
+
+    def stale_prs(self):
+        """Same rows as DatabaseAnalytics.get_stale_prs"""
+        import numpy as np
+
+        with self._lock:
+            mask = (self.pull_requests.numpy('is_stale') & self.pull_requests.numpy('is_open')).astype(bool)
+            rows = np.flatnonzero(mask)
+            last_activity = self.pull_requests.numpy('last_activity_at')[rows]
+            columns, text = self.pull_requests.columns, self.pull_requests.text
+            full_names, usernames = self.repositories.text['full_name'], self.users.text['username']
+            result = []
+            for row in rows[np.argsort(last_activity, kind='stable')].tolist():
+                result.append((
+                    columns['id'][row],
+                    text['title'][row],
+                    columns['number'][row],
+                    text['html_url'][row],
+                    full_names[columns['repository'][row]],
+                    usernames[columns['author'][row]],
+                    from_micros(columns['created_at'][row]),
+                    from_micros(columns['last_activity_at'][row])
+                ))
+            return result
+
+    # Diagnostics
+
+    def memory_report(self):
+        """Row counts and bytes per column, per table"""
+        with self._lock:
+            tables = {}
+            total = 0
+            for name in ('users', 'repositories', 'pull_requests', 'reviews', 'comments'):
+                table = getattr(self, name)
+                columns = table.memory()
+                table_bytes = sum(columns.values())
+                total += table_bytes
+                tables[name] = {'rows': len(table), 'bytes': table_bytes, 'columns': columns}
+            return {
+                'loaded': self.loaded,
+                'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+                'load_seconds': self.load_seconds,
+                'updates': self.updates,
+                'missed_updates': self.missed_updates,
+                'total_bytes': total,
+                'tables': tables
+            }
+
+    def verify(self, db, limit=20):
+        """
+        Compare every snapshot query with its SQL version
+
+        Returns a list of differences (empty when consistent). Timestamps are
+        compared to the second, and ties in the ORDER BY are ignored.
+        """
+        differences = []
+
+        def compare(name, expected, actual):
+            for key in sorted(set(expected) | set(actual), key=str):
+                if expected.get(key) != actual.get(key):
+                    differences.append(f"{name} {key}: database={expected.get(key)!r} snapshot={actual.get(key)!r}")
+                    if len(differences) >= limit:
+                        return
+
+        def normalize(record):
+            record = dict(record)
+            for key in ('created_at', 'last_activity'):
+                if record.get(key):
+                    record[key] = record[key][:19]
+            if 'repositories' in record:
+                record['repositories'] = sorted(record['repositories'])
+            return record
+
+        metrics, expected_metrics = self.pr_metrics(), db.get_pr_metrics()
+        for key in ('pr_authors', 'active_reviewers', 'comment_users'):
+            compare(f"metrics.{key}", dict(map(tuple, expected_metrics.get(key, []))), dict(map(tuple, metrics[key])))
+        compare("metrics", {'stale_pr_count': expected_metrics.get('stale_pr_count')},
+                {'stale_pr_count': metrics['stale_pr_count']})
+
+        compare("repository", {r['id']: normalize(r) for r in db.get_repositories_with_pr_counts()},
+                {r['id']: normalize(r) for r in self.repositories_with_pr_counts()})
+        compare("contributor", {c['id']: normalize(c) for c in db.get_contributors_with_counts()},
+                {c['id']: normalize(c) for c in self.contributors_with_counts()})
+
+        def stale_key(row):
+            return tuple(row[:6]) + tuple(value.replace(microsecond=0) if value else None for value in row[6:])
+        compare("stale_pr", {row[0]: stale_key(row) for row in db.get_stale_prs()},
+                {row[0]: stale_key(row) for row in self.stale_prs()})
+        return differences[:limit]
+
+class AnalyticsSnapshotManager:
+    """
+    The process-wide snapshot: serves the loaded one, builds replacements
+
+    Model methods report writes through observe(); while a reload is
+    building a new snapshot, writes go to both, so nothing committed during
+    the reload is lost when the new snapshot is swapped in.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.active = None
+        self._building = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def configure(self, enabled):
+        """Enable or disable the snapshot (disabling frees it)"""
+        with self._lock:
+            self.enabled = enabled
+            if not enabled:
+                self.active = None
+
+    def current(self):
+        """The loaded snapshot, or None when queries should go to the database"""
+        return self.active if self.enabled else None
+
+    def age(self):
+        """Seconds since the active snapshot was loaded (None when there is none)"""
+        active = self.active
+        if active is None or active.loaded_at is None:
+            return None
+        return (datetime.now() - active.loaded_at).total_seconds()
+
+    def observe(self, method, *args):
+        """Forward a committed write to the active and the loading snapshot"""
+        if not self.enabled:
+            return
+        with self._lock:
+            targets = [snapshot for snapshot in (self.active, self._building) if snapshot is not None]
+        for snapshot in targets:
+            try:
+                snapshot.apply(method, *args)
+            except Exception as e:
+                logger.error(f"Error updating analytics snapshot ({method}): {str(e)}")
+
+    def reload(self, db_factory):
+        """Build a new snapshot from the database and swap it in; returns True on success"""
+        with self._reload_lock:
+            snapshot = AnalyticsSnapshot()
+            with self._lock:
+                self._building = snapshot
+            loaded = None
+            db = None
+            try:
+                db = db_factory()
+                loaded = snapshot.load(db)
+            finally:
+                if db is not None:
+                    db.close()
+                with self._lock:
+                    self._building = None
+                    if loaded and self.enabled:
+                        self.active = snapshot
+            return loaded
+
+analytics_snapshot = AnalyticsSnapshotManager()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('report', 'verify'))
+    args = parser.parse_args()
+
+    from prequel_config.settings import configure_logging
+    from prequel_db.db_handler import DatabaseHandler
+    configure_logging()
+
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+    try:
+        snapshot = AnalyticsSnapshot()
+        if not snapshot.load(db):
+            sys.exit("Loading the snapshot failed")
+        if args.command == 'report':
+            print(json.dumps(snapshot.memory_report(), indent=2))
+            return
+        differences = snapshot.verify(db)
+    finally:
+        db.close()
+    for difference in differences:
+        print(difference)
+    print("Snapshot matches the database" if not differences else f"{len(differences)} differences")
+    sys.exit(1 if differences else 0)
+
+if __name__ == '__main__':
+    main()
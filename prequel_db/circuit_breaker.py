@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Circuit breaker with closed, open and half-open states
+
+    Closed: calls go through and failures are counted. After failure_threshold
+    consecutive failures the breaker opens. Open: calls are refused immediately
+    until reset_timeout has passed. Half-open: a limited number of probe calls
+    are let through; a success closes the breaker, a failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._last_failure = None
+
+    def configure(self, failure_threshold, reset_timeout):
+        """Change the thresholds in place (settings reload); the current state is kept"""
+        with self._lock:
+            self.failure_threshold = failure_threshold
+            self.reset_timeout = reset_timeout
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        # An open breaker whose timeout has elapsed is ready for a probe
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def is_open(self):
+        """True while calls are being refused (does not consume a probe)"""
+        return self.state == self.OPEN
+
+    def allow_request(self):
+        """Return True if the caller may attempt the protected call"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.OPEN:
+                return False
+
+            # Half-open: let a limited number of probes through
+            if self._state == self.OPEN:
+                self._state = self.HALF_OPEN
+                self._half_open_calls = 0
+                logger.info(f"Circuit breaker '{self.name}' half-open, probing")
+            if self._half_open_calls >= self.half_open_max_calls:
+                return False
+            self._half_open_calls += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit breaker '{self.name}' closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._half_open_calls = 0
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._failures += 1
+            self._last_failure = str(error) if error else None
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Circuit breaker '{self.name}' opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_calls = 0
+
+    def retry_after(self):
+        """Seconds until the breaker will allow a probe (0 if not open)"""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def snapshot(self):
+        """Current breaker state for health reporting"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'last_failure': self._last_failure
+            }
+
+# Shared breaker for every DatabaseConnection in this process; the servers
+# apply DB_BREAKER_* from the settings with configure()
+database_breaker = CircuitBreaker('database')
@@ -0,0 +1,299 @@
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+from prequel_config.settings import get_settings, configure_logging
+from prequel_db.db_connection import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+# Values of review_comments.body_storage
+STORAGE_FULL = 'full'
+STORAGE_COMPRESSED = 'compressed'
+STORAGE_TRUNCATED = 'truncated'
+STORAGE_EXTERNAL = 'external'
+STORAGE_MODES = (STORAGE_FULL, STORAGE_COMPRESSED, STORAGE_TRUNCATED, STORAGE_EXTERNAL)
+
+DEFAULT_TRUNCATE_CHARS = 280
+# gzip adds ~20 bytes of framing, so short bodies are cheaper stored as-is
+DEFAULT_MIN_ENCODED_CHARS = 128
+
+class BlobStore:
+    """
+    Content-addressed local file store for comment bodies
+
+    Blobs are gzip files named by the SHA-256 of the body, fanned out over
+    256 sub-directories. Identical bodies are stored once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest_hex):
+        return os.path.join(self.root, digest_hex[:2], digest_hex + '.gz')
+
+    def put(self, digest_hex, body):
+        path = self._path(digest_hex)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as blob_file:
+            blob_file.write(gzip.compress(body.encode('utf-8'), mtime=0))
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, digest_hex):
+        try:
+            with open(self._path(digest_hex), 'rb') as blob_file:
+                return gzip.decompress(blob_file.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+class CommentBodyCodec:
+    """
+    Encodes comment bodies for storage according to a storage policy
+
+    encode() returns the column values (body, body_compressed, body_sha256,
+    body_storage) for a review_comments row:
+
+    full        body as-is
+    compressed  gzip of the UTF-16LE body in body_compressed, so SQL Server can
+                read it with CAST(DECOMPRESS(body_compressed) AS NVARCHAR(MAX))
+    truncated   first truncate_chars characters plus the SHA-256 of the full
+                body; the rest is discarded
+    external    body in the BlobStore, keyed by its SHA-256
+
+    Bodies shorter than min_encoded_chars are always stored in full.
+    """
+
+    def __init__(self, mode=STORAGE_FULL, truncate_chars=DEFAULT_TRUNCATE_CHARS,
+                 blob_dir=None, min_encoded_chars=DEFAULT_MIN_ENCODED_CHARS):
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown comment body storage mode: {mode}")
+        if mode == STORAGE_EXTERNAL and not blob_dir:
+            raise ValueError("COMMENT_BLOB_DIR is required for external comment storage")
+        self.mode = mode
+        self.truncate_chars = truncate_chars
+        self.min_encoded_chars = min_encoded_chars
+        self.blobs = BlobStore(blob_dir) if blob_dir else None
+
+    def encode(self, body):
+        body = body or ''
+        if self.mode == STORAGE_FULL or len(body) < self.min_encoded_chars:
+            return body, None, None, STORAGE_FULL
+
+        digest = hashlib.sha256(body.encode('utf-8')).digest()
+        if self.mode == STORAGE_COMPRESSED:
+            return '', gzip.compress(body.encode('utf-16-le'), mtime=0), digest, STORAGE_COMPRESSED
+        if self.mode == STORAGE_TRUNCATED:
+            if len(body) <= self.truncate_chars:
+                return body, None, None, STORAGE_FULL
+            return body[:self.truncate_chars], None, digest, STORAGE_TRUNCATED
+
+        self.blobs.put(digest.hex(), body)
+        return '', None, digest, STORAGE_EXTERNAL
+
+    def decode(self, body, body_compressed, body_sha256, body_storage):
+        """
+        Return the stored body text
+
+        Truncated rows only have their prefix; external rows whose blob is
+        missing return None.
+        """
+        if body_storage == STORAGE_COMPRESSED:
+            return gzip.decompress(body_compressed).decode('utf-16-le')
+        if body_storage == STORAGE_EXTERNAL:
+            if self.blobs is None or body_sha256 is None:
+                return None
+            return self.blobs.get(bytes(body_sha256).hex())
+        return body
+
+def comment_body_codec_from_settings(comment_settings):
+    """Build the codec configured by COMMENT_BODY_STORAGE and related settings"""
+    return CommentBodyCodec(
+        mode=comment_settings.mode,
+        truncate_chars=comment_settings.truncate_chars,
+        blob_dir=comment_settings.blob_dir,
+        min_encoded_chars=comment_settings.min_encoded_chars
+    )
+
+_default_codec = None
+
+def get_comment_body_codec():
+    """Process-wide codec, rebuilt when reloaded settings change the storage policy"""
+    global _default_codec
+    comment_settings = get_settings().comments
+    if _default_codec is None or _default_codec[0] is not comment_settings:
+        _default_codec = (comment_settings, comment_body_codec_from_settings(comment_settings))
+    return _default_codec[1]
+
+class DatabaseCommentStorage(DatabaseConnection):
+    """
+    Storage policy operations for review comment bodies
+    """
+
+    def get_review_comment_body(self, comment_id):
+        """Get a comment body regardless of how it is stored"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            self.cursor.execute(
+                """SELECT body, body_compressed, body_sha256, body_storage
+                   FROM review_comments WHERE id = ?""",
+                (comment_id,)
+            )
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+            return get_comment_body_codec().decode(*row)
+
+        except Exception as e:
+            logger.error(f"Error in get_review_comment_body: {str(e)}")
+            return None
+
+    def migrate_review_comment_storage(self, codec, batch_size=500):
+        """
+        Re-encode existing comment bodies with codec, one transaction per batch
+
+        Rows already stored in the target mode are skipped, as are truncated
+        rows (their full text is gone) and external rows whose blob cannot be
+        read. Returns (migrated, skipped).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0, 0
+
+        # Full rows too short to encode would come back unchanged, so leave them out
+        keep_full_below = 0
+        if codec.mode != STORAGE_FULL:
+            keep_full_below = codec.min_encoded_chars
+            if codec.mode == STORAGE_TRUNCATED:
+                keep_full_below = max(keep_full_below, codec.truncate_chars + 1)
+
+        last_id = 0
+        migrated = 0
+        skipped = 0
+        while True:
+            try:
+                self.cursor.execute(
+                    f"""SELECT TOP ({int(batch_size)}) id, body, body_compressed, body_sha256, body_storage
+                        FROM review_comments
+                        WHERE id > ? AND body_storage <> ? AND body_storage <> ?
+                          AND NOT (body_storage = ? AND LEN(body) < ?)
+                        ORDER BY id""",
+                    (last_id, codec.mode, STORAGE_TRUNCATED, STORAGE_FULL, keep_full_below)
+                )
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+
+                updates = []
+                for comment_id, body, body_compressed, body_sha256, body_storage in rows:
+                    text = codec.decode(body, body_compressed, body_sha256, body_storage)
+                    if text is None:
+                        logger.warning(f"Comment {comment_id} body is unavailable, not migrated")
+                        skipped += 1
+                        continue
+                    updates.append(codec.encode(text) + (comment_id,))
+
+                if updates:
+                    self.cursor.executemany(
+                        """UPDATE review_comments
+                           SET body = ?, body_compressed = ?, body_sha256 = ?, body_storage = ?
+                           WHERE id = ?""",
+                        updates
+                    )
+                self.conn.commit()
+            except Exception as e:
+                logger.error(f"Error in migrate_review_comment_storage: {str(e)}")
+                self.conn.rollback()
+                break
+
+            last_id = rows[-1][0]
+            migrated += len(updates)
+            logger.info(f"Comment storage migration: {migrated} migrated, {skipped} skipped")
+        return migrated, skipped
+
+    def get_review_comment_storage_stats(self):
+        """Get row counts per storage mode plus table size from sp_spaceused"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return {}
+
+        try:
+            self.cursor.execute(
+                """SELECT body_storage, COUNT(*),
+                          SUM(DATALENGTH(body)), SUM(ISNULL(DATALENGTH(body_compressed), 0))
+                   FROM review_comments GROUP BY body_storage"""
+            )
+            modes = {
+                row[0]: {'rows': row[1], 'body_bytes': row[2] or 0, 'compressed_bytes': row[3] or 0}
+                for row in self.cursor.fetchall()
+            }
+
+            self.cursor.execute("EXEC sp_spaceused N'review_comments'")
+            space = self.cursor.fetchone()
+            return {
+                'modes': modes,
+                'rows': space[1].strip(),
+                'reserved': space[2].strip(),
+                'data': space[3].strip(),
+                'index_size': space[4].strip()
+            }
+
+        except Exception as e:
+            logger.error(f"Error in get_review_comment_storage_stats: {str(e)}")
+            return {}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review comment body storage tools")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subcommands.add_parser('migrate', help="Re-encode existing comment bodies")
+    migrate_parser.add_argument('--mode', choices=STORAGE_MODES, help="Target mode (default: COMMENT_BODY_STORAGE)")
+    migrate_parser.add_argument('--batch-size', type=int, default=500)
+
+    subcommands.add_parser('stats', help="Show comment storage and table size")
+
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from prequel_db.db_handler import DatabaseHandler
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+
+    try:
+        if args.command == 'migrate':
+            codec = comment_body_codec_from_settings(db.settings.comments)
+            if args.mode:
+                codec = CommentBodyCodec(
+                    args.mode,
+                    truncate_chars=codec.truncate_chars,
+                    blob_dir=codec.blobs.root if codec.blobs else None,
+                    min_encoded_chars=codec.min_encoded_chars
+                )
+            migrated, skipped = db.migrate_review_comment_storage(codec, batch_size=args.batch_size)
+            print(f"Migrated {migrated} comments to '{codec.mode}' storage ({skipped} skipped)")
+        else:
+            stats = db.get_review_comment_storage_stats()
+            for mode, counts in sorted(stats.get('modes', {}).items()):
+                print(f"{mode:<11} {counts['rows']:>10} rows {counts['body_bytes']:>14} body bytes "
+                      f"{counts['compressed_bytes']:>14} compressed bytes")
+            print(f"review_comments: reserved {stats.get('reserved')}, data {stats.get('data')}, "
+                  f"indexes {stats.get('index_size')}")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 import logging
 from datetime import datetime, timedelta
 from prequel_db.db_connection import DatabaseConnection
+from prequel_db.db_replica import read_replica
+from prequel_db.analytics_snapshot import analytics_snapshot
+from prequel_db.live_events import live_events
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class DatabaseAnalytics(DatabaseConnection):
@@ -44,6 +45,14 @@ class DatabaseAnalytics(DatabaseConnection):
                     (pr_id,)
                 )
                 
+                # Close any earlier stale period so only one history row stays active
+                self.cursor.execute(
+                    """UPDATE stale_pr_history 
+                       SET marked_active_at = GETDATE() 
+                       WHERE pull_request_id = ? AND marked_active_at IS NULL""", 
+                    (pr_id,)
+                )
+                
                 # Add to stale PR history
                 self.cursor.execute(
                     "INSERT INTO stale_pr_history (pull_request_id) VALUES (?)", 
@@ -53,6 +62,10 @@ class DatabaseAnalytics(DatabaseConnection):
                 newly_stale_pr_ids.append(pr_id)
             
             self.conn.commit()
+            if newly_stale_pr_ids:
+                self._after_commit(analytics_snapshot.observe, '_mark_stale', newly_stale_pr_ids)
+                self._after_commit(live_events.publish, 'pr.stale', {'pull_request_ids': newly_stale_pr_ids})
+                self._after_commit(live_events.publish_counters, len(newly_stale_pr_ids))
             return newly_stale_pr_ids
             
         except Exception as e:
@@ -61,6 +74,7 @@ class DatabaseAnalytics(DatabaseConnection):
                 self.conn.rollback()
             return []
     
+    @read_replica
     def get_stale_prs(self):
         """Get all currently stale PRs"""
         # Check if we have a valid connection
@@ -68,23 +82,126 @@ class DatabaseAnalytics(DatabaseConnection):
             logger.warning("Database operation skipped due to missing connection")
             return []
             
+        try:
+            return self._stale_pr_rows()
+            
+        except Exception as e:
+            logger.error(f"Error in get_stale_prs: {str(e)}")
+            return []
+    
+    @read_replica
+    def iter_stale_prs(self):
+        """
+        get_stale_prs as a generator, fetching the rows in chunks as they are consumed
+        
+        A database error is logged and raised, so a streamed response is cut
+        off rather than ending early in a valid but incomplete list.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return
+            
+        try:
+            self._execute_stale_pr_query()
+            yield from self._fetch_in_chunks()
+            
+        except Exception as e:
+            logger.error(f"Error in iter_stale_prs: {str(e)}")
+            raise
+    
+    def _stale_pr_rows(self):
+        """Rows of get_stale_prs; raises on error"""
+        self._execute_stale_pr_query()
+        return self.cursor.fetchall()
+    
+    def _execute_stale_pr_query(self):
+        self.cursor.execute(
+            """SELECT pr.id, pr.title, pr.number, pr.html_url, repo.full_name, u.username,
+                      pr.created_at, pr.last_activity_at
+               FROM pull_requests pr
+               JOIN repositories repo ON pr.repository_id = repo.id
+               JOIN users u ON pr.author_id = u.id
+               WHERE pr.is_stale = 1
+               AND pr.state = 'open'
+               ORDER BY pr.last_activity_at ASC"""
+        )
+    
+    def get_stale_prs_pending_notification(self, reminder_base_days=7, reminder_max_days=30):
+        """
+        Get stale PRs that are due a Slack notification
+        
+        Newly stale PRs (notification_sent = 0) are always due. PRs that were already
+        announced are due a reminder once reminder_base_days * 2^(notification_count - 1)
+        days have passed since the last notification, capped at reminder_max_days.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
+            
         try:
             self.cursor.execute(
-                """SELECT pr.id, pr.title, pr.number, pr.html_url, repo.full_name, u.username,
-                          pr.created_at, pr.last_activity_at
-                   FROM pull_requests pr
+                """SELECT h.id, pr.id, pr.title, pr.number, pr.html_url, repo.full_name, u.username,
+                          pr.created_at, pr.last_activity_at, h.notification_count
+                   FROM stale_pr_history h
+                   JOIN pull_requests pr ON h.pull_request_id = pr.id
                    JOIN repositories repo ON pr.repository_id = repo.id
                    JOIN users u ON pr.author_id = u.id
-                   WHERE pr.is_stale = 1
+                   CROSS APPLY (
+                       SELECT CAST(? AS BIGINT) * POWER(CAST(2 AS BIGINT),
+                              CASE WHEN h.notification_count > 16 THEN 15
+                                   WHEN h.notification_count < 1 THEN 0
+                                   ELSE h.notification_count - 1 END) AS reminder_days
+                   ) cadence
+                   WHERE h.marked_active_at IS NULL
+                   AND pr.is_stale = 1
                    AND pr.state = 'open'
-                   ORDER BY pr.last_activity_at ASC"""
+                   AND (h.notification_sent = 0
+                        OR h.last_notified_at IS NULL
+                        OR h.last_notified_at <= DATEADD(day,
+                               -CAST(CASE WHEN cadence.reminder_days > ? THEN ? ELSE cadence.reminder_days END AS INT),
+                               GETDATE()))
+                   ORDER BY pr.last_activity_at ASC""",
+                (reminder_base_days, reminder_max_days, reminder_max_days)
             )
             return self.cursor.fetchall()
             
         except Exception as e:
-            logger.error(f"Error in get_stale_prs: {str(e)}")
+            logger.error(f"Error in get_stale_prs_pending_notification: {str(e)}")
             return []
     
+    def mark_stale_notifications_sent(self, history_ids):
+        """Record that a notification went out for the given stale_pr_history rows"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+            
+        if not history_ids:
+            return True
+            
+        try:
+            # One statement per chunk so a digest is either fully recorded or not at all
+            placeholders = ', '.join('?' for _ in history_ids)
+            self.cursor.execute(
+                f"""UPDATE stale_pr_history 
+                    SET notification_sent = 1,
+                        notification_count = notification_count + 1,
+                        last_notified_at = GETDATE()
+                    WHERE id IN ({placeholders})""",
+                tuple(history_ids)
+            )
+            self.conn.commit()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error in mark_stale_notifications_sent: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return False
+    
+    @read_replica
     def get_pr_metrics(self):
         """Get metrics for the frontend dashboard"""
         # Check if we have a valid connection
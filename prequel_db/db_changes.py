@@ -0,0 +1,265 @@
+import logging
+from prequel_db.db_connection import DatabaseConnection, CHANGE_TRACKED_TABLES
+
+logger = logging.getLogger(__name__)
+
+# A change token is the row_version (hex) below which a client has seen every change
+ZERO_VERSION = bytes(8)
+
+# Tombstones are purged in batches of this many rows
+TOMBSTONE_PURGE_BATCH = 5000
+
+# Upper bound of the change window, plus the newest reset marker and purge horizon
+CHANGE_WINDOW_SQL = """
+SELECT MIN_ACTIVE_ROWVERSION(),
+       MAX(CASE WHEN purged_through IS NULL THEN row_version END),
+       MAX(purged_through)
+FROM change_tombstones
+WHERE table_name = '*'
+"""
+
+# Repositories whose /api/repositories row may have changed: the repository
+# itself, or one of its PRs or reviews was written or removed
+CHANGED_REPOSITORIES_SQL = """
+SELECT id FROM repositories WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT repository_id FROM pull_requests WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT pr.repository_id
+FROM pr_reviews rv
+JOIN pull_requests pr ON pr.id = rv.pull_request_id
+WHERE rv.row_version >= ? AND rv.row_version < ?
+UNION
+SELECT repository_id FROM change_tombstones
+WHERE table_name IN ('pull_requests', 'pr_reviews') AND row_version >= ? AND row_version < ?
+"""
+
+# Users whose /api/contributors row may have changed: the user, or a PR,
+# review or comment they wrote was written or removed
+CHANGED_CONTRIBUTORS_SQL = """
+SELECT id FROM users WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT author_id FROM pull_requests WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT reviewer_id FROM pr_reviews WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT author_id FROM review_comments WHERE row_version >= ? AND row_version < ?
+UNION
+SELECT user_id FROM change_tombstones
+WHERE table_name IN ('pull_requests', 'pr_reviews', 'review_comments') AND row_version >= ? AND row_version < ?
+"""
+
+# Every PR written in the window; the flag says whether it belongs in /api/stale-prs
+CHANGED_STALE_PRS_SQL = """
+SELECT pr.id, pr.title, pr.number, pr.html_url, repo.full_name, u.username,
+       pr.created_at, pr.last_activity_at,
+       CASE WHEN pr.is_stale = 1 AND pr.state = 'open' THEN 1 ELSE 0 END
+FROM pull_requests pr
+JOIN repositories repo ON pr.repository_id = repo.id
+JOIN users u ON pr.author_id = u.id
+WHERE pr.row_version >= ? AND pr.row_version < ?
+ORDER BY pr.last_activity_at ASC
+"""
+
+def encode_change_token(version):
+    """Opaque token for a row_version (8 bytes)"""
+    return bytes(version).hex()
+
+def parse_change_token(token):
+    """row_version bytes from a since= token ('0' means from the beginning); raises ValueError"""
+    token = (token or '').strip().lower()
+    if token in ('0', ''):
+        return ZERO_VERSION
+    if len(token) != 16:
+        raise ValueError("since must be a change token returned by an earlier request")
+    try:
+        return bytes.fromhex(token)
+    except ValueError:
+        raise ValueError("since must be a change token returned by an earlier request")
+
+class DatabaseChanges(DatabaseConnection):
+    """
+    Handles change tracking for the delta sync API (?since= on the list endpoints)
+
+    Every change-tracked table (CHANGE_TRACKED_TABLES) has a ROWVERSION
+    column, which SQL Server bumps on each insert and update from one
+    database-wide counter. A token is the MIN_ACTIVE_ROWVERSION() read at
+    the start of a request: every change below it is committed, so the next
+    request asks for [token, new upper bound) and misses nothing, even with
+    transactions still open while the token was taken.
+
+    The delta reads run on the primary, never the read replica: a replica
+    serves an older snapshot than MIN_ACTIVE_ROWVERSION() describes, and a
+    token taken there would skip changes the rows did not show yet.
+
+    Deletes leave no row to version, so code that removes tracked rows
+    records tombstones in the same transaction (record_change_tombstones).
+    Tombstones are kept for CHANGE_TOMBSTONE_RETENTION_DAYS; a client whose
+    token predates the purge horizon, or a reset marker written when the
+    tables were cleared (event store rebuild), gets a full response.
+
+    The per-endpoint queries (_repository_rows, _contributor_rows,
+    _stale_pr_rows) come from the other DatabaseHandler bases.
+    """
+
+    def _change_window(self, since):
+        """(upper bound, full) for a delta read starting at since; raises on error"""
+        self.cursor.execute(CHANGE_WINDOW_SQL)
+        upper, reset_version, purged_through = self.cursor.fetchone()
+        upper = bytes(upper)
+        full = ((reset_version is not None and bytes(reset_version) >= since)
+                or (purged_through is not None and since <= bytes(purged_through)))
+        return upper, full
+
+    def _deleted_ids(self, table, since, upper):
+        self.cursor.execute(
+            """SELECT row_id FROM change_tombstones
+               WHERE table_name = ? AND row_id IS NOT NULL AND row_version >= ? AND row_version < ?""",
+            (table, since, upper)
+        )
+        return sorted({row[0] for row in self.cursor.fetchall()})
+
+    @staticmethod
+    def _changes(since, upper, full, changes, deleted):
+        return {
+            # Never move a client back, e.g. across a failover to a lagging server
+            'token': encode_change_token(max(since, upper)),
+            'full': full,
+            'changes': changes,
+            'deleted': deleted
+        }
+
+    def get_repository_changes(self, since):
+        """
+        /api/repositories rows changed since a token
+
+        Returns {token, full, changes, deleted} (deleted: repository ids), or
+        None if the read failed. With full=True, changes is every row and the
+        client should replace what it has.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            upper, full = self._change_window(since)
+            if full:
+                return self._changes(since, upper, True, self._repository_rows(), [])
+            changes = self._repository_rows(f"WHERE repo.id IN ({CHANGED_REPOSITORIES_SQL})", (since, upper) * 4)
+            deleted = self._deleted_ids('repositories', since, upper)
+            return self._changes(since, upper, False, changes, deleted)
+
+        except Exception as e:
+            logger.error(f"Error in get_repository_changes: {str(e)}")
+            return None
+
+    def get_contributor_changes(self, since):
+        """/api/contributors rows changed since a token (see get_repository_changes)"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            upper, full = self._change_window(since)
+            if full:
+                return self._changes(since, upper, True, self._contributor_rows(), [])
+            changes = self._contributor_rows(f"WHERE u.id IN ({CHANGED_CONTRIBUTORS_SQL})", (since, upper) * 5)
+            deleted = self._deleted_ids('users', since, upper)
+            return self._changes(since, upper, False, changes, deleted)
+
+        except Exception as e:
+            logger.error(f"Error in get_contributor_changes: {str(e)}")
+            return None
+
+    def get_stale_pr_changes(self, since):
+        """
+        Stale PR rows changed since a token (rows shaped like get_stale_prs)
+
+        deleted lists PRs that were removed or are no longer stale and open.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            upper, full = self._change_window(since)
+            if full:
+                return self._changes(since, upper, True, self._stale_pr_rows(), [])
+            self.cursor.execute(CHANGED_STALE_PRS_SQL, (since, upper))
+            rows = self.cursor.fetchall()
+            changes, deleted = [], self._deleted_ids('pull_requests', since, upper)
+            for row in rows:
+                if row[8]:
+                    changes.append(tuple(row[:8]))
+                else:
+                    deleted.append(row[0])
+            return self._changes(since, upper, False, changes, deleted)
+
+        except Exception as e:
+            logger.error(f"Error in get_stale_pr_changes: {str(e)}")
+            return None
+
+    def record_change_tombstones(self, table, rows):
+        """
+        Record removed rows of a change-tracked table (commits with the caller's transaction)
+
+        rows are (row_id, repository_id, user_id): the keys of the aggregates
+        the row counted towards, so delta readers can refresh them.
+        """
+        if table not in CHANGE_TRACKED_TABLES:
+            raise ValueError(f"{table} is not change tracked")
+        rows = list(rows)
+        if rows:
+            self.cursor.executemany(
+                "INSERT INTO change_tombstones (table_name, row_id, repository_id, user_id) VALUES (?, ?, ?, ?)",
+                [(table, row_id, repository_id, user_id) for row_id, repository_id, user_id in rows]
+            )
+        return len(rows)
+
+    def record_change_reset(self):
+        """Mark every change token issued so far as stale (after the tracked tables were cleared)"""
+        self.cursor.execute("INSERT INTO change_tombstones (table_name) VALUES ('*')")
+
+    def purge_change_tombstones(self, retention_days):
+        """
+        Delete tombstones older than retention_days; returns the number deleted
+
+        The newest purged row_version is kept as the purge horizon, so tokens
+        from before it get a full response instead of missing a delete.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0
+
+        deleted = 0
+        try:
+            while True:
+                self.cursor.execute(
+                    """DELETE TOP (?) FROM change_tombstones
+                       OUTPUT DELETED.row_version
+                       WHERE table_name <> '*' AND deleted_at < DATEADD(day, ?, SYSUTCDATETIME())""",
+                    (TOMBSTONE_PURGE_BATCH, -int(retention_days))
+                )
+                versions = [bytes(row[0]) for row in self.cursor.fetchall()]
+                if versions:
+                    # One horizon marker is enough; older ones are superseded
+                    horizon = max(versions)
+                    self.cursor.execute(
+                        """DELETE FROM change_tombstones WHERE table_name = '*' AND purged_through < ?
+                           INSERT INTO change_tombstones (table_name, purged_through) VALUES ('*', ?)""",
+                        (horizon, horizon)
+                    )
+                self.conn.commit()
+                deleted += len(versions)
+                if len(versions) < TOMBSTONE_PURGE_BATCH:
+                    return deleted
+
+        except Exception as e:
+            logger.error(f"Error in purge_change_tombstones: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return deleted
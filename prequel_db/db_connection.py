@@ -1,10 +1,12 @@
-import os
 import logging
+import threading
+import time
 from datetime import datetime
-from dotenv import load_dotenv
+from prequel_config.settings import get_settings
+from prequel_db.circuit_breaker import database_breaker
+from prequel_db.db_replica import get_read_replica
+from prequel_db.db_indexes import apply_managed_indexes
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Define pyodbc at the module level
@@ -12,7 +14,6 @@ pyodbc = None
 
 try:
     import pyodbc
-    logger.info("Successfully imported pyodbc")
 except ImportError as e:
     logger.error(f"Failed to import pyodbc: {str(e)}")
     # Temporary fallback to allow debugging
@@ -22,53 +23,101 @@ except ImportError as e:
             return None
     pyodbc = MockPyodbc()
 
+# How often the primary refreshes the replication heartbeat row
+HEARTBEAT_INTERVAL_SECONDS = 5.0
+_last_heartbeat = 0.0
+_heartbeat_lock = threading.Lock()
+
+# Rows fetched per round trip when a result set is streamed (see _fetch_in_chunks)
+FETCH_CHUNK_ROWS = 500
+
+# Entity tables with a row_version column, read by the delta sync API (prequel_db/db_changes.py)
+CHANGE_TRACKED_TABLES = ('repositories', 'users', 'pull_requests', 'pr_reviews', 'review_comments')
+
+# (server, database) pairs whose tables were checked by this process
+_tables_ensured = set()
+_tables_lock = threading.Lock()
+
+def _run_callbacks(callbacks):
+    """Run after-commit callbacks; they observe writes and must never fail them"""
+    for callback, args in callbacks:
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Error in after-commit callback {getattr(callback, '__name__', callback)}: {str(e)}")
+
+def build_connection_string(server, database, username, password, read_only=False, connect_timeout=30):
+    """Build an ODBC connection string for Azure SQL"""
+    conn_str = (
+        f"Driver={{ODBC Driver 17 for SQL Server}};"
+        f"Server=tcp:{server},1433;"
+        f"Database={database};"
+        f"Uid={username};"
+        f"Pwd={password};"
+        f"Encrypt=yes;"
+        f"TrustServerCertificate=no;"
+        f"Connection Timeout={connect_timeout};"
+    )
+    if read_only:
+        conn_str += "ApplicationIntent=ReadOnly;"
+    return conn_str
+
 class DatabaseConnection:
     
-    def __init__(self):
-        """Initialize database connection using environment variables"""
+    def __init__(self, settings=None):
+        """Initialize database connection from the application settings"""
+        self.settings = settings or get_settings()
         try:
-            # Load environment variables from .env file
-            load_dotenv()
-            
-            # Get credentials from environment variables with no defaults
-            server = os.getenv("SQL_SERVER")
-            database = os.getenv("SQL_DATABASE")
-            username = os.getenv("SQL_USERNAME")
-            password = os.getenv("SQL_PASSWORD")
-            
-            # Check if any required environment variables are missing
-            missing_vars = []
-            if not server: missing_vars.append("SQL_SERVER")
-            if not database: missing_vars.append("SQL_DATABASE")
-            if not username: missing_vars.append("SQL_USERNAME")
-            if not password: missing_vars.append("SQL_PASSWORD")
+            db_settings = self.settings.database
             
+            # Check if any required settings are missing
+            missing_vars = db_settings.missing()
             if missing_vars:
                 raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
             
-            logger.debug(f"Using database: {database} on server: {server}")
+            server = db_settings.server
+            logger.debug(f"Using database: {db_settings.database} on server: {server}")
+            
+            # While the database is known to be down, fail in microseconds instead of
+            # waiting for the connection timeout on every request
+            if not database_breaker.allow_request():
+                logger.warning("Database circuit breaker is open, skipping connection attempt")
+                self.conn = None
+                self.cursor = None
+                self.connection_failed = True
+                self.circuit_open = True
+                return
             
             # Build connection string
-            conn_str = (
-                f"Driver={{ODBC Driver 17 for SQL Server}};"
-                f"Server=tcp:{server},1433;"
-                f"Database={database};"
-                f"Uid={username};"
-                f"Pwd={password};"
-                f"Encrypt=yes;"
-                f"TrustServerCertificate=no;"
-                f"Connection Timeout=30;"
+            conn_str = build_connection_string(
+                server, db_settings.database, db_settings.username, db_settings.password,
+                connect_timeout=db_settings.connect_timeout
             )
             
             logger.debug(f"Attempting to connect to database")
             
             # Connect to database
-            self.conn = pyodbc.connect(conn_str)
+            try:
+                self.conn = pyodbc.connect(conn_str)
+            except Exception as e:
+                database_breaker.record_failure(e)
+                raise
+            if self.conn is None:
+                database_breaker.record_failure("driver unavailable")
+                raise ConnectionError("Database driver returned no connection")
+            database_breaker.record_success()
             self.cursor = self.conn.cursor()
             logger.info(f"Successfully connected to Azure SQL database at {server}")
             
-            # Initialize tables if they don't exist
-            self._ensure_tables_exist()
+            # Initialize tables if they don't exist (once per process and database)
+            key = (server, db_settings.database)
+            if key not in _tables_ensured:
+                with _tables_lock:
+                    if key not in _tables_ensured and self._ensure_tables_exist():
+                        _tables_ensured.add(key)
+            
+            if self._get_read_replica():
+                self._write_replication_heartbeat()
             
         except ValueError as e:
             # Handle missing environment variables
@@ -91,6 +140,111 @@ class DatabaseConnection:
             self.conn.close()
             logger.info("Database connection closed")
     
+    # Write batches: a WriteBatcher runs several items in one transaction, so
+    # model methods commit and roll back through these helpers instead of
+    # calling conn.commit()/conn.rollback() directly
+    
+    def _commit(self):
+        """Commit, unless a write batch is open (the batch commits once at the end)"""
+        if getattr(self, '_write_batch_open', False):
+            return
+        self.conn.commit()
+    
+    def run_in_transaction(self, fn, *args):
+        """
+        Run fn(*args) as one transaction: every _commit() inside it is deferred
+        to a single commit at the end, and any failure rolls all of it back.
+        Inside an open write batch fn simply joins the batch transaction.
+        Returns fn's result, or None if the transaction was rolled back.
+        """
+        if getattr(self, '_write_batch_open', False):
+            return fn(*args)
+        self.begin_write_batch()
+        self.begin_write_batch_item()
+        committed = False
+        try:
+            result = fn(*args)
+            committed = not self.write_batch_item_failed and not self.write_batch_aborted
+        finally:
+            self.end_write_batch(commit=committed)
+        return result if committed else None
+    
+    def _after_commit(self, callback, *args):
+        """Run callback(*args) once the writes made so far are committed (call after _commit)"""
+        if getattr(self, '_write_batch_open', False):
+            self._batch_callbacks.append((callback, args))
+            return
+        _run_callbacks([(callback, args)])
+    
+    def _rollback(self):
+        """Roll back; inside a write batch only the current item's work is undone"""
+        if not getattr(self, '_write_batch_open', False):
+            self.conn.rollback()
+            return
+        self.write_batch_item_failed = True
+        # The item is re-run on its own, which registers its callbacks again
+        del self._batch_callbacks[self._batch_item_callbacks:]
+        try:
+            self.cursor.execute("ROLLBACK TRANSACTION batch_item")
+        except Exception as e:
+            # The whole transaction is doomed; the batcher has to start over
+            logger.error(f"Error rolling back write batch item: {str(e)}")
+            self.write_batch_aborted = True
+    
+    def begin_write_batch(self):
+        """Start one transaction for a batch of writes"""
+        self.cursor.execute("IF @@TRANCOUNT = 0 BEGIN TRANSACTION")
+        self._write_batch_open = True
+        self.write_batch_aborted = False
+        self._batch_callbacks = []
+    
+    def begin_write_batch_item(self):
+        """Mark the start of one item so a failure only undoes that item"""
+        self.write_batch_item_failed = False
+        self._batch_item_callbacks = len(self._batch_callbacks)
+        self.cursor.execute("SAVE TRANSACTION batch_item")
+    
+    def end_write_batch(self, commit=True):
+        """Commit (or roll back) the batch transaction, then run its after-commit callbacks"""
+        self._write_batch_open = False
+        callbacks, self._batch_callbacks = self._batch_callbacks, []
+        if commit:
+            self.conn.commit()
+            _run_callbacks(callbacks)
+        else:
+            self.conn.rollback()
+    
+    def _fetch_in_chunks(self, size=FETCH_CHUNK_ROWS):
+        """Yield the current result set's rows, fetching size rows at a time"""
+        while True:
+            rows = self.cursor.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+    
+    def _get_read_replica(self):
+        """Get the configured read replica, or None when reads use the primary"""
+        return get_read_replica(build_connection_string, pyodbc.connect, self.settings.database)
+    
+    def _write_replication_heartbeat(self):
+        """Refresh the heartbeat row replicas use to measure their lag (throttled per process)"""
+        global _last_heartbeat
+        with _heartbeat_lock:
+            if time.monotonic() - _last_heartbeat < HEARTBEAT_INTERVAL_SECONDS:
+                return
+            _last_heartbeat = time.monotonic()
+        
+        try:
+            self.cursor.execute(
+                """UPDATE replication_heartbeat SET beat_at = SYSUTCDATETIME() WHERE id = 1
+                   IF @@ROWCOUNT = 0
+                       INSERT INTO replication_heartbeat (id, beat_at) VALUES (1, SYSUTCDATETIME())"""
+            )
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing replication heartbeat: {str(e)}")
+            self.conn.rollback()
+    
     def _ensure_tables_exist(self):
         """Create tables if they don't exist in the Azure SQL database"""
         try:
@@ -103,7 +257,8 @@ class DatabaseConnection:
                     github_id BIGINT UNIQUE,
                     name NVARCHAR(255) NOT NULL,
                     full_name NVARCHAR(255) NOT NULL,
-                    created_at DATETIME DEFAULT GETDATE()
+                    created_at DATETIME DEFAULT GETDATE(),
+                    row_version ROWVERSION
                 )
             END
             """)
@@ -117,7 +272,8 @@ class DatabaseConnection:
                     github_id BIGINT UNIQUE,
                     username NVARCHAR(255) NOT NULL,
                     avatar_url NVARCHAR(255),
-                    created_at DATETIME DEFAULT GETDATE()
+                    created_at DATETIME DEFAULT GETDATE(),
+                    row_version ROWVERSION
                 )
             END
             """)
@@ -141,6 +297,7 @@ class DatabaseConnection:
                     merged_at DATETIME NULL,
                     is_stale BIT DEFAULT 0,
                     last_activity_at DATETIME NOT NULL,
+                    row_version ROWVERSION,
                     FOREIGN KEY (repository_id) REFERENCES repositories(id),
                     FOREIGN KEY (author_id) REFERENCES users(id)
                 )
@@ -158,6 +315,7 @@ class DatabaseConnection:
                     reviewer_id INT,
                     state NVARCHAR(50) NOT NULL,
                     submitted_at DATETIME NOT NULL,
+                    row_version ROWVERSION,
                     FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id),
                     FOREIGN KEY (reviewer_id) REFERENCES users(id)
                 )
@@ -179,6 +337,10 @@ class DatabaseConnection:
                     updated_at DATETIME NOT NULL,
                     contains_command BIT DEFAULT 0,
                     command_type NVARCHAR(50) NULL,
+                    body_storage VARCHAR(10) NOT NULL DEFAULT 'full',
+                    body_compressed VARBINARY(MAX) NULL,
+                    body_sha256 BINARY(32) NULL,
+                    row_version ROWVERSION,
                     FOREIGN KEY (review_id) REFERENCES pr_reviews(id),
                     FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id),
                     FOREIGN KEY (author_id) REFERENCES users(id)
@@ -196,15 +358,382 @@ class DatabaseConnection:
                     marked_stale_at DATETIME DEFAULT GETDATE(),
                     marked_active_at DATETIME NULL,
                     notification_sent BIT DEFAULT 0,
+                    notification_count INT NOT NULL DEFAULT 0,
+                    last_notified_at DATETIME NULL,
                     FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id)
                 )
             END
             """)
             
+            # Older deployments created stale_pr_history without the reminder columns
+            self.cursor.execute("""
+            IF COL_LENGTH('stale_pr_history', 'notification_count') IS NULL
+            BEGIN
+                ALTER TABLE stale_pr_history ADD
+                    notification_count INT NOT NULL DEFAULT 0,
+                    last_notified_at DATETIME NULL
+            END
+            """)
+            
+            # Older deployments created review_comments without the body storage columns
+            self.cursor.execute("""
+            IF COL_LENGTH('review_comments', 'body_storage') IS NULL
+            BEGIN
+                ALTER TABLE review_comments ADD
+                    body_storage VARCHAR(10) NOT NULL DEFAULT 'full',
+                    body_compressed VARBINARY(MAX) NULL,
+                    body_sha256 BINARY(32) NULL
+            END
+            """)
+            
+            # Older deployments created the entity tables without change tracking (see prequel_db/db_changes.py)
+            for table in CHANGE_TRACKED_TABLES:
+                self.cursor.execute(f"""
+                IF COL_LENGTH('{table}', 'row_version') IS NULL
+                    ALTER TABLE {table} ADD row_version ROWVERSION
+                """)
+            
+            # Rows removed from the change-tracked tables, for delta sync clients
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[change_tombstones]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE change_tombstones (
+                    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+                    table_name VARCHAR(40) NOT NULL,
+                    row_id INT NULL,
+                    repository_id INT NULL,
+                    user_id INT NULL,
+                    purged_through BINARY(8) NULL,
+                    deleted_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    row_version ROWVERSION
+                )
+            END
+            """)
+            
+            # Archived closed PRs and their history (see prequel_db/db_retention.py): same ids and
+            # columns as the live tables, no foreign keys (DELETE ... OUTPUT INTO needs none), page compressed
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[pull_requests_archive]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE pull_requests_archive (
+                    id INT NOT NULL,
+                    github_id BIGINT,
+                    repository_id INT,
+                    author_id INT,
+                    title NVARCHAR(255) NOT NULL,
+                    number INT NOT NULL,
+                    state NVARCHAR(50) NOT NULL,
+                    html_url NVARCHAR(255) NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL,
+                    closed_at DATETIME NULL,
+                    merged_at DATETIME NULL,
+                    is_stale BIT,
+                    last_activity_at DATETIME NOT NULL,
+                    archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    CONSTRAINT PK_pull_requests_archive PRIMARY KEY CLUSTERED (id)
+                )
+                WITH (DATA_COMPRESSION = PAGE)
+            END
+            """)
+
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[pr_reviews_archive]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE pr_reviews_archive (
+                    id INT NOT NULL,
+                    github_id BIGINT,
+                    pull_request_id INT,
+                    reviewer_id INT,
+                    state NVARCHAR(50) NOT NULL,
+                    submitted_at DATETIME NOT NULL,
+                    archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    CONSTRAINT PK_pr_reviews_archive PRIMARY KEY CLUSTERED (id)
+                )
+                WITH (DATA_COMPRESSION = PAGE)
+            END
+            """)
+
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[review_comments_archive]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE review_comments_archive (
+                    id INT NOT NULL,
+                    github_id BIGINT,
+                    review_id INT NULL,
+                    pull_request_id INT,
+                    author_id INT,
+                    body NVARCHAR(MAX) NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL,
+                    contains_command BIT,
+                    command_type NVARCHAR(50) NULL,
+                    body_storage VARCHAR(10) NOT NULL,
+                    body_compressed VARBINARY(MAX) NULL,
+                    body_sha256 BINARY(32) NULL,
+                    archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    CONSTRAINT PK_review_comments_archive PRIMARY KEY CLUSTERED (id)
+                )
+                WITH (DATA_COMPRESSION = PAGE)
+            END
+            """)
+
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[stale_pr_history_archive]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE stale_pr_history_archive (
+                    id INT NOT NULL,
+                    pull_request_id INT,
+                    marked_stale_at DATETIME,
+                    marked_active_at DATETIME NULL,
+                    notification_sent BIT,
+                    notification_count INT NOT NULL,
+                    last_notified_at DATETIME NULL,
+                    archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    CONSTRAINT PK_stale_pr_history_archive PRIMARY KEY CLUSTERED (id)
+                )
+                WITH (DATA_COMPRESSION = PAGE)
+            END
+            """)
+
+            # Check if the Slack routing tables exist
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[slack_routes]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE slack_routes (
+                    id INT IDENTITY(1,1) PRIMARY KEY,
+                    repository NVARCHAR(255) NULL,
+                    team NVARCHAR(255) NULL,
+                    event_type NVARCHAR(100) NULL,
+                    webhook_url NVARCHAR(1000) NOT NULL,
+                    enabled BIT NOT NULL DEFAULT 1,
+                    created_at DATETIME DEFAULT GETDATE()
+                )
+            END
+            """)
+            
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[slack_team_repositories]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE slack_team_repositories (
+                    id INT IDENTITY(1,1) PRIMARY KEY,
+                    team NVARCHAR(255) NOT NULL,
+                    repository NVARCHAR(255) NOT NULL,
+                    CONSTRAINT UQ_slack_team_repositories UNIQUE (team, repository)
+                )
+            END
+            """)
+            
+            # Cycle-time rollups: per-PR flags so each PR is counted once, and daily histogram buckets
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[pr_cycle_facts]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE pr_cycle_facts (
+                    pull_request_id INT PRIMARY KEY,
+                    first_review_recorded BIT NOT NULL DEFAULT 0,
+                    merge_recorded BIT NOT NULL DEFAULT 0
+                )
+            END
+            """)
+            
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[pr_cycle_rollup_daily]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE pr_cycle_rollup_daily (
+                    metric TINYINT NOT NULL,
+                    day DATE NOT NULL,
+                    repository_id INT NOT NULL,
+                    author_id INT NOT NULL,
+                    bucket SMALLINT NOT NULL,
+                    pr_count INT NOT NULL,
+                    CONSTRAINT PK_pr_cycle_rollup_daily PRIMARY KEY (metric, day, repository_id, author_id, bucket)
+                )
+            END
+            """)
+            
+            # Heartbeat written by the primary so read replicas can measure their lag
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[replication_heartbeat]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE replication_heartbeat (
+                    id INT PRIMARY KEY,
+                    beat_at DATETIME2 NOT NULL
+                )
+            END
+            """)
+            
+            # Single-row version counter, bumped whenever routes or teams change
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[slack_routing_version]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE slack_routing_version (
+                    id INT PRIMARY KEY,
+                    version BIGINT NOT NULL
+                )
+                INSERT INTO slack_routing_version (id, version) VALUES (1, 0)
+            END
+            """)
+            
+            # Cursors and ETags of the GitHub reconciliation sync, per repository resource
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[github_sync_state]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE github_sync_state (
+                    repository NVARCHAR(255) NOT NULL,
+                    resource NVARCHAR(100) NOT NULL,
+                    etag NVARCHAR(255) NULL,
+                    since_cursor NVARCHAR(40) NULL,
+                    synced_at DATETIME NOT NULL DEFAULT GETDATE(),
+                    CONSTRAINT PK_github_sync_state PRIMARY KEY (repository, resource)
+                )
+            END
+            """)
+            
+            # Slack notifications queued with the event data, delivered by the outbox worker
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[notification_outbox]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE notification_outbox (
+                    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+                    repository NVARCHAR(255) NULL,
+                    event_type NVARCHAR(100) NOT NULL,
+                    payload NVARCHAR(MAX) NOT NULL,
+                    status TINYINT NOT NULL DEFAULT 0,
+                    attempts INT NOT NULL DEFAULT 0,
+                    next_attempt_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    claim_token UNIQUEIDENTIFIER NULL,
+                    locked_until DATETIME2 NULL,
+                    delivered_targets NVARCHAR(MAX) NULL,
+                    last_error NVARCHAR(1000) NULL,
+                    created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                    delivered_at DATETIME2 NULL
+                )
+            END
+            """)
+            
+            # GitHub Actions workflows (see prequel_db/db_workflows.py). The raw run and
+            # job tables are partitioned by month so retention can truncate whole
+            # partitions; the partition function starts with the current month and
+            # maintain_workflow_partitions adds the following ones.
+            self.cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sys.partition_functions WHERE name = 'pf_workflow_month')
+            BEGIN
+                CREATE PARTITION FUNCTION pf_workflow_month (DATE)
+                AS RANGE RIGHT FOR VALUES ('{datetime.utcnow().date().replace(day=1).isoformat()}')
+            END
+            """)
+            
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.partition_schemes WHERE name = 'ps_workflow_month')
+            BEGIN
+                CREATE PARTITION SCHEME ps_workflow_month
+                AS PARTITION pf_workflow_month ALL TO ([PRIMARY])
+            END
+            """)
+            
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[workflows]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE workflows (
+                    id INT IDENTITY(1,1) PRIMARY KEY,
+                    repository_id INT NOT NULL,
+                    name NVARCHAR(255) NOT NULL,
+                    github_workflow_id BIGINT NULL,
+                    created_at DATETIME NOT NULL DEFAULT GETDATE(),
+                    CONSTRAINT UQ_workflows_repository_name UNIQUE (repository_id, name),
+                    FOREIGN KEY (repository_id) REFERENCES repositories(id)
+                )
+            END
+            """)
+            
+            # Completed runs and jobs: narrow rows, duplicates dropped by the insert
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[workflow_runs]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE workflow_runs (
+                    run_day DATE NOT NULL,
+                    run_id BIGINT NOT NULL,
+                    run_attempt SMALLINT NOT NULL,
+                    workflow_id INT NOT NULL,
+                    conclusion TINYINT NOT NULL,
+                    created_at DATETIME2(0) NULL,
+                    started_at DATETIME2(0) NULL,
+                    completed_at DATETIME2(0) NOT NULL,
+                    duration_seconds INT NULL,
+                    CONSTRAINT PK_workflow_runs PRIMARY KEY CLUSTERED (run_day, run_id, run_attempt)
+                        WITH (IGNORE_DUP_KEY = ON)
+                ) ON ps_workflow_month (run_day)
+                WITH (DATA_COMPRESSION = ROW)
+            END
+            """)
+            
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[workflow_jobs]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE workflow_jobs (
+                    job_day DATE NOT NULL,
+                    job_id BIGINT NOT NULL,
+                    run_id BIGINT NULL,
+                    run_attempt SMALLINT NOT NULL,
+                    workflow_id INT NOT NULL,
+                    conclusion TINYINT NOT NULL,
+                    created_at DATETIME2(0) NULL,
+                    started_at DATETIME2(0) NULL,
+                    completed_at DATETIME2(0) NOT NULL,
+                    queue_seconds INT NULL,
+                    duration_seconds INT NULL,
+                    CONSTRAINT PK_workflow_jobs PRIMARY KEY CLUSTERED (job_day, job_id)
+                        WITH (IGNORE_DUP_KEY = ON)
+                ) ON ps_workflow_month (job_day)
+                WITH (DATA_COMPRESSION = ROW)
+            END
+            """)
+            
+            # Per-workflow daily histograms (conclusions, run duration, job queue time and duration)
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[workflow_rollup_daily]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE workflow_rollup_daily (
+                    metric TINYINT NOT NULL,
+                    day DATE NOT NULL,
+                    workflow_id INT NOT NULL,
+                    bucket SMALLINT NOT NULL,
+                    sample_count INT NOT NULL,
+                    value_sum BIGINT NOT NULL,
+                    CONSTRAINT PK_workflow_rollup_daily PRIMARY KEY (day, workflow_id, metric, bucket)
+                )
+            END
+            """)
+            
+            # The latest run of every workflow, including runs still in progress
+            self.cursor.execute("""
+            IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[workflow_latest_runs]') AND type in (N'U'))
+            BEGIN
+                CREATE TABLE workflow_latest_runs (
+                    workflow_id INT PRIMARY KEY,
+                    run_id BIGINT NOT NULL,
+                    run_attempt SMALLINT NOT NULL,
+                    run_number INT NULL,
+                    completed BIT NOT NULL,
+                    conclusion TINYINT NULL,
+                    triggered_by NVARCHAR(255) NULL,
+                    html_url NVARCHAR(255) NULL,
+                    created_at DATETIME2(0) NULL,
+                    duration_seconds INT NULL,
+                    updated_at DATETIME2 NOT NULL
+                )
+            END
+            """)
+            
+            # Indexes for the hot query shapes (see prequel_db/db_indexes.py)
+            apply_managed_indexes(self.cursor)
+            
             self.conn.commit()
             logger.info("Database tables initialized successfully")
+            return True
         
         except Exception as e:
             logger.error(f"Error ensuring tables exist: {str(e)}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
\ No newline at end of file
+                self.conn.rollback()
+            return False
\ No newline at end of file
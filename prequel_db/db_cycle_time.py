@@ -0,0 +1,268 @@
+import logging
+import math
+import sys
+from collections import Counter
+from prequel_db.db_connection import DatabaseConnection
+from prequel_db.db_replica import read_replica
+from prequel_db.histograms import (
+    log_bucket,
+    linear_bucket,
+    log_bucket_upper_bounds,
+    linear_bucket_upper_bounds,
+    histogram_matrix,
+    percentiles
+)
+
+logger = logging.getLogger(__name__)
+
+# Metric codes stored in pr_cycle_rollup_daily.metric
+METRIC_FIRST_REVIEW = 1
+METRIC_MERGE = 2
+METRIC_REVIEW_ROUNDS = 3
+
+METRIC_NAMES = {
+    METRIC_FIRST_REVIEW: 'time_to_first_review',
+    METRIC_MERGE: 'time_to_merge',
+    METRIC_REVIEW_ROUNDS: 'review_rounds'
+}
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Per-PR inputs for the rollups: first non-author review and merge, plus
+# whether each has already been counted
+CYCLE_TIME_SOURCE_SQL = """
+    SELECT {top} pr.id, pr.repository_id, pr.author_id,
+           first_review.submitted_at,
+           DATEDIFF(second, pr.created_at, first_review.submitted_at),
+           pr.merged_at,
+           DATEDIFF(second, pr.created_at, pr.merged_at),
+           (SELECT COUNT(*) FROM pr_reviews rv
+             WHERE rv.pull_request_id = pr.id AND UPPER(rv.state) = 'CHANGES_REQUESTED'),
+           ISNULL(f.first_review_recorded, 0),
+           ISNULL(f.merge_recorded, 0)
+    FROM pull_requests pr {lock_hint}
+    LEFT JOIN pr_cycle_facts f ON f.pull_request_id = pr.id
+    OUTER APPLY (
+        SELECT MIN(rv.submitted_at) AS submitted_at
+        FROM pr_reviews rv
+        WHERE rv.pull_request_id = pr.id AND rv.reviewer_id <> pr.author_id
+    ) first_review
+"""
+
+class DatabaseCycleTime(DatabaseConnection):
+    """
+    PR cycle-time analytics backed by incrementally maintained daily rollups
+
+    Each PR contributes at most once to each metric: time to first review on
+    the day of its first review, and time to merge plus review rounds on the
+    day it merged. Contributions are stored as log-scale histogram buckets per
+    (day, repository, author), so any window and grouping is a small GROUP BY
+    over the rollup and percentiles come from the merged histograms.
+    """
+
+    def update_cycle_time_rollups(self, pull_request_id):
+        """Add a PR's not-yet-counted contributions to the rollups (call after ingesting it)"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            # UPDLOCK on the PR row serialises concurrent events for the same PR
+            self.cursor.execute(
+                CYCLE_TIME_SOURCE_SQL.format(top='', lock_hint="WITH (UPDLOCK, ROWLOCK)") + " WHERE pr.id = ?",
+                (pull_request_id,)
+            )
+            row = self.cursor.fetchone()
+            if row:
+                self._apply_cycle_time_rows([row])
+            self._commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error in update_cycle_time_rollups: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self._rollback()
+            return False
+
+    def backfill_cycle_time_rollups(self, batch_size=500):
+        """Build rollups for existing history in id order, one transaction per batch"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0
+
+        last_id = 0
+        processed = 0
+        while True:
+            try:
+                self.cursor.execute(
+                    CYCLE_TIME_SOURCE_SQL.format(top=f"TOP ({int(batch_size)})", lock_hint='')
+                    + " WHERE pr.id > ? ORDER BY pr.id",
+                    (last_id,)
+                )
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                self._apply_cycle_time_rows(rows)
+                self.conn.commit()
+            except Exception as e:
+                logger.error(f"Error in backfill_cycle_time_rollups: {str(e)}")
+                self.conn.rollback()
+                break
+
+            last_id = rows[-1][0]
+            processed += len(rows)
+            logger.info(f"Cycle-time backfill processed {processed} pull requests")
+        return processed
+
+    def _apply_cycle_time_rows(self, rows):
+        """Turn source rows into rollup increments and fact flags (caller commits)"""
+        increments = Counter()
+        facts = []
+
+        for row in rows:
+            (pr_id, repository_id, author_id, first_review_at, first_review_seconds,
+             merged_at, merge_seconds, changes_requested, first_review_recorded, merge_recorded) = row
+
+            record_first_review = bool(first_review_at) and not first_review_recorded
+            record_merge = bool(merged_at) and not merge_recorded
+            if not record_first_review and not record_merge:
+                continue
+
+            if record_first_review:
+                day = first_review_at.date()
+                bucket = log_bucket(max(first_review_seconds or 0, 0))
+                increments[(day, repository_id, author_id, METRIC_FIRST_REVIEW, bucket)] += 1
+
+            if record_merge:
+                day = merged_at.date()
+                bucket = log_bucket(max(merge_seconds or 0, 0))
+                increments[(day, repository_id, author_id, METRIC_MERGE, bucket)] += 1
+                # One round for the initial review cycle plus one per request for changes
+                rounds = linear_bucket(1 + (changes_requested or 0))
+                increments[(day, repository_id, author_id, METRIC_REVIEW_ROUNDS, rounds)] += 1
+
+            facts.append((
+                pr_id,
+                1 if (first_review_recorded or record_first_review) else 0,
+                1 if (merge_recorded or record_merge) else 0
+            ))
+
+        if increments:
+            self.cursor.executemany(
+                """MERGE pr_cycle_rollup_daily WITH (HOLDLOCK) AS t
+                   USING (SELECT ? AS day, ? AS repository_id, ? AS author_id, ? AS metric, ? AS bucket, ? AS pr_count) AS s
+                   ON t.metric = s.metric AND t.day = s.day AND t.repository_id = s.repository_id
+                      AND t.author_id = s.author_id AND t.bucket = s.bucket
+                   WHEN MATCHED THEN UPDATE SET pr_count = t.pr_count + s.pr_count
+                   WHEN NOT MATCHED THEN
+                       INSERT (day, repository_id, author_id, metric, bucket, pr_count)
+                       VALUES (s.day, s.repository_id, s.author_id, s.metric, s.bucket, s.pr_count);""",
+                [key + (count,) for key, count in increments.items()]
+            )
+
+        if facts:
+            self.cursor.executemany(
+                """MERGE pr_cycle_facts WITH (HOLDLOCK) AS t
+                   USING (SELECT ? AS pull_request_id, ? AS first_review_recorded, ? AS merge_recorded) AS s
+                   ON t.pull_request_id = s.pull_request_id
+                   WHEN MATCHED THEN UPDATE SET first_review_recorded = s.first_review_recorded,
+                                                merge_recorded = s.merge_recorded
+                   WHEN NOT MATCHED THEN
+                       INSERT (pull_request_id, first_review_recorded, merge_recorded)
+                       VALUES (s.pull_request_id, s.first_review_recorded, s.merge_recorded);""",
+                facts
+            )
+
+    @read_replica
+    def get_cycle_time_metrics(self, window_days=30, group_by='repository'):
+        """
+        Get p50/p90/p99 time to first review, time to merge and review rounds
+
+        group_by is 'repository' or 'author'. Durations are in seconds.
+        """
+        empty = {'window_days': window_days, 'group_by': group_by, 'overall': {}, 'groups': []}
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return empty
+
+        if group_by == 'author':
+            key_column, name_sql = 'r.author_id', "JOIN users g ON g.id = r.author_id"
+            name_column = 'g.username'
+        else:
+            key_column, name_sql = 'r.repository_id', "JOIN repositories g ON g.id = r.repository_id"
+            name_column = 'g.full_name'
+
+        try:
+            self.cursor.execute(
+                f"""SELECT {key_column}, {name_column}, r.metric, r.bucket, SUM(r.pr_count)
+                    FROM pr_cycle_rollup_daily r
+                    {name_sql}
+                    WHERE r.day >= CAST(DATEADD(day, ?, GETDATE()) AS DATE)
+                    GROUP BY {key_column}, {name_column}, r.metric, r.bucket""",
+                (-int(window_days),)
+            )
+            rows = self.cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error in get_cycle_time_metrics: {str(e)}")
+            return empty
+
+        return summarize_cycle_time_rows(rows, window_days, group_by)
+
+def summarize_cycle_time_rows(rows, window_days, group_by):
+    """Compute per-group and overall percentiles from (key, name, metric, bucket, count) rows"""
+    result = {'window_days': window_days, 'group_by': group_by, 'overall': {}, 'groups': []}
+    if not rows:
+        return result
+
+    import numpy as np
+
+    keys = np.array([row[0] for row in rows], dtype=np.int64)
+    metrics = np.array([row[2] for row in rows], dtype=np.int64)
+    buckets = np.array([row[3] for row in rows], dtype=np.int64)
+    counts = np.array([row[4] for row in rows], dtype=np.int64)
+
+    # Integer-code the groups so every metric becomes one (groups x buckets) matrix
+    unique_keys, group_codes = np.unique(keys, return_inverse=True)
+    names = {}
+    for row in rows:
+        names.setdefault(row[0], row[1])
+
+    groups = [{'id': int(key), 'name': names[key]} for key in unique_keys.tolist()]
+    for metric, metric_name in METRIC_NAMES.items():
+        mask = metrics == metric
+        matrix = histogram_matrix(group_codes[mask], buckets[mask], counts[mask], len(unique_keys))
+        bounds = linear_bucket_upper_bounds() if metric == METRIC_REVIEW_ROUNDS else log_bucket_upper_bounds()
+
+        totals, values = percentiles(matrix, QUANTILES, bounds)
+        for index, group in enumerate(groups):
+            group[metric_name] = _metric_summary(totals[index], values[index])
+
+        overall_totals, overall_values = percentiles(matrix.sum(axis=0, keepdims=True), QUANTILES, bounds)
+        result['overall'][metric_name] = _metric_summary(overall_totals[0], overall_values[0])
+
+    result['groups'] = groups
+    return result
+
+def _metric_summary(total, values):
+    summary = {'count': int(total)}
+    for quantile, value in zip(QUANTILES, values):
+        summary[f"p{int(quantile * 100)}"] = None if math.isnan(value) else round(float(value), 1)
+    return summary
+
+if __name__ == '__main__':
+    # python -m prequel_db.db_cycle_time backfill
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        from prequel_config.settings import configure_logging
+        from prequel_db.db_handler import DatabaseHandler
+        configure_logging()
+        db = DatabaseHandler()
+        if getattr(db, 'connection_failed', False):
+            sys.exit("Database connection failed")
+        total = db.backfill_cycle_time_rollups()
+        db.close()
+        print(f"Backfilled cycle-time rollups for {total} pull requests")
+    else:
+        print("Usage: python -m prequel_db.db_cycle_time backfill")
@@ -1,25 +1,39 @@
 import logging
 from prequel_db.db_models import DatabaseModels
 from prequel_db.db_analytics import DatabaseAnalytics
+from prequel_db.db_routing import DatabaseRouting
+from prequel_db.db_cycle_time import DatabaseCycleTime
+from prequel_db.comment_storage import DatabaseCommentStorage
+from prequel_db.db_sync_state import DatabaseSyncState
+from prequel_db.db_outbox import DatabaseOutbox
+from prequel_db.db_pull_requests import DatabasePullRequests
+from prequel_db.db_workflows import DatabaseWorkflows
+from prequel_db.db_changes import DatabaseChanges
+from prequel_db.db_retention import DatabaseRetention, history_source
+from prequel_db.db_replica import read_replica
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
+class DatabaseHandler(DatabaseModels, DatabaseAnalytics, DatabaseRouting, DatabaseCycleTime,
+                      DatabaseCommentStorage, DatabaseSyncState, DatabaseOutbox, DatabasePullRequests,
+                      DatabaseWorkflows, DatabaseChanges, DatabaseRetention):
     """
     Main database handler that combines models and analytics functionality
     
     This class serves as the primary interface for database operations,
-    inheriting both model operations (CRUD for repositories, users, PRs)
-    and analytics functions (stale PR tracking, metrics reporting).
+    inheriting model operations (CRUD for repositories, users, PRs),
+    analytics functions (stale PR tracking, metrics reporting, cycle time),
+    Slack routing rule storage, comment body storage policy, GitHub
+    sync state, the notification outbox, the pull request list and
+    timeline, GitHub Actions workflow runs, change tracking for
+    delta sync, and archiving of closed pull requests.
     """
     
-    def __init__(self):
+    def __init__(self, settings=None):
         """
         Initialize database connection by calling parent class initializer
         """
-        super().__init__()
+        super().__init__(settings)
         logger.info("DatabaseHandler initialized")
     
     def check_connection(self):
@@ -41,16 +55,51 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
         
     # In prequel_db/db_handler.py or a new file like prequel_db/db_api.py
 
-    def get_repositories_with_pr_counts(self):
-        """Get repositories with PR counts for frontend"""
+    @read_replica
+    def get_repositories_with_pr_counts(self, include_archived=False):
+        """Get repositories with PR counts for frontend (include_archived counts archived PRs too)"""
         # Check if we have a valid connection
         if not hasattr(self, 'conn') or not self.conn:
             logger.warning("Database operation skipped due to missing connection")
             return []
             
         try:
-            self.cursor.execute(
-                """SELECT 
+            return self._repository_rows(include_archived=include_archived)
+            
+        except Exception as e:
+            logger.error(f"Error in get_repositories_with_pr_counts: {str(e)}")
+            return []    
+    
+    @read_replica
+    def iter_repositories_with_pr_counts(self, include_archived=False):
+        """
+        get_repositories_with_pr_counts as a generator, fetching the rows in chunks as they are consumed
+        
+        A database error is logged and raised, so a streamed response is cut
+        off rather than ending early in a valid but incomplete list.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return
+            
+        try:
+            yield from self._iter_repository_rows(include_archived=include_archived)
+            
+        except Exception as e:
+            logger.error(f"Error in iter_repositories_with_pr_counts: {str(e)}")
+            raise
+    
+    def _repository_rows(self, where="", params=(), include_archived=False):
+        """Repositories with PR counts, optionally filtered (e.g. "WHERE repo.id IN (...)"); raises on error"""
+        return list(self._iter_repository_rows(where, params, include_archived))
+    
+    def _iter_repository_rows(self, where="", params=(), include_archived=False):
+        # One query, with the review count as a subquery, so the rows can be streamed off the cursor
+        pull_requests = history_source('pull_requests', include_archived)
+        pr_reviews = history_source('pr_reviews', include_archived)
+        self.cursor.execute(
+            f"""SELECT 
                 repo.id,
                 repo.github_id,
                 repo.name,
@@ -58,121 +107,137 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
                 repo.created_at,
                 COUNT(pr.id) as pr_count,
                 SUM(CASE WHEN pr.is_stale = 1 THEN 1 ELSE 0 END) as stale_pr_count,
-                (SELECT COUNT(DISTINCT author_id) FROM pull_requests WHERE repository_id = repo.id) as contributor_count,
-                (SELECT MAX(last_activity_at) FROM pull_requests WHERE repository_id = repo.id) as last_activity
+                (SELECT COUNT(DISTINCT p.author_id) FROM {pull_requests} p WHERE p.repository_id = repo.id) as contributor_count,
+                (SELECT MAX(p.last_activity_at) FROM {pull_requests} p WHERE p.repository_id = repo.id) as last_activity,
+                (SELECT COUNT(rv.id)
+                 FROM {pr_reviews} rv
+                 JOIN {pull_requests} p ON rv.pull_request_id = p.id
+                 WHERE p.repository_id = repo.id) as review_count
             FROM repositories repo
-            LEFT JOIN pull_requests pr ON repo.id = pr.repository_id
+            LEFT JOIN {pull_requests} pr ON repo.id = pr.repository_id
+            {where}
             GROUP BY repo.id, repo.github_id, repo.name, repo.full_name, repo.created_at
-            ORDER BY pr_count DESC"""
-            )
-            
-            repositories = []
-            for row in self.cursor.fetchall():
-                repo_id, github_id, name, full_name, created_at, pr_count, stale_pr_count, contributor_count, last_activity = row
-                
-                # Get review count for this repository
-                self.cursor.execute(
-                    """SELECT COUNT(rv.id)
-                    FROM pr_reviews rv
-                    JOIN pull_requests pr ON rv.pull_request_id = pr.id
-                    WHERE pr.repository_id = ?""",
-                    (repo_id,)
-                )
-                review_count = self.cursor.fetchone()[0] or 0
-                
-                repositories.append({
-                    'id': repo_id,
-                    'github_id': github_id,
-                    'name': name,
-                    'full_name': full_name,
-                    'created_at': created_at.isoformat() if created_at else None,
-                    'pr_count': pr_count or 0,
-                    'review_count': review_count,
-                    'stale_pr_count': stale_pr_count or 0,
-                    'contributor_count': contributor_count or 0,
-                    'last_activity': last_activity.isoformat() if last_activity else None
-                })
+            ORDER BY pr_count DESC""",
+            params
+        )
+        
+        for row in self._fetch_in_chunks():
+            (repo_id, github_id, name, full_name, created_at, pr_count, stale_pr_count, contributor_count,
+             last_activity, review_count) = row
+            yield {
+                'id': repo_id,
+                'github_id': github_id,
+                'name': name,
+                'full_name': full_name,
+                'created_at': created_at.isoformat() if created_at else None,
+                'pr_count': pr_count or 0,
+                'review_count': review_count or 0,
+                'stale_pr_count': stale_pr_count or 0,
+                'contributor_count': contributor_count or 0,
+                'last_activity': last_activity.isoformat() if last_activity else None
+            }
+
+    @read_replica
+    def get_contributors_with_counts(self, include_archived=False):
+        """Get contributors with PR and review counts (include_archived counts archived history too)"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
             
-            return repositories
+        try:
+            return self._contributor_rows(include_archived=include_archived)
             
         except Exception as e:
-            logger.error(f"Error in get_repositories_with_pr_counts: {str(e)}")
-            return []    
-
-    def get_contributors_with_counts(self):
-        """Get contributors with PR and review counts"""
+            logger.error(f"Error in get_contributors_with_counts: {str(e)}")
+            return []   
+    
+    @read_replica
+    def iter_contributors_with_counts(self, include_archived=False):
+        """
+        get_contributors_with_counts as a generator, fetching the rows in chunks as they are consumed
+        
+        A database error is logged and raised, so a streamed response is cut
+        off rather than ending early in a valid but incomplete list.
+        """
         # Check if we have a valid connection
         if not hasattr(self, 'conn') or not self.conn:
             logger.warning("Database operation skipped due to missing connection")
-            return []
+            return
             
         try:
-            self.cursor.execute(
-                """SELECT 
+            yield from self._iter_contributor_rows(include_archived=include_archived)
+            
+        except Exception as e:
+            logger.error(f"Error in iter_contributors_with_counts: {str(e)}")
+            raise
+    
+    def _contributor_rows(self, where="", params=(), include_archived=False):
+        """Contributors with counts, optionally filtered (e.g. "WHERE u.id IN (...)"); raises on error"""
+        return list(self._iter_contributor_rows(where, params, include_archived))
+    
+    def _iter_contributor_rows(self, where="", params=(), include_archived=False):
+        # One query, with the repository names aggregated in a subquery, so the rows can be
+        # streamed off the cursor (GitHub repository names cannot contain a comma)
+        pull_requests = history_source('pull_requests', include_archived)
+        pr_reviews = history_source('pr_reviews', include_archived)
+        review_comments = history_source('review_comments', include_archived)
+        self.cursor.execute(
+            f"""SELECT 
                 u.id,
                 u.github_id,
                 u.username,
                 u.avatar_url,
                 u.created_at,
                 COUNT(DISTINCT pr.id) as pr_count,
-                (SELECT COUNT(DISTINCT rv.id) FROM pr_reviews rv WHERE rv.reviewer_id = u.id) as review_count,
-                (SELECT COUNT(DISTINCT rc.id) FROM review_comments rc WHERE rc.author_id = u.id AND rc.contains_command = 1) as command_count
+                (SELECT COUNT(DISTINCT rv.id) FROM {pr_reviews} rv WHERE rv.reviewer_id = u.id) as review_count,
+                (SELECT COUNT(DISTINCT rc.id) FROM {review_comments} rc WHERE rc.author_id = u.id AND rc.contains_command = 1) as command_count,
+                (SELECT STRING_AGG(names.name, ',')
+                 FROM (SELECT DISTINCT repo.name
+                       FROM repositories repo
+                       JOIN {pull_requests} p ON repo.id = p.repository_id
+                       WHERE p.author_id = u.id) names) as repositories
             FROM users u
-            LEFT JOIN pull_requests pr ON u.id = pr.author_id
+            LEFT JOIN {pull_requests} pr ON u.id = pr.author_id
+            {where}
             GROUP BY u.id, u.github_id, u.username, u.avatar_url, u.created_at
-            ORDER BY pr_count DESC"""
-            )
-            
-            contributors = []
-            for row in self.cursor.fetchall():
-                user_id, github_id, username, avatar_url, created_at, pr_count, review_count, command_count = row
-                
-                # Get repositories this user contributed to
-                self.cursor.execute(
-                    """SELECT DISTINCT repo.name
-                    FROM repositories repo
-                    JOIN pull_requests pr ON repo.id = pr.repository_id
-                    WHERE pr.author_id = ?""",
-                    (user_id,)
-                )
-                repositories = [repo[0] for repo in self.cursor.fetchall()]
-                
-                contributors.append({
-                    'id': user_id,
-                    'github_id': github_id,
-                    'username': username,
-                    'avatar_url': avatar_url,
-                    'created_at': created_at.isoformat() if created_at else None,
-                    'pr_count': pr_count or 0,
-                    'review_count': review_count or 0,
-                    'command_count': command_count or 0,
-                    'repositories': repositories
-                })
-            
-            return contributors
-            
-        except Exception as e:
-            logger.error(f"Error in get_contributors_with_counts: {str(e)}")
-            return []   
+            ORDER BY pr_count DESC""",
+            params
+        )
+        
+        for row in self._fetch_in_chunks():
+            user_id, github_id, username, avatar_url, created_at, pr_count, review_count, command_count, repositories = row
+            yield {
+                'id': user_id,
+                'github_id': github_id,
+                'username': username,
+                'avatar_url': avatar_url,
+                'created_at': created_at.isoformat() if created_at else None,
+                'pr_count': pr_count or 0,
+                'review_count': review_count or 0,
+                'command_count': command_count or 0,
+                'repositories': repositories.split(',') if repositories else []
+            }
         
-    def get_pr_metrics(self):
-        """Get metrics for the frontend dashboard"""
+    @read_replica
+    def get_pr_metrics(self, include_archived=False):
+        """Get metrics for the frontend dashboard (include_archived counts archived history too)"""
         # Check if we have a valid connection
         if not hasattr(self, 'conn') or not self.conn:
             logger.warning("Database operation skipped due to missing connection")
             return {
                 'pr_authors': [],
                 'active_reviewers': [],
-                'command_users': [],
+                'comment_users': [],
                 'stale_pr_count': 0
             }
             
         try:
             # Get PR authors count
             self.cursor.execute(
-                """SELECT u.username, COUNT(pr.id) as pr_count
+                f"""SELECT u.username, COUNT(pr.id) as pr_count
                    FROM users u
-                   JOIN pull_requests pr ON u.id = pr.author_id
+                   JOIN {history_source('pull_requests', include_archived)} pr ON u.id = pr.author_id
                    GROUP BY u.username
                    ORDER BY pr_count DESC"""
             )
@@ -181,9 +246,9 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
             
             # Get active reviewers
             self.cursor.execute(
-                """SELECT u.username, COUNT(rv.id) as review_count
+                f"""SELECT u.username, COUNT(rv.id) as review_count
                    FROM users u
-                   JOIN pr_reviews rv ON u.id = rv.reviewer_id
+                   JOIN {history_source('pr_reviews', include_archived)} rv ON u.id = rv.reviewer_id
                    GROUP BY u.username
                    ORDER BY review_count DESC"""
             )
@@ -191,9 +256,9 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
             active_reviewers = [[row[0], row[1]] for row in active_reviewers_rows]
             
             self.cursor.execute(
-                """SELECT u.username, COUNT(rc.id) as comment_count
+                f"""SELECT u.username, COUNT(rc.id) as comment_count
                    FROM users u
-                   JOIN review_comments rc ON u.id = rc.author_id
+                   JOIN {history_source('review_comments', include_archived)} rc ON u.id = rc.author_id
                    GROUP BY u.username
                    ORDER BY comment_count DESC"""
             )       
@@ -210,7 +275,7 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
             return {
                 'pr_authors': pr_authors,
                 'active_reviewers': active_reviewers,
-                'command_users': command_users,
+                'comment_users': comment_users,
                 'stale_pr_count': stale_pr_count
             }
         except Exception as e:
@@ -218,7 +283,7 @@ class DatabaseHandler(DatabaseModels, DatabaseAnalytics):
             return {
                 'pr_authors': [],
                 'active_reviewers': [],
-                'command_users': [],
+                'comment_users': [],
                 'stale_pr_count': 0
             }     
             
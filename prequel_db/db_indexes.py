@@ -0,0 +1,129 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Managed nonclustered indexes: (name, table, key columns, included columns, filter).
+# Each one is matched to the query shapes in prequel_db that it serves; github_id
+# lookups are already covered by the UNIQUE constraints on every entity table.
+MANAGED_INDEXES = [
+    # get_stale_prs / stale PR count: is_stale = 1 AND state = 'open' ORDER BY last_activity_at
+    ('IX_pull_requests_stale_state_activity', 'pull_requests',
+     'is_stale, state, last_activity_at',
+     'repository_id, author_id, title, number, html_url, created_at', None),
+    # check_for_stale_prs: open, unmerged, unclosed PRs with last_activity_at < ?
+    ('IX_pull_requests_open_activity', 'pull_requests',
+     'last_activity_at', 'is_stale',
+     "state = 'open' AND closed_at IS NULL AND merged_at IS NULL"),
+    # Per-repository counts, contributor counts and last activity; the PR list
+    # filtered by repository, in last-activity order
+    ('IX_pull_requests_repository_activity', 'pull_requests',
+     'repository_id, last_activity_at', 'author_id, is_stale, state', None),
+    # Per-author PR counts and the repositories a contributor worked in; the
+    # PR list filtered by author, in last-activity order
+    ('IX_pull_requests_author_activity', 'pull_requests',
+     'author_id, last_activity_at', 'repository_id, is_stale, state', None),
+    # PR list filtered by state, in last-activity order
+    ('IX_pull_requests_state_activity', 'pull_requests',
+     'state, last_activity_at', 'repository_id, author_id, is_stale', None),
+    # PR list filters by repository full name and author username
+    ('IX_repositories_full_name', 'repositories',
+     'full_name', None, None),
+    ('IX_users_username', 'users',
+     'username', None, None),
+    # Review counts per reviewer
+    ('IX_pr_reviews_reviewer', 'pr_reviews',
+     'reviewer_id', None, None),
+    # Reviews of a PR: per-repository review counts and cycle-time first review
+    ('IX_pr_reviews_pull_request', 'pr_reviews',
+     'pull_request_id, submitted_at', 'reviewer_id, state', None),
+    # Comment and command counts per author
+    ('IX_review_comments_author_command', 'review_comments',
+     'author_id, contains_command', None, None),
+    # Comments of a PR in time order (PR timeline)
+    ('IX_review_comments_pull_request_created', 'review_comments',
+     'pull_request_id, created_at', 'author_id, review_id, contains_command, command_type', None),
+    # The open stale period of a PR, looked up on every stale check and reminder
+    ('IX_stale_pr_history_active', 'stale_pr_history',
+     'pull_request_id', 'notification_sent, notification_count, last_notified_at',
+     'marked_active_at IS NULL'),
+    # Outbox worker: due notifications in next_attempt_at order
+    ('IX_notification_outbox_due', 'notification_outbox',
+     'next_attempt_at, id', 'locked_until', 'status = 0'),
+    # Recent workflow runs: the latest run of each workflow, most recently updated first
+    ('IX_workflow_latest_runs_updated', 'workflow_latest_runs',
+     'updated_at', 'run_id, completed, conclusion, duration_seconds', None),
+    # Delta sync: rows changed within a row_version range, with the keys of the
+    # aggregates (repository, contributor) they feed
+    ('IX_repositories_row_version', 'repositories',
+     'row_version', None, None),
+    ('IX_users_row_version', 'users',
+     'row_version', None, None),
+    ('IX_pull_requests_row_version', 'pull_requests',
+     'row_version', 'repository_id, author_id', None),
+    ('IX_pr_reviews_row_version', 'pr_reviews',
+     'row_version', 'pull_request_id, reviewer_id', None),
+    ('IX_review_comments_row_version', 'review_comments',
+     'row_version', 'author_id', None),
+    ('IX_change_tombstones_row_version', 'change_tombstones',
+     'row_version', 'table_name, row_id, repository_id, user_id', None),
+    # Reset and purge markers checked before every delta
+    ('IX_change_tombstones_markers', 'change_tombstones',
+     'row_version', 'purged_through', "table_name = '*'"),
+    # Retention: closed PRs in closed_at order, the oldest archived first
+    ('IX_pull_requests_closed_at', 'pull_requests',
+     'closed_at', 'state', 'closed_at IS NOT NULL'),
+    # Archived history, read only with include_archived: the same per-repository,
+    # per-author and per-PR shapes as the live tables
+    ('IX_pull_requests_archive_repository', 'pull_requests_archive',
+     'repository_id', 'author_id, is_stale, last_activity_at', None),
+    ('IX_pull_requests_archive_author', 'pull_requests_archive',
+     'author_id', 'repository_id', None),
+    ('IX_pr_reviews_archive_pull_request', 'pr_reviews_archive',
+     'pull_request_id', 'reviewer_id, github_id', None),
+    ('IX_pr_reviews_archive_reviewer', 'pr_reviews_archive',
+     'reviewer_id', None, None),
+    ('IX_review_comments_archive_pull_request', 'review_comments_archive',
+     'pull_request_id, created_at', None, None),
+    ('IX_review_comments_archive_author_command', 'review_comments_archive',
+     'author_id, contains_command', None, None),
+]
+
+# Earlier single-column indexes that the managed set makes redundant
+RETIRED_INDEXES = [
+    ('IX_pull_requests_is_stale', 'pull_requests'),
+    ('IX_review_comments_contains_command', 'review_comments'),
+    ('IX_pull_requests_repository', 'pull_requests'),
+    ('IX_pull_requests_author', 'pull_requests'),
+    ('IX_review_comments_pull_request', 'review_comments'),
+]
+
+def index_ddl(name, table, columns, include=None, where=None):
+    """CREATE INDEX statement for one managed index"""
+    ddl = f"CREATE NONCLUSTERED INDEX {name} ON {table} ({columns})"
+    if include:
+        ddl += f" INCLUDE ({include})"
+    if where:
+        ddl += f" WHERE {where}"
+    return ddl
+
+def apply_managed_indexes(cursor):
+    """
+    Create missing managed indexes and drop retired ones (caller commits)
+
+    Indexes are matched by name only; to change a definition, give it a new
+    name and retire the old one.
+    """
+    for name, table in RETIRED_INDEXES:
+        cursor.execute(
+            f"""IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = ? AND object_id = OBJECT_ID(?))
+                DROP INDEX {name} ON {table}""",
+            (name, table)
+        )
+
+    for name, table, columns, include, where in MANAGED_INDEXES:
+        cursor.execute(
+            f"""IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = ? AND object_id = OBJECT_ID(?))
+                {index_ddl(name, table, columns, include, where)}""",
+            (name, table)
+        )
+    logger.info(f"Managed indexes verified ({len(MANAGED_INDEXES)} indexes)")
@@ -1,9 +1,10 @@
 import logging
 from datetime import datetime
 from prequel_db.db_connection import DatabaseConnection
+from prequel_db.comment_storage import get_comment_body_codec
+from prequel_db.analytics_snapshot import analytics_snapshot
+from prequel_db.live_events import live_events
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class DatabaseModels(DatabaseConnection):
@@ -36,12 +37,15 @@ class DatabaseModels(DatabaseConnection):
             )
             result = self.cursor.fetchone()
             
+            name = str(repo_data.get('name', 'unknown'))
+            full_name = str(repo_data.get('full_name', 'unknown/unknown'))
+            
             if result:
+                self._after_commit(analytics_snapshot.observe, '_upsert_repository',
+                                   result[0], github_id, name, full_name, None)
                 return result[0]
             
             # Repository doesn't exist, create it
-            name = str(repo_data.get('name', 'unknown'))
-            full_name = str(repo_data.get('full_name', 'unknown/unknown'))
             
             # Log the data for debugging
             logger.debug(f"Creating repository: github_id={github_id}, name={name}, full_name={full_name}")
@@ -50,15 +54,17 @@ class DatabaseModels(DatabaseConnection):
             self.cursor.execute(
                 """
                 INSERT INTO repositories (github_id, name, full_name) 
-                OUTPUT INSERTED.id
+                OUTPUT INSERTED.id, INSERTED.created_at
                 VALUES (?, ?, ?)
                 """, 
                 (github_id, name, full_name)
             )
             
             # Get the ID directly from the OUTPUT clause
-            new_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            new_id, created_at = self.cursor.fetchone()
+            self._commit()
+            self._after_commit(analytics_snapshot.observe, '_upsert_repository',
+                               new_id, github_id, name, full_name, created_at)
             
             return new_id
             
@@ -66,7 +72,7 @@ class DatabaseModels(DatabaseConnection):
             logger.error(f"Error in get_or_create_repository: {str(e)}")
             logger.error(f"Repository data that caused error: {repo_data}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
+                self._rollback()
             return None
     
     def get_or_create_user(self, user_data):
@@ -94,12 +100,16 @@ class DatabaseModels(DatabaseConnection):
             )
             result = self.cursor.fetchone()
             
+            username = str(user_data.get('login', 'unknown'))
+            avatar_url = str(user_data.get('avatar_url', ''))  # Use empty string as default
+            
             if result:
+                self._after_commit(analytics_snapshot.observe, '_upsert_user',
+                                   result[0], github_id, username, avatar_url, None)
+                self._after_commit(live_events.remember_user, result[0], username)
                 return result[0]
             
             # User doesn't exist, create it
-            username = str(user_data.get('login', 'unknown'))
-            avatar_url = str(user_data.get('avatar_url', ''))  # Use empty string as default
             
             # Log the data for debugging
             logger.debug(f"Creating user: github_id={github_id}, username={username}")
@@ -108,15 +118,18 @@ class DatabaseModels(DatabaseConnection):
             self.cursor.execute(
                 """
                 INSERT INTO users (github_id, username, avatar_url) 
-                OUTPUT INSERTED.id
+                OUTPUT INSERTED.id, INSERTED.created_at
                 VALUES (?, ?, ?)
                 """, 
                 (github_id, username, avatar_url)
             )
             
             # Get the ID directly from the OUTPUT clause
-            new_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            new_id, created_at = self.cursor.fetchone()
+            self._commit()
+            self._after_commit(analytics_snapshot.observe, '_upsert_user',
+                               new_id, github_id, username, avatar_url, created_at)
+            self._after_commit(live_events.remember_user, new_id, username)
             
             return new_id
             
@@ -124,7 +137,7 @@ class DatabaseModels(DatabaseConnection):
             logger.error(f"Error in get_or_create_user: {str(e)}")
             logger.error(f"User data that caused error: {user_data}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
+                self._rollback()
             return None
     
     def get_or_create_pull_request(self, pr_data, repository_id, author_id):
@@ -149,9 +162,9 @@ class DatabaseModels(DatabaseConnection):
                 logger.error("PR github_id is missing")
                 return None
                 
-            # Check if PR exists
+            # Check if PR exists (state and is_stale tell live clients what changed)
             self.cursor.execute(
-                "SELECT id FROM pull_requests WHERE github_id = ?", 
+                "SELECT id, state, is_stale FROM pull_requests WHERE github_id = ?", 
                 (github_id,)
             )
             result = self.cursor.fetchone()
@@ -170,7 +183,7 @@ class DatabaseModels(DatabaseConnection):
             
             if result:
                 # PR exists, update it
-                pr_id = result[0]
+                pr_id, previous_state, was_stale = result
                 self.cursor.execute(
                     """UPDATE pull_requests 
                        SET title = ?, 
@@ -182,7 +195,21 @@ class DatabaseModels(DatabaseConnection):
                        WHERE id = ?""", 
                     (title, state, updated_at, closed_at, merged_at, updated_at, pr_id)
                 )
-                self.conn.commit()
+                self._commit()
+                self._after_commit(analytics_snapshot.observe, '_upsert_pull_request', pr_id, repository_id,
+                                   author_id, number, title, html_url, state, created_at, updated_at)
+                
+                # A stale PR only counts towards stale_pr_count while it is open
+                op, stale_delta = 'updated', 0
+                if state != previous_state:
+                    if state == 'open':
+                        op, stale_delta = 'reopened', 1 if was_stale else 0
+                    else:
+                        op = 'merged' if merged_at else 'closed'
+                        stale_delta = -1 if was_stale and previous_state == 'open' else 0
+                self._after_commit(live_events.publish_pull_request, op, pr_id, repository_id, author_id,
+                                   number, title, html_url, state, created_at, updated_at, closed_at,
+                                   merged_at, stale_delta)
                 return pr_id
             
             # PR doesn't exist, create it
@@ -200,7 +227,11 @@ class DatabaseModels(DatabaseConnection):
             
             # Get the ID directly from the OUTPUT clause
             new_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._commit()
+            self._after_commit(analytics_snapshot.observe, '_upsert_pull_request', new_id, repository_id,
+                               author_id, number, title, html_url, state, created_at, updated_at, 0)
+            self._after_commit(live_events.publish_pull_request, 'opened', new_id, repository_id, author_id,
+                               number, title, html_url, state, created_at, updated_at, closed_at, merged_at)
             
             return new_id
             
@@ -208,9 +239,20 @@ class DatabaseModels(DatabaseConnection):
             logger.error(f"Error in get_or_create_pull_request: {str(e)}")
             logger.error(f"PR data that caused error: {pr_data}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
+                self._rollback()
             return None
     
+    def _touch_pull_request(self, pull_request_id, activity_at):
+        """Record activity on a PR and clear is_stale; returns True if it was a stale open PR"""
+        self.cursor.execute(
+            """UPDATE pull_requests SET last_activity_at = ?, is_stale = 0
+               OUTPUT DELETED.is_stale, DELETED.state
+               WHERE id = ?""", 
+            (activity_at, pull_request_id)
+        )
+        previous = self.cursor.fetchone()
+        return bool(previous and previous[0] and previous[1] == 'open')
+    
     def add_pr_review(self, review_data, pull_request_id, reviewer_id):
         """Add a new PR review"""
         # Check if we have a valid connection
@@ -247,14 +289,15 @@ class DatabaseModels(DatabaseConnection):
                     "UPDATE pr_reviews SET state = ? WHERE id = ?", 
                     (state, review_id)
                 )
-                self.conn.commit()
+                self._commit()
                 
                 # Update last activity on PR
-                self.cursor.execute(
-                    "UPDATE pull_requests SET last_activity_at = ?, is_stale = 0 WHERE id = ?", 
-                    (submitted_at, pull_request_id)
-                )
-                self.conn.commit()
+                was_stale = self._touch_pull_request(pull_request_id, submitted_at)
+                self._commit()
+                self._after_commit(analytics_snapshot.observe, '_upsert_review',
+                                   review_id, pull_request_id, reviewer_id, submitted_at)
+                self._after_commit(live_events.publish_activity, 'review', review_id, pull_request_id,
+                                   reviewer_id, submitted_at, False, was_stale)
                 return review_id
             
             # Review doesn't exist, create it
@@ -271,14 +314,15 @@ class DatabaseModels(DatabaseConnection):
             
             # Get the ID directly from the OUTPUT clause
             review_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._commit()
             
             # Update last activity on PR
-            self.cursor.execute(
-                "UPDATE pull_requests SET last_activity_at = ?, is_stale = 0 WHERE id = ?", 
-                (submitted_at, pull_request_id)
-            )
-            self.conn.commit()
+            was_stale = self._touch_pull_request(pull_request_id, submitted_at)
+            self._commit()
+            self._after_commit(analytics_snapshot.observe, '_upsert_review',
+                               review_id, pull_request_id, reviewer_id, submitted_at)
+            self._after_commit(live_events.publish_activity, 'review', review_id, pull_request_id,
+                               reviewer_id, submitted_at, True, was_stale, {'state': state})
             
             return review_id
             
@@ -286,7 +330,7 @@ class DatabaseModels(DatabaseConnection):
             logger.error(f"Error in add_pr_review: {str(e)}")
             logger.error(f"Review data that caused error: {review_data}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
+                self._rollback()
             return None    
     
     def add_review_comment(self, comment_data, pull_request_id, author_id, review_id=None):
@@ -324,6 +368,9 @@ class DatabaseModels(DatabaseConnection):
                     command_type = cmd
                     break
             
+            # Commands are detected on the full text; what is kept depends on COMMENT_BODY_STORAGE
+            stored_body, body_compressed, body_sha256, body_storage = get_comment_body_codec().encode(body)
+            
             # Check if comment exists
             self.cursor.execute(
                 "SELECT id FROM review_comments WHERE github_id = ?", 
@@ -336,18 +383,21 @@ class DatabaseModels(DatabaseConnection):
                 comment_id = result[0]
                 self.cursor.execute(
                     """UPDATE review_comments 
-                       SET body = ?, updated_at = ?, contains_command = ?, command_type = ? 
+                       SET body = ?, body_compressed = ?, body_sha256 = ?, body_storage = ?,
+                           updated_at = ?, contains_command = ?, command_type = ? 
                        WHERE id = ?""", 
-                    (body, updated_at, contains_command, command_type, comment_id)
+                    (stored_body, body_compressed, body_sha256, body_storage,
+                     updated_at, contains_command, command_type, comment_id)
                 )
-                self.conn.commit()
+                self._commit()
                 
                 # Update last activity on PR
-                self.cursor.execute(
-                    "UPDATE pull_requests SET last_activity_at = ?, is_stale = 0 WHERE id = ?", 
-                    (updated_at, pull_request_id)
-                )
-                self.conn.commit()
+                was_stale = self._touch_pull_request(pull_request_id, updated_at)
+                self._commit()
+                self._after_commit(analytics_snapshot.observe, '_upsert_comment',
+                                   comment_id, pull_request_id, author_id, contains_command, updated_at)
+                self._after_commit(live_events.publish_activity, 'comment', comment_id, pull_request_id,
+                                   author_id, updated_at, False, was_stale)
                 return comment_id
             
             # Comment doesn't exist, create it
@@ -356,22 +406,27 @@ class DatabaseModels(DatabaseConnection):
             # SQL Server approach to get the last inserted ID
             self.cursor.execute(
                 """INSERT INTO review_comments 
-                   (github_id, review_id, pull_request_id, author_id, body, created_at, updated_at, contains_command, command_type) 
+                   (github_id, review_id, pull_request_id, author_id, body, body_compressed, body_sha256, body_storage,
+                    created_at, updated_at, contains_command, command_type) 
                    OUTPUT INSERTED.id
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
-                (github_id, review_id, pull_request_id, author_id, body, created_at, updated_at, contains_command, command_type)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
+                (github_id, review_id, pull_request_id, author_id, stored_body, body_compressed, body_sha256, body_storage,
+                 created_at, updated_at, contains_command, command_type)
             )
             
             # Get the ID directly from the OUTPUT clause
             comment_id = self.cursor.fetchone()[0]
-            self.conn.commit()
+            self._commit()
             
             # Update last activity on PR
-            self.cursor.execute(
-                "UPDATE pull_requests SET last_activity_at = ?, is_stale = 0 WHERE id = ?", 
-                (updated_at, pull_request_id)
-            )
-            self.conn.commit()
+            was_stale = self._touch_pull_request(pull_request_id, updated_at)
+            self._commit()
+            self._after_commit(analytics_snapshot.observe, '_upsert_comment',
+                               comment_id, pull_request_id, author_id, contains_command, updated_at)
+            self._after_commit(live_events.publish_activity, 'comment', comment_id, pull_request_id,
+                               author_id, updated_at, True, was_stale,
+                               {'review_id': review_id, 'contains_command': bool(contains_command),
+                                'command_type': command_type})
             
             return comment_id
             
@@ -379,5 +434,5 @@ class DatabaseModels(DatabaseConnection):
             logger.error(f"Error in add_review_comment: {str(e)}")
             logger.error(f"Comment data that caused error: {comment_data}")
             if hasattr(self, 'conn') and self.conn:
-                self.conn.rollback()
+                self._rollback()
             return None
\ No newline at end of file
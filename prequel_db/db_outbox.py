@@ -0,0 +1,226 @@
+import json
+import logging
+import uuid
+from prequel_db.db_connection import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+# notification_outbox.status
+OUTBOX_PENDING = 0
+OUTBOX_DELIVERED = 1
+OUTBOX_DEAD = 2
+
+OUTBOX_STATUS_NAMES = {
+    OUTBOX_PENDING: 'pending',
+    OUTBOX_DELIVERED: 'delivered',
+    OUTBOX_DEAD: 'dead'
+}
+
+class DatabaseOutbox(DatabaseConnection):
+    """
+    Handles the notification outbox
+
+    Notifications are inserted by the same transaction that stores the event
+    they announce, and delivered later by prequel_app.outbox_worker. Workers
+    claim due rows with a lease and a claim token (READPAST, so concurrent
+    workers skip each other's rows); only the holder of the current token can
+    settle a row, so a row is marked delivered at most once.
+    """
+
+    def enqueue_notification(self, repository, event_type, title, text, fields=None, actions=None):
+        """Queue a Slack notification (commits with the caller's transaction)"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            payload = json.dumps({'title': title, 'text': text, 'fields': fields, 'actions': actions})
+            self.cursor.execute(
+                """INSERT INTO notification_outbox (repository, event_type, payload)
+                   OUTPUT INSERTED.id
+                   VALUES (?, ?, ?)""",
+                (repository, event_type, payload)
+            )
+            outbox_id = self.cursor.fetchone()[0]
+            self._commit()
+            return outbox_id
+
+        except Exception as e:
+            logger.error(f"Error in enqueue_notification: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self._rollback()
+            return None
+
+    def claim_outbox_notifications(self, limit, lease_seconds):
+        """
+        Claim up to limit due notifications for lease_seconds
+
+        Returns (claim_token, rows) where each row is a dict with id,
+        repository, event_type, payload (dict), attempts (including this one)
+        and delivered_targets (webhook URLs an earlier attempt already reached).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None, []
+
+        claim_token = str(uuid.uuid4())
+        try:
+            self.cursor.execute(
+                """WITH due AS (
+                       SELECT TOP (?) *
+                       FROM notification_outbox WITH (ROWLOCK, READPAST, UPDLOCK)
+                       WHERE status = 0
+                       AND next_attempt_at <= SYSUTCDATETIME()
+                       AND (locked_until IS NULL OR locked_until < SYSUTCDATETIME())
+                       ORDER BY next_attempt_at, id
+                   )
+                   UPDATE due
+                   SET claim_token = ?,
+                       locked_until = DATEADD(second, ?, SYSUTCDATETIME()),
+                       attempts = attempts + 1
+                   OUTPUT INSERTED.id, INSERTED.repository, INSERTED.event_type, INSERTED.payload,
+                          INSERTED.attempts, INSERTED.delivered_targets""",
+                (int(limit), claim_token, int(lease_seconds))
+            )
+            rows = self.cursor.fetchall()
+            self.conn.commit()
+
+        except Exception as e:
+            logger.error(f"Error in claim_outbox_notifications: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return None, []
+
+        claimed = []
+        for outbox_id, repository, event_type, payload, attempts, delivered_targets in rows:
+            claimed.append({
+                'id': outbox_id,
+                'repository': repository,
+                'event_type': event_type,
+                'payload': json.loads(payload),
+                'attempts': attempts,
+                'delivered_targets': json.loads(delivered_targets) if delivered_targets else []
+            })
+        return claim_token, claimed
+
+    def settle_outbox_notification(self, outbox_id, claim_token, status, delivered_targets=(),
+                                   retry_in_seconds=None, error=None):
+        """
+        Record the outcome of a delivery attempt
+
+        status is OUTBOX_DELIVERED, OUTBOX_DEAD, or OUTBOX_PENDING with
+        retry_in_seconds. Returns False if the claim was lost (lease expired
+        and another worker took the row).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            self.cursor.execute(
+                """UPDATE notification_outbox
+                   SET status = ?,
+                       delivered_targets = ?,
+                       last_error = ?,
+                       next_attempt_at = DATEADD(second, ?, SYSUTCDATETIME()),
+                       delivered_at = CASE WHEN ? = 1 THEN SYSUTCDATETIME() ELSE delivered_at END,
+                       locked_until = NULL,
+                       claim_token = NULL
+                   WHERE id = ? AND claim_token = ?""",
+                (status, json.dumps(list(delivered_targets)) if delivered_targets else None,
+                 error[:1000] if error else None, int(retry_in_seconds or 0), status,
+                 outbox_id, claim_token)
+            )
+            settled = self.cursor.rowcount == 1
+            self.conn.commit()
+            if not settled:
+                logger.warning(f"Outbox notification {outbox_id} was claimed by another worker")
+            return settled
+
+        except Exception as e:
+            logger.error(f"Error in settle_outbox_notification: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return False
+
+    def requeue_dead_notifications(self, outbox_ids=None):
+        """Give dead-lettered notifications (all, or the given ids) a fresh set of attempts"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0
+
+        try:
+            sql = """UPDATE notification_outbox
+                     SET status = 0, attempts = 0, next_attempt_at = SYSUTCDATETIME(), last_error = NULL
+                     WHERE status = 2"""
+            params = ()
+            if outbox_ids:
+                sql += f" AND id IN ({', '.join('?' for _ in outbox_ids)})"
+                params = tuple(outbox_ids)
+            self.cursor.execute(sql, params)
+            count = self.cursor.rowcount
+            self.conn.commit()
+            return count
+
+        except Exception as e:
+            logger.error(f"Error in requeue_dead_notifications: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return 0
+
+    def purge_delivered_notifications(self, older_than_days, batch_size=1000):
+        """Delete delivered notifications older than the given age, in small batches"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0
+
+        deleted = 0
+        try:
+            while True:
+                self.cursor.execute(
+                    """DELETE TOP (?) FROM notification_outbox
+                       WHERE status = 1 AND delivered_at < DATEADD(day, ?, SYSUTCDATETIME())""",
+                    (int(batch_size), -int(older_than_days))
+                )
+                count = self.cursor.rowcount
+                self.conn.commit()
+                deleted += max(count, 0)
+                if count < batch_size:
+                    return deleted
+
+        except Exception as e:
+            logger.error(f"Error in purge_delivered_notifications: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return deleted
+
+    def get_outbox_stats(self):
+        """Row counts per status, plus the age in seconds of the oldest pending notification"""
+        stats = {name: 0 for name in OUTBOX_STATUS_NAMES.values()}
+        stats['oldest_pending_seconds'] = None
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return stats
+
+        try:
+            self.cursor.execute(
+                """SELECT status, COUNT(*),
+                          DATEDIFF(second, MIN(created_at), SYSUTCDATETIME())
+                   FROM notification_outbox
+                   GROUP BY status"""
+            )
+            for status, count, oldest_seconds in self.cursor.fetchall():
+                stats[OUTBOX_STATUS_NAMES.get(status, str(status))] = count
+                if status == OUTBOX_PENDING:
+                    stats['oldest_pending_seconds'] = oldest_seconds
+            return stats
+
+        except Exception as e:
+            logger.error(f"Error in get_outbox_stats: {str(e)}")
+            return stats
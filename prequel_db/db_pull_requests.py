@@ -0,0 +1,305 @@
+import base64
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from prequel_db.db_connection import DatabaseConnection
+from prequel_db.db_replica import read_replica
+from prequel_db.comment_storage import get_comment_body_codec
+from prequel_db.db_retention import history_source
+
+logger = logging.getLogger(__name__)
+
+# Sort keys accepted by list_pull_requests and the column each one orders by
+SORT_COLUMNS = {
+    'last_activity': 'last_activity_at',
+    'created': 'created_at',
+    'updated': 'updated_at'
+}
+PR_STATES = ('open', 'closed', 'merged')
+MAX_PAGE_SIZE = 200
+MAX_TIMELINE_EVENTS = 2000
+
+PULL_REQUEST_COLUMNS = """pr.id, pr.github_id, pr.repository_id, pr.author_id, pr.title, pr.number, pr.state,
+       pr.html_url, pr.created_at, pr.updated_at, pr.closed_at, pr.merged_at, pr.is_stale,
+       pr.last_activity_at, repo.full_name, u.username"""
+
+# One statement per PR: lifecycle events from the PR row plus its reviews and
+# comments, each branch a seek on pull_request_id (IX_pr_reviews_pull_request,
+# IX_review_comments_pull_request_created). NULLs are typed so every branch
+# unions to the same column types. The tables are filled in by timeline_sql.
+TIMELINE_SQL = """
+SELECT TOP (?) e.event_type, e.event_id, e.occurred_at, u.username, e.state, e.review_id,
+       e.contains_command, e.command_type, e.body, e.body_compressed, e.body_sha256, e.body_storage
+FROM (
+    SELECT 'opened' AS event_type, pr.id AS event_id, pr.created_at AS occurred_at, pr.author_id AS actor_id,
+           CAST(NULL AS NVARCHAR(50)) AS state, CAST(NULL AS INT) AS review_id,
+           CAST(NULL AS BIT) AS contains_command, CAST(NULL AS NVARCHAR(50)) AS command_type,
+           CAST(NULL AS NVARCHAR(MAX)) AS body, CAST(NULL AS VARBINARY(MAX)) AS body_compressed,
+           CAST(NULL AS BINARY(32)) AS body_sha256, CAST(NULL AS VARCHAR(10)) AS body_storage
+    FROM {pull_requests} pr
+    WHERE pr.id = ?
+    UNION ALL
+    SELECT CASE WHEN pr.merged_at IS NOT NULL THEN 'merged' ELSE 'closed' END, pr.id,
+           ISNULL(pr.merged_at, pr.closed_at), CAST(NULL AS INT),
+           NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+    FROM {pull_requests} pr
+    WHERE pr.id = ? AND (pr.merged_at IS NOT NULL OR pr.closed_at IS NOT NULL)
+    UNION ALL
+    SELECT 'review', rv.id, rv.submitted_at, rv.reviewer_id, rv.state,
+           NULL, NULL, NULL, NULL, NULL, NULL, NULL
+    FROM {pr_reviews} rv
+    WHERE rv.pull_request_id = ?
+    UNION ALL
+    SELECT 'comment', rc.id, rc.created_at, rc.author_id, NULL, rc.review_id,
+           rc.contains_command, rc.command_type, rc.body, rc.body_compressed, rc.body_sha256, rc.body_storage
+    FROM {review_comments} rc
+    WHERE rc.pull_request_id = ?
+) e
+LEFT JOIN users u ON u.id = e.actor_id
+ORDER BY e.occurred_at, e.event_id
+"""
+
+def timeline_sql(include_archived=False):
+    """TIMELINE_SQL over the live tables, or the live and archived ones"""
+    return TIMELINE_SQL.format(
+        pull_requests=history_source('pull_requests', include_archived),
+        pr_reviews=history_source('pr_reviews', include_archived),
+        review_comments=history_source('review_comments', include_archived)
+    )
+
+def encode_page_cursor(sort, order, value, row_id):
+    """Opaque keyset cursor: the sort column value and id of the last row of a page"""
+    raw = json.dumps([sort, order, value.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_cursor(cursor, sort, order):
+    """(value, id) from a cursor; raises ValueError if it is malformed or for another sort"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, row_id = json.loads(raw)
+        value, row_id = datetime.fromisoformat(value), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("Cursor belongs to a different sort order")
+    return value, row_id
+
+def _parse_datetime(name, value):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    return parsed.replace(tzinfo=None)
+
+def _parse_int(name, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+
+def parse_include_archived(args):
+    """The include_archived query parameter as a bool; raises ValueError"""
+    value = args.get('include_archived', 'false')
+    if value not in ('true', 'false', '1', '0'):
+        raise ValueError("include_archived must be true or false")
+    return value in ('true', '1')
+
+def parse_pull_request_query(args):
+    """
+    Validate list query parameters (a dict-like, e.g. request.args) into
+    keyword arguments for list_pull_requests; raises ValueError with a
+    message fit for a 400 response
+    """
+    sort = args.get('sort', 'last_activity')
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    state = args.get('state') or None
+    if state is not None and state not in PR_STATES:
+        raise ValueError(f"state must be one of {', '.join(PR_STATES)}")
+    stale = args.get('stale')
+    if stale is not None and stale not in ('true', 'false', '1', '0'):
+        raise ValueError("stale must be true or false")
+    limit = _parse_int('limit', args.get('limit', '50'))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    include_archived = parse_include_archived(args)
+
+    return {
+        'state': state,
+        'repository': args.get('repository') or None,
+        'repository_id': _parse_int('repository_id', args['repository_id']) if args.get('repository_id') else None,
+        'author': args.get('author') or None,
+        'author_id': _parse_int('author_id', args['author_id']) if args.get('author_id') else None,
+        'stale': None if stale is None else stale in ('true', '1'),
+        'since': _parse_datetime('since', args['since']) if args.get('since') else None,
+        'until': _parse_datetime('until', args['until']) if args.get('until') else None,
+        'sort': sort,
+        'order': order,
+        'limit': limit,
+        'after': decode_page_cursor(args['cursor'], sort, order) if args.get('cursor') else None,
+        'include_archived': include_archived
+    }
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+@dataclass(slots=True)
+class PullRequestRow:
+    """A list_pull_requests row (see prequel_app/serialization.py for how it is encoded)"""
+    id: int
+    github_id: int
+    repository_id: int
+    author_id: int
+    title: str
+    number: int
+    state: str
+    html_url: str
+    created_at: datetime
+    updated_at: datetime
+    closed_at: datetime
+    merged_at: datetime
+    is_stale: bool
+    last_activity_at: datetime
+    repository_name: str
+    author_name: str
+
+class DatabasePullRequests(DatabaseConnection):
+    """
+    Handles the pull request list and per-PR activity timeline for the frontend
+
+    The list uses keyset pagination: each page continues after the (sort
+    column, id) of the previous page's last row, so deep pages cost the same
+    as the first one. Every filter is a seek on a managed index (see
+    prequel_db/db_indexes.py), and the default last_activity sort is read
+    in index order.
+    """
+
+    @read_replica
+    def list_pull_requests(self, state=None, repository=None, repository_id=None, author=None, author_id=None,
+                           stale=None, since=None, until=None, sort='last_activity', order='desc',
+                           limit=50, after=None, include_archived=False):
+        """
+        Get one page of pull requests as (PullRequestRow list, next_cursor)
+
+        Arguments are validated by parse_pull_request_query. repository is a
+        full name and author a username (or pass the ids); since/until bound
+        the sort column; after is the decoded cursor of the previous page;
+        include_archived lists archived PRs too (see prequel_db/db_retention.py).
+        next_cursor is None on the last page.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return [], None
+
+        column = f"pr.{SORT_COLUMNS[sort]}"
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conditions, params = [], []
+        if state == 'merged':
+            conditions.append("pr.merged_at IS NOT NULL")
+        elif state:
+            conditions.append("pr.state = ?")
+            params.append(state)
+        if repository_id is not None:
+            conditions.append("pr.repository_id = ?")
+            params.append(int(repository_id))
+        elif repository:
+            conditions.append("pr.repository_id IN (SELECT id FROM repositories WHERE full_name = ?)")
+            params.append(repository)
+        if author_id is not None:
+            conditions.append("pr.author_id = ?")
+            params.append(int(author_id))
+        elif author:
+            conditions.append("pr.author_id IN (SELECT id FROM users WHERE username = ?)")
+            params.append(author)
+        if stale is not None:
+            conditions.append("pr.is_stale = ?")
+            params.append(1 if stale else 0)
+        if since is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append(f"{column} < ?")
+            params.append(until)
+        if after:
+            # Written as a range plus a tie-break so the range stays seekable
+            value, row_id = after
+            if order == 'desc':
+                conditions.append(f"{column} <= ? AND ({column} < ? OR pr.id < ?)")
+            else:
+                conditions.append(f"{column} >= ? AND ({column} > ? OR pr.id > ?)")
+            params.extend([value, value, row_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = 'DESC' if order == 'desc' else 'ASC'
+        try:
+            self.cursor.execute(
+                f"""SELECT TOP (?) {PULL_REQUEST_COLUMNS}
+                    FROM {history_source('pull_requests', include_archived)} pr
+                    JOIN repositories repo ON repo.id = pr.repository_id
+                    JOIN users u ON u.id = pr.author_id
+                    {where}
+                    ORDER BY {column} {direction}, pr.id {direction}""",
+                [limit + 1] + params
+            )
+            rows = self.cursor.fetchall()
+
+        except Exception as e:
+            logger.error(f"Error in list_pull_requests: {str(e)}")
+            return [], None
+
+        pull_requests = [self._pull_request_row(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            sort_value = {'last_activity': last[13], 'created': last[8], 'updated': last[9]}[sort]
+            next_cursor = encode_page_cursor(sort, order, sort_value, last[0])
+        return pull_requests, next_cursor
+
+    @staticmethod
+    def _pull_request_row(row):
+        return PullRequestRow(*row[:12], bool(row[12]), *row[13:])
+
+    @read_replica
+    def get_pull_request_timeline(self, pull_request_id, limit=500, include_archived=False):
+        """
+        Get a PR's activity (opened, reviews, comments, merged/closed) in time order
+
+        Returns None if the PR does not exist (or, without include_archived,
+        has been archived).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        limit = max(1, min(int(limit), MAX_TIMELINE_EVENTS))
+        try:
+            self.cursor.execute(timeline_sql(include_archived), (limit,) + (pull_request_id,) * 4)
+            rows = self.cursor.fetchall()
+
+        except Exception as e:
+            logger.error(f"Error in get_pull_request_timeline: {str(e)}")
+            return None
+
+        if not rows:
+            return None
+
+        codec = get_comment_body_codec()
+        events = []
+        for (event_type, event_id, occurred_at, actor, state, review_id, contains_command, command_type,
+             body, body_compressed, body_sha256, body_storage) in rows:
+            event = {'type': event_type, 'id': event_id, 'at': _iso(occurred_at), 'actor': actor}
+            if event_type == 'review':
+                event['state'] = state
+            elif event_type == 'comment':
+                event['review_id'] = review_id
+                event['body'] = codec.decode(body, body_compressed, body_sha256, body_storage)
+                event['contains_command'] = bool(contains_command)
+                event['command_type'] = command_type
+            events.append(event)
+        return events
@@ -0,0 +1,257 @@
+import contextlib
+import functools
+import inspect
+import logging
+import threading
+import time
+from prequel_db.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+class ConnectionPool:
+    """
+    Small thread-safe pool of pyodbc connections
+
+    At most max_size connections are handed out at once. Idle connections
+    older than validate_after seconds are pinged before being reused.
+    """
+
+    def __init__(self, connect, max_size=8, acquire_timeout=1.0, validate_after=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.validate_after = validate_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        """Get a connection, or None if the pool is exhausted or connecting fails"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            logger.warning("Connection pool exhausted")
+            return None
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, released_at = self._idle.pop()
+                if time.monotonic() - released_at < self.validate_after or self._is_alive(conn):
+                    return conn
+                self._discard(conn)
+
+            conn = self._connect()
+            if conn is None:
+                self._slots.release()
+            return conn
+        except Exception as e:
+            logger.error(f"Error opening pooled connection: {str(e)}")
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool (or close it if discard is set)"""
+        try:
+            if not discard and conn is not None:
+                # End anything the borrower left open before the next one reads
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+            if discard or conn is None:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            if conn is not None:
+                conn.close()
+        except Exception:
+            pass
+
+class ReadReplica:
+    """
+    Read-side connection target with its own pool and a staleness bound
+
+    Lag is measured from the replication_heartbeat row the primary refreshes
+    every few seconds. When the measured lag exceeds max_staleness seconds (or
+    the replica is unreachable) callers are told to use the primary instead.
+    """
+
+    def __init__(self, connect, pool_size=8, max_staleness=30.0, lag_check_interval=5.0):
+        self.pool = ConnectionPool(connect, max_size=pool_size)
+        self.max_staleness = max_staleness
+        self.lag_check_interval = lag_check_interval
+        self.breaker = CircuitBreaker('read_replica', failure_threshold=3, reset_timeout=30.0)
+        self._lag_lock = threading.Lock()
+        self._lag_checked_at = 0.0
+        self._lag_seconds = None
+
+    def _measure_lag(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT DATEDIFF(millisecond, beat_at, SYSUTCDATETIME()) FROM replication_heartbeat WHERE id = 1"
+            )
+            row = cursor.fetchone()
+            return row[0] / 1000.0 if row and row[0] is not None else None
+        finally:
+            cursor.close()
+
+    def _lag_within_bound(self, conn):
+        now = time.monotonic()
+        with self._lag_lock:
+            if now - self._lag_checked_at >= self.lag_check_interval:
+                self._lag_seconds = self._measure_lag(conn)
+                self._lag_checked_at = now
+                if self._lag_seconds is None or self._lag_seconds > self.max_staleness:
+                    logger.warning(f"Read replica lag {self._lag_seconds}s exceeds {self.max_staleness}s, using primary")
+            lag = self._lag_seconds
+        return lag is not None and lag <= self.max_staleness
+
+    def acquire(self):
+        """Get a replica connection that is fresh enough, or None to use the primary"""
+        if not self.breaker.allow_request():
+            return None
+
+        try:
+            conn = self.pool.acquire()
+        except Exception as e:
+            self.breaker.record_failure(e)
+            return None
+        if conn is None:
+            self.breaker.record_failure("no replica connection")
+            return None
+
+        try:
+            fresh = self._lag_within_bound(conn)
+        except Exception as e:
+            logger.error(f"Error checking read replica lag: {str(e)}")
+            self.breaker.record_failure(e)
+            self.pool.release(conn, discard=True)
+            return None
+
+        self.breaker.record_success()
+        if not fresh:
+            self.pool.release(conn)
+            return None
+        return conn
+
+    def release(self, conn, discard=False):
+        self.pool.release(conn, discard=discard)
+
+_read_replica = None
+_read_replica_lock = threading.Lock()
+
+def get_read_replica(build_connection_string, connect, db_settings):
+    """
+    Get the process-wide read replica, or None if no read target is configured
+
+    db_settings are the DatabaseSettings; a read target is configured with
+    SQL_READ_SERVER (a replica host) and/or SQL_READ_APPLICATION_INTENT=true (ApplicationIntent=ReadOnly against the
+    primary's listener, which Azure SQL routes to a readable secondary).
+    """
+    global _read_replica
+    if _read_replica is not None:
+        return _read_replica or None
+
+    with _read_replica_lock:
+        if _read_replica is not None:
+            return _read_replica or None
+
+        read_server = db_settings.read_server
+        if not read_server and not db_settings.read_application_intent:
+            _read_replica = False
+            return None
+
+        conn_str = build_connection_string(
+            server=read_server or db_settings.server,
+            database=db_settings.read_database or db_settings.database,
+            username=db_settings.read_username or db_settings.username,
+            password=db_settings.read_password or db_settings.password,
+            read_only=True,
+            connect_timeout=db_settings.connect_timeout
+        )
+        # Autocommit, so an idle pooled connection holds no transaction (on a
+        # readable secondary an open one keeps reading its first snapshot)
+        _read_replica = ReadReplica(
+            lambda: connect(conn_str, autocommit=True),
+            pool_size=db_settings.read_pool_size,
+            max_staleness=db_settings.read_max_staleness_seconds
+        )
+        logger.info(f"Read queries routed to {read_server or 'ReadOnly application intent'}")
+        return _read_replica
+
+@contextlib.contextmanager
+def _replica_connection(handler):
+    """Swap the handler's conn/cursor for a pooled replica connection (or keep the primary)"""
+    replica = handler._get_read_replica()
+    read_conn = replica.acquire() if replica else None
+    if read_conn is None:
+        yield
+        return
+
+    primary_conn, primary_cursor = getattr(handler, 'conn', None), getattr(handler, 'cursor', None)
+    discard = False
+    try:
+        handler.conn = read_conn
+        handler.cursor = read_conn.cursor()
+        yield
+    except Exception:
+        discard = True
+        raise
+    finally:
+        try:
+            handler.cursor.close()
+        except Exception:
+            discard = True
+        handler.conn, handler.cursor = primary_conn, primary_cursor
+        replica.release(read_conn, discard=discard)
+
+def read_replica(method):
+    """
+    Run a read-only DatabaseConnection method against the read replica
+
+    The handler's conn/cursor are swapped for a pooled replica connection for
+    the duration of the call. Falls back to the primary connection when no
+    replica is configured, the pool is exhausted or the replica is too stale.
+    A generator method keeps the replica connection until it is exhausted or
+    closed.
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            with _replica_connection(self):
+                yield from method(self, *args, **kwargs)
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _replica_connection(self):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,176 @@
+"""
+Retention for closed pull requests
+
+The dashboard's hot queries (stale checks, stale PR list, open PR counts)
+only read open PRs, yet the PR tables keep every PR ever closed along with
+its reviews, comments and stale history. PRs closed (or merged) more than
+RETENTION_CLOSED_PR_DAYS ago are moved, with their child rows, into
+page-compressed *_archive tables that keep the same ids and columns.
+
+Each batch is one short transaction: a few PR ids are picked with READPAST
+(rows ingestion is writing are skipped, not waited on) and every table is
+moved with DELETE ... OUTPUT DELETED.* INTO its archive, children first.
+Sessions run at low deadlock priority so webhooks win any conflict, and
+batches are separated by a pause so ingestion is never locked out.
+
+Archived rows are read back only when a caller asks for them
+(include_archived=True on the analytics reads, ?include_archived=true on
+the endpoints), through history_source. A PR that is reopened after it was
+archived is recorded again as a new live row; reads that include the
+archive then prefer the live row (matched on github_id).
+
+A PR's pr_cycle_facts row only marks it as already counted in the rollups,
+so it is deleted with the batch rather than archived. Archived PRs are also
+dropped from the analytics snapshot, whose queries read live rows only.
+
+Usage (archive one backlog now, ignoring RETENTION_MAX_BATCHES):
+  python -m prequel_db.db_retention archive [--days N]
+"""
+import argparse
+import logging
+import sys
+import time
+from prequel_db.analytics_snapshot import analytics_snapshot
+from prequel_db.db_connection import DatabaseConnection
+from prequel_db.live_events import live_events
+
+logger = logging.getLogger(__name__)
+
+# Columns copied to each archive table (the live columns without row_version)
+ARCHIVE_COLUMNS = {
+    'pull_requests': ('id, github_id, repository_id, author_id, title, number, state, html_url, created_at, '
+                      'updated_at, closed_at, merged_at, is_stale, last_activity_at'),
+    'pr_reviews': 'id, github_id, pull_request_id, reviewer_id, state, submitted_at',
+    'review_comments': ('id, github_id, review_id, pull_request_id, author_id, body, created_at, updated_at, '
+                        'contains_command, command_type, body_storage, body_compressed, body_sha256'),
+    'stale_pr_history': ('id, pull_request_id, marked_stale_at, marked_active_at, notification_sent, '
+                         'notification_count, last_notified_at')
+}
+
+# Children first, so no foreign key is ever left dangling
+ARCHIVE_ORDER = ('review_comments', 'stale_pr_history', 'pr_reviews', 'pull_requests')
+
+def _delete_into_archive(table):
+    columns = ARCHIVE_COLUMNS[table]
+    deleted = ', '.join(f"DELETED.{column.strip()}" for column in columns.split(','))
+    key = 'id' if table == 'pull_requests' else 'pull_request_id'
+    return (f"DELETE FROM {table} OUTPUT {deleted} INTO {table}_archive ({columns}) "
+            f"WHERE {key} IN (SELECT id FROM @batch);")
+
+ARCHIVE_DELETES = "\n".join(_delete_into_archive(table) for table in ARCHIVE_ORDER)
+
+# One batch: pick closed PRs, leave delta sync tombstones for the rows that
+# move (see DatabaseChanges.record_change_tombstones), drop their cycle-time
+# facts (the rollups already hold their counts), then move every table.
+# The PR ids are the only result set.
+ARCHIVE_BATCH_SQL = f"""
+SET NOCOUNT ON;
+SET DEADLOCK_PRIORITY LOW;
+DECLARE @batch TABLE (id INT PRIMARY KEY);
+INSERT INTO @batch (id)
+SELECT TOP (?) id FROM pull_requests WITH (READPAST)
+WHERE state <> 'open' AND closed_at < DATEADD(day, ?, GETDATE())
+ORDER BY closed_at;
+INSERT INTO change_tombstones (table_name, row_id, repository_id, user_id)
+SELECT 'review_comments', rc.id, pr.repository_id, rc.author_id
+FROM review_comments rc JOIN pull_requests pr ON pr.id = rc.pull_request_id
+WHERE rc.pull_request_id IN (SELECT id FROM @batch)
+UNION ALL
+SELECT 'pr_reviews', rv.id, pr.repository_id, rv.reviewer_id
+FROM pr_reviews rv JOIN pull_requests pr ON pr.id = rv.pull_request_id
+WHERE rv.pull_request_id IN (SELECT id FROM @batch)
+UNION ALL
+SELECT 'pull_requests', pr.id, pr.repository_id, pr.author_id
+FROM pull_requests pr
+WHERE pr.id IN (SELECT id FROM @batch);
+DELETE FROM pr_cycle_facts WHERE pull_request_id IN (SELECT id FROM @batch);
+{ARCHIVE_DELETES}
+SET DEADLOCK_PRIORITY NORMAL;
+SET NOCOUNT OFF;
+SELECT id FROM @batch;
+"""
+
+def history_source(table, include_archived=False):
+    """
+    Row source for a PR history table in a FROM clause
+
+    The live table, or with include_archived a derived table of the live
+    rows plus the archived rows that are not live again. Alias it like the
+    table (e.g. f"{history_source('pull_requests', True)} pr").
+    """
+    if not include_archived:
+        return table
+    columns = ARCHIVE_COLUMNS[table]
+    return (f"(SELECT {columns} FROM {table} UNION ALL "
+            f"SELECT {columns} FROM {table}_archive a "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} l WHERE l.github_id = a.github_id))")
+
+class DatabaseRetention(DatabaseConnection):
+    """Handles archiving of closed pull requests (see module docstring)"""
+
+    def archive_closed_pull_requests(self, closed_days, batch_size=100, max_batches=200, pause_seconds=0.5):
+        """
+        Move PRs closed more than closed_days ago into the archive tables
+
+        Works in batches of batch_size PRs, pausing pause_seconds between
+        them, and stops after max_batches (0 = until none are left) so one
+        run stays short. Returns the number of PRs archived.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0
+
+        if closed_days <= 0:
+            return 0
+
+        archived = 0
+        batches = 0
+        try:
+            while not max_batches or batches < max_batches:
+                self.cursor.execute(ARCHIVE_BATCH_SQL, (int(batch_size), -int(closed_days)))
+                pull_request_ids = [row[0] for row in self.cursor.fetchall()]
+                self._commit()
+                if pull_request_ids:
+                    self._after_commit(analytics_snapshot.observe, '_archive_pull_requests', pull_request_ids)
+                    self._after_commit(live_events.publish, 'pr.archived', {'pull_request_ids': pull_request_ids})
+                archived += len(pull_request_ids)
+                batches += 1
+                if len(pull_request_ids) < batch_size:
+                    break
+                time.sleep(pause_seconds)
+            return archived
+
+        except Exception as e:
+            logger.error(f"Error in archive_closed_pull_requests: {str(e)}")
+            self._rollback()
+            return archived
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('archive',))
+    parser.add_argument('--days', type=int, help="archive PRs closed more than this many days ago "
+                                                 "(default RETENTION_CLOSED_PR_DAYS)")
+    args = parser.parse_args()
+
+    from prequel_config.settings import configure_logging, get_settings
+    from prequel_db.db_handler import DatabaseHandler
+    configure_logging()
+
+    retention = get_settings().retention
+    days = args.days if args.days is not None else retention.closed_pr_days
+    if days <= 0:
+        sys.exit("Set RETENTION_CLOSED_PR_DAYS or pass --days")
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+    try:
+        if args.command == 'archive':
+            archived = db.archive_closed_pull_requests(days, retention.batch_size, 0,
+                                                       retention.batch_pause_seconds)
+            print(f"Archived {archived} pull requests closed more than {days} days ago")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
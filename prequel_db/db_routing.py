@@ -0,0 +1,177 @@
+import logging
+from prequel_db.db_connection import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+class DatabaseRouting(DatabaseConnection):
+    """
+    Handles persistence of Slack routing rules and team membership
+    """
+
+    def get_slack_routing_version(self):
+        """Get the current routing version (changes whenever routes or teams change)"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            self.cursor.execute("SELECT version FROM slack_routing_version WHERE id = 1")
+            result = self.cursor.fetchone()
+            return result[0] if result else 0
+
+        except Exception as e:
+            logger.error(f"Error in get_slack_routing_version: {str(e)}")
+            return None
+
+    def get_slack_routes(self, include_disabled=False):
+        """Get all Slack routing rules"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
+
+        try:
+            query = """SELECT id, repository, team, event_type, webhook_url, enabled
+                       FROM slack_routes"""
+            if not include_disabled:
+                query += " WHERE enabled = 1"
+            self.cursor.execute(query + " ORDER BY id")
+
+            routes = []
+            for row in self.cursor.fetchall():
+                route_id, repository, team, event_type, webhook_url, enabled = row
+                routes.append({
+                    'id': route_id,
+                    'repository': repository,
+                    'team': team,
+                    'event_type': event_type,
+                    'webhook_url': webhook_url,
+                    'enabled': bool(enabled)
+                })
+            return routes
+
+        except Exception as e:
+            logger.error(f"Error in get_slack_routes: {str(e)}")
+            return []
+
+    def get_slack_team_repositories(self):
+        """Get team membership as a list of (team, repository) pairs"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
+
+        try:
+            self.cursor.execute("SELECT team, repository FROM slack_team_repositories")
+            return [(row[0], row[1]) for row in self.cursor.fetchall()]
+
+        except Exception as e:
+            logger.error(f"Error in get_slack_team_repositories: {str(e)}")
+            return []
+
+    def add_slack_route(self, webhook_url, repository=None, team=None, event_type=None):
+        """Add a Slack routing rule"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            if not webhook_url:
+                logger.error("Slack route webhook_url is missing")
+                return None
+
+            if repository and team:
+                logger.error("Slack route must match either a repository or a team, not both")
+                return None
+
+            self.cursor.execute(
+                """INSERT INTO slack_routes (repository, team, event_type, webhook_url)
+                   OUTPUT INSERTED.id
+                   VALUES (?, ?, ?, ?)""",
+                (repository, team, event_type, webhook_url)
+            )
+            route_id = self.cursor.fetchone()[0]
+            self._bump_slack_routing_version()
+            self.conn.commit()
+
+            return route_id
+
+        except Exception as e:
+            logger.error(f"Error in add_slack_route: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return None
+
+    def delete_slack_route(self, route_id):
+        """Delete a Slack routing rule"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            self.cursor.execute("DELETE FROM slack_routes WHERE id = ?", (route_id,))
+            deleted = self.cursor.rowcount > 0
+            if deleted:
+                self._bump_slack_routing_version()
+            self.conn.commit()
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error in delete_slack_route: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return False
+
+    def add_slack_team_repository(self, team, repository):
+        """Add a repository to a routing team"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            self.cursor.execute(
+                """IF NOT EXISTS (SELECT 1 FROM slack_team_repositories WHERE team = ? AND repository = ?)
+                   INSERT INTO slack_team_repositories (team, repository) VALUES (?, ?)""",
+                (team, repository, team, repository)
+            )
+            self._bump_slack_routing_version()
+            self.conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error in add_slack_team_repository: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return False
+
+    def remove_slack_team_repository(self, team, repository):
+        """Remove a repository from a routing team"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            self.cursor.execute(
+                "DELETE FROM slack_team_repositories WHERE team = ? AND repository = ?",
+                (team, repository)
+            )
+            deleted = self.cursor.rowcount > 0
+            if deleted:
+                self._bump_slack_routing_version()
+            self.conn.commit()
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error in remove_slack_team_repository: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return False
+
+    def _bump_slack_routing_version(self):
+        """Increment the routing version inside the caller's transaction"""
+        self.cursor.execute("UPDATE slack_routing_version SET version = version + 1 WHERE id = 1")
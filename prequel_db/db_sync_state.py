@@ -0,0 +1,124 @@
+import logging
+from prequel_db.db_connection import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+class DatabaseSyncState(DatabaseConnection):
+    """
+    Handles the cursors and ETags of the GitHub reconciliation sync, and the
+    lookups it needs to tell changed data from unchanged data
+    """
+
+    def get_repositories_for_sync(self):
+        """Get (id, full_name) for every known repository"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
+
+        try:
+            self.cursor.execute("SELECT id, full_name FROM repositories ORDER BY id")
+            return [(row[0], row[1]) for row in self.cursor.fetchall()]
+
+        except Exception as e:
+            logger.error(f"Error in get_repositories_for_sync: {str(e)}")
+            return []
+
+    def get_sync_state(self, repository, resource):
+        """Get (etag, cursor) for a repository resource, or (None, None) if never synced"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None, None
+
+        try:
+            self.cursor.execute(
+                "SELECT etag, since_cursor FROM github_sync_state WHERE repository = ? AND resource = ?",
+                (repository, resource)
+            )
+            row = self.cursor.fetchone()
+            return (row[0], row[1]) if row else (None, None)
+
+        except Exception as e:
+            logger.error(f"Error in get_sync_state: {str(e)}")
+            return None, None
+
+    def save_sync_state(self, repository, resource, etag, cursor):
+        """Record the ETag and cursor reached for a repository resource"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return False
+
+        try:
+            self.cursor.execute(
+                """MERGE github_sync_state WITH (HOLDLOCK) AS t
+                   USING (SELECT ? AS repository, ? AS resource) AS s
+                   ON t.repository = s.repository AND t.resource = s.resource
+                   WHEN MATCHED THEN UPDATE SET etag = ?, since_cursor = ?, synced_at = GETDATE()
+                   WHEN NOT MATCHED THEN
+                       INSERT (repository, resource, etag, since_cursor, synced_at)
+                       VALUES (s.repository, s.resource, ?, ?, GETDATE());""",
+                (repository, resource, etag, cursor, etag, cursor)
+            )
+            self._commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error in save_sync_state: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self._rollback()
+            return False
+
+    def get_pull_request_versions(self, github_ids):
+        """Map PR github_id -> (id, updated_at, state) for the given PRs that exist"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn or not github_ids:
+            return {}
+
+        try:
+            placeholders = ', '.join('?' for _ in github_ids)
+            self.cursor.execute(
+                f"SELECT github_id, id, updated_at, state FROM pull_requests WHERE github_id IN ({placeholders})",
+                tuple(github_ids)
+            )
+            return {row[0]: (row[1], row[2], row[3]) for row in self.cursor.fetchall()}
+
+        except Exception as e:
+            logger.error(f"Error in get_pull_request_versions: {str(e)}")
+            return {}
+
+    def get_pull_request_id_by_number(self, repository_id, number):
+        """Get (id, author_id) of a repository's PR by its number"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            return None, None
+
+        try:
+            self.cursor.execute(
+                "SELECT id, author_id FROM pull_requests WHERE repository_id = ? AND number = ?",
+                (repository_id, number)
+            )
+            row = self.cursor.fetchone()
+            return (row[0], row[1]) if row else (None, None)
+
+        except Exception as e:
+            logger.error(f"Error in get_pull_request_id_by_number: {str(e)}")
+            return None, None
+
+    def get_review_states(self, pull_request_id):
+        """Map review github_id -> state for a PR's stored reviews"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            return {}
+
+        try:
+            self.cursor.execute(
+                "SELECT github_id, state FROM pr_reviews WHERE pull_request_id = ?",
+                (pull_request_id,)
+            )
+            return {row[0]: row[1] for row in self.cursor.fetchall()}
+
+        except Exception as e:
+            logger.error(f"Error in get_review_states: {str(e)}")
+            return {}
@@ -0,0 +1,527 @@
+"""
+GitHub Actions workflow storage and CI metrics
+
+workflow_run and workflow_job deliveries outnumber PR events by an order of
+magnitude, so they are stored differently from the PR tables:
+
+- Completed runs and jobs go into narrow, row-compressed tables clustered on
+  (day, GitHub id) and partitioned by month, with IGNORE_DUP_KEY so webhook
+  redeliveries are dropped by the insert itself. Retention truncates whole
+  partitions instead of deleting rows.
+- Every newly inserted run or job adds to per-workflow daily histogram
+  rollups (conclusions, run duration, job queue time, job duration) in the
+  same transaction, and the latest run of each workflow is kept in
+  workflow_latest_runs. The CI endpoints read only those two tables.
+
+Usage (add future partitions and apply retention):
+  python -m prequel_db.db_workflows maintain
+"""
+import argparse
+import logging
+import math
+import sys
+import threading
+from datetime import date, datetime
+from prequel_db.db_connection import DatabaseConnection
+from prequel_db.db_replica import read_replica
+from prequel_db.histograms import log_bucket, log_bucket_upper_bounds, histogram_matrix, percentiles
+
+logger = logging.getLogger(__name__)
+
+# Conclusion codes stored in workflow_runs, workflow_jobs and workflow_latest_runs
+CONCLUSIONS = {
+    'success': 1,
+    'failure': 2,
+    'cancelled': 3,
+    'skipped': 4,
+    'timed_out': 5,
+    'action_required': 6,
+    'neutral': 7,
+    'stale': 8,
+    'startup_failure': 9
+}
+CONCLUSION_NAMES = {code: name for name, code in CONCLUSIONS.items()}
+SUCCESS_CONCLUSIONS = (1, 4, 7)
+FAILED_CONCLUSIONS = (2, 5, 9)
+
+# Metric codes stored in workflow_rollup_daily.metric. For METRIC_RUN_CONCLUSION
+# the bucket is the conclusion code; the others are log-scale duration buckets.
+METRIC_RUN_CONCLUSION = 1
+METRIC_RUN_DURATION = 2
+METRIC_JOB_QUEUE = 3
+METRIC_JOB_DURATION = 4
+
+DURATION_METRICS = {
+    METRIC_RUN_DURATION: 'duration',
+    METRIC_JOB_QUEUE: 'queue_time',
+    METRIC_JOB_DURATION: 'job_duration'
+}
+
+# CI durations are mostly seconds to minutes, so buckets start at one second
+DURATION_MIN_SECONDS = 1
+QUANTILES = (0.5, 0.9, 0.99)
+
+PARTITION_FUNCTION = 'pf_workflow_month'
+PARTITION_SCHEME = 'ps_workflow_month'
+PARTITIONED_TABLES = ('workflow_runs', 'workflow_jobs')
+
+# (repository_id, workflow name) -> workflows.id, filled once the row is committed
+_workflow_ids = {}
+_workflow_ids_lock = threading.Lock()
+
+def _cache_workflow_id(key, workflow_id):
+    with _workflow_ids_lock:
+        _workflow_ids[key] = workflow_id
+
+def parse_github_time(value):
+    """Naive UTC datetime from a GitHub timestamp, or None"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+def _seconds_between(start, end):
+    if start is None or end is None:
+        return None
+    return max(int((end - start).total_seconds()), 0)
+
+def add_months(day, months):
+    """First day of the month months after day's month"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def run_status(status, conclusion):
+    """The frontend's WorkflowRun.status for a run's GitHub status and conclusion code"""
+    if status != 'completed':
+        return 'in_progress'
+    if conclusion in SUCCESS_CONCLUSIONS:
+        return 'success'
+    if conclusion in FAILED_CONCLUSIONS:
+        return 'failure'
+    return 'cancelled'
+
+class DatabaseWorkflows(DatabaseConnection):
+    """
+    Handles workflow run and job ingestion, CI rollups and partition maintenance
+    """
+
+    def _get_or_create_workflow(self, repository_id, name, github_workflow_id=None):
+        """
+        workflows.id for a repository's workflow name (caller commits)
+
+        Callers cache the id with _cache_workflow_id once their write is committed.
+        """
+        with _workflow_ids_lock:
+            workflow_id = _workflow_ids.get((repository_id, name))
+        if workflow_id is not None:
+            return workflow_id
+
+        self.cursor.execute(
+            "SELECT id FROM workflows WHERE repository_id = ? AND name = ?",
+            (repository_id, name)
+        )
+        result = self.cursor.fetchone()
+        if result:
+            workflow_id = result[0]
+        else:
+            self.cursor.execute(
+                """INSERT INTO workflows (repository_id, name, github_workflow_id)
+                   OUTPUT INSERTED.id
+                   VALUES (?, ?, ?)""",
+                (repository_id, name, github_workflow_id)
+            )
+            workflow_id = self.cursor.fetchone()[0]
+        return workflow_id
+
+    def _add_workflow_rollups(self, increments):
+        """Add {(metric, day, workflow_id, bucket): (count, value_sum)} to the daily rollups in one statement"""
+        if not increments:
+            return
+        values = ", ".join("(?, ?, ?, ?, ?, ?)" for _ in increments)
+        params = []
+        for (metric, day, workflow_id, bucket), (count, value_sum) in sorted(increments.items()):
+            params.extend([metric, day, workflow_id, bucket, count, value_sum])
+        self.cursor.execute(
+            f"""MERGE workflow_rollup_daily WITH (HOLDLOCK) AS t
+                USING (VALUES {values}) AS s (metric, day, workflow_id, bucket, sample_count, value_sum)
+                ON t.metric = s.metric AND t.day = s.day AND t.workflow_id = s.workflow_id AND t.bucket = s.bucket
+                WHEN MATCHED THEN UPDATE SET sample_count = t.sample_count + s.sample_count,
+                                             value_sum = t.value_sum + s.value_sum
+                WHEN NOT MATCHED THEN
+                    INSERT (metric, day, workflow_id, bucket, sample_count, value_sum)
+                    VALUES (s.metric, s.day, s.workflow_id, s.bucket, s.sample_count, s.value_sum);""",
+            params
+        )
+
+    def record_workflow_run(self, run_data, repository_id, triggered_by=None):
+        """
+        Store a workflow_run event (any action)
+
+        Every action updates the workflow's latest run; a completed run is also
+        inserted into workflow_runs and, unless it was already stored, counted
+        in the rollups. Returns the GitHub run id, or None on failure.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            run_id = run_data.get('id')
+            name = run_data.get('name')
+            if run_id is None or not name:
+                logger.error("Workflow run id or name is missing")
+                return None
+
+            name = str(name)[:255]
+            workflow_id = self._get_or_create_workflow(repository_id, name, run_data.get('workflow_id'))
+            status = run_data.get('status')
+            completed = status == 'completed'
+            conclusion = CONCLUSIONS.get(run_data.get('conclusion'), 0) if completed else None
+            run_attempt = int(run_data.get('run_attempt') or 1)
+            created_at = parse_github_time(run_data.get('created_at'))
+            started_at = parse_github_time(run_data.get('run_started_at')) or created_at
+            completed_at = parse_github_time(run_data.get('updated_at')) if completed else None
+            duration = _seconds_between(started_at, completed_at)
+
+            # A later run, a later attempt, or the completion of the stored attempt
+            # replaces the latest run; late in_progress deliveries do not
+            self.cursor.execute(
+                """MERGE workflow_latest_runs WITH (HOLDLOCK) AS t
+                   USING (SELECT ? AS workflow_id, ? AS run_id, ? AS run_attempt, ? AS run_number, ? AS completed,
+                                 ? AS conclusion, ? AS triggered_by, ? AS html_url, ? AS created_at,
+                                 ? AS duration_seconds) AS s
+                   ON t.workflow_id = s.workflow_id
+                   WHEN MATCHED AND (s.run_id > t.run_id
+                                     OR (s.run_id = t.run_id AND s.run_attempt > t.run_attempt)
+                                     OR (s.run_id = t.run_id AND s.run_attempt = t.run_attempt AND t.completed = 0))
+                       THEN UPDATE SET run_id = s.run_id, run_attempt = s.run_attempt, run_number = s.run_number,
+                                       completed = s.completed, conclusion = s.conclusion,
+                                       triggered_by = s.triggered_by, html_url = s.html_url,
+                                       created_at = s.created_at, duration_seconds = s.duration_seconds,
+                                       updated_at = SYSUTCDATETIME()
+                   WHEN NOT MATCHED THEN
+                       INSERT (workflow_id, run_id, run_attempt, run_number, completed, conclusion, triggered_by,
+                               html_url, created_at, duration_seconds, updated_at)
+                       VALUES (s.workflow_id, s.run_id, s.run_attempt, s.run_number, s.completed, s.conclusion,
+                               s.triggered_by, s.html_url, s.created_at, s.duration_seconds, SYSUTCDATETIME());""",
+                (workflow_id, run_id, run_attempt, run_data.get('run_number'), 1 if completed else 0,
+                 conclusion, triggered_by, run_data.get('html_url'), created_at, duration)
+            )
+
+            if completed and completed_at is not None:
+                day = completed_at.date()
+                # IGNORE_DUP_KEY turns a redelivered run into a no-op insert
+                self.cursor.execute(
+                    """INSERT INTO workflow_runs (run_day, run_id, run_attempt, workflow_id, conclusion,
+                                                  created_at, started_at, completed_at, duration_seconds)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (day, run_id, run_attempt, workflow_id, conclusion,
+                     created_at, started_at, completed_at, duration)
+                )
+                if self.cursor.rowcount == 1:
+                    increments = {(METRIC_RUN_CONCLUSION, day, workflow_id, conclusion): (1, 0)}
+                    if duration is not None:
+                        bucket = log_bucket(duration, DURATION_MIN_SECONDS)
+                        increments[(METRIC_RUN_DURATION, day, workflow_id, bucket)] = (1, duration)
+                    self._add_workflow_rollups(increments)
+
+            self._commit()
+            self._after_commit(_cache_workflow_id, (repository_id, name), workflow_id)
+            return run_id
+
+        except Exception as e:
+            logger.error(f"Error in record_workflow_run: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self._rollback()
+            return None
+
+    def record_workflow_job(self, job_data, repository_id):
+        """
+        Store a completed workflow_job event and add its queue time and duration to the rollups
+
+        Returns the GitHub job id, or None on failure.
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return None
+
+        try:
+            job_id = job_data.get('id')
+            workflow_name = job_data.get('workflow_name')
+            if job_id is None or not workflow_name:
+                logger.error("Workflow job id or workflow name is missing")
+                return None
+
+            workflow_name = str(workflow_name)[:255]
+            workflow_id = self._get_or_create_workflow(repository_id, workflow_name)
+            conclusion = CONCLUSIONS.get(job_data.get('conclusion'), 0)
+            created_at = parse_github_time(job_data.get('created_at'))
+            started_at = parse_github_time(job_data.get('started_at'))
+            completed_at = parse_github_time(job_data.get('completed_at')) or started_at
+            if completed_at is None:
+                logger.error(f"Workflow job {job_id} has no completion time")
+                return None
+            queue_seconds = _seconds_between(created_at, started_at)
+            duration = _seconds_between(started_at, completed_at)
+
+            day = completed_at.date()
+            self.cursor.execute(
+                """INSERT INTO workflow_jobs (job_day, job_id, run_id, run_attempt, workflow_id, conclusion,
+                                              created_at, started_at, completed_at, queue_seconds, duration_seconds)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (day, job_id, job_data.get('run_id'), int(job_data.get('run_attempt') or 1), workflow_id,
+                 conclusion, created_at, started_at, completed_at, queue_seconds, duration)
+            )
+            # Skipped jobs never ran, so they say nothing about queue time or duration
+            if self.cursor.rowcount == 1 and conclusion != CONCLUSIONS['skipped']:
+                increments = {}
+                if queue_seconds is not None:
+                    bucket = log_bucket(queue_seconds, DURATION_MIN_SECONDS)
+                    increments[(METRIC_JOB_QUEUE, day, workflow_id, bucket)] = (1, queue_seconds)
+                if duration is not None:
+                    bucket = log_bucket(duration, DURATION_MIN_SECONDS)
+                    increments[(METRIC_JOB_DURATION, day, workflow_id, bucket)] = (1, duration)
+                self._add_workflow_rollups(increments)
+
+            self._commit()
+            self._after_commit(_cache_workflow_id, (repository_id, workflow_name), workflow_id)
+            return job_id
+
+        except Exception as e:
+            logger.error(f"Error in record_workflow_job: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self._rollback()
+            return None
+
+    @read_replica
+    def get_workflow_metrics(self, window_days=30):
+        """
+        Run counts, success rate and duration/queue-time percentiles per workflow
+
+        Read from the daily rollups only. Durations are in seconds, except the
+        frontend's workflow_run_durations (average minutes per workflow).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return summarize_workflow_rows([], window_days)
+
+        try:
+            self.cursor.execute(
+                """SELECT r.workflow_id, w.name, repo.full_name, r.metric, r.bucket,
+                          SUM(r.sample_count), SUM(r.value_sum)
+                   FROM workflow_rollup_daily r
+                   JOIN workflows w ON w.id = r.workflow_id
+                   JOIN repositories repo ON repo.id = w.repository_id
+                   WHERE r.day >= CAST(DATEADD(day, ?, SYSUTCDATETIME()) AS DATE)
+                   GROUP BY r.workflow_id, w.name, repo.full_name, r.metric, r.bucket""",
+                (-int(window_days),)
+            )
+            rows = self.cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error in get_workflow_metrics: {str(e)}")
+            rows = []
+
+        return summarize_workflow_rows(rows, window_days)
+
+    @read_replica
+    def get_recent_workflow_runs(self, limit=50):
+        """The latest run of each workflow, most recently updated first"""
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return []
+
+        try:
+            self.cursor.execute(
+                """SELECT TOP (?) l.run_id, w.name, repo.full_name, l.completed, l.conclusion,
+                          l.duration_seconds, l.triggered_by, l.created_at, l.run_attempt, l.run_number, l.html_url
+                   FROM workflow_latest_runs l
+                   JOIN workflows w ON w.id = l.workflow_id
+                   JOIN repositories repo ON repo.id = w.repository_id
+                   ORDER BY l.updated_at DESC""",
+                (int(limit),)
+            )
+            rows = self.cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error in get_recent_workflow_runs: {str(e)}")
+            return []
+
+        runs = []
+        for (run_id, name, repository, completed, conclusion, duration, triggered_by, created_at,
+             run_attempt, run_number, html_url) in rows:
+            runs.append({
+                'id': run_id,
+                'workflow_name': name,
+                'repository': repository,
+                'status': run_status('completed' if completed else 'in_progress', conclusion),
+                'conclusion': CONCLUSION_NAMES.get(conclusion) if completed else None,
+                'duration_seconds': duration or 0,
+                'triggered_by': triggered_by,
+                'created_at': created_at.isoformat() if created_at else None,
+                'run_attempt': run_attempt,
+                'run_number': run_number,
+                'html_url': html_url
+            })
+        return runs
+
+    def _workflow_partition_boundaries(self):
+        """Boundary values of the monthly partition function, in order"""
+        self.cursor.execute(
+            """SELECT CAST(v.value AS DATE)
+               FROM sys.partition_range_values v
+               JOIN sys.partition_functions f ON f.function_id = v.function_id
+               WHERE f.name = ?
+               ORDER BY v.boundary_id""",
+            (PARTITION_FUNCTION,)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def maintain_workflow_partitions(self, retention_days, months_ahead=2, today=None):
+        """
+        Add monthly partitions ahead of time and drop months past retention
+
+        New boundaries are only split off the last (empty) partition and old
+        ones are merged only once both sides are truncated, so both are
+        metadata operations. Retention works in whole months: a partition is
+        truncated once its last day is older than retention_days. Returns
+        (partitions added, partitions truncated).
+        """
+        # Check if we have a valid connection
+        if not hasattr(self, 'conn') or not self.conn:
+            logger.warning("Database operation skipped due to missing connection")
+            return 0, 0
+
+        today = today or datetime.utcnow().date()
+        added, truncated = 0, 0
+        try:
+            boundaries = self._workflow_partition_boundaries()
+            last = boundaries[-1] if boundaries else None
+            for months in range(months_ahead + 1):
+                boundary = add_months(today, months)
+                if last is not None and boundary <= last:
+                    continue
+                # Dates are generated here, so inlining the literal is safe (DDL takes no parameters)
+                self.cursor.execute(f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY]")
+                self.cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE ('{boundary.isoformat()}')")
+                self.conn.commit()
+                last = boundary
+                added += 1
+
+            if retention_days > 0:
+                cutoff = date.fromordinal(today.toordinal() - int(retention_days))
+                boundaries = self._workflow_partition_boundaries()
+                # Partition n (RANGE RIGHT) holds rows before boundary n
+                expired = [boundary for boundary in boundaries if boundary <= cutoff]
+                if expired:
+                    for table in PARTITIONED_TABLES:
+                        self.cursor.execute(f"TRUNCATE TABLE {table} WITH (PARTITIONS (1 TO {len(expired)}))")
+                    for boundary in expired[:-1]:
+                        self.cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() MERGE RANGE ('{boundary.isoformat()}')")
+                    self.conn.commit()
+                    truncated = len(expired)
+            return added, truncated
+
+        except Exception as e:
+            logger.error(f"Error in maintain_workflow_partitions: {str(e)}")
+            if hasattr(self, 'conn') and self.conn:
+                self.conn.rollback()
+            return added, truncated
+
+def summarize_workflow_rows(rows, window_days):
+    """Build the workflow metrics from (workflow_id, name, repository, metric, bucket, count, value_sum) rows"""
+    result = {
+        'window_days': window_days,
+        'total_workflows': 0,
+        'successful_workflows': 0,
+        'failed_workflows': 0,
+        'workflow_run_durations': [],
+        'workflows': []
+    }
+    if not rows:
+        return result
+
+    import numpy as np
+
+    keys = np.array([row[0] for row in rows], dtype=np.int64)
+    metrics = np.array([row[3] for row in rows], dtype=np.int64)
+    buckets = np.array([row[4] for row in rows], dtype=np.int64)
+    counts = np.array([row[5] for row in rows], dtype=np.int64)
+    sums = np.array([row[6] or 0 for row in rows], dtype=np.float64)
+
+    unique_keys, group_codes = np.unique(keys, return_inverse=True)
+    names = {}
+    for row in rows:
+        names.setdefault(row[0], (row[1], row[2]))
+
+    workflows = [
+        {'id': int(key), 'name': names[key][0], 'repository': names[key][1]}
+        for key in unique_keys.tolist()
+    ]
+
+    # Conclusions: the bucket is the conclusion code
+    conclusion_mask = metrics == METRIC_RUN_CONCLUSION
+    conclusions = np.zeros((len(unique_keys), max(CONCLUSION_NAMES) + 1), dtype=np.int64)
+    np.add.at(conclusions, (group_codes[conclusion_mask], buckets[conclusion_mask]), counts[conclusion_mask])
+    runs = conclusions.sum(axis=1)
+    successful = conclusions[:, list(SUCCESS_CONCLUSIONS)].sum(axis=1)
+    failed = conclusions[:, list(FAILED_CONCLUSIONS)].sum(axis=1)
+
+    bounds = log_bucket_upper_bounds(DURATION_MIN_SECONDS)
+    for index, workflow in enumerate(workflows):
+        workflow['runs'] = int(runs[index])
+        workflow['successful'] = int(successful[index])
+        workflow['failed'] = int(failed[index])
+        workflow['success_rate'] = round(float(successful[index]) / runs[index], 4) if runs[index] else None
+
+    for metric, metric_name in DURATION_METRICS.items():
+        mask = metrics == metric
+        matrix = histogram_matrix(group_codes[mask], buckets[mask], counts[mask], len(unique_keys))
+        totals, values = percentiles(matrix, QUANTILES, bounds)
+        value_sums = np.zeros(len(unique_keys), dtype=np.float64)
+        np.add.at(value_sums, group_codes[mask], sums[mask])
+        for index, workflow in enumerate(workflows):
+            workflow[metric_name] = _duration_summary(totals[index], values[index], value_sums[index])
+
+    result['total_workflows'] = int(runs.sum())
+    result['successful_workflows'] = int(successful.sum())
+    result['failed_workflows'] = int(failed.sum())
+    timed = [workflow for workflow in workflows if workflow['duration']['avg'] is not None]
+    timed.sort(key=lambda workflow: workflow['duration']['avg'], reverse=True)
+    result['workflow_run_durations'] = [
+        [workflow['name'], round(workflow['duration']['avg'] / 60, 1)] for workflow in timed
+    ]
+    workflows.sort(key=lambda workflow: workflow['runs'], reverse=True)
+    result['workflows'] = workflows
+    return result
+
+def _duration_summary(total, values, value_sum):
+    summary = {'count': int(total), 'avg': round(float(value_sum) / total, 1) if total else None}
+    for quantile, value in zip(QUANTILES, values):
+        summary[f"p{int(quantile * 100)}"] = None if math.isnan(value) else round(float(value), 1)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('maintain',))
+    args = parser.parse_args()
+
+    from prequel_config.settings import configure_logging, get_settings
+    from prequel_db.db_handler import DatabaseHandler
+    configure_logging()
+
+    workflows = get_settings().workflows
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+    try:
+        if args.command == 'maintain':
+            added, truncated = db.maintain_workflow_partitions(workflows.retention_days,
+                                                               workflows.partition_months_ahead)
+            print(f"Added {added} partitions, truncated {truncated} expired partitions")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
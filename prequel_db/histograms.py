@@ -0,0 +1,67 @@
+import math
+
+# numpy is imported inside the functions that use it: it is only needed when
+# percentiles are computed and is the slowest import in prequel_db
+
+# Log-scale buckets: 8 per doubling keeps every percentile within ~9% of the true
+# value, and 200 buckets starting at one minute cover more than 30 years.
+BUCKETS_PER_DOUBLING = 8
+LOG_MIN_VALUE = 60
+MAX_BUCKET = 200
+
+def log_bucket(value, min_value=LOG_MIN_VALUE):
+    """Map a non-negative duration (seconds) to its log-scale bucket"""
+    if value is None or value <= min_value:
+        return 0
+    bucket = int(math.ceil(BUCKETS_PER_DOUBLING * math.log2(value / min_value)))
+    return min(bucket, MAX_BUCKET)
+
+def linear_bucket(value):
+    """Map a small non-negative count (e.g. review rounds) to its own bucket"""
+    if value is None or value < 0:
+        return 0
+    return min(int(value), MAX_BUCKET)
+
+def log_bucket_upper_bounds(min_value=LOG_MIN_VALUE):
+    """Upper bound of every log-scale bucket, as an array indexed by bucket"""
+    import numpy as np
+    return min_value * np.exp2(np.arange(MAX_BUCKET + 1) / BUCKETS_PER_DOUBLING)
+
+def linear_bucket_upper_bounds():
+    import numpy as np
+    return np.arange(MAX_BUCKET + 1, dtype=np.float64)
+
+def histogram_matrix(group_codes, buckets, counts, group_count):
+    """
+    Build a (group_count x buckets) count matrix from parallel arrays
+
+    group_codes, buckets and counts are 1-D arrays of equal length, typically
+    straight from a GROUP BY over a rollup table.
+    """
+    import numpy as np
+    matrix = np.zeros((group_count, MAX_BUCKET + 1), dtype=np.int64)
+    if len(counts):
+        np.add.at(matrix, (np.asarray(group_codes), np.asarray(buckets)), np.asarray(counts))
+    return matrix
+
+def percentiles(matrix, quantiles, upper_bounds):
+    """
+    Percentiles for every row of a histogram matrix at once
+
+    Returns (totals, values) where totals has one entry per row and values
+    is a (rows x len(quantiles)) array of bucket upper bounds; rows without
+    data get NaN.
+    """
+    import numpy as np
+    cumulative = np.cumsum(matrix, axis=1)
+    totals = cumulative[:, -1]
+    # Rank of the observation each quantile falls on, per row
+    ranks = np.ceil(np.outer(totals, np.asarray(quantiles, dtype=np.float64)))
+    ranks = np.maximum(ranks, 1)
+    values = np.empty(ranks.shape, dtype=np.float64)
+    for column in range(ranks.shape[1]):
+        # First bucket whose cumulative count reaches the rank
+        index = (cumulative < ranks[:, [column]]).sum(axis=1)
+        values[:, column] = upper_bounds[np.minimum(index, MAX_BUCKET)]
+    values[totals == 0] = np.nan
+    return totals, values
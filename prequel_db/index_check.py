@@ -0,0 +1,219 @@
+"""
+Query-plan check for the hot queries in prequel_db
+
+Captures the estimated plan (SET SHOWPLAN_XML ON) of every hot query and
+fails when one of them reads a hot table with a full scan (Table Scan or
+Clustered Index Scan) instead of seeking into an index. Queries are not
+executed, so this is safe against any database; the plans are only
+meaningful once _ensure_tables_exist has created the managed indexes.
+
+On a nearly empty database the optimizer scans simply because the tables
+are tiny. --simulate-rows makes it plan as if the hot tables were large by
+overriding their statistics row counts; only use it on a scratch or CI
+database.
+
+Usage: python -m prequel_db.index_check [--simulate-rows N] [--verbose]
+Exit status is 1 when any hot query falls back to a full scan.
+tests/test_index_check.py runs the same check under pytest (one test per
+hot query) and is skipped when no SQL Server is configured.
+"""
+import argparse
+import sys
+import xml.etree.ElementTree as ET
+
+from prequel_config.settings import configure_logging
+from prequel_db.db_pull_requests import timeline_sql, PULL_REQUEST_COLUMNS
+from prequel_db.db_changes import (
+    CHANGE_WINDOW_SQL,
+    CHANGED_REPOSITORIES_SQL,
+    CHANGED_CONTRIBUTORS_SQL,
+    CHANGED_STALE_PRS_SQL
+)
+
+SHOWPLAN_NS = {'p': 'http://schemas.microsoft.com/sqlserver/2004/07/showplan'}
+
+HOT_TABLES = ('pull_requests', 'pr_reviews', 'review_comments', 'stale_pr_history',
+              'workflows', 'workflow_rollup_daily', 'workflow_latest_runs', 'change_tombstones',
+              'pull_requests_archive', 'pr_reviews_archive', 'review_comments_archive')
+FULL_SCAN_OPS = ('Table Scan', 'Clustered Index Scan')
+
+def _in_change_window(sql):
+    """A delta sync query with a literal row_version window"""
+    return (sql.replace('row_version >= ?', 'row_version >= 0x00000000000007D0')
+            .replace('row_version < ?', 'row_version < 0x00000000000007E0'))
+
+# (name, query) pairs mirroring the selective queries in prequel_db with
+# representative literal values. Dashboard aggregates that read every row
+# by design (e.g. PR counts per user) are not listed.
+HOT_QUERIES = [
+    ('pull_request_by_github_id',
+     "SELECT id FROM pull_requests WHERE github_id = 123456789"),
+    ('review_by_github_id',
+     "SELECT id FROM pr_reviews WHERE github_id = 123456789"),
+    ('comment_by_github_id',
+     "SELECT id FROM review_comments WHERE github_id = 123456789"),
+    ('check_for_stale_prs',
+     """SELECT id FROM pull_requests
+        WHERE state = 'open' AND is_stale = 0 AND last_activity_at < DATEADD(day, -7, GETDATE())
+        AND (closed_at IS NULL AND merged_at IS NULL)"""),
+    ('close_open_stale_period',
+     """UPDATE stale_pr_history SET marked_active_at = GETDATE()
+        WHERE pull_request_id = 42 AND marked_active_at IS NULL"""),
+    ('get_stale_prs',
+     """SELECT pr.id, pr.title, pr.number, pr.html_url, repo.full_name, u.username,
+               pr.created_at, pr.last_activity_at
+        FROM pull_requests pr
+        JOIN repositories repo ON pr.repository_id = repo.id
+        JOIN users u ON pr.author_id = u.id
+        WHERE pr.is_stale = 1 AND pr.state = 'open'
+        ORDER BY pr.last_activity_at ASC"""),
+    ('stale_pr_count',
+     "SELECT COUNT(id) FROM pull_requests WHERE is_stale = 1 AND state = 'open'"),
+    ('repository_contributors',
+     """SELECT COUNT(DISTINCT author_id), MAX(last_activity_at)
+        FROM pull_requests WHERE repository_id = 7"""),
+    ('repository_review_count',
+     """SELECT COUNT(rv.id) FROM pr_reviews rv
+        JOIN pull_requests pr ON rv.pull_request_id = pr.id
+        WHERE pr.repository_id = 7"""),
+    ('contributor_repositories',
+     """SELECT DISTINCT repo.name FROM repositories repo
+        JOIN pull_requests pr ON repo.id = pr.repository_id
+        WHERE pr.author_id = 7"""),
+    ('reviewer_review_count',
+     "SELECT COUNT(DISTINCT rv.id) FROM pr_reviews rv WHERE rv.reviewer_id = 7"),
+    ('author_command_count',
+     """SELECT COUNT(DISTINCT rc.id) FROM review_comments rc
+        WHERE rc.author_id = 7 AND rc.contains_command = 1"""),
+    ('first_review_of_pr',
+     """SELECT MIN(rv.submitted_at) FROM pr_reviews rv
+        WHERE rv.pull_request_id = 42 AND rv.reviewer_id <> 7"""),
+    ('pull_request_list_page',
+     f"""SELECT TOP (51) {PULL_REQUEST_COLUMNS}
+         FROM pull_requests pr
+         JOIN repositories repo ON repo.id = pr.repository_id
+         JOIN users u ON u.id = pr.author_id
+         WHERE pr.last_activity_at <= '2024-01-01' AND (pr.last_activity_at < '2024-01-01' OR pr.id < 4242)
+         ORDER BY pr.last_activity_at DESC, pr.id DESC"""),
+    ('pull_request_list_by_state',
+     f"""SELECT TOP (51) {PULL_REQUEST_COLUMNS}
+         FROM pull_requests pr
+         JOIN repositories repo ON repo.id = pr.repository_id
+         JOIN users u ON u.id = pr.author_id
+         WHERE pr.state = 'open'
+         ORDER BY pr.last_activity_at DESC, pr.id DESC"""),
+    ('pull_request_list_by_repository',
+     f"""SELECT TOP (51) {PULL_REQUEST_COLUMNS}
+         FROM pull_requests pr
+         JOIN repositories repo ON repo.id = pr.repository_id
+         JOIN users u ON u.id = pr.author_id
+         WHERE pr.repository_id IN (SELECT id FROM repositories WHERE full_name = 'org/repo')
+         ORDER BY pr.last_activity_at DESC, pr.id DESC"""),
+    ('pull_request_list_by_author',
+     f"""SELECT TOP (51) {PULL_REQUEST_COLUMNS}
+         FROM pull_requests pr
+         JOIN repositories repo ON repo.id = pr.repository_id
+         JOIN users u ON u.id = pr.author_id
+         WHERE pr.author_id IN (SELECT id FROM users WHERE username = 'octocat')
+         ORDER BY pr.last_activity_at DESC, pr.id DESC"""),
+    ('pull_request_timeline',
+     timeline_sql().replace('?', '42')),
+    ('pull_request_timeline_archived',
+     timeline_sql(include_archived=True).replace('?', '42')),
+    ('retention_candidates',
+     """SELECT TOP (100) id FROM pull_requests WITH (READPAST)
+        WHERE state <> 'open' AND closed_at < DATEADD(day, -365, GETDATE())
+        ORDER BY closed_at"""),
+    ('workflow_by_name',
+     "SELECT id FROM workflows WHERE repository_id = 42 AND name = 'CI'"),
+    ('workflow_metrics_window',
+     """SELECT r.workflow_id, r.metric, r.bucket, SUM(r.sample_count), SUM(r.value_sum)
+        FROM workflow_rollup_daily r
+        WHERE r.day >= CAST(DATEADD(day, -30, SYSUTCDATETIME()) AS DATE)
+        GROUP BY r.workflow_id, r.metric, r.bucket"""),
+    ('recent_workflow_runs',
+     "SELECT TOP (50) workflow_id, run_id, completed, conclusion FROM workflow_latest_runs ORDER BY updated_at DESC"),
+    ('change_window',
+     CHANGE_WINDOW_SQL),
+    ('changed_repositories',
+     _in_change_window(CHANGED_REPOSITORIES_SQL)),
+    ('changed_contributors',
+     _in_change_window(CHANGED_CONTRIBUTORS_SQL)),
+    ('changed_stale_prs',
+     _in_change_window(CHANGED_STALE_PRS_SQL)),
+]
+
+def capture_plan(cursor, query):
+    """Estimated plan XML for query; the query itself is not run"""
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        cursor.execute(query)
+        row = cursor.fetchone()
+        # Drain any further statement plans in the batch
+        while cursor.nextset():
+            pass
+        return row[0]
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+
+def full_scans(plan_xml, tables=HOT_TABLES):
+    """(operator, table, index) for every full scan of a hot table in a plan"""
+    root = ET.fromstring(plan_xml)
+    scans = []
+    for rel_op in root.iter(f"{{{SHOWPLAN_NS['p']}}}RelOp"):
+        physical_op = rel_op.get('PhysicalOp')
+        if physical_op not in FULL_SCAN_OPS:
+            continue
+        # The scanned object is on the operator's own child element, not on nested RelOps
+        for child in rel_op:
+            obj = child.find('p:Object', SHOWPLAN_NS)
+            if obj is None:
+                continue
+            table = (obj.get('Table') or '').strip('[]')
+            if table in tables:
+                scans.append((physical_op, table, (obj.get('Index') or '').strip('[]')))
+    return scans
+
+def simulate_rows(cursor, rows):
+    """Make the optimizer plan as if every hot table had this many rows"""
+    for table in HOT_TABLES:
+        cursor.execute(f"UPDATE STATISTICS {table} WITH ROWCOUNT = {int(rows)}, PAGECOUNT = {max(1, int(rows) // 20)}")
+
+def run_checks(cursor, verbose=False):
+    """Return the list of (query name, scans) for hot queries that fall back to full scans"""
+    failures = []
+    for name, query in HOT_QUERIES:
+        scans = full_scans(capture_plan(cursor, query))
+        if scans:
+            failures.append((name, scans))
+        if verbose or scans:
+            status = 'FULL SCAN' if scans else 'ok'
+            print(f"{name:<28} {status}")
+            for physical_op, table, index in scans:
+                print(f"    {physical_op} on {table}" + (f" ({index})" if index else ''))
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--simulate-rows', type=int, help="Plan as if hot tables had this many rows (scratch databases only)")
+    parser.add_argument('--verbose', action='store_true', help="Also list queries that pass")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from prequel_db.db_handler import DatabaseHandler
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False):
+        sys.exit("Database connection failed")
+
+    try:
+        if args.simulate_rows:
+            simulate_rows(db.cursor, args.simulate_rows)
+        failures = run_checks(db.cursor, verbose=args.verbose)
+    finally:
+        db.close()
+
+    print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use index access")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Fan-out of committed changes to live dashboard clients (/api/events)
+
+The model methods publish a compact delta for each change a dashboard shows
+(see DatabaseConnection._after_commit, so only committed writes are sent):
+
+  pr.opened, pr.updated, pr.closed, pr.merged, pr.reopened   the PR's row
+  review.added, comment.added                                 the new row
+  pr.stale, pr.active                                         PR ids whose is_stale changed
+  pr.archived                                                 PR ids moved to the archive tables
+  counters                                                    increments to /api/metrics fields
+
+Clients fetch the dashboard data once and apply deltas from then on. Each
+event is encoded once as a Server-Sent Events frame and the same bytes are
+queued for every client, so publishing costs a deque append per client.
+
+Every client has a bounded buffer. A client that falls that far behind has
+its buffer dropped and gets a single `reset` event instead, telling it to
+refetch; the webhook path never waits for a slow reader. Recent frames are
+kept in a replay ring, so a client reconnecting with Last-Event-ID receives
+what it missed, or `reset` when the gap is no longer covered.
+
+Events are per process: a client sees the writes committed by the server
+process it is connected to. Serve /api/events from the process that handles
+webhooks (the ASGI server streams without holding a thread per client).
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# How long a reconnecting EventSource waits before retrying, sent with the first frame
+RETRY_MILLISECONDS = 3000
+
+# usernames remembered for counter deltas (/api/metrics counts per username)
+MAX_USERNAMES = 10000
+
+def encode_frame(event_id, event_type, data):
+    """One Server-Sent Events frame"""
+    payload = json.dumps(data, separators=(',', ':'), default=str)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode('utf-8')
+
+HEARTBEAT_FRAME = b": keep-alive\n\n"
+
+class Subscription:
+    """
+    One connected client: a bounded queue of frames plus a wake-up
+
+    notify is called (from the publishing thread) whenever frames are
+    queued; the async server passes one that wakes its event loop, threaded
+    servers block in wait() instead.
+    """
+
+    def __init__(self, broker, max_buffer, notify=None):
+        self.max_buffer = max_buffer
+        self._broker = broker
+        self.dropped = 0
+        self._frames = deque()
+        self._reset = False
+        self._ready = threading.Event()
+        self._notify = notify
+        # Id of the last event before this client's queue starts (set by subscribe)
+        self.start_id = None
+
+    def hello(self):
+        """First bytes of the stream: the reconnect delay and the position the queue starts at"""
+        return (f"retry: {RETRY_MILLISECONDS}\n".encode('ascii')
+                + encode_frame(self.start_id, 'hello', {'id': self.start_id}))
+
+    def _push(self, frame):
+        # Called with the broker lock held
+        if self._reset:
+            # Already told to refetch; what it would have missed is covered by that
+            return
+        if len(self._frames) >= self.max_buffer:
+            self.dropped += len(self._frames)
+            self._frames.clear()
+            self._reset = True
+        else:
+            self._frames.append(frame)
+        self._wake()
+
+    def _wake(self):
+        self._ready.set()
+        if self._notify is not None:
+            try:
+                self._notify()
+            except Exception as e:
+                # e.g. the client's event loop is already closed
+                logger.debug(f"Live event client wake-up failed: {str(e)}")
+
+    def drain(self):
+        """Frames queued since the last call (a reset frame if the buffer overflowed)"""
+        broker = self._broker
+        with broker._lock:
+            self._ready.clear()
+            frames = list(self._frames)
+            self._frames.clear()
+            if self._reset:
+                self._reset = False
+                frames.insert(0, broker._reset_frame())
+        return frames
+
+    def wait(self, timeout):
+        """Block until frames are queued or timeout passes; returns drain()"""
+        self._ready.wait(timeout)
+        return self.drain()
+
+class LiveEventBroker:
+    """Publishes committed changes to every subscribed client"""
+
+    def __init__(self, max_clients=1000, client_buffer=256, replay_size=1024):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # Ids are "<epoch>-<sequence>", so ids from before a restart are recognised as unknown
+        self._epoch = str(int(time.time()))
+        self._sequence = 0
+        self._replay = deque(maxlen=replay_size)
+        self._usernames = OrderedDict()
+        self.max_clients = max_clients
+        self.client_buffer = client_buffer
+        self.published = 0
+        self.resets = 0
+        self.rejected = 0
+
+    def configure(self, live_event_settings):
+        """Apply reloaded settings (new limits apply to clients that connect afterwards)"""
+        with self._lock:
+            self.max_clients = live_event_settings.max_clients
+            self.client_buffer = live_event_settings.client_buffer
+            if self._replay.maxlen != live_event_settings.replay_size:
+                self._replay = deque(self._replay, maxlen=live_event_settings.replay_size)
+
+    def _event_id(self, sequence):
+        return f"{self._epoch}-{sequence}"
+
+    def _reset_frame(self):
+        # Called with the lock held; carries the current id so a reconnect resumes from here
+        self.resets += 1
+        return encode_frame(self._event_id(self._sequence), 'reset', {'reason': 'refetch'})
+
+    def publish(self, event_type, data):
+        """Queue an event for every client (safe to call from any thread)"""
+        with self._lock:
+            self._sequence += 1
+            frame = encode_frame(self._event_id(self._sequence), event_type, data)
+            self._replay.append((self._sequence, frame))
+            self.published += 1
+            for subscription in self._subscribers:
+                subscription._push(frame)
+
+    def subscribe(self, last_event_id=None, notify=None):
+        """
+        Register a client; returns None when max_clients are connected
+
+        With last_event_id (the Last-Event-ID of a reconnecting client) the
+        events after it are queued straight away, or a reset if they are no
+        longer all in the replay ring.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                self.rejected += 1
+                return None
+            subscription = Subscription(self, self.client_buffer, notify)
+            subscription.start_id = self._event_id(self._sequence)
+            if last_event_id:
+                missed = self._replay_after(last_event_id)
+                if missed is None or len(missed) > subscription.max_buffer:
+                    subscription._reset = True
+                else:
+                    subscription.start_id = last_event_id
+                    subscription._frames.extend(missed)
+                subscription._ready.set()
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _replay_after(self, last_event_id):
+        """Frames after last_event_id, or None if they are not all in the replay ring"""
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self._epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self._sequence:
+            return None
+        if sequence == self._sequence:
+            return []
+        if not self._replay or self._replay[0][0] > sequence + 1:
+            return None
+        return [frame for frame_sequence, frame in self._replay if frame_sequence > sequence]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    # Helpers for the model methods
+
+    def remember_user(self, user_id, username):
+        """Keep the username of a user id seen on the webhook path, for counter deltas"""
+        with self._lock:
+            self._usernames[user_id] = username
+            self._usernames.move_to_end(user_id)
+            if len(self._usernames) > MAX_USERNAMES:
+                self._usernames.popitem(last=False)
+
+    def username(self, user_id):
+        with self._lock:
+            return self._usernames.get(user_id)
+
+    def publish_counters(self, stale_pr_count=0, pr_author=None, reviewer=None, commenter=None):
+        """
+        Publish increments to the /api/metrics fields
+
+        stale_pr_count is a delta; the others are the user id whose
+        pr_authors, active_reviewers or comment_users count went up by one,
+        sent as {username: 1} when the username is known. Zero and unknown
+        deltas are left out.
+        """
+        counters = {}
+        if stale_pr_count:
+            counters['stale_pr_count'] = stale_pr_count
+        for name, user_id in (('pr_authors', pr_author), ('active_reviewers', reviewer),
+                              ('comment_users', commenter)):
+            username = self.username(user_id) if user_id is not None else None
+            if username is not None:
+                counters[name] = {username: 1}
+        if counters:
+            self.publish('counters', counters)
+
+    def publish_pull_request(self, op, pr_id, repository_id, author_id, number, title, html_url, state,
+                             created_at, updated_at, closed_at=None, merged_at=None, stale_delta=0):
+        """Publish a PR change, plus the counters it moves"""
+        self.publish(f"pr.{op}", {
+            'id': pr_id,
+            'repository_id': repository_id,
+            'author_id': author_id,
+            'author_name': self.username(author_id),
+            'number': number,
+            'title': title,
+            'html_url': html_url,
+            'state': state,
+            'created_at': created_at,
+            'last_activity_at': updated_at,
+            'closed_at': closed_at,
+            'merged_at': merged_at
+        })
+        self.publish_counters(stale_delta, pr_author=author_id if op == 'opened' else None)
+
+    def publish_activity(self, kind, item_id, pull_request_id, user_id, at, added, was_stale, fields=None):
+        """
+        Publish a review or comment (kind) on a PR
+
+        Only added ones are sent, as review.added/comment.added with fields
+        merged in; either way a stale open PR the activity touched
+        (was_stale) becomes active again.
+        """
+        fields = fields or {}
+        reviewer = commenter = None
+        if added:
+            data = {'id': item_id, 'pull_request_id': pull_request_id, 'user_id': user_id,
+                    'username': self.username(user_id), 'at': at}
+            data.update(fields)
+            self.publish(f"{kind}.added", data)
+            # comment_users counts every comment, with or without a command
+            if kind == 'review':
+                reviewer = user_id
+            else:
+                commenter = user_id
+        if was_stale:
+            self.publish('pr.active', {'pull_request_ids': [pull_request_id]})
+        self.publish_counters(-1 if was_stale else 0, reviewer=reviewer, commenter=commenter)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'client_buffer': self.client_buffer,
+                'last_event_id': self._event_id(self._sequence),
+                'published': self.published,
+                'resets': self.resets,
+                'rejected': self.rejected,
+                'dropped': sum(subscription.dropped for subscription in self._subscribers)
+            }
+
+# Shared by the model methods (publishers) and the /api/events endpoints
+live_events = LiveEventBroker()
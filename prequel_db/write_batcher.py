@@ -0,0 +1,204 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from prequel_db.db_handler import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+class _WriteItem:
+    __slots__ = ('fn', 'args', 'future')
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+
+class WriteBatcher:
+    """
+    Coalesces concurrent database writes into one transaction
+
+    submit(fn, *args) queues fn(*args, db=db) and returns a Future. A single
+    writer thread waits up to window_ms after the first queued item (or until
+    max_items are queued) and then runs the whole batch on its own
+    connection inside one transaction, with a savepoint per item. Commits,
+    and the log flushes behind them, happen once per batch instead of
+    several times per item.
+
+    Futures resolve only after the batch commits. An item whose writes fail
+    is rolled back to its savepoint once it returns, dropping everything it
+    wrote and its after-commit callbacks, and is re-run on its own connection
+    after the batch, so callers see the same result they would without
+    batching.
+    If the batch transaction itself fails, every item is re-run that way.
+    """
+
+    def __init__(self, window_ms=5, max_items=50, db_factory=DatabaseHandler):
+        self.window = window_ms / 1000.0
+        self.max_items = max_items
+        self._db_factory = db_factory
+        self._db = None
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'items': 0, 'retried_items': 0, 'failed_batches': 0, 'max_batch': 0}
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args, db=<shared handler>) and return a Future for its result"""
+        item = _WriteItem(fn, args)
+        if self._stopped:
+            self._run_single(item)
+        else:
+            self._queue.put(item)
+        return item.future
+
+    def run(self, fn, *args, timeout=None):
+        """Submit and wait for the result"""
+        return self.submit(fn, *args).result(timeout=timeout)
+
+    def close(self, timeout=5):
+        """Flush queued items and stop the writer thread"""
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['window_ms'] = self.window * 1000
+        stats['max_items'] = self.max_items
+        stats['avg_batch'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else 0
+        return stats
+
+    # Writer thread
+
+    def _collect(self):
+        """Block for the first item, then gather more until the window closes or the batch is full"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop ends after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                logger.error(f"Unexpected error in write batcher: {str(e)}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    def _get_db(self):
+        if self._db is None:
+            db = self._db_factory()
+            if getattr(db, 'connection_failed', False):
+                return None
+            self._db = db
+        return self._db
+
+    def _discard_db(self):
+        try:
+            if self._db is not None:
+                self._db.close()
+        except Exception:
+            pass
+        self._db = None
+
+    def _run_batch(self, batch):
+        db = self._get_db()
+        if db is None:
+            # No shared connection; each item falls back to its own, as without batching
+            for item in batch:
+                self._run_single(item)
+            return
+
+        results = []
+        retry = []
+        try:
+            db.begin_write_batch()
+            for item in batch:
+                db.begin_write_batch_item()
+                try:
+                    result = item.fn(*item.args, db=db)
+                except Exception as e:
+                    logger.error(f"Error in batched write {getattr(item.fn, '__name__', item.fn)}: {str(e)}")
+                    db.write_batch_item_failed = True
+                    result = None
+                if db.write_batch_item_failed and not db.write_batch_aborted:
+                    # Roll back once the item returns: it may have kept writing after
+                    # the failure (e.g. comments after a failed review), and all of it
+                    # is re-run on its own
+                    db._rollback()
+                if db.write_batch_aborted:
+                    raise RuntimeError("Write batch transaction can no longer be used")
+                if db.write_batch_item_failed:
+                    retry.append(item)
+                else:
+                    results.append((item, result))
+            db.end_write_batch(commit=True)
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} items failed, retrying items one by one: {str(e)}")
+            try:
+                db.end_write_batch(commit=False)
+            except Exception:
+                pass
+            self._discard_db()
+            with self._stats_lock:
+                self._stats['failed_batches'] += 1
+                self._stats['retried_items'] += len(batch)
+            for item in batch:
+                self._run_single(item)
+            return
+
+        for item, result in results:
+            item.future.set_result(result)
+        for item in retry:
+            self._run_single(item)
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['items'] += len(batch)
+            self._stats['retried_items'] += len(retry)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+
+    @staticmethod
+    def _run_single(item):
+        try:
+            item.future.set_result(item.fn(*item.args))
+        except Exception as e:
+            item.future.set_exception(e)
+
+def write_batcher_from_settings(db_settings):
+    """Create the WriteBatcher configured by WRITE_BATCH_WINDOW_MS, or None when it is 0"""
+    if db_settings.write_batch_window_ms <= 0:
+        return None
+    return WriteBatcher(
+        window_ms=db_settings.write_batch_window_ms,
+        max_items=db_settings.write_batch_max_items
+    )
@@ -5,6 +5,7 @@ CREATE TABLE repositories (
   name NVARCHAR(255) NOT NULL,
   full_name NVARCHAR(255) NOT NULL,
   created_at DATETIME2 NOT NULL DEFAULT GETDATE(),
+  row_version ROWVERSION,
   CONSTRAINT UQ_repositories_github_id UNIQUE (github_id)
 );
 
@@ -15,6 +16,7 @@ CREATE TABLE users (
   username NVARCHAR(255) NOT NULL,
   avatar_url NVARCHAR(1000) NULL,
   created_at DATETIME2 NOT NULL DEFAULT GETDATE(),
+  row_version ROWVERSION,
   CONSTRAINT UQ_users_github_id UNIQUE (github_id)
 );
 
@@ -34,6 +36,7 @@ CREATE TABLE pull_requests (
   merged_at DATETIME2 NULL,
   is_stale BIT NOT NULL DEFAULT 0,
   last_activity_at DATETIME2 NOT NULL,
+  row_version ROWVERSION,
   CONSTRAINT FK_pull_requests_repositories FOREIGN KEY (repository_id) REFERENCES repositories(id),
   CONSTRAINT FK_pull_requests_users FOREIGN KEY (author_id) REFERENCES users(id),
   CONSTRAINT UQ_pull_requests_github_id UNIQUE (github_id)
@@ -47,6 +50,7 @@ CREATE TABLE pr_reviews (
   reviewer_id INT NOT NULL,
   state NVARCHAR(50) NOT NULL, -- APPROVED, CHANGES_REQUESTED, COMMENTED, DISMISSED
   submitted_at DATETIME2 NOT NULL,
+  row_version ROWVERSION,
   CONSTRAINT FK_pr_reviews_pull_requests FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id),
   CONSTRAINT FK_pr_reviews_users FOREIGN KEY (reviewer_id) REFERENCES users(id),
   CONSTRAINT UQ_pr_reviews_github_id UNIQUE (github_id)
@@ -64,6 +68,10 @@ CREATE TABLE review_comments (
   updated_at DATETIME2 NOT NULL,
   contains_command BIT NOT NULL DEFAULT 0,
   command_type NVARCHAR(50) NULL,
+  body_storage VARCHAR(10) NOT NULL DEFAULT 'full',
+  body_compressed VARBINARY(MAX) NULL,
+  body_sha256 BINARY(32) NULL,
+  row_version ROWVERSION,
   CONSTRAINT FK_review_comments_pr_reviews FOREIGN KEY (review_id) REFERENCES pr_reviews(id),
   CONSTRAINT FK_review_comments_pull_requests FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id),
   CONSTRAINT FK_review_comments_users FOREIGN KEY (author_id) REFERENCES users(id),
@@ -77,12 +85,265 @@ CREATE TABLE stale_pr_history (
   marked_stale_at DATETIME2 NOT NULL DEFAULT GETDATE(),
   marked_active_at DATETIME2 NULL,
   notification_sent BIT NOT NULL DEFAULT 0,
+  notification_count INT NOT NULL DEFAULT 0,
+  last_notified_at DATETIME2 NULL,
   CONSTRAINT FK_stale_pr_history_pull_requests FOREIGN KEY (pull_request_id) REFERENCES pull_requests(id)
 );
 
+-- Rows removed from the change-tracked tables, for delta sync clients (?since= tokens). table_name '*'
+-- rows are markers: a reset (every tracked row was removed) or, with purged_through, the newest purged tombstone
+CREATE TABLE change_tombstones (
+  id BIGINT IDENTITY(1,1) PRIMARY KEY,
+  table_name VARCHAR(40) NOT NULL,
+  row_id INT NULL,
+  repository_id INT NULL,
+  user_id INT NULL,
+  purged_through BINARY(8) NULL,
+  deleted_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  row_version ROWVERSION
+);
+
+-- Archived closed PRs and their history (prequel_db/db_retention.py): same ids and columns as the live tables,
+-- no foreign keys, page compressed
+CREATE TABLE pull_requests_archive (
+  id INT NOT NULL,
+  github_id INT NOT NULL,
+  repository_id INT NOT NULL,
+  author_id INT NOT NULL,
+  title NVARCHAR(500) NOT NULL,
+  number INT NOT NULL,
+  state NVARCHAR(50) NOT NULL,
+  html_url NVARCHAR(1000) NOT NULL,
+  created_at DATETIME2 NOT NULL,
+  updated_at DATETIME2 NOT NULL,
+  closed_at DATETIME2 NULL,
+  merged_at DATETIME2 NULL,
+  is_stale BIT NOT NULL,
+  last_activity_at DATETIME2 NOT NULL,
+  archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  CONSTRAINT PK_pull_requests_archive PRIMARY KEY CLUSTERED (id)
+) WITH (DATA_COMPRESSION = PAGE);
+
+CREATE TABLE pr_reviews_archive (
+  id INT NOT NULL,
+  github_id INT NOT NULL,
+  pull_request_id INT NOT NULL,
+  reviewer_id INT NOT NULL,
+  state NVARCHAR(50) NOT NULL,
+  submitted_at DATETIME2 NOT NULL,
+  archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  CONSTRAINT PK_pr_reviews_archive PRIMARY KEY CLUSTERED (id)
+) WITH (DATA_COMPRESSION = PAGE);
+
+CREATE TABLE review_comments_archive (
+  id INT NOT NULL,
+  github_id INT NOT NULL,
+  review_id INT NULL,
+  pull_request_id INT NOT NULL,
+  author_id INT NOT NULL,
+  body NVARCHAR(MAX) NOT NULL,
+  created_at DATETIME2 NOT NULL,
+  updated_at DATETIME2 NOT NULL,
+  contains_command BIT NOT NULL,
+  command_type NVARCHAR(50) NULL,
+  body_storage VARCHAR(10) NOT NULL,
+  body_compressed VARBINARY(MAX) NULL,
+  body_sha256 BINARY(32) NULL,
+  archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  CONSTRAINT PK_review_comments_archive PRIMARY KEY CLUSTERED (id)
+) WITH (DATA_COMPRESSION = PAGE);
+
+CREATE TABLE stale_pr_history_archive (
+  id INT NOT NULL,
+  pull_request_id INT NOT NULL,
+  marked_stale_at DATETIME2 NOT NULL,
+  marked_active_at DATETIME2 NULL,
+  notification_sent BIT NOT NULL,
+  notification_count INT NOT NULL,
+  last_notified_at DATETIME2 NULL,
+  archived_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  CONSTRAINT PK_stale_pr_history_archive PRIMARY KEY CLUSTERED (id)
+) WITH (DATA_COMPRESSION = PAGE);
+
+-- Slack routing rules: a rule matches a repository, a team or everything, optionally limited to one event type
+CREATE TABLE slack_routes (
+  id INT IDENTITY(1,1) PRIMARY KEY,
+  repository NVARCHAR(255) NULL,
+  team NVARCHAR(255) NULL,
+  event_type NVARCHAR(100) NULL,
+  webhook_url NVARCHAR(1000) NOT NULL,
+  enabled BIT NOT NULL DEFAULT 1,
+  created_at DATETIME2 NOT NULL DEFAULT GETDATE()
+);
+
+-- Team membership for routing (team -> repository full_name)
+CREATE TABLE slack_team_repositories (
+  id INT IDENTITY(1,1) PRIMARY KEY,
+  team NVARCHAR(255) NOT NULL,
+  repository NVARCHAR(255) NOT NULL,
+  CONSTRAINT UQ_slack_team_repositories UNIQUE (team, repository)
+);
+
+-- Routing version counter, bumped on every routing change so app instances know when to reload
+CREATE TABLE slack_routing_version (
+  id INT PRIMARY KEY,
+  version BIGINT NOT NULL
+);
+INSERT INTO slack_routing_version (id, version) VALUES (1, 0);
+
+-- Replication heartbeat, refreshed by the primary so read replicas can measure their lag
+CREATE TABLE replication_heartbeat (
+  id INT PRIMARY KEY,
+  beat_at DATETIME2 NOT NULL
+);
+
+-- Cycle-time rollups: which metrics each PR has already contributed to
+CREATE TABLE pr_cycle_facts (
+  pull_request_id INT PRIMARY KEY,
+  first_review_recorded BIT NOT NULL DEFAULT 0,
+  merge_recorded BIT NOT NULL DEFAULT 0
+);
+
+-- Daily log-scale histograms per repository and author
+-- (metric 1 = time to first review, 2 = time to merge, 3 = review rounds)
+CREATE TABLE pr_cycle_rollup_daily (
+  metric TINYINT NOT NULL,
+  day DATE NOT NULL,
+  repository_id INT NOT NULL,
+  author_id INT NOT NULL,
+  bucket SMALLINT NOT NULL,
+  pr_count INT NOT NULL,
+  CONSTRAINT PK_pr_cycle_rollup_daily PRIMARY KEY (metric, day, repository_id, author_id, bucket)
+);
+
+-- GitHub reconciliation sync state: ETag and since cursor per repository resource
+CREATE TABLE github_sync_state (
+  repository NVARCHAR(255) NOT NULL,
+  resource NVARCHAR(100) NOT NULL,
+  etag NVARCHAR(255) NULL,
+  since_cursor NVARCHAR(40) NULL,
+  synced_at DATETIME2 NOT NULL DEFAULT GETDATE(),
+  CONSTRAINT PK_github_sync_state PRIMARY KEY (repository, resource)
+);
+
+-- Slack notifications queued in the same transaction as the event data (status: 0 pending, 1 delivered, 2 dead)
+CREATE TABLE notification_outbox (
+  id BIGINT IDENTITY(1,1) PRIMARY KEY,
+  repository NVARCHAR(255) NULL,
+  event_type NVARCHAR(100) NOT NULL,
+  payload NVARCHAR(MAX) NOT NULL,
+  status TINYINT NOT NULL DEFAULT 0,
+  attempts INT NOT NULL DEFAULT 0,
+  next_attempt_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  claim_token UNIQUEIDENTIFIER NULL,
+  locked_until DATETIME2 NULL,
+  delivered_targets NVARCHAR(MAX) NULL,
+  last_error NVARCHAR(1000) NULL,
+  created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+  delivered_at DATETIME2 NULL
+);
+
+-- GitHub Actions workflows: raw completed runs and jobs are partitioned by month
+-- (maintain_workflow_partitions adds future months and truncates expired ones)
+CREATE PARTITION FUNCTION pf_workflow_month (DATE) AS RANGE RIGHT FOR VALUES ('2025-01-01');
+CREATE PARTITION SCHEME ps_workflow_month AS PARTITION pf_workflow_month ALL TO ([PRIMARY]);
+
+CREATE TABLE workflows (
+  id INT IDENTITY(1,1) PRIMARY KEY,
+  repository_id INT NOT NULL,
+  name NVARCHAR(255) NOT NULL,
+  github_workflow_id BIGINT NULL,
+  created_at DATETIME NOT NULL DEFAULT GETDATE(),
+  CONSTRAINT UQ_workflows_repository_name UNIQUE (repository_id, name),
+  FOREIGN KEY (repository_id) REFERENCES repositories(id)
+);
+
+CREATE TABLE workflow_runs (
+  run_day DATE NOT NULL,
+  run_id BIGINT NOT NULL,
+  run_attempt SMALLINT NOT NULL,
+  workflow_id INT NOT NULL,
+  conclusion TINYINT NOT NULL,
+  created_at DATETIME2(0) NULL,
+  started_at DATETIME2(0) NULL,
+  completed_at DATETIME2(0) NOT NULL,
+  duration_seconds INT NULL,
+  CONSTRAINT PK_workflow_runs PRIMARY KEY CLUSTERED (run_day, run_id, run_attempt) WITH (IGNORE_DUP_KEY = ON)
+) ON ps_workflow_month (run_day)
+WITH (DATA_COMPRESSION = ROW);
+
+CREATE TABLE workflow_jobs (
+  job_day DATE NOT NULL,
+  job_id BIGINT NOT NULL,
+  run_id BIGINT NULL,
+  run_attempt SMALLINT NOT NULL,
+  workflow_id INT NOT NULL,
+  conclusion TINYINT NOT NULL,
+  created_at DATETIME2(0) NULL,
+  started_at DATETIME2(0) NULL,
+  completed_at DATETIME2(0) NOT NULL,
+  queue_seconds INT NULL,
+  duration_seconds INT NULL,
+  CONSTRAINT PK_workflow_jobs PRIMARY KEY CLUSTERED (job_day, job_id) WITH (IGNORE_DUP_KEY = ON)
+) ON ps_workflow_month (job_day)
+WITH (DATA_COMPRESSION = ROW);
+
+-- Per-workflow daily histograms (metric: 1 conclusion, 2 run duration, 3 job queue time, 4 job duration)
+CREATE TABLE workflow_rollup_daily (
+  metric TINYINT NOT NULL,
+  day DATE NOT NULL,
+  workflow_id INT NOT NULL,
+  bucket SMALLINT NOT NULL,
+  sample_count INT NOT NULL,
+  value_sum BIGINT NOT NULL,
+  CONSTRAINT PK_workflow_rollup_daily PRIMARY KEY (day, workflow_id, metric, bucket)
+);
+
+CREATE TABLE workflow_latest_runs (
+  workflow_id INT PRIMARY KEY,
+  run_id BIGINT NOT NULL,
+  run_attempt SMALLINT NOT NULL,
+  run_number INT NULL,
+  completed BIT NOT NULL,
+  conclusion TINYINT NULL,
+  triggered_by NVARCHAR(255) NULL,
+  html_url NVARCHAR(255) NULL,
+  created_at DATETIME2(0) NULL,
+  duration_seconds INT NULL,
+  updated_at DATETIME2 NOT NULL
+);
+
 -- Create indexes for better performance
 CREATE INDEX IX_pull_requests_last_activity_at ON pull_requests(last_activity_at);
 CREATE INDEX IX_pull_requests_created_at ON pull_requests(created_at);
-CREATE INDEX IX_pull_requests_is_stale ON pull_requests(is_stale);
 CREATE INDEX IX_pr_reviews_submitted_at ON pr_reviews(submitted_at);
-CREATE INDEX IX_review_comments_contains_command ON review_comments(contains_command);
\ No newline at end of file
+
+-- Workload-matched indexes (kept in sync with prequel_db/db_indexes.py)
+CREATE NONCLUSTERED INDEX IX_pull_requests_stale_state_activity ON pull_requests (is_stale, state, last_activity_at) INCLUDE (repository_id, author_id, title, number, html_url, created_at);
+CREATE NONCLUSTERED INDEX IX_pull_requests_open_activity ON pull_requests (last_activity_at) INCLUDE (is_stale) WHERE state = 'open' AND closed_at IS NULL AND merged_at IS NULL;
+CREATE NONCLUSTERED INDEX IX_pull_requests_repository_activity ON pull_requests (repository_id, last_activity_at) INCLUDE (author_id, is_stale, state);
+CREATE NONCLUSTERED INDEX IX_pull_requests_author_activity ON pull_requests (author_id, last_activity_at) INCLUDE (repository_id, is_stale, state);
+CREATE NONCLUSTERED INDEX IX_pull_requests_state_activity ON pull_requests (state, last_activity_at) INCLUDE (repository_id, author_id, is_stale);
+CREATE NONCLUSTERED INDEX IX_repositories_full_name ON repositories (full_name);
+CREATE NONCLUSTERED INDEX IX_users_username ON users (username);
+CREATE NONCLUSTERED INDEX IX_pr_reviews_reviewer ON pr_reviews (reviewer_id);
+CREATE NONCLUSTERED INDEX IX_pr_reviews_pull_request ON pr_reviews (pull_request_id, submitted_at) INCLUDE (reviewer_id, state);
+CREATE NONCLUSTERED INDEX IX_review_comments_author_command ON review_comments (author_id, contains_command);
+CREATE NONCLUSTERED INDEX IX_review_comments_pull_request_created ON review_comments (pull_request_id, created_at) INCLUDE (author_id, review_id, contains_command, command_type);
+CREATE NONCLUSTERED INDEX IX_stale_pr_history_active ON stale_pr_history (pull_request_id) INCLUDE (notification_sent, notification_count, last_notified_at) WHERE marked_active_at IS NULL;
+CREATE NONCLUSTERED INDEX IX_notification_outbox_due ON notification_outbox (next_attempt_at, id) INCLUDE (locked_until) WHERE status = 0;
+CREATE NONCLUSTERED INDEX IX_workflow_latest_runs_updated ON workflow_latest_runs (updated_at) INCLUDE (run_id, completed, conclusion, duration_seconds);
+CREATE NONCLUSTERED INDEX IX_repositories_row_version ON repositories (row_version);
+CREATE NONCLUSTERED INDEX IX_users_row_version ON users (row_version);
+CREATE NONCLUSTERED INDEX IX_pull_requests_row_version ON pull_requests (row_version) INCLUDE (repository_id, author_id);
+CREATE NONCLUSTERED INDEX IX_pr_reviews_row_version ON pr_reviews (row_version) INCLUDE (pull_request_id, reviewer_id);
+CREATE NONCLUSTERED INDEX IX_review_comments_row_version ON review_comments (row_version) INCLUDE (author_id);
+CREATE NONCLUSTERED INDEX IX_change_tombstones_row_version ON change_tombstones (row_version) INCLUDE (table_name, row_id, repository_id, user_id);
+CREATE NONCLUSTERED INDEX IX_change_tombstones_markers ON change_tombstones (row_version) INCLUDE (purged_through) WHERE table_name = '*';
+CREATE NONCLUSTERED INDEX IX_pull_requests_closed_at ON pull_requests (closed_at) INCLUDE (state) WHERE closed_at IS NOT NULL;
+CREATE NONCLUSTERED INDEX IX_pull_requests_archive_repository ON pull_requests_archive (repository_id) INCLUDE (author_id, is_stale, last_activity_at);
+CREATE NONCLUSTERED INDEX IX_pull_requests_archive_author ON pull_requests_archive (author_id) INCLUDE (repository_id);
+CREATE NONCLUSTERED INDEX IX_pr_reviews_archive_pull_request ON pr_reviews_archive (pull_request_id) INCLUDE (reviewer_id, github_id);
+CREATE NONCLUSTERED INDEX IX_pr_reviews_archive_reviewer ON pr_reviews_archive (reviewer_id);
+CREATE NONCLUSTERED INDEX IX_review_comments_archive_pull_request ON review_comments_archive (pull_request_id, created_at);
+CREATE NONCLUSTERED INDEX IX_review_comments_archive_author_command ON review_comments_archive (author_id, contains_command);
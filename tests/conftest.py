@@ -0,0 +1,111 @@
+"""
+Shared fixtures: the fake GitHub API from tools/fake_github.py and an
+in-memory stand-in for the DatabaseHandler methods the sync and the branch
+protection job use
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import fake_github
+
+class MemoryDB:
+    """Sync state, users, PRs, reviews and comments kept in dicts; shared by every worker"""
+
+    connection_failed = False
+
+    def __init__(self, repositories=()):
+        self.lock = threading.Lock()
+        self.repositories = [(index + 1, name) for index, name in enumerate(repositories)]
+        self.sync_state = {}
+        self.users = {}
+        self.pull_requests = {}
+        self.reviews = {}
+        self.comments = {}
+        self.applied = []
+        self.fail_pull_requests = set()
+
+    def close(self):
+        pass
+
+    def get_repositories_for_sync(self):
+        return list(self.repositories)
+
+    def get_sync_state(self, repository, resource):
+        with self.lock:
+            return self.sync_state.get((repository, resource), (None, None))
+
+    def save_sync_state(self, repository, resource, etag, cursor):
+        with self.lock:
+            self.sync_state[(repository, resource)] = (etag, cursor)
+        return True
+
+    def get_or_create_user(self, user):
+        with self.lock:
+            return self.users.setdefault(user['id'], len(self.users) + 1)
+
+    def get_pull_request_versions(self, github_ids):
+        with self.lock:
+            return {github_id: (pr['id'], pr['updated_at'], pr['state'])
+                    for github_id, pr in self.pull_requests.items() if github_id in github_ids}
+
+    def get_or_create_pull_request(self, pr, repository_id, author_id):
+        if pr['id'] in self.fail_pull_requests:
+            return None
+        with self.lock:
+            stored = self.pull_requests.setdefault(pr['id'], {'id': len(self.pull_requests) + 1})
+            stored.update(repository_id=repository_id, number=pr['number'], state=pr['state'],
+                          updated_at=datetime.strptime(pr['updated_at'], '%Y-%m-%dT%H:%M:%SZ'))
+            self.applied.append(pr['id'])
+            return stored['id']
+
+    def update_cycle_time_rollups(self, pr_id):
+        pass
+
+    def get_pull_request_id_by_number(self, repository_id, number):
+        with self.lock:
+            for pr in self.pull_requests.values():
+                if pr['repository_id'] == repository_id and pr['number'] == number:
+                    return pr['id'], pr['state']
+        return None, None
+
+    def get_review_states(self, pr_id):
+        with self.lock:
+            return {github_id: state for github_id, (stored_pr_id, state) in self.reviews.items()
+                    if stored_pr_id == pr_id}
+
+    def add_pr_review(self, review, pr_id, reviewer_id):
+        with self.lock:
+            self.reviews[review['id']] = (pr_id, review['state'])
+        return review['id']
+
+    def add_review_comment(self, comment, pr_id, author_id):
+        with self.lock:
+            self.comments[comment['id']] = (pr_id, comment['updated_at'])
+        return comment['id']
+
+@pytest.fixture
+def github_server():
+    """Start a fake GitHub API on a free port; call with FakeGitHub options"""
+    servers = []
+
+    def start(**options):
+        server = fake_github.serve(0, **options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def memory_db():
+    return MemoryDB
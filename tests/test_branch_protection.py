@@ -0,0 +1,102 @@
+"""BranchProtectionApplier against the fake GitHub API"""
+import pytest
+
+from prequel_app.branch_protection import BranchProtectionApplier, BranchProtectionJob, ProtectionRules
+from prequel_app.github_sync import GitHubClient, RateLimiter
+
+PROTECTED = 'fake-org/repo0'
+UNPROTECTED = 'fake-org/repo1'
+
+@pytest.fixture
+def setup(github_server, memory_db):
+    server = github_server(repos=2, prs=1)
+    db = memory_db([PROTECTED, UNPROTECTED])
+    client = GitHubClient(api_url=server.github.base_url,
+                          rate_limiter=RateLimiter(min_remaining=0, min_write_interval=0))
+    return server.github, db, BranchProtectionApplier(client, concurrency=2, db_factory=lambda: db)
+
+def rules(reviewers=2, **options):
+    return ProtectionRules.from_request(dict(options, requirePullRequest=True, requiredReviewers=reviewers))
+
+def test_put_carries_over_unmanaged_settings(setup):
+    github, db, applier = setup
+
+    assert applier.apply_repository(db, PROTECTED, 'main', rules(dismissStaleReviews=True)) == 'applied'
+
+    protection = github.protections[(PROTECTED, 'main')]
+    reviews = protection['required_pull_request_reviews']
+    assert reviews['required_approving_review_count'] == 2
+    assert reviews['dismiss_stale_reviews'] is True
+    assert reviews['require_last_push_approval'] is True
+    assert reviews['dismissal_restrictions']['teams'] == [{'slug': 'maintainers'}]
+    assert reviews['bypass_pull_request_allowances']['apps'] == [{'slug': 'dependabot'}]
+    assert protection['required_status_checks']['contexts'] == ['ci/build']
+    assert protection['required_linear_history'] == {'enabled': True}
+    assert protection['required_conversation_resolution'] == {'enabled': True}
+    assert github.stats['protection_updates'] == 1
+    assert github.stats['protection_settings_dropped'] == 0
+
+def test_unchanged_protection_costs_one_304(setup):
+    github, db, applier = setup
+
+    assert applier.apply_repository(db, PROTECTED, 'main', rules()) == 'applied'
+    # The PUT dropped the ETag: one full read, which finds nothing to change
+    assert applier.apply_repository(db, PROTECTED, 'main', rules()) == 'unchanged'
+    assert db.get_sync_state(PROTECTED, 'protection/main')[0] is not None
+    remaining = github.remaining
+
+    assert applier.apply_repository(db, PROTECTED, 'main', rules()) == 'unchanged'
+    assert github.stats['not_modified'] == 1
+    assert github.remaining == remaining
+    assert github.stats['protection_updates'] == 1
+
+def test_changed_rules_after_304_are_diffed_and_applied(setup):
+    github, db, applier = setup
+    applier.apply_repository(db, PROTECTED, 'main', rules())
+    applier.apply_repository(db, PROTECTED, 'main', rules())
+
+    assert applier.apply_repository(db, PROTECTED, 'main', rules(reviewers=3)) == 'applied'
+
+    assert github.stats['not_modified'] == 1
+    assert github.protections[(PROTECTED, 'main')]['required_pull_request_reviews']['required_approving_review_count'] == 3
+    assert github.stats['protection_settings_dropped'] == 0
+
+def test_out_of_band_change_is_reapplied(setup):
+    github, db, applier = setup
+    applier.apply_repository(db, PROTECTED, 'main', rules())
+    applier.apply_repository(db, PROTECTED, 'main', rules())
+
+    # Someone lowers the review count on GitHub: the stored ETag no longer matches
+    with github.lock:
+        github.set_protection(PROTECTED, 'main', {'required_pull_request_reviews': {'required_approving_review_count': 1}})
+
+    assert applier.apply_repository(db, PROTECTED, 'main', rules()) == 'applied'
+    assert github.stats['not_modified'] == 0
+    assert github.protections[(PROTECTED, 'main')]['required_pull_request_reviews']['required_approving_review_count'] == 2
+
+def test_unprotected_branch_is_protected(setup):
+    github, db, applier = setup
+
+    assert applier.apply_repository(db, UNPROTECTED, 'main', rules(requireCodeOwners=True)) == 'applied'
+
+    reviews = github.protections[(UNPROTECTED, 'main')]['required_pull_request_reviews']
+    assert reviews['required_approving_review_count'] == 2
+    assert reviews['require_code_owner_reviews'] is True
+    assert applier.apply_repository(db, UNPROTECTED, 'main', rules(requireCodeOwners=True)) == 'unchanged'
+
+def test_job_covers_every_known_repository(setup):
+    github, db, applier = setup
+    job = BranchProtectionJob(None, 'main', rules())
+
+    applier.run(job)
+
+    snapshot = job.snapshot()
+    assert snapshot['status'] == 'completed'
+    assert (snapshot['total'], snapshot['applied'], snapshot['unchanged'], snapshot['failed']) == (2, 2, 0, 0)
+    assert snapshot['errors'] == []
+
+    job = BranchProtectionJob(None, 'main', rules())
+    applier.run(job)
+    assert job.snapshot()['unchanged'] == 2
+    assert github.stats['protection_updates'] == 2
+    assert github.stats['protection_settings_dropped'] == 0
@@ -0,0 +1,134 @@
+"""GitHubSync against the fake GitHub API: ETag 304s, cursors and rate-limit pauses"""
+import threading
+import time
+
+from prequel_app.github_sync import GitHubClient, GitHubSync, RateLimiter
+
+REPO = 'fake-org/repo0'
+
+def sync(server, db, rate_limiter=None):
+    """One sync run with a fresh client, so the request counters are per run"""
+    client = GitHubClient(api_url=server.github.base_url,
+                          rate_limiter=rate_limiter or RateLimiter(min_remaining=0))
+    return GitHubSync(client, concurrency=2, db_factory=lambda: db).sync_all()
+
+def pull_request(server, number):
+    return server.github.repos[REPO]['pulls'][number]
+
+def test_first_sync_applies_everything(github_server, memory_db):
+    server = github_server(repos=1, prs=12, reviews_per_pr=2, comments_per_pr=3)
+    db = memory_db([REPO])
+
+    totals = sync(server, db)
+
+    assert (totals['pull_requests'], totals['reviews'], totals['comments'], totals['errors']) == (12, 24, 36, 0)
+    assert len(db.comments) == 36
+
+def test_unchanged_repository_costs_only_304s(github_server, memory_db):
+    server = github_server(repos=1, prs=12)
+    db = memory_db([REPO])
+    sync(server, db)
+    # The comment cursor moved on the first run, so its ETag is only kept from the second
+    sync(server, db)
+
+    totals = sync(server, db)
+
+    assert (totals['pull_requests'], totals['reviews'], totals['comments'], totals['errors']) == (0, 0, 0, 0)
+    assert totals['requests'] == totals['not_modified'] == 2
+
+def test_cursor_advances_past_applied_pull_requests(github_server, memory_db):
+    server = github_server(repos=1, prs=12, reviews_per_pr=0, comments_per_pr=0)
+    db = memory_db([REPO])
+    sync(server, db)
+    _, cursor = db.get_sync_state(REPO, 'pulls')
+    assert cursor == pull_request(server, 12)['updated_at']
+
+    server.github.mutate(REPO, 5)
+    totals = sync(server, db)
+
+    assert totals['pull_requests'] == 1
+    assert db.get_sync_state(REPO, 'pulls')[1] == pull_request(server, 5)['updated_at'] > cursor
+    # Comments, one page of pulls and the reviews of the one PR applied
+    assert totals['requests'] == 3
+
+def test_update_in_the_cursor_second_is_applied(github_server, memory_db):
+    server = github_server(repos=1, prs=12)
+    db = memory_db([REPO])
+    sync(server, db)
+    _, cursor = db.get_sync_state(REPO, 'pulls')
+
+    # Same updated_at as the cursor: a `>` cutoff would skip it for good
+    server.github.mutate(REPO, 4, same_second=True)
+    assert pull_request(server, 4)['updated_at'] == cursor
+    db.applied.clear()
+    totals = sync(server, db)
+
+    assert db.applied and set(db.applied) == {pull_request(server, 4)['id']}
+    assert totals['comments'] >= 1
+    assert len(db.comments) == 12 * 3 + 1
+
+def test_failed_pull_request_holds_the_cursor(github_server, memory_db):
+    server = github_server(repos=1, prs=12)
+    db = memory_db([REPO])
+    sync(server, db)
+
+    server.github.mutate(REPO, 3)
+    server.github.mutate(REPO, 7)
+    db.fail_pull_requests.add(pull_request(server, 3)['id'])
+    totals = sync(server, db)
+
+    # PR 7 is newer and applied, but the cursor may not pass PR 3
+    assert (totals['pull_requests'], totals['errors']) == (1, 1)
+    assert db.get_sync_state(REPO, 'pulls') == (None, pull_request(server, 3)['updated_at'])
+
+    db.fail_pull_requests.clear()
+    db.applied.clear()
+    totals = sync(server, db)
+
+    assert (totals['pull_requests'], totals['errors']) == (1, 0)
+    assert set(db.applied) == {pull_request(server, 3)['id']}
+    assert db.get_sync_state(REPO, 'pulls')[1] == pull_request(server, 7)['updated_at']
+
+def test_secondary_limit_pauses_and_retries(github_server, memory_db):
+    server = github_server(repos=1, prs=3, secondary_every=4)
+    db = memory_db([REPO])
+
+    started = time.monotonic()
+    totals = sync(server, db)
+
+    assert server.github.stats['secondary_limited'] >= 1
+    assert time.monotonic() - started >= 1
+    assert (totals['pull_requests'], totals['reviews'], totals['errors']) == (3, 6, 0)
+
+def test_primary_limit_pauses_until_reset(github_server, memory_db):
+    server = github_server(repos=1, prs=3, rate_limit=4)
+    github = server.github
+    github.reset_at = int(time.time()) + 2
+    db = memory_db([REPO])
+
+    def reset():
+        with github.lock:
+            github.remaining = github.rate_limit
+    timer = threading.Timer(1.5, reset)
+    timer.start()
+    try:
+        started = time.monotonic()
+        # Comments, pulls and one review page leave 1 request: every worker waits for the reset
+        totals = sync(server, db, RateLimiter(min_remaining=1, max_wait=10))
+    finally:
+        timer.cancel()
+
+    assert time.monotonic() - started >= 1.5
+    assert (totals['pull_requests'], totals['reviews'], totals['errors']) == (3, 6, 0)
+
+def test_primary_limit_beyond_max_wait_stops_the_sync(github_server, memory_db):
+    server = github_server(repos=1, prs=3)
+    db = memory_db([REPO])
+
+    started = time.monotonic()
+    # The fake resets an hour from now, far past max_wait
+    totals = sync(server, db, RateLimiter(min_remaining=server.github.rate_limit, max_wait=5))
+
+    assert time.monotonic() - started < 5
+    assert (totals['pull_requests'], totals['errors']) == (0, 1)
+    assert db.get_sync_state(REPO, 'pulls') == (None, None)
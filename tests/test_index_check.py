@@ -0,0 +1,37 @@
+"""
+Every hot query uses index access (prequel_db/index_check.py) on a real SQL Server
+
+Skipped unless pyodbc is installed and SQL_SERVER, SQL_DATABASE,
+SQL_USERNAME and SQL_PASSWORD point at a database. Set
+INDEX_CHECK_SIMULATE_ROWS to plan as if the hot tables were that large
+(scratch or CI databases only, like --simulate-rows).
+"""
+import os
+
+import pytest
+
+from prequel_db.index_check import HOT_QUERIES, capture_plan, full_scans, simulate_rows
+
+@pytest.fixture(scope='module')
+def cursor():
+    pytest.importorskip('pyodbc')
+    from prequel_config.settings import get_settings
+    missing = get_settings().database.missing()
+    if missing:
+        pytest.skip(f"No SQL Server configured ({', '.join(missing)} not set)")
+
+    from prequel_db.db_handler import DatabaseHandler
+    db = DatabaseHandler()
+    if getattr(db, 'connection_failed', False) or not db.conn:
+        pytest.fail("Database connection failed")
+    try:
+        rows = os.environ.get('INDEX_CHECK_SIMULATE_ROWS')
+        if rows:
+            simulate_rows(db.cursor, int(rows))
+        yield db.cursor
+    finally:
+        db.close()
+
+@pytest.mark.parametrize('query', [query for _, query in HOT_QUERIES], ids=[name for name, _ in HOT_QUERIES])
+def test_hot_query_uses_index_access(cursor, query):
+    assert full_scans(capture_plan(cursor, query)) == []
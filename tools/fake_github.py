@@ -0,0 +1,442 @@
+"""
+Fake GitHub REST API for exercising the reconciliation sync and bulk branch protection
+
+Serves generated repositories with the endpoints the sync reads:
+  GET /repos/{owner}/{repo}/pulls              (state, sort=updated, direction, per_page, page)
+  GET /repos/{owner}/{repo}/pulls/{n}/reviews  (per_page, page)
+  GET /repos/{owner}/{repo}/pulls/comments     (since, sort=updated, direction, per_page, page)
+with weak ETags and 304s for If-None-Match, Link pagination and
+X-RateLimit-* headers (304s do not use up the limit, like on GitHub).
+
+Branch protection (branches main and develop exist; main starts protected
+with one required review in every other repository, plus dismissal and
+bypass restrictions, last push approval, linear history and conversation
+resolution):
+  GET /repos/{owner}/{repo}/branches/{branch}/protection   (ETag/304, 404 when not protected)
+  PUT /repos/{owner}/{repo}/branches/{branch}/protection
+Like GitHub, a PUT replaces the whole protection and anything left out of
+it is switched off. /_stats counts PUTs that dropped a setting the app does
+not manage (protection_settings_dropped), which should stay 0.
+
+Control endpoints:
+  GET  /_stats                           request, 304 and rate-limit counters
+  POST /_mutate/{owner}/{repo}/{n}       touch a PR: new comment, bumped updated_at
+       ?same_second=1                    without advancing the clock, so updated_at can equal
+                                         the sync cursor (the next sync must still apply it)
+  POST /_reset_stats
+
+--secondary-every N answers every Nth request with a 403 secondary rate
+limit and Retry-After: 1.
+
+Usage:
+  python tools/fake_github.py [--port 5055] [--repos 3] [--prs 250] [--rate-limit 5000]
+  GITHUB_API_URL=http://127.0.0.1:5055 python -m prequel_app.github_sync
+  python -m prequel_app.branch_protection --api-url http://127.0.0.1:5055 --branch main --repo fake-org/repo0
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+
+PULLS_PATH = re.compile(r'^/repos/([^/]+/[^/]+)/pulls$')
+REVIEWS_PATH = re.compile(r'^/repos/([^/]+/[^/]+)/pulls/(\d+)/reviews$')
+COMMENTS_PATH = re.compile(r'^/repos/([^/]+/[^/]+)/pulls/comments$')
+MUTATE_PATH = re.compile(r'^/_mutate/([^/]+/[^/]+)/(\d+)$')
+PROTECTION_PATH = re.compile(r'^/repos/([^/]+/[^/]+)/branches/([^/]+)/protection$')
+BRANCHES = ('main', 'develop')
+
+# Settings GET returns as {"enabled": bool}; always present, like on GitHub
+PROTECTION_TOGGLES = ('required_linear_history', 'allow_force_pushes', 'allow_deletions', 'block_creations',
+                      'required_conversation_resolution', 'lock_branch', 'allow_fork_syncing')
+
+# Review settings the branch protection job manages; a PUT may change these
+MANAGED_REVIEW_SETTINGS = ('required_approving_review_count', 'dismiss_stale_reviews', 'require_code_owner_reviews')
+
+def _iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _actors(section):
+    """Users, teams and apps of an update body in the shape GET returns"""
+    return {
+        'users': [{'login': login} for login in section.get('users', [])],
+        'teams': [{'slug': slug} for slug in section.get('teams', [])],
+        'apps': [{'slug': slug} for slug in section.get('apps', [])]
+    }
+
+def _dropped_settings(previous, protection):
+    """Unmanaged settings that were on in previous and are off or gone in protection"""
+    def unmanaged(value):
+        value = {key: item for key, item in value.items() if key != 'url'}
+        reviews = value.get('required_pull_request_reviews')
+        if reviews:
+            value['required_pull_request_reviews'] = {key: item for key, item in reviews.items()
+                                                      if key not in MANAGED_REVIEW_SETTINGS}
+        return value
+    before, after = unmanaged(previous), unmanaged(protection)
+    # Turning reviews off altogether is a managed change; their sub-settings go with them
+    if not after.get('required_pull_request_reviews'):
+        before.pop('required_pull_request_reviews', None)
+    return [key for key, value in before.items()
+            if value not in (None, {'enabled': False}) and after.get(key) != value]
+
+class FakeGitHub:
+    """In-memory repositories, PRs, reviews and comments plus request counters"""
+
+    def __init__(self, repos=3, prs=250, reviews_per_pr=2, comments_per_pr=3, rate_limit=5000, secondary_every=0):
+        self.lock = threading.Lock()
+        self.rate_limit = rate_limit
+        self.remaining = rate_limit
+        self.reset_at = int(time.time()) + 3600
+        self.secondary_every = secondary_every
+        self.stats = self._new_stats()
+        self.base_url = ''
+        self.repos = {}
+        self.protections = {}
+        self._next_id = 1000
+        self.clock = datetime(2024, 1, 1)
+
+        for r in range(repos):
+            full_name = f"fake-org/repo{r}"
+            repo = {'pulls': {}, 'reviews': {}, 'comments': {}}
+            self.repos[full_name] = repo
+            for number in range(1, prs + 1):
+                self._add_pr(full_name, number, reviews_per_pr, comments_per_pr)
+            if r % 2 == 0:
+                self.set_protection(full_name, 'main', {
+                    'required_status_checks': {'strict': True, 'checks': [{'context': 'ci/build', 'app_id': None}]},
+                    'enforce_admins': False,
+                    'required_pull_request_reviews': {
+                        'required_approving_review_count': 1,
+                        'require_last_push_approval': True,
+                        'dismissal_restrictions': {'users': ['dev1'], 'teams': ['maintainers'], 'apps': []},
+                        'bypass_pull_request_allowances': {'users': [], 'teams': ['release'], 'apps': ['dependabot']}
+                    },
+                    'restrictions': None,
+                    'required_linear_history': True,
+                    'required_conversation_resolution': True
+                })
+
+    @staticmethod
+    def _new_stats():
+        return {'requests': 0, 'not_modified': 0, 'secondary_limited': 0, 'protection_updates': 0,
+                'protection_settings_dropped': 0}
+
+    def _id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _tick(self):
+        self.clock += timedelta(seconds=7)
+        return _iso(self.clock)
+
+    def _user(self, n):
+        return {'id': 500 + n, 'login': f'dev{n}', 'avatar_url': f'https://avatars.example/{n}'}
+
+    def _add_pr(self, full_name, number, reviews, comments):
+        repo = self.repos[full_name]
+        created = self._tick()
+        repo['pulls'][number] = {
+            'id': self._id(), 'number': number, 'state': 'open', 'title': f'Change {number}',
+            'html_url': f'https://github.com/{full_name}/pull/{number}',
+            'created_at': created, 'updated_at': created, 'closed_at': None, 'merged_at': None,
+            'user': self._user(number % 17)
+        }
+        repo['reviews'][number] = []
+        for i in range(reviews):
+            repo['reviews'][number].append({
+                'id': self._id(), 'state': 'APPROVED' if i == reviews - 1 else 'COMMENTED',
+                'submitted_at': self._tick(), 'user': self._user((number + i + 1) % 17)
+            })
+        for _ in range(comments):
+            self._add_comment(full_name, number)
+        repo['pulls'][number]['updated_at'] = _iso(self.clock)
+
+    def _add_comment(self, full_name, number, stamp=None):
+        stamp = stamp or self._tick()
+        comment = {
+            'id': self._id(), 'body': f'Comment at {stamp}', 'path': 'src/app.py', 'position': 3,
+            'created_at': stamp, 'updated_at': stamp, 'user': self._user(number % 13),
+            'pull_request_url': f'https://api.github.com/repos/{full_name}/pulls/{number}'
+        }
+        self.repos[full_name]['comments'][comment['id']] = comment
+
+    def mutate(self, full_name, number, same_second=False):
+        with self.lock:
+            self._add_comment(full_name, number, _iso(self.clock) if same_second else None)
+            self.repos[full_name]['pulls'][number]['updated_at'] = _iso(self.clock)
+
+    def set_protection(self, full_name, branch, update):
+        """Store a protection from a PUT body, in the shape GET returns"""
+        url = f"{self.base_url}/repos/{full_name}/branches/{branch}/protection"
+        protection = {'url': url, 'enforce_admins': {'enabled': bool(update.get('enforce_admins'))}}
+        checks = update.get('required_status_checks')
+        if checks:
+            protection['required_status_checks'] = {
+                'strict': bool(checks.get('strict')),
+                'contexts': [check['context'] for check in checks.get('checks', [])] + list(checks.get('contexts', [])),
+                'checks': [{'context': check['context'], 'app_id': check.get('app_id')} for check in checks.get('checks', [])]
+            }
+        reviews = update.get('required_pull_request_reviews')
+        if reviews is not None:
+            protection['required_pull_request_reviews'] = {
+                'dismiss_stale_reviews': bool(reviews.get('dismiss_stale_reviews')),
+                'require_code_owner_reviews': bool(reviews.get('require_code_owner_reviews')),
+                'required_approving_review_count': int(reviews.get('required_approving_review_count', 1)),
+                'require_last_push_approval': bool(reviews.get('require_last_push_approval'))
+            }
+            for section in ('dismissal_restrictions', 'bypass_pull_request_allowances'):
+                actors = reviews.get(section)
+                if actors and any(actors.get(kind) for kind in ('users', 'teams', 'apps')):
+                    protection['required_pull_request_reviews'][section] = _actors(actors)
+        restrictions = update.get('restrictions')
+        if restrictions:
+            protection['restrictions'] = _actors(restrictions)
+        for toggle in PROTECTION_TOGGLES:
+            protection[toggle] = {'enabled': bool(update.get(toggle))}
+
+        previous = self.protections.get((full_name, branch))
+        if previous is not None and _dropped_settings(previous, protection):
+            self.stats['protection_settings_dropped'] += 1
+        self.protections[(full_name, branch)] = protection
+        return protection
+
+    def pulls(self, full_name, query):
+        items = list(self.repos[full_name]['pulls'].values())
+        state = query.get('state', 'open')
+        if state != 'all':
+            items = [pr for pr in items if pr['state'] == state]
+        items.sort(key=lambda pr: pr['updated_at'], reverse=query.get('direction', 'desc') == 'desc')
+        return items
+
+    def reviews(self, full_name, number):
+        return list(self.repos[full_name]['reviews'].get(number, []))
+
+    def comments(self, full_name, query):
+        items = list(self.repos[full_name]['comments'].values())
+        since = query.get('since')
+        if since:
+            items = [c for c in items if c['updated_at'] >= since]
+        items.sort(key=lambda c: c['updated_at'], reverse=query.get('direction', 'asc') == 'desc')
+        return items
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeGitHub/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def github(self):
+        return self.server.github
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(payload)))
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+
+    def _rate_headers(self):
+        return {
+            'X-RateLimit-Limit': str(self.github.rate_limit),
+            'X-RateLimit-Remaining': str(max(0, self.github.remaining)),
+            'X-RateLimit-Reset': str(self.github.reset_at)
+        }
+
+    def _page(self, path, query, items):
+        """Serve one page of items with ETag/304, Link and rate-limit handling"""
+        github = self.github
+        per_page = min(100, int(query.get('per_page', 30)))
+        page = max(1, int(query.get('page', 1)))
+        chunk = items[(page - 1) * per_page:page * per_page]
+        etag = 'W/"' + hashlib.sha1(json.dumps(chunk, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+
+        headers = {'ETag': etag}
+        if self.headers.get('If-None-Match') == etag:
+            with github.lock:
+                github.stats['not_modified'] += 1
+            headers.update(self._rate_headers())
+            self._send(304, None, headers)
+            return
+
+        with github.lock:
+            if github.remaining <= 0:
+                headers.update(self._rate_headers())
+                self._send(403, {'message': 'API rate limit exceeded'}, headers)
+                return
+            github.remaining -= 1
+        headers.update(self._rate_headers())
+        if page * per_page < len(items):
+            next_query = dict(query, page=str(page + 1))
+            headers['Link'] = f'<{github.base_url}{path}?{urlencode(next_query)}>; rel="next"'
+        self._send(200, chunk, headers)
+
+    def _secondary_limited(self):
+        """Count the request; answer it with a secondary rate limit every --secondary-every requests"""
+        github = self.github
+        with github.lock:
+            github.stats['requests'] += 1
+            limited = github.secondary_every and github.stats['requests'] % github.secondary_every == 0
+            if limited:
+                github.stats['secondary_limited'] += 1
+        if limited:
+            self._send(403, {'message': 'You have exceeded a secondary rate limit.'}, {'Retry-After': '1'})
+        return limited
+
+    def _use_rate_limit(self):
+        """Spend one request of the primary limit; answers 403 and returns False when it is used up"""
+        github = self.github
+        with github.lock:
+            if github.remaining <= 0:
+                self._send(403, {'message': 'API rate limit exceeded'}, self._rate_headers())
+                return False
+            github.remaining -= 1
+        return True
+
+    def _protection(self, full_name, branch):
+        """GET a branch protection with ETag/304 handling"""
+        github = self.github
+        if branch not in BRANCHES:
+            self._send(404, {'message': 'Branch not found'})
+            return
+        with github.lock:
+            protection = github.protections.get((full_name, branch))
+        if protection is None:
+            if self._use_rate_limit():
+                self._send(404, {'message': 'Branch not protected'}, self._rate_headers())
+            return
+        etag = '"' + hashlib.sha1(json.dumps(protection, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            with github.lock:
+                github.stats['not_modified'] += 1
+            self._send(304, None, dict(self._rate_headers(), ETag=etag))
+            return
+        if self._use_rate_limit():
+            self._send(200, protection, dict(self._rate_headers(), ETag=etag))
+
+    def do_GET(self):
+        github = self.github
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/_stats':
+            with github.lock:
+                stats = dict(github.stats, remaining=github.remaining)
+            self._send(200, stats)
+            return
+
+        if self._secondary_limited():
+            return
+
+        match = PROTECTION_PATH.match(url.path)
+        if match and match.group(1) in github.repos:
+            self._protection(match.group(1), unquote(match.group(2)))
+            return
+
+        with github.lock:
+            match = PULLS_PATH.match(url.path)
+            if match and match.group(1) in github.repos:
+                items = github.pulls(match.group(1), query)
+            elif REVIEWS_PATH.match(url.path) and REVIEWS_PATH.match(url.path).group(1) in github.repos:
+                match = REVIEWS_PATH.match(url.path)
+                items = github.reviews(match.group(1), int(match.group(2)))
+            elif COMMENTS_PATH.match(url.path) and COMMENTS_PATH.match(url.path).group(1) in github.repos:
+                items = github.comments(COMMENTS_PATH.match(url.path).group(1), query)
+            else:
+                items = None
+        if items is None:
+            self._send(404, {'message': 'Not Found'})
+            return
+        self._page(url.path, query, items)
+
+    def do_PUT(self):
+        github = self.github
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if self._secondary_limited():
+            return
+        match = PROTECTION_PATH.match(url.path)
+        if not match or match.group(1) not in github.repos:
+            self._send(404, {'message': 'Not Found'})
+            return
+        branch = unquote(match.group(2))
+        if branch not in BRANCHES:
+            self._send(404, {'message': 'Branch not found'})
+            return
+        try:
+            update = json.loads(body or b'{}')
+        except ValueError:
+            self._send(400, {'message': 'Problems parsing JSON'})
+            return
+        if not self._use_rate_limit():
+            return
+        with github.lock:
+            protection = github.set_protection(match.group(1), branch, update)
+            github.stats['protection_updates'] += 1
+        self._send(200, protection, self._rate_headers())
+
+    def do_POST(self):
+        github = self.github
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        match = MUTATE_PATH.match(url.path)
+        if match and match.group(1) in github.repos and int(match.group(2)) in github.repos[match.group(1)]['pulls']:
+            same_second = parse_qs(url.query).get('same_second', ['0'])[-1] in ('1', 'true')
+            github.mutate(match.group(1), int(match.group(2)), same_second)
+            self._send(200, {'status': 'ok'})
+        elif url.path == '/_reset_stats':
+            with github.lock:
+                github.stats = github._new_stats()
+                github.remaining = github.rate_limit
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'message': 'Not Found'})
+
+def serve(port=5055, **options):
+    """Start the fake API on a background thread; returns the server"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeGitHubHandler)
+    server.daemon_threads = True
+    server.github = FakeGitHub(**options)
+    server.github.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake GitHub REST API for the reconciliation sync and branch protection")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--repos', type=int, default=3)
+    parser.add_argument('--prs', type=int, default=250)
+    parser.add_argument('--reviews-per-pr', type=int, default=2)
+    parser.add_argument('--comments-per-pr', type=int, default=3)
+    parser.add_argument('--rate-limit', type=int, default=5000)
+    parser.add_argument('--secondary-every', type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.port, repos=args.repos, prs=args.prs, reviews_per_pr=args.reviews_per_pr,
+                   comments_per_pr=args.comments_per_pr, rate_limit=args.rate_limit,
+                   secondary_every=args.secondary_every)
+    print(f"Fake GitHub API on {server.github.base_url} ({', '.join(server.github.repos)})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
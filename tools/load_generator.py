@@ -0,0 +1,407 @@
+"""
+Open-loop load generator for the webhook endpoint
+
+Synthesizes signed pull_request, pull_request_review and
+pull_request_review_comment deliveries shaped like GitHub's, and sends them
+at a fixed target rate no matter how fast the server answers (open loop), so
+a slow server builds a backlog instead of slowing the generator down.
+Latency is measured from each request's scheduled send time, which keeps
+queueing delay in the numbers.
+
+Rates are stepped (--rates, or --start-rate doubling up to --max-rate) and
+every step reports achieved throughput, latency percentiles, errors and
+shed requests (503). The saturation point is the first step that misses
+the target throughput by more than 10%, exceeds --max-error-rate, or has a
+p99 above --slo-ms.
+
+Deliveries are signed with X-Hub-Signature-256 exactly as GitHub does
+(HMAC-SHA256 of the raw body), so they pass WebhookVerifier; --dry-run
+checks that and prints payload sizes without sending anything.
+
+Requires httpx. Usage:
+  python tools/load_generator.py --url http://127.0.0.1:5001/ --secret S \
+      [--rates 25,50,100,200] [--duration 20] [--repos 20 --users 200] \
+      [--mix pull_request=3,pull_request_review=3,pull_request_review_comment=4] \
+      [--body-bytes 600] [--poisson] [--json results.json]
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_MIX = {'pull_request': 3, 'pull_request_review': 3, 'pull_request_review_comment': 4}
+REVIEW_STATES = (('approved', 5), ('commented', 4), ('changes_requested', 2))
+REPOSITORY_LINKS = ('forks', 'keys', 'collaborators', 'teams', 'hooks', 'issue_events', 'events', 'assignees',
+                    'branches', 'tags', 'blobs', 'git_tags', 'git_refs', 'trees', 'statuses', 'languages',
+                    'stargazers', 'contributors', 'subscribers', 'subscription', 'commits', 'git_commits',
+                    'comments', 'issue_comment', 'contents', 'compare', 'merges', 'archive', 'downloads',
+                    'issues', 'pulls', 'milestones', 'notifications', 'labels', 'releases', 'deployments')
+WORDS = ('refactor', 'handler', 'cache', 'retry', 'config', 'tests', 'docs', 'schema', 'query', 'index',
+         'timeout', 'webhook', 'slack', 'token', 'cleanup', 'migration', 'parser', 'logging', 'metrics')
+
+def sign(secret, body):
+    """X-Hub-Signature-256 value for a raw body"""
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+def _iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+class PayloadFactory:
+    """
+    Builds GitHub-shaped deliveries over a fixed population of repos and users
+
+    PRs are tracked per repository so reviews and comments refer to PRs that
+    were opened earlier in the run. Body lengths follow a log-normal
+    distribution around body_bytes, which is how real PR and comment bodies
+    are spread (mostly short, some very long).
+    """
+
+    def __init__(self, repos=20, users=200, mix=None, body_bytes=600, body_sigma=1.0, open_prs_per_repo=30, seed=None):
+        self.random = random.Random(seed)
+        self.mix = list((mix or DEFAULT_MIX).items())
+        self.body_bytes = body_bytes
+        self.body_sigma = body_sigma
+        self.open_prs_per_repo = open_prs_per_repo
+        self.clock = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=30)
+        self.users = [
+            {'login': f'loadgen-user{i}', 'id': 80000000 + i, 'avatar_url': f'https://avatars.githubusercontent.com/u/{80000000 + i}?v=4',
+             'type': 'User', 'site_admin': False}
+            for i in range(users)
+        ]
+        self.repos = []
+        for i in range(repos):
+            name = f'service-{i}'
+            self.repos.append({
+                'id': 70000000 + i, 'node_id': f'R_loadgen{i}', 'name': name, 'full_name': f'loadgen-org/{name}',
+                'private': True, 'owner': {'login': 'loadgen-org', 'id': 69999999, 'type': 'Organization'},
+                'html_url': f'https://github.com/loadgen-org/{name}', 'default_branch': 'main',
+                'url': f'https://api.github.com/repos/loadgen-org/{name}'
+            })
+            # GitHub repeats the full repository object, with all its API links,
+            # in repository, pull_request.head.repo and pull_request.base.repo
+            for link in REPOSITORY_LINKS:
+                self.repos[-1][f'{link}_url'] = f"https://api.github.com/repos/loadgen-org/{name}/{link}"
+        # Users contribute to a stable subset of repos, as teams do
+        self.members = {repo['id']: self.random.sample(self.users, min(len(self.users), max(3, users // max(1, repos) * 2)))
+                        for repo in self.repos}
+        self.open_prs = {repo['id']: [] for repo in self.repos}
+        self.next_number = {repo['id']: 1 for repo in self.repos}
+        self.next_id = 900000000
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def _tick(self):
+        self.clock += timedelta(seconds=self.random.randint(1, 90))
+        return _iso(self.clock)
+
+    def _text(self, mean_bytes):
+        if mean_bytes <= 0:
+            return ''
+        target = int(self.random.lognormvariate(math.log(mean_bytes), self.body_sigma))
+        words = []
+        size = 0
+        while size < target:
+            word = self.random.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join(words)
+
+    def _pick_weighted(self, choices):
+        total = sum(weight for _, weight in choices)
+        point = self.random.uniform(0, total)
+        for value, weight in choices:
+            point -= weight
+            if point <= 0:
+                return value
+        return choices[-1][0]
+
+    def _pull_request(self, repo, pr):
+        branch = f"feature/{pr['number']}-{self.random.choice(WORDS)}"
+        return {
+            'url': f"{repo['url']}/pulls/{pr['number']}", 'id': pr['id'], 'node_id': f"PR_{pr['id']}",
+            'html_url': f"{repo['html_url']}/pull/{pr['number']}", 'number': pr['number'], 'state': 'open',
+            'locked': False, 'title': pr['title'], 'user': pr['user'], 'body': pr['body'],
+            'created_at': pr['created_at'], 'updated_at': _iso(self.clock), 'closed_at': None, 'merged_at': None,
+            'draft': False, 'requested_reviewers': [], 'labels': [],
+            'head': {'label': f"loadgen-org:{branch}", 'ref': branch, 'sha': uuid.uuid4().hex + uuid.uuid4().hex[:8], 'repo': repo},
+            'base': {'label': 'loadgen-org:main', 'ref': 'main', 'sha': uuid.uuid4().hex + uuid.uuid4().hex[:8], 'repo': repo},
+            'commits': self.random.randint(1, 12), 'additions': self.random.randint(1, 800),
+            'deletions': self.random.randint(0, 300), 'changed_files': self.random.randint(1, 25)
+        }
+
+    def _open_pr(self, repo):
+        number = self.next_number[repo['id']]
+        self.next_number[repo['id']] += 1
+        pr = {
+            'id': self._id(), 'number': number, 'user': self.random.choice(self.members[repo['id']]),
+            'title': f"{self.random.choice(WORDS).capitalize()} {self.random.choice(WORDS)} ({number})",
+            'body': self._text(self.body_bytes), 'created_at': self._tick()
+        }
+        prs = self.open_prs[repo['id']]
+        prs.append(pr)
+        if len(prs) > self.open_prs_per_repo:
+            prs.pop(0)
+        return pr
+
+    def make(self):
+        """Return (event_type, payload dict) for the next delivery"""
+        event = self._pick_weighted(self.mix)
+        repo = self.random.choice(self.repos)
+        prs = self.open_prs[repo['id']]
+        if event == 'pull_request' or not prs:
+            if prs and self.random.random() < 0.5:
+                action, pr = self.random.choice(('synchronize', 'edited')), self.random.choice(prs)
+                self._tick()
+            else:
+                action, pr = 'opened', self._open_pr(repo)
+            return 'pull_request', {
+                'action': action, 'number': pr['number'], 'pull_request': self._pull_request(repo, pr),
+                'repository': repo, 'sender': pr['user']
+            }
+
+        pr = self.random.choice(prs)
+        others = [user for user in self.members[repo['id']] if user['id'] != pr['user']['id']] or self.users
+        actor = self.random.choice(others)
+        stamp = self._tick()
+        if event == 'pull_request_review':
+            review_id = self._id()
+            return 'pull_request_review', {
+                'action': 'submitted',
+                'review': {
+                    'id': review_id, 'node_id': f'PRR_{review_id}', 'user': actor,
+                    'body': self._text(self.body_bytes // 3) if self.random.random() < 0.6 else None,
+                    'state': self._pick_weighted(REVIEW_STATES), 'submitted_at': stamp,
+                    'html_url': f"{repo['html_url']}/pull/{pr['number']}#pullrequestreview-{review_id}",
+                    'commit_id': uuid.uuid4().hex + uuid.uuid4().hex[:8]
+                },
+                'pull_request': self._pull_request(repo, pr), 'repository': repo, 'sender': actor
+            }
+
+        comment_id = self._id()
+        return 'pull_request_review_comment', {
+            'action': 'created',
+            'comment': {
+                'id': comment_id, 'node_id': f'PRRC_{comment_id}', 'user': actor,
+                'body': self._text(self.body_bytes // 2), 'created_at': stamp, 'updated_at': stamp,
+                'pull_request_review_id': None, 'path': f"src/{self.random.choice(WORDS)}.py",
+                'position': self.random.randint(1, 200), 'diff_hunk': '@@ -1,4 +1,6 @@',
+                'html_url': f"{repo['html_url']}/pull/{pr['number']}#discussion_r{comment_id}"
+            },
+            'pull_request': self._pull_request(repo, pr), 'repository': repo, 'sender': actor
+        }
+
+def build_deliveries(factory, secret, count):
+    """Pre-build count signed deliveries as (event_type, body, signature)"""
+    deliveries = []
+    for _ in range(count):
+        event_type, payload = factory.make()
+        # GitHub sends compact JSON with "action" first, which the event registry relies on
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        deliveries.append((event_type, body, sign(secret, body)))
+    return deliveries
+
+def _percentile(sorted_values, quantile):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(quantile * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+async def _send(client, url, delivery, scheduled, loop):
+    event_type, body, signature = delivery
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'GitHub-Hookshot/loadgen',
+        'X-GitHub-Event': event_type,
+        'X-GitHub-Delivery': str(uuid.uuid4()),
+        'X-Hub-Signature-256': signature
+    }
+    try:
+        response = await client.post(url, content=body, headers=headers)
+        status = response.status_code
+    except Exception as e:
+        status = type(e).__name__
+    return event_type, status, loop.time() - scheduled
+
+async def run_step(url, deliveries, rate, duration, timeout, connections, poisson, rng):
+    """Send at rate requests/second for duration seconds; returns a result dict"""
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    tasks = []
+    max_lag = 0.0
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = loop.time() + 0.05
+        scheduled = start
+        end = start + duration
+        index = 0
+        while scheduled < end:
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            tasks.append(asyncio.ensure_future(
+                _send(client, url, deliveries[index % len(deliveries)], scheduled, loop)
+            ))
+            index += 1
+            scheduled += rng.expovariate(rate) if poisson else 1.0 / rate
+        results = await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+
+    statuses = Counter(status for _, status, _ in results)
+    ok = sorted(latency for _, status, latency in results if isinstance(status, int) and status < 400)
+    latencies = sorted(latency for _, _, latency in results)
+    shed = statuses.get(503, 0)
+    errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or (status >= 400 and status != 503))
+    return {
+        'target_rps': rate,
+        'sent': len(results),
+        'achieved_rps': round(sum(1 for _, status, _ in results if isinstance(status, int) and status < 400) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+        'p90_ms': round(_percentile(latencies, 0.90) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+        'ok_p99_ms': round(_percentile(ok, 0.99) * 1000, 1) if ok else None,
+        'error_rate': round(errors / len(results), 4) if results else 0.0,
+        'shed_rate': round(shed / len(results), 4) if results else 0.0,
+        'generator_lag_ms': round(max_lag * 1000, 1),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'events': dict(Counter(event for event, _, _ in results))
+    }
+
+def is_saturated(step, slo_ms, max_error_rate):
+    """Reasons a step counts as past the saturation point (empty if it is not)"""
+    reasons = []
+    if step['achieved_rps'] < 0.9 * step['target_rps']:
+        reasons.append(f"throughput {step['achieved_rps']}/{step['target_rps']} rps")
+    if step['error_rate'] + step['shed_rate'] > max_error_rate:
+        reasons.append(f"errors+shed {100 * (step['error_rate'] + step['shed_rate']):.1f}%")
+    if step['p99_ms'] > slo_ms:
+        reasons.append(f"p99 {step['p99_ms']} ms > {slo_ms} ms")
+    return reasons
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        event, _, weight = part.partition('=')
+        if event.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown event '{event.strip()}'")
+        mix[event.strip()] = float(weight or 1)
+    return mix
+
+def _rates(args):
+    if args.rates:
+        return [float(rate) for rate in args.rates.split(',')]
+    rates = []
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        rates.append(rate)
+        rate *= 2
+    return rates
+
+def dry_run(deliveries, secret):
+    """Print payload sizes per event and check signatures with the app's verifier"""
+    from prequel_app.github_handler import WebhookVerifier
+    verifier = WebhookVerifier([secret])
+    sizes = {}
+    for event_type, body, signature in deliveries:
+        check = verifier.begin(signature, len(body))
+        check.update(body)
+        if not check.finish():
+            sys.exit(f"Signature check failed for a {event_type} delivery")
+        sizes.setdefault(event_type, []).append(len(body))
+    print(f"{'event':<30} {'count':>6} {'median B':>9} {'p90 B':>9} {'max B':>9}")
+    for event_type, values in sorted(sizes.items()):
+        values.sort()
+        print(f"{event_type:<30} {len(values):>6} {statistics.median(values):>9.0f} "
+              f"{_percentile(values, 0.9):>9} {values[-1]:>9}")
+    print(f"all {len(deliveries)} signatures verified")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5001/')
+    parser.add_argument('--secret', default=os.getenv('GITHUB_WEBHOOK_SECRET', 'loadgen-secret'))
+    parser.add_argument('--rates', help="Comma-separated requests/second per step")
+    parser.add_argument('--start-rate', type=float, default=25.0)
+    parser.add_argument('--max-rate', type=float, default=1600.0)
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per step")
+    parser.add_argument('--repos', type=int, default=20)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX, help="event=weight,... (default 3/3/4)")
+    parser.add_argument('--body-bytes', type=int, default=600, help="Median PR body size; reviews and comments are smaller")
+    parser.add_argument('--body-sigma', type=float, default=1.0, help="Log-normal spread of body sizes")
+    parser.add_argument('--pool', type=int, default=5000, help="Distinct deliveries built up front and cycled")
+    parser.add_argument('--poisson', action='store_true', help="Exponential inter-arrival times instead of a fixed interval")
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--slo-ms', type=float, default=1000.0)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--keep-going', action='store_true', help="Run every step even after saturation")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--json', help="Also write the step results to this file")
+    args = parser.parse_args()
+
+    factory = PayloadFactory(args.repos, args.users, args.mix, args.body_bytes, args.body_sigma, seed=args.seed)
+    deliveries = build_deliveries(factory, args.secret, args.pool)
+    if args.dry_run:
+        dry_run(deliveries, args.secret)
+        return
+    if httpx is None:
+        sys.exit("httpx is required: pip install httpx")
+
+    rng = random.Random(args.seed)
+    steps = []
+    saturation = None
+    print(f"{'target':>7} {'achieved':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>9} {'max ms':>9} "
+          f"{'err %':>6} {'shed %':>7} {'lag ms':>7}")
+    for rate in _rates(args):
+        step = asyncio.run(run_step(args.url, deliveries, rate, args.duration, args.timeout,
+                                    args.connections, args.poisson, rng))
+        steps.append(step)
+        print(f"{step['target_rps']:>7.0f} {step['achieved_rps']:>9.1f} {step['p50_ms']:>8.1f} {step['p90_ms']:>8.1f} "
+              f"{step['p99_ms']:>9.1f} {step['max_ms']:>9.1f} {100 * step['error_rate']:>6.2f} "
+              f"{100 * step['shed_rate']:>7.2f} {step['generator_lag_ms']:>7.1f}")
+        if step['generator_lag_ms'] > 100:
+            print("  warning: the generator fell behind schedule; results at this rate understate the load")
+        reasons = is_saturated(step, args.slo_ms, args.max_error_rate)
+        if reasons and saturation is None:
+            saturation = {'rate': rate, 'reasons': reasons}
+            if not args.keep_going:
+                break
+
+    if saturation:
+        sustained = [step['target_rps'] for step in steps if step['target_rps'] < saturation['rate']]
+        print(f"saturation at {saturation['rate']:.0f} rps ({'; '.join(saturation['reasons'])}); "
+              f"highest sustained step: {max(sustained):.0f} rps" if sustained else
+              f"saturation at the first step ({'; '.join(saturation['reasons'])})")
+    else:
+        print("no saturation within the tested rates")
+
+    if args.json:
+        with open(args.json, 'w') as result_file:
+            json.dump({'steps': steps, 'saturation': saturation, 'config': {
+                'url': args.url, 'repos': args.repos, 'users': args.users, 'mix': args.mix,
+                'body_bytes': args.body_bytes, 'duration': args.duration, 'poisson': args.poisson
+            }}, result_file, indent=2)
+
+if __name__ == '__main__':
+    main()